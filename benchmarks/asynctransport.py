@@ -0,0 +1,127 @@
+"""Benchmark: request/reply latency and throughput of the TCP device transports.
+
+A fake device, echoing back every newline-terminated message, runs as a TCP server in a separate process. The same
+messages are sent to it through the 'process' transport (`TCPCommunicator` in its own process, talking to the caller
+over multiprocessing queues, with two poll timeouts) and through the 'asyncio' transport (`AsyncTCPConnection` in the
+shared event loop thread, talking over a queue.Queue), the way `DeviceBackend_TCP` uses them.
+
+Two measurements are made for each transport:
+
+- latency: one message is sent, its reply is waited for, then the next one is sent. This is how a device backend
+  usually queries the variables one by one.
+- throughput: all messages are queued at once, then the replies are collected. The transport still waits for the
+  reply to each message before sending the next one (asynchronous=False), as it does with the real devices.
+
+Usage: python benchmarks/asynctransport.py [number of round trips]
+"""
+import multiprocessing
+import os
+import queue
+import socket
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from cct.core.devices.device.asynctransport import AsyncTCPConnection  # noqa: E402
+from cct.core.devices.device.device_tcp import TCPCommunicator  # noqa: E402
+from cct.core.devices.device.framing import DelimiterFramer  # noqa: E402
+from cct.core.devices.device.message import Message  # noqa: E402
+
+
+def echo_server(listener: socket.socket):
+    """The fake device: answer each line with the same line."""
+    while True:
+        connection, address = listener.accept()
+        connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        buffer = b''
+        while True:
+            data = connection.recv(4096)
+            if not data:
+                break
+            buffer += data
+            *lines, buffer = buffer.split(b'\n')
+            if lines:
+                connection.sendall(b''.join(line + b'\n' for line in lines))
+        connection.close()
+
+
+def make_messages(n: int):
+    return [Message('send', i, 'benchmark__backend', message='GET {:d}\n'.format(i).encode('ascii'),
+                    expected_replies=1, timeout=5, asynchronous=False) for i in range(n)]
+
+
+def wait_for_reply(incomingqueue):
+    """Wait for the next 'incoming' message, skipping 'send_complete'."""
+    while True:
+        message = incomingqueue.get(timeout=10)
+        if message['type'] == 'incoming':
+            return message
+        elif message['type'] != 'send_complete':
+            raise RuntimeError('Unexpected message from the transport: {}'.format(message['type']))
+
+
+def measure(send, incomingqueue, n: int):
+    """Return the round trip times (seconds) of sequential requests and the total time of a burst of requests."""
+    roundtrips = []
+    for msg in make_messages(n):
+        t0 = time.perf_counter()
+        send(msg)
+        wait_for_reply(incomingqueue)
+        roundtrips.append(time.perf_counter() - t0)
+    t0 = time.perf_counter()
+    for msg in make_messages(n):
+        send(msg)
+    for i in range(n):
+        wait_for_reply(incomingqueue)
+    return roundtrips, time.perf_counter() - t0
+
+
+def benchmark_process(port: int, poll_timeout: float, n: int):
+    sendqueue = multiprocessing.Queue()
+    incomingqueue = multiprocessing.Queue()
+    killflag = multiprocessing.Event()
+    exitedflag = multiprocessing.Event()
+    process = multiprocessing.Process(
+        target=TCPCommunicator.create_and_run,
+        args=('echo', 'localhost', port, poll_timeout, sendqueue, incomingqueue, killflag, exitedflag,
+              DelimiterFramer(b'\n')), daemon=True)
+    process.start()
+    try:
+        return measure(sendqueue.put_nowait, incomingqueue, n)
+    finally:
+        killflag.set()
+        exitedflag.wait(5)
+        process.join(2)
+
+
+def benchmark_asyncio(port: int, n: int):
+    incomingqueue = queue.Queue()
+    connection = AsyncTCPConnection.open('echo', 'localhost', port, DelimiterFramer(b'\n'), incomingqueue)
+    try:
+        return measure(connection.send, incomingqueue, n)
+    finally:
+        connection.close()
+
+
+def report(label: str, roundtrips, bursttime: float):
+    print('  {:<40s} {:7.0f} round trips/s, median {:7.1f} us; burst: {:7.0f} messages/s'.format(
+        label, len(roundtrips) / sum(roundtrips), statistics.median(roundtrips) * 1e6, len(roundtrips) / bursttime))
+
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    listener = socket.socket()
+    listener.bind(('localhost', 0))
+    listener.listen(5)
+    port = listener.getsockname()[1]
+    server = multiprocessing.Process(target=echo_server, args=(listener,), daemon=True)
+    server.start()
+    print('{:d} request/reply round trips with an echo server, {:d} CPU(s):'.format(n, os.cpu_count()))
+    for poll_timeout in [0.01, 0.001]:
+        # the slow one is only there to show the effect of the poll timeout
+        report('process transport, poll_timeout={:g}:'.format(poll_timeout),
+               *benchmark_process(port, poll_timeout, n if poll_timeout < 0.01 else min(n, 500)))
+    report('asyncio transport:', *benchmark_asyncio(port, n))
+    server.terminate()
@@ -0,0 +1,179 @@
+"""Benchmark: signal emissions per second with the indexed `Callbacks` against the original linear scan.
+
+A 'variable-change' signal with 5 handlers is emitted while N further handlers are connected to other signals of the
+same object, as on a device front-end with many listeners (GUI widgets, commands, services). The original
+implementation, which scanned every connection of the object on each emission, is kept below (`LinearCallbacks`,
+the emit-related methods verbatim).
+
+Usage: python benchmarks/callbacks.py [number of emissions]
+"""
+import itertools
+import logging
+import os
+import sys
+import time
+import traceback
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from cct.core.utils.callback import Callbacks, SignalFlags  # noqa: E402
+
+logger = logging.getLogger(__name__)
+
+SIGNALS = {'variable-change': (SignalFlags.RUN_FIRST, None, (str, object)),
+           'error': (SignalFlags.RUN_LAST, None, (str, object, str)),
+           'disconnect': (SignalFlags.RUN_LAST, None, (bool,)),
+           'ready': (SignalFlags.RUN_LAST, None, ()),
+           'telemetry': (SignalFlags.RUN_FIRST, None, (object,)),
+           }
+
+
+class LinearCallbacks(object):
+    """The original implementation: a single list of all connections, scanned on each emission."""
+    __signals__ = {}
+    _nextsignalconnectionid = 0
+
+    def __init__(self):
+        self.__signalhandles = []
+
+    @classmethod
+    def _get_signal_description(cls, name):
+        if name in cls.__signals__:
+            return cls.__signals__[name]
+        else:
+            for bcls in cls.__bases__:
+                try:
+                    # noinspection PyProtectedMember
+                    return bcls._get_signal_description(name)
+                except AttributeError:
+                    pass
+            raise ValueError(name)
+
+    def connect(self, signal, callback, *args, **kwargs) -> int:
+        self._get_signal_description(signal)
+        conn = {'signal': signal, 'callback': callback, 'args': args, 'kwargs': kwargs,
+                'id': self.__class__._nextsignalconnectionid, 'blocked': 0}
+        self.__signalhandles.append(conn)
+        self.__class__._nextsignalconnectionid += 1
+        logger.debug('Connected signal handler {:d} for signal {}, callback {}'.format(conn['id'], signal, callback))
+        return conn['id']
+
+    def emit(self, signal: str, *args):
+        if signal not in ['telemetry', 'variable-change']:
+            logger.debug('Emitting signal: {}'.format(signal))
+        sigdesc = self._get_signal_description(signal)
+        if len(args) != len(sigdesc[2]):
+            raise ValueError('Incorrect number of arguments supplied to signal {}.'.format(signal))
+        # test the types of the supplied arguments
+        for a, t, i in zip(args, sigdesc[2], itertools.count(0)):
+            if not isinstance(a, (t, type(None))):
+                raise TypeError('Argument #{:d} of signal {} is of incorrect type {}. Expected: {} or None.'.format(
+                    i, signal, type(a), t))
+        if sigdesc[0] & SignalFlags.RUN_FIRST:
+            # run the default callback before the connected handlers
+            retval = self._call_default_callback(signal, *args)
+            if isinstance(retval, tuple):
+                assert len(retval) == 2
+                done, ret = retval
+            else:
+                done = bool(retval)
+                ret = None
+            if done:
+                assert isinstance(ret, sigdesc[1])
+                if signal not in ['telemetry', 'variable-change']:
+                    logger.debug('Done emitting signal {} after the default callback (RUN_FIRST).'.format(signal))
+                return ret
+        for s_ in self.__signalhandles:
+            assert isinstance(s_, dict)
+        for s in self.__signalhandles:
+            assert isinstance(s, dict)
+            if (s['signal'] != signal) or (s['blocked'] > 0):
+                continue
+            if signal not in ['telemetry', 'variable-change']:
+                logger.debug('Calling signal hander {:d} for signal {}: {}'.format(s['id'], signal, str(s['callback'])))
+            try:
+                retval = s['callback'](self, *(args + s['args']), **s['kwargs'])
+            except Exception as exc:
+                logger.error(
+                    'Error in handler for signal {}: {}, {}'.format(signal, exc, traceback.format_exc()))
+                retval = None
+            if isinstance(retval, tuple):
+                assert len(retval) == 2
+                done, ret = retval
+            else:
+                done = bool(retval)
+                ret = None
+            if done:
+                if sigdesc[1] is not None:
+                    assert isinstance(ret, sigdesc[1])
+                if signal not in ['telemetry', 'variable-change']:
+                    logger.debug('Done emitting signal {} after registered callback {:d}.'.format(signal, s['id']))
+                return ret
+        if sigdesc[0] & SignalFlags.RUN_LAST:
+            retval = self._call_default_callback(signal, *args)
+            if isinstance(retval, tuple):
+                assert len(retval) == 2
+                done, ret = retval
+            else:
+                done = bool(retval)
+                ret = None
+            if done:
+                if sigdesc[1] is not None:
+                    assert isinstance(ret, sigdesc[1])
+                    if signal not in ['telemetry', 'variable-change']:
+                        logger.debug('Done emitting signal {} after the default callback (RUN_LAST).'.format(signal))
+                    return ret
+        if signal not in ['telemetry', 'variable-change']:
+            logger.debug('Done emitting signal {}: no callbacks left'.format(signal))
+        return None
+
+    def _call_default_callback(self, signal: str, *args):
+        defaulthandlername = 'do_' + signal.replace('-', '_')
+        if hasattr(self, defaulthandlername) and callable(
+                getattr(self, defaulthandlername)):
+            try:
+                return getattr(self, defaulthandlername)(*args)
+            except Exception as exc:
+                logger.error(
+                    'Error in default handler {}: {}, {}'.format(defaulthandlername, exc, traceback.format_exc()))
+                return None
+        return None
+
+
+class LinearDevice(LinearCallbacks):
+    __signals__ = SIGNALS
+
+
+class IndexedDevice(Callbacks):
+    __signals__ = SIGNALS
+
+
+class IndexedDeviceNoChecks(IndexedDevice):
+    check_signal_arguments = False
+
+
+def handler(device, name, value):
+    return False
+
+
+def benchmark(cls, nother: int, nemit: int) -> float:
+    """Emissions per second"""
+    device = cls()
+    others = ['error', 'disconnect', 'ready', 'telemetry']
+    for i in range(nother):
+        device.connect(others[i % len(others)], handler)
+    for i in range(5):
+        device.connect('variable-change', handler)
+    t0 = time.perf_counter()
+    for i in range(nemit):
+        device.emit('variable-change', 'temperature', 25.0)
+    return nemit / (time.perf_counter() - t0)
+
+
+if __name__ == '__main__':
+    nemit = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    print('Emissions of \'variable-change\' (5 handlers) per second, N handlers on other signals:')
+    print('{:>6s} {:>12s} {:>12s} {:>20s}'.format('N', 'linear', 'indexed', 'indexed, no checks'))
+    for nother in [0, 10, 100, 1000]:
+        print('{:6d} {:12.0f} {:12.0f} {:20.0f}'.format(
+            nother, *[benchmark(cls, nother, nemit) for cls in [LinearDevice, IndexedDevice, IndexedDeviceNoChecks]]))
@@ -0,0 +1,102 @@
+"""Benchmark: latency of saving the instrument configuration and propagating a small change.
+
+Compares the old way (pickling the whole config to the file and sending the whole dict to every device and service
+process) with the current one (`write_config_file()` and a patch computed by `diff_config()`). The receivers are
+real processes listening on multiprocessing queues, like the device backends, and the time is measured until all of
+them have applied the change and acknowledged it.
+
+Usage: python benchmarks/config_propagation.py [number of samples] [number of receivers]
+"""
+import copy
+import multiprocessing
+import os
+import pickle
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from cct.core.utils.configtools import apply_config_patch, diff_config, write_config_file  # noqa: E402
+
+
+def make_config(nsamples: int) -> dict:
+    """A configuration dictionary of realistic size and structure"""
+    return {
+        'path': {'directories': {name: '/mnt/data/credo/' + name for name in
+                                 ['log', 'images', 'param', 'config', 'mask', 'nexus', 'eval1d', 'eval2d', 'status',
+                                  'scan', 'param_override']},
+                 'prefixes': {'crd': 'crd', 'scn': 'scn', 'tra': 'tra', 'tst': 'tst'}},
+        'geometry': {'dist_sample_det': 1300.0, 'pinhole_1': 600.0, 'pinhole_2': 300.0, 'pinhole_3': 500.0,
+                     'beamstop': 4.0, 'wavelength': 0.15418, 'beamposx': 330.0, 'beamposy': 257.0,
+                     'pixelsize': 0.172, 'mask': 'mask.mat'},
+        'devices': {'dev{:d}'.format(i): {'param{:d}'.format(j): float(j) for j in range(50)} for i in range(10)},
+        'services': {'serv{:d}'.format(i): {'param{:d}'.format(j): j for j in range(20)} for i in range(8)},
+        'samples': [{'title': 'Sample{:d}'.format(i), 'positionx': (i * 1.5, 0.01), 'positiony': (i * 0.7, 0.01),
+                     'thickness': (0.1, 0.001), 'transmission': (0.5, 0.01), 'preparedby': 'Anonymous',
+                     'preparetime': '2020-01-01 00:00:00', 'distminus': (0.0, 0.0), 'description': 'x' * 80,
+                     'category': 'sample', 'situation': 'vacuum'} for i in range(nsamples)],
+        'gui': {'optimizegeometry': {'spacers': [65.0, 65.0, 100.0, 100.0, 200.0, 500.0, 800.0],
+                                     'pinholes': [100.0, 150.0, 300.0, 500.0, 600.0, 750.0, 1000.0]}},
+    }
+
+
+def receiver(inqueue, outqueue):
+    config = None
+    while True:
+        message = inqueue.get()
+        if message is None:
+            break
+        kind, payload = message
+        if kind == 'config':
+            config = payload
+        else:
+            apply_config_patch(config, payload)
+        outqueue.put(True)
+
+
+def benchmark(nsamples: int, nreceivers: int, repeat: int = 20):
+    config = make_config(nsamples)
+    ackqueue = multiprocessing.Queue()
+    queues = [multiprocessing.Queue() for i in range(nreceivers)]
+    processes = [multiprocessing.Process(target=receiver, args=(q, ackqueue)) for q in queues]
+    for p in processes:
+        p.start()
+    for q in queues:
+        q.put(('config', config))
+    for q in queues:
+        ackqueue.get()
+    folder = tempfile.mkdtemp()
+    propagated = copy.deepcopy(config)
+    told = tnew = 0.0
+    for i in range(repeat):
+        config['samples'][i % nsamples]['thickness'] = (0.1 + i * 0.001, 0.001)
+        # old: pickle the whole config and send it to everybody
+        t0 = time.perf_counter()
+        with open(os.path.join(folder, 'cct.pickle'), 'wb') as f:
+            pickle.dump(config, f)
+        for q in queues:
+            q.put(('config', config))
+        for q in queues:
+            ackqueue.get()
+        told += time.perf_counter() - t0
+        # new: atomic versioned write and a patch
+        t0 = time.perf_counter()
+        write_config_file(os.path.join(folder, 'cct.config'), config)
+        patch = diff_config(propagated, config)
+        apply_config_patch(propagated, copy.deepcopy(patch))
+        for q in queues:
+            q.put(('patch', patch))
+        for q in queues:
+            ackqueue.get()
+        tnew += time.perf_counter() - t0
+    for q in queues:
+        q.put(None)
+    for p in processes:
+        p.join()
+    print('{:d} samples ({:.0f} kB pickled), {:d} receivers: full config {:.1f} ms, patch {:.1f} ms per save'.format(
+        nsamples, len(pickle.dumps(config)) / 1024, nreceivers, told / repeat * 1000, tnew / repeat * 1000))
+
+
+if __name__ == '__main__':
+    benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 300, int(sys.argv[2]) if len(sys.argv) > 2 else 18)
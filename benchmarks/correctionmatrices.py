@@ -0,0 +1,78 @@
+"""Benchmark: the single-pass Cython correction matrices against the NumPy implementation.
+
+Times `correctionmatrices_cython()` and the `_solidangle_trig()`, `_angledependentabsorption_trig()` and
+`_angledependentairtransmission_trig()` functions of `cct.core.utils.geometrycorrections` on matrices of the size of
+a Pilatus 300k and of a larger detector, and checks that the results agree.
+
+The extension module must be built in place first: python setup.py build_ext --inplace
+
+Usage: python benchmarks/correctionmatrices.py [number of repeats]
+"""
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from cct.core.utils.correctionmatrices import correctionmatrices_cython  # noqa: E402
+from cct.core.utils.geometrycorrections import (_angledependentabsorption_trig,  # noqa: E402
+                                                _angledependentairtransmission_trig, _solidangle_trig)
+
+
+def make_geometry(shape, distance: float = 1300.0, pixelsize: float = 0.172):
+    """The sin(2theta), 1/cos(2theta), cos(2theta) and dtwotheta matrices of a detector with the beam in the middle"""
+    row, column = np.ogrid[:shape[0], :shape[1]]
+    radius = np.hypot((row - shape[0] / 2) * pixelsize, (column - shape[1] / 2) * pixelsize)
+    twotheta = np.arctan(radius / distance)
+    dtwotheta = np.full(shape, 1e-4)
+    return np.sin(twotheta), 1 / np.cos(twotheta), np.cos(twotheta), dtwotheta
+
+
+def timeit(func, repeat: int) -> float:
+    """The best time of `repeat` runs, in ms"""
+    best = np.inf
+    for i in range(repeat):
+        t0 = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - t0)
+    return best * 1000
+
+
+def benchmark(shape, repeat: int):
+    sin2theta, invcos2theta, cos2theta, dtwotheta = make_geometry(shape)
+    distance, ddistance, transmission, dtransmission, pressure = 1300.0, 0.5, 0.5, 0.01, 0.2
+
+    def numpy_all():
+        return (_solidangle_trig(cos2theta, sin2theta, dtwotheta, distance, ddistance) +
+                _angledependentabsorption_trig(sin2theta, invcos2theta, dtwotheta, transmission, dtransmission) +
+                _angledependentairtransmission_trig(sin2theta, invcos2theta, dtwotheta, pressure, distance, ddistance))
+
+    def cython_all():
+        return correctionmatrices_cython(sin2theta, invcos2theta, dtwotheta, distance, ddistance, transmission,
+                                         dtransmission, pressure)
+
+    def numpy_exposure():
+        # the solid angle is cached per geometry: only the transmission- and pressure-dependent ones are needed
+        return (_angledependentabsorption_trig(sin2theta, invcos2theta, dtwotheta, transmission, dtransmission) +
+                _angledependentairtransmission_trig(sin2theta, invcos2theta, dtwotheta, pressure, distance, ddistance))
+
+    def cython_exposure():
+        return correctionmatrices_cython(sin2theta, invcos2theta, dtwotheta, distance, ddistance, transmission,
+                                         dtransmission, pressure, solidangle=False)[2:]
+
+    maxdiff = max(np.max(np.abs(c - n) / np.abs(n)) for c, n in zip(cython_all(), numpy_all()))
+    print('{:d}x{:d} pixels (largest relative difference: {:.1e}):'.format(shape[0], shape[1], maxdiff))
+    for label, numpyfunc, cythonfunc in [('all three corrections', numpy_all, cython_all),
+                                         ('per exposure (no solid angle)', numpy_exposure, cython_exposure)]:
+        tnumpy = timeit(numpyfunc, repeat)
+        tcython = timeit(cythonfunc, repeat)
+        print('  {:<30s} NumPy {:7.2f} ms, Cython {:7.2f} ms, speedup {:.1f}x'.format(
+            label, tnumpy, tcython, tnumpy / tcython))
+
+
+if __name__ == '__main__':
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    for shape in [(619, 487), (1679, 1475)]:
+        benchmark(shape, repeat)
@@ -0,0 +1,138 @@
+"""Benchmark: the tiled correlation matrix kernel and the incremental update against the original kernel.
+
+For each number of curves N (with 500 q points), in linear and logarithmic mode, the following are timed:
+
+- the original `correlmatrix_cython()` (the untiled kernel with a uint8 mask and two divisions per point, compiled
+  from the copy below with pyximport),
+- the current `correlmatrix_cython()` in double and single precision,
+- `IncrementalCorrelMatrix.update()` with 10 new curves added to the already known N-10, which is what
+  ProcessingJob does when new exposures arrive. The original kernel recomputed the whole matrix in this case.
+
+The extension modules must be built in place first: python setup.py build_ext --inplace
+
+Usage: python benchmarks/correlmatrix.py [largest N]
+"""
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pyximport
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from cct.core.processing.correlmatrix import correlmatrix_cython  # noqa: E402
+from cct.core.processing.incrementalcorrelmatrix import IncrementalCorrelMatrix  # noqa: E402
+
+# The kernel before the tiling, verbatim.
+BASELINE_SOURCE = """\
+#cython: boundscheck=False, cdivision=True, embedsignature=True, language_level=3, initializedcheck=False
+import numpy as np
+from cython.parallel import prange
+from libc.math cimport log, nan, isfinite
+
+
+def correlmatrix_cython(double[:,:] intensities not None, double[:,:] errors not None, bint logarithmic=False):
+    cdef Py_ssize_t Ncurves, Npoints, icurves, ipoints, jcurves, npoints
+    cdef double[:,:] cm
+    cdef double weight
+    cdef double cmpoint, w
+    cdef unsigned char[:,:] mymask
+    cdef double NaN = nan('NaN')
+    Ncurves=intensities.shape[1]
+    Npoints=intensities.shape[0]
+    if (errors.shape[1] != Ncurves) or (errors.shape[0] != Npoints):
+        raise ValueError('Invalid shape of errors')
+    mymask = np.empty((Npoints, Ncurves), np.uint8)
+    cm = np.empty((Ncurves, Ncurves), np.double)
+    for icurves in range(Ncurves):
+        for ipoints in range(Npoints):
+            mymask[ipoints, icurves] = (((intensities[ipoints, icurves])>0) or (not logarithmic)) and (errors[ipoints, icurves]>0)
+    for icurves in prange(Ncurves, nogil=True, schedule='guided'):
+        for jcurves in range(icurves+1, Ncurves):
+            cmpoint=0
+            weight = 0
+            for ipoints in range(Npoints):
+                if (not mymask[ipoints, icurves]) or (not mymask[ipoints, jcurves]):
+                    continue
+                if logarithmic:
+                    w = (errors[ipoints, icurves]/intensities[ipoints,icurves])**2+ (errors[ipoints,jcurves]/intensities[ipoints,jcurves])**2
+                    cmpoint=cmpoint+(log(intensities[ipoints, icurves])-log(intensities[ipoints,jcurves]))**2/w
+                else:
+                    w = errors[ipoints, icurves]**2+errors[ipoints,jcurves]**2
+                    cmpoint=cmpoint +(intensities[ipoints,icurves]-intensities[ipoints,jcurves])**2/w
+                weight=weight+1/w
+            if weight>0:
+                cm[icurves,jcurves]=cm[jcurves,icurves]=cmpoint/weight
+            else:
+                cm[icurves, jcurves]=cm[jcurves,icurves]=NaN
+    for icurves in range(Ncurves):
+        cmpoint = 0
+        npoints = 0
+        for jcurves in range(Ncurves):
+            if (jcurves != icurves) and isfinite(cm[icurves,jcurves]):
+                cmpoint = cmpoint + cm[icurves,jcurves]
+                npoints = npoints+1
+        if npoints>0:
+            cm[icurves,icurves] = cmpoint / npoints
+        else:
+            cm[icurves, icurves] = NaN
+    del mymask
+    return cm
+"""
+
+NPOINTS = 500
+NNEW = 10  # number of new curves in the incremental update
+
+
+def load_baseline():
+    folder = tempfile.mkdtemp()
+    with open(os.path.join(folder, 'correlmatrix_baseline.pyx'), 'wt') as f:
+        f.write(BASELINE_SOURCE)
+    sys.path.insert(0, folder)
+    pyximport.install(setup_args={'include_dirs': np.get_include()}, build_dir=folder, language_level=3)
+    import correlmatrix_baseline
+    return correlmatrix_baseline.correlmatrix_cython
+
+
+def make_curves(ncurves: int):
+    """Power-law curves with 1% noise and some invalid points"""
+    rng = np.random.default_rng(ncurves)
+    q = np.linspace(0.1, 5, NPOINTS)
+    intensities = (100 * q ** -3)[:, np.newaxis] * (1 + 0.01 * rng.standard_normal((NPOINTS, ncurves)))
+    errors = 0.01 * np.abs(intensities)
+    errors[rng.random(errors.shape) < 0.01] = 0
+    return q, intensities, errors
+
+
+def timeit(func):
+    t0 = time.perf_counter()
+    result = func()
+    return time.perf_counter() - t0, result
+
+
+def benchmark(ncurves: int, logarithmic: bool, baseline):
+    q, intensities, errors = make_curves(ncurves)
+    fsns = list(range(ncurves))
+    tbase, cmbase = timeit(lambda: np.asarray(baseline(intensities, errors, logarithmic)))
+    tnew, cmnew = timeit(lambda: correlmatrix_cython(intensities, errors, logarithmic))
+    tsingle, cmsingle = timeit(lambda: correlmatrix_cython(intensities, errors, logarithmic, single_precision=True))
+    incremental = IncrementalCorrelMatrix(logarithmic)
+    incremental.update(fsns[:-NNEW], q, intensities[:, :-NNEW], errors[:, :-NNEW])
+    tincr, cmincr = timeit(lambda: incremental.update(fsns, q, intensities, errors))
+    maxdiff = max(np.nanmax(np.abs(cm - cmbase) / np.abs(cmbase)) for cm in [cmnew, cmincr])
+    print('{:5d} {:<11s} {:9.4f} {:9.4f} {:9.4f} {:13.4f} {:9.1f}x {:12.1e} {:9.1e}'.format(
+        ncurves, 'log' if logarithmic else 'linear', tbase, tnew, tsingle, tincr, tbase / tnew, maxdiff,
+        np.nanmax(np.abs(cmsingle - cmbase) / np.abs(cmbase))))
+
+
+if __name__ == '__main__':
+    largest = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    baseline = load_baseline()
+    print('Times in seconds, {:d} q points, incremental: {:d} new curves.'.format(NPOINTS, NNEW))
+    print('{:>5s} {:<11s} {:>9s} {:>9s} {:>9s} {:>13s} {:>10s} {:>12s} {:>9s}'.format(
+        'N', 'mode', 'original', 'tiled', 'float32', 'incremental', 'speedup', 'rel. diff', 'float32'))
+    for ncurves in [n for n in [50, 100, 200, 500, 1000, 2000] if n <= largest]:
+        for logarithmic in [False, True]:
+            benchmark(ncurves, logarithmic, baseline)
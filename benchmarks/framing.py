@@ -0,0 +1,140 @@
+"""Benchmark: splitting the received byte stream into device messages.
+
+Compares the original receive path (each read is concatenated to the pending bytes, then the device's
+`get_complete_messages()` re-splits all of them) with `ReceiveBuffer` and the framers the devices use now. The byte
+streams are made of representative replies of the devices, cut into reads of a given size, as the socket would give
+them. The frames produced by the two paths are checked to be identical.
+
+Usage: python benchmarks/framing.py [number of repeats]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from cct.core.devices.device.framing import DelimiterFramer, FixedLengthFramer, ReceiveBuffer  # noqa: E402
+
+
+# The get_complete_messages() functions of the devices before the framers, verbatim.
+
+def tmcm_get_complete_messages(message):
+    messages = []
+    # messages from the TMCM cards always consist of 9 bytes.
+    while len(message) >= 9:
+        messages.append(message[:9])
+        message = message[9:]
+    # now add the remainder as the last item of the list
+    messages.append(message)
+    return messages
+
+
+def pilatus_get_complete_messages(message: bytes) -> list:
+    return message.split(b'\x18')
+
+
+def tpg201_get_complete_messages(message: bytes):
+    messages = message.split(b'\r')
+    for i in range(len(messages) - 1):
+        messages[i] = messages[i] + b'\r'
+    return messages
+
+
+def haakephoenix_get_complete_messages(message: bytes):
+    if len(message) > 64:
+        raise ValueError('Haake Phoenix circulator not connected or not turned on, receiving garbage messages.')
+    messages = message.split(b'\r')
+    for i in range(len(messages) - 1):
+        messages[i] = messages[i] + b'\r'
+    return messages
+
+
+def tmcm_replies(n: int) -> bytes:
+    """GAP replies: reply address, module address, status, command, 4 bytes value, checksum"""
+    replies = []
+    for i in range(n):
+        reply = bytes([2, 1, 100, 6]) + (i * 1000).to_bytes(4, 'big', signed=True)
+        replies.append(reply + bytes([sum(reply) % 256]))
+    return b''.join(replies)
+
+
+def pilatus_replies(n: int) -> bytes:
+    return b''.join(b'15 OK Exposure time set to: %f sec.\x18' % (i * 0.1) for i in range(n))
+
+
+def pilatus_long_reply(size: int) -> bytes:
+    line = b'15 OK Channel 0: Temperature = 25.3C, Rel. Humidity = 12.4%;\n'
+    return line * (size // len(line)) + b'\x18'
+
+
+def tpg201_replies(n: int) -> bytes:
+    return b''.join(b'001M100023D\r' for i in range(n))
+
+
+def haakephoenix_replies(n: int) -> bytes:
+    return b''.join(b'$%06.2fC\r' % (20 + i % 100 / 10) for i in range(n))
+
+
+def chunks(stream: bytes, readsize: int):
+    return [stream[i:i + readsize] for i in range(0, len(stream), readsize)]
+
+
+def old_path(reads, get_complete_messages):
+    frames = []
+    pending = b''
+    for data in reads:
+        pending = pending + data
+        messages = get_complete_messages(pending)
+        frames.extend(messages[:-1])
+        pending = messages[-1]
+    return frames
+
+
+def new_path(reads, framer):
+    frames = []
+    buffer = ReceiveBuffer()
+    for data in reads:
+        # stands for ReceiveBuffer.recv_into(), which copies the data from the socket the same way.
+        buffer.feed(data)
+        frames.extend(buffer.pop_frames(framer))
+    return frames
+
+
+def timeit(func, repeat: int) -> float:
+    """Best of `repeat` runs, in ms"""
+    best = float('inf')
+    for i in range(repeat):
+        t0 = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - t0)
+    return best * 1000
+
+
+CASES = [
+    # label, byte stream, read size, old function, new framer
+    ('TMCM, 100k replies, 64 kB reads', tmcm_replies(100000), 65536, tmcm_get_complete_messages,
+     FixedLengthFramer(9)),
+    ('TMCM, 20k replies, 4 kB reads', tmcm_replies(20000), 4096, tmcm_get_complete_messages, FixedLengthFramer(9)),
+    ('TMCM, 20k replies, one per read', tmcm_replies(20000), 9, tmcm_get_complete_messages, FixedLengthFramer(9)),
+    ('Pilatus, 2 MB reply, 4 kB reads', pilatus_long_reply(2 * 1024 * 1024), 4096, pilatus_get_complete_messages,
+     DelimiterFramer(b'\x18')),
+    ('Pilatus, 20k short replies, 4 kB reads', pilatus_replies(20000), 4096, pilatus_get_complete_messages,
+     DelimiterFramer(b'\x18')),
+    ('Pilatus, 20k short replies, one per read', pilatus_replies(20000), 46, pilatus_get_complete_messages,
+     DelimiterFramer(b'\x18')),
+    ('TPG201, 20k replies, one per read', tpg201_replies(20000), 12, tpg201_get_complete_messages,
+     DelimiterFramer(b'\r', keep_delimiter=True)),
+    ('Haake Phoenix, 20k replies, one per read', haakephoenix_replies(20000), 8, haakephoenix_get_complete_messages,
+     DelimiterFramer(b'\r', keep_delimiter=True, maxlength=64)),
+]
+
+if __name__ == '__main__':
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    print('{:<42s} {:>10s} {:>10s} {:>8s}'.format('', 'old (ms)', 'new (ms)', 'speedup'))
+    for label, stream, readsize, function, framer in CASES:
+        reads = chunks(stream, readsize)
+        if old_path(reads, function) != new_path(reads, framer):
+            raise AssertionError('Different frames in case ' + label)
+        told = timeit(lambda: old_path(reads, function), repeat)
+        tnew = timeit(lambda: new_path(reads, framer), repeat)
+        print('{:<42s} {:10.1f} {:10.1f} {:7.1f}x'.format(label, told, tnew, told / tnew))
@@ -0,0 +1,151 @@
+"""Benchmark: the import time of `cct.core.utils.geometrycorrections` and the first call of the absorption correction.
+
+The original module derived the error propagation formula of the angle-dependent absorption correction with sympy
+when it was imported, and lambdified it. Each process importing it (the GUI, the workers of ExposureAnalyzer and of
+the processing pool) paid for this. The absorption-related part of the original module is kept below, verbatim,
+and imported from a temporary directory.
+
+Each measurement runs in a new interpreter, after importing NumPy and sastool, so that only the work done by the
+module itself is timed:
+
+- import: importing the module,
+- first call, second call: `angledependentabsorption()` on a matrix of the size of a Pilatus 300k.
+
+The current module is also imported with the `correctionmatrices` extension module made unimportable, to check that
+it works without it.
+
+Usage: python benchmarks/geometrycorrections.py [number of interpreters]
+"""
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+# The absorption correction of the original module, verbatim.
+BASELINE_SOURCE = r'''import numpy as np
+
+from sastool.misc.errorvalue import ErrorValue
+
+
+def _angledependentabsorption_value(twotheta, transmission):
+    """Correction for angle-dependent absorption of the sample
+
+    Inputs:
+        twotheta: matrix of two-theta values
+        transmission: the transmission of the sample (I_after/I_before, or
+            exp(-mu*d))
+
+    The output matrix is of the same shape as twotheta. The scattering intensity
+        matrix should be multiplied by it. Note, that this does not corrects for
+        sample transmission by itself, as the 2*theta -> 0 limit of this matrix
+        is unity. Twotheta==0 and transmission==1 cases are handled correctly
+        (the limit is 1 in both cases).
+    """
+    cor = np.ones(twotheta.shape)
+    if transmission == 1:
+        return cor
+    mud = -np.log(transmission)
+
+    cor[twotheta > 0] = transmission * mud * (1 - 1 / np.cos(twotheta[twotheta > 0])) / (
+        np.exp(-mud / np.cos(twotheta[twotheta > 0])) - np.exp(-mud))
+    return cor
+
+
+def _angledependentabsorption_error_ugly(twotheta, dtwotheta, transmission, dtransmission):
+    # calculated using sympy
+    return ((transmission * np.cos(twotheta) - np.exp(np.log(transmission) / np.cos(twotheta)) *
+             np.log(transmission) * np.cos(twotheta) + np.exp(np.log(transmission) / np.cos(twotheta))
+             * np.log(transmission) - np.exp(np.log(transmission) / np.cos(twotheta)) * np.cos(twotheta)) ** 2
+            * (transmission ** 2 * dtwotheta ** 2 * np.log(transmission) ** 2 * np.sin(twotheta) ** 2
+               + dtransmission ** 2 * np.sin(twotheta) ** 4 - 3 * dtransmission ** 2 * np.sin(twotheta) ** 2
+               - 2 * dtransmission ** 2 * np.cos(twotheta) ** 3 + 2 * dtransmission ** 2) /
+            (transmission - np.exp(np.log(transmission) / np.cos(twotheta))) ** 4) ** 0.5 * \
+           np.abs(np.cos(twotheta)) ** (-3.0)
+
+
+def __create_adaerror_function():
+    try:
+        # noinspection PyUnresolvedReferences,PyPackageRequirements
+        import sympy
+
+        tth, dtth, T, dT = sympy.symbols('tth dtth T dT')
+        mud = -sympy.log(T)
+        corr = sympy.exp(-mud) * mud * (1 - 1 / sympy.cos(tth)) / (sympy.exp(-mud / sympy.cos(tth)) - sympy.exp(-mud))
+        dcorr = (sympy.diff(corr, T) ** 2 * dT ** 2 + sympy.diff(corr, tth) ** 2 * dtth ** 2) ** 0.5
+        func = sympy.lambdify((tth, dtth, T, dT), dcorr, "numpy")
+        del sympy, tth, dtth, T, dT, mud, corr, dcorr
+    except ImportError:
+        func = _angledependentabsorption_error_ugly
+    return func
+
+
+_angledependentabsorption_error = __create_adaerror_function()
+
+
+def angledependentabsorption(twotheta, dtwotheta, transmission, dtransmission):
+    """Correction for angle-dependent absorption of the sample with error propagation
+
+    Inputs:
+        twotheta: matrix of two-theta values
+        dtwotheta: matrix of absolute error of two-theta values
+        transmission: the transmission of the sample (I_after/I_before, or
+            exp(-mu*d))
+        dtransmission: the absolute error of the transmission of the sample
+
+    Two matrices are returned: the first one is the correction (intensity matrix
+        should be multiplied by it), the second is its absolute error.
+    """
+    # error propagation formula calculated using sympy
+    return ErrorValue(_angledependentabsorption_value(twotheta, transmission),
+                      _angledependentabsorption_error(twotheta, dtwotheta, transmission, dtransmission))
+'''
+
+MEASUREMENT = """
+import sys
+import time
+sys.path[:0] = {path!r}
+import numpy as np
+import sastool.misc.errorvalue
+# the error formula of the original module is 0/0 at the beam
+np.seterr(divide='ignore', invalid='ignore')
+if {noextension!r}:
+    # makes importing the extension module fail, as if it was not built
+    sys.modules['cct.core.utils.correctionmatrices'] = None
+t0 = time.perf_counter()
+import {module} as module
+t1 = time.perf_counter()
+row, column = np.ogrid[:619, :487]
+twotheta = np.arctan(np.hypot((row - 300) * 0.172, (column - 240) * 0.172) / 1300)
+dtwotheta = np.full(twotheta.shape, 1e-4)
+module.angledependentabsorption(twotheta, dtwotheta, 0.5, 0.01)
+t2 = time.perf_counter()
+module.angledependentabsorption(twotheta, dtwotheta, 0.5, 0.01)
+t3 = time.perf_counter()
+print(t1 - t0, t2 - t1, t3 - t2)
+"""
+
+
+def measure(module: str, path, noextension: bool, ninterpreters: int):
+    """The median import time, first and second call times in ms"""
+    times = []
+    for i in range(ninterpreters):
+        output = subprocess.run([sys.executable, '-c', MEASUREMENT.format(path=path, module=module, noextension=noextension)], check=True,
+                                stdout=subprocess.PIPE, universal_newlines=True).stdout
+        times.append([float(x) * 1000 for x in output.split()])
+    return [statistics.median(column) for column in zip(*times)]
+
+
+if __name__ == '__main__':
+    ninterpreters = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    folder = tempfile.mkdtemp()
+    with open(os.path.join(folder, 'geometrycorrections_baseline.py'), 'wt') as f:
+        f.write(BASELINE_SOURCE)
+    root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+    print('Median of {:d} interpreters, ms:'.format(ninterpreters))
+    print('{:<30s} {:>10s} {:>12s} {:>12s}'.format('', 'import', 'first call', 'second call'))
+    for label, module, noextension in [('original', 'geometrycorrections_baseline', False),
+                                       ('current', 'cct.core.utils.geometrycorrections', False),
+                                       ('current, extension not built', 'cct.core.utils.geometrycorrections', True)]:
+        print('{:<30s} {:10.1f} {:12.1f} {:12.1f}'.format(
+            label, *measure(module, [folder, root], noextension, ninterpreters)))
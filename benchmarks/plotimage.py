@@ -0,0 +1,159 @@
+"""Benchmark: redrawing the two-dimensional image on a new exposure, headless (Agg canvas).
+
+The artist operations of `PlotImage.replot()` are replayed on a matplotlib figure with an Agg canvas, without Qt (the
+Qt canvas of the widget is an Agg canvas, too, only the final copy to the screen is missing here):
+
+- original: the image, the mask and the colour bar are removed and created again at full resolution, then the whole
+  canvas is drawn, followed by a garbage collection, as the widget did before the blitting.
+- full redraw: the artists are reused and the image is downsampled to the size of the axes, but the whole canvas is
+  drawn. This is what happens now when the colour bar is shown.
+- blitting: the artists are reused, the saved background is restored and only the image, the mask, the crosshair and
+  the title are drawn, then blitted.
+
+Logarithmic colour scale, 5% of the pixels masked, a figure of 640x480 pixels.
+
+The user interface files must be compiled first (python setup.py build).
+
+Usage: python benchmarks/plotimage.py [number of frames]
+"""
+import gc
+import os
+import sys
+import time
+
+import matplotlib
+import matplotlib.colors
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from cct.qtgui.core.plotimage.plotimage import downsample, downsampled_extent  # noqa: E402
+
+MASKCOLOUR = (255, 255, 255, 180)
+
+
+def make_frames(shape, nframes: int):
+    """Scattering patterns with noise, the beam in the middle, and a mask"""
+    rng = np.random.default_rng(shape[0])
+    row, column = np.ogrid[:shape[0], :shape[1]]
+    radius = np.hypot(row - shape[0] / 2, column - shape[1] / 2) + 1
+    frames = [1e6 * radius ** -3 * rng.poisson(100, shape) / 100 for i in range(nframes)]
+    mask = rng.random(shape) > 0.05
+    return frames, mask
+
+
+def make_figure():
+    figure = Figure(figsize=(6.4, 4.8), dpi=100)
+    canvas = FigureCanvasAgg(figure)
+    axes = figure.add_subplot(1, 1, 1)
+    return figure, canvas, axes
+
+
+def label(axes, i: int):
+    axes.xaxis.set_label_text('Absolute column coordinate (pixel)')
+    axes.yaxis.set_label_text('Absolute row coordinate (pixel)')
+    return axes.set_title('#{:d}: Benchmark (1300.00 mm)'.format(i))
+
+
+def original(frames, mask) -> float:
+    """Frames per second"""
+    figure, canvas, axes = make_figure()
+    extent = (0, mask.shape[1] - 1, mask.shape[0] - 1, 0)
+    image = maskimage = colorbar = crosshair = None
+    t0 = time.perf_counter()
+    for i, frame in enumerate(frames):
+        matrix = frame.copy()
+        matrix[matrix <= 0] = np.nan
+        if image is not None:
+            colorbar.remove()
+            image.remove()
+        image = axes.imshow(matrix, cmap='viridis', norm=matplotlib.colors.LogNorm(), aspect='equal',
+                            interpolation='nearest', origin='upper', zorder=1, extent=extent)
+        colorbar = figure.colorbar(image, ax=axes, use_gridspec=True)
+        if crosshair is not None:
+            for c in crosshair:
+                c.remove()
+        crosshair = axes.plot([0, mask.shape[1]], [mask.shape[0] / 2] * 2, 'w-',
+                              [mask.shape[1] / 2] * 2, [0, mask.shape[0]], 'w-', scalex=False, scaley=False)
+        gc.collect()
+        if maskimage is not None:
+            maskimage.remove()
+        mf = np.ones(mask.shape, np.double)
+        mf[~mask] = np.nan
+        maskimage = axes.imshow(mf, cmap='gray_r', interpolation='nearest', aspect='equal', alpha=0.7,
+                                origin='upper', extent=image.get_extent(), zorder=2)
+        gc.collect()
+        label(axes, i)
+        canvas.draw()
+        gc.collect()
+    return len(frames) / (time.perf_counter() - t0)
+
+
+def current(frames, mask, blit: bool) -> float:
+    """Frames per second"""
+    figure, canvas, axes = make_figure()
+    extent = (0, mask.shape[1] - 1, mask.shape[0] - 1, 0)
+    bbox = axes.get_window_extent()
+    factor = max(1, int(min(mask.shape[1] / bbox.width, mask.shape[0] / bbox.height)))
+    shownmask = downsample(mask, factor, np.logical_and, True)
+    overlay = np.zeros(shownmask.shape + (4,), np.uint8)
+    overlay[~shownmask] = MASKCOLOUR
+    displayextent = downsampled_extent(extent, mask.shape, factor)
+    image = axes.imshow(downsample(np.where(frames[0] > 0, frames[0], np.nan), factor, np.fmax, np.nan),
+                        cmap='viridis', norm=matplotlib.colors.LogNorm(), aspect='equal', interpolation='nearest',
+                        origin='upper', zorder=1, extent=displayextent, animated=True)
+    axes.axis(extent)
+    if not blit:
+        figure.colorbar(image, ax=axes, use_gridspec=True)
+    crosshair = axes.plot([0, mask.shape[1]], [mask.shape[0] / 2] * 2, 'w-',
+                          [mask.shape[1] / 2] * 2, [0, mask.shape[0]], 'w-', scalex=False, scaley=False,
+                          animated=True)
+    maskimage = axes.imshow(overlay, interpolation='nearest', aspect='equal', origin='upper', extent=displayextent,
+                            zorder=2, animated=True)
+    title = label(axes, 0)
+    title.set_animated(True)
+    animated = sorted([image, maskimage, title] + crosshair, key=lambda a: a.get_zorder())
+
+    def draw_animated():
+        for artist in animated:
+            figure.draw_artist(artist)
+        for spine in axes.spines.values():
+            figure.draw_artist(spine)
+
+    # stands for onCanvasDraw()
+    canvas.draw()
+    background = canvas.copy_from_bbox(figure.bbox)
+    draw_animated()
+    t0 = time.perf_counter()
+    for i, frame in enumerate(frames):
+        image.set_data(downsample(np.where(frame > 0, frame, np.nan), factor, np.fmax, np.nan))
+        image.set_extent(displayextent)
+        image.norm.vmin = None
+        image.norm.vmax = None
+        image.autoscale_None()
+        maskimage.set_extent(displayextent)
+        title.set_text('#{:d}: Benchmark (1300.00 mm)'.format(i))
+        if blit:
+            canvas.restore_region(background)
+            draw_animated()
+            canvas.blit(figure.bbox)
+        else:
+            canvas.draw()
+            background = canvas.copy_from_bbox(figure.bbox)
+            draw_animated()
+    return len(frames) / (time.perf_counter() - t0)
+
+
+if __name__ == '__main__':
+    nframes = int(sys.argv[1]) if len(sys.argv) > 1 else 15
+    print('Matplotlib {}, {:d} frames, frames per second:'.format(matplotlib.__version__, nframes))
+    print('{:>11s} {:>10s} {:>12s} {:>10s} {:>8s}'.format('frame', 'original', 'full redraw', 'blitting', 'speedup'))
+    for shape in [(619, 487), (1043, 981), (1679, 1475)]:
+        frames, mask = make_frames(shape, nframes)
+        forig = original(frames, mask)
+        ffull = current(frames, mask, blit=False)
+        fblit = current(frames, mask, blit=True)
+        print('{:>11s} {:10.1f} {:12.1f} {:10.1f} {:7.1f}x'.format(
+            '{:d}x{:d}'.format(*shape), forig, ffull, fblit, fblit / forig))
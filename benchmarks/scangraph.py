@@ -0,0 +1,184 @@
+"""Benchmark: showing the points of a running scan in the scan graph, headless (Agg canvas).
+
+The artist operations of `ScanGraph` are replayed on a matplotlib figure with an Agg canvas, without Qt (the Qt canvas
+of the window is an Agg canvas, too), with 8 signals plotted with '.-' lines, as in a scan of the beamstop or of a
+sample stage:
+
+- original: `appendScanPoint()` called `replot()` for each point: the data of all the lines were set, the data limits
+  recalculated from all the points (`relim()`), the legend built again and the whole figure drawn. The cost of a
+  point is measured after 1000, 5000 and 10000 points, and the time of the whole scan is interpolated from these.
+- incremental: the points are collected and shown in frames, as `updateCurves()` does when its timer fires: the data
+  limits are extended by the new points only, the view limits are extended with headroom if the new points do not
+  fit (`ScanGraph._extendViewLimits()`), and if the view limits did not change, only the new line segments are drawn
+  on the saved background and blitted. A whole scan of 10000 points is shown, 50 points per frame (a point every
+  2 ms at 10 frames per second), then replotted once at the end, as when the scan finishes.
+- incremental, tight: the same, but the view limits follow the data tightly (`autoscale_view(tight=True)`). As the
+  abscissa grows with every point, the view limits change in every frame and the figure is always redrawn.
+
+Usage: python benchmarks/scangraph.py [number of points]
+"""
+import sys
+import time
+
+import matplotlib
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from matplotlib.lines import Line2D
+
+NSIGNALS = 8
+POINTSPERFRAME = 50
+NREPEAT = 5  # the number of points timed at each length with the original replot
+HEADROOM = 0.5  # ScanGraph.autoscale_headroom
+
+
+def make_scan(npoints: int) -> np.ndarray:
+    """A scan of a motor with 8 noisy signals"""
+    rng = np.random.default_rng(npoints)
+    data = np.zeros(npoints, dtype=[('Motor', np.double), ('FSN', np.double)] +
+                                   [('signal{:d}'.format(i), np.double) for i in range(NSIGNALS - 1)])
+    data['Motor'] = np.linspace(-5, 5, npoints)
+    data['FSN'] = np.arange(npoints)
+    for i in range(NSIGNALS - 1):
+        data['signal{:d}'.format(i)] = (i + 1) * np.exp(-data['Motor'] ** 2 / 2) + 0.05 * rng.standard_normal(
+            npoints)
+    return data
+
+
+class Graph(object):
+    """The figure of the scan graph with one line for each signal"""
+
+    def __init__(self, data: np.ndarray):
+        self.data = data
+        self.figure = Figure(figsize=(6.4, 4.8), dpi=100)
+        self.canvas = FigureCanvasAgg(self.figure)
+        self.axes = self.figure.add_subplot(1, 1, 1)
+        self.curvehandles = []
+        for signal in self.data.dtype.names[1:]:
+            self.curvehandles.extend(self.axes.plot([], [], '.-', label=signal))
+        self.axes.autoscale(True, tight=True)
+        self.drawnlength = 0
+        self.background = None
+
+    def draw(self):
+        # stands for onCanvasDraw()
+        self.canvas.draw()
+        self.background = self.canvas.copy_from_bbox(self.figure.bbox)
+
+    def replot(self, length: int):
+        """The original path, also run once when the scan finishes"""
+        abscissa = self.data['Motor'][:length]
+        for signal, handle in zip(self.data.dtype.names[1:], self.curvehandles):
+            handle.set_xdata(abscissa)
+            handle.set_ydata(self.data[signal][:length])
+            handle.set_lw(1)
+        self.drawnlength = length
+        self.curvehandles[0].set_lw(3)
+        self.axes.relim(True)
+        self.axes.autoscale_view(True, True, True)
+        self.axes.legend(self.curvehandles, [c.get_label() for c in self.curvehandles], loc='best')
+        self.draw()
+
+    def extend_view_limits(self, fresh: bool) -> bool:
+        """Same as ScanGraph._extendViewLimits()"""
+        changed = False
+        for limits, (datalow, datahigh), inverted, setlimits in [
+            (self.axes.get_xlim(), self.axes.dataLim.intervalx, self.axes.xaxis_inverted(), self.axes.set_xlim),
+            (self.axes.get_ylim(), self.axes.dataLim.intervaly, self.axes.yaxis_inverted(), self.axes.set_ylim)]:
+            if not (np.isfinite(datalow) and np.isfinite(datahigh)):
+                continue
+            low, high = sorted(limits)
+            headroom = (datahigh - datalow) * HEADROOM
+            if headroom <= 0:
+                headroom = max(abs(datalow), 1) * HEADROOM
+            if fresh or (datalow < low) or (datahigh > high):
+                if fresh or (datalow < low):
+                    low = datalow - headroom
+                if fresh or (datahigh > high):
+                    high = datahigh + headroom
+                setlimits(*((high, low) if inverted else (low, high)), auto=None)
+                changed = True
+        return changed
+
+    def update_curves(self, length: int, tight: bool) -> bool:
+        """The incremental path. Returns True if the figure had to be drawn again."""
+        start, end = self.drawnlength, length
+        first = max(start - 1, 0)
+        abscissa = self.data['Motor'][:end]
+        segments = []
+        for signal, handle in zip(self.data.dtype.names[1:], self.curvehandles):
+            ordinate = self.data[signal][:end]
+            handle.set_data(abscissa, ordinate)
+            segment = Line2D(abscissa[first:], ordinate[first:])
+            segment.update_from(handle)
+            segment.set_figure(self.figure)
+            segments.append(segment)
+        self.drawnlength = end
+        viewlimits = self.axes.viewLim.get_points().copy()
+        self.axes.update_datalim(np.vstack([s.get_xydata()[start - first:] for s in segments]))
+        if tight:
+            self.axes.autoscale_view(tight=True)
+            limitschanged = not np.array_equal(viewlimits, self.axes.viewLim.get_points())
+        else:
+            limitschanged = self.extend_view_limits(start == 0)
+        if (self.background is None) or limitschanged:
+            self.draw()
+            return True
+        self.canvas.restore_region(self.background)
+        for segment in segments:
+            self.axes.draw_artist(segment)
+        self.background = self.canvas.copy_from_bbox(self.figure.bbox)
+        self.canvas.blit(self.axes.bbox)
+        return False
+
+
+def original(data: np.ndarray, lengths):
+    """Milliseconds per point after the given number of points"""
+    graph = Graph(data)
+    times = []
+    for length in lengths:
+        t0 = time.perf_counter()
+        for i in range(NREPEAT):
+            graph.replot(length - NREPEAT + i + 1)
+        times.append((time.perf_counter() - t0) / NREPEAT * 1000)
+    return times
+
+
+def incremental(data: np.ndarray, lengths, tight: bool):
+    """Milliseconds per frame around the given number of points, the number of full redraws, the total time of the
+    scan and the time of the final replot"""
+    graph = Graph(data)
+    frametimes = []
+    redraws = 0
+    t0 = time.perf_counter()
+    for end in range(POINTSPERFRAME, len(data) + 1, POINTSPERFRAME):
+        t1 = time.perf_counter()
+        redraws += graph.update_curves(end, tight)
+        frametimes.append((end, (time.perf_counter() - t1) * 1000))
+    t1 = time.perf_counter()
+    graph.replot(len(data))
+    tfinal = time.perf_counter() - t1
+    times = []
+    for length in lengths:
+        # the median of the frames around this length, to skip the occasional full redraws
+        times.append(np.median([t for end, t in frametimes if abs(end - length) <= 5 * POINTSPERFRAME]))
+    return times, redraws, len(frametimes), time.perf_counter() - t0, tfinal
+
+
+if __name__ == '__main__':
+    npoints = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    lengths = [n for n in [1000, 5000, 10000] if n <= npoints]
+    data = make_scan(npoints)
+    print('Matplotlib {}, {:d} signals, {:d} points:'.format(matplotlib.__version__, NSIGNALS, npoints))
+    told = original(data, lengths)
+    results = {label: incremental(data, lengths, tight) for label, tight in [('incremental', False),
+                                                                             ('incremental, tight', True)]}
+    print('{:>8s} {:>20s} {:>30s} {:>30s}'.format('points', 'original (ms/point)', *[
+        '{} (ms/frame)'.format(label) for label in results]))
+    for i, length in enumerate(lengths):
+        print('{:8d} {:20.1f} {:30.1f} {:30.1f}'.format(length, told[i], *[r[0][i] for r in results.values()]))
+    for label, (times, redraws, nframes, ttotal, tfinal) in results.items():
+        print('{}, whole scan: {:.2f} s for {:d} frames of {:d} points ({:d} full redraws), final replot {:.0f} '
+              'ms.'.format(label.capitalize(), ttotal, nframes, POINTSPERFRAME, redraws, tfinal * 1000))
+    print('Original, whole scan (interpolated from the above): {:.0f} s.'.format(
+        np.interp(np.arange(1, npoints + 1), [0] + lengths, [0] + told).sum() / 1000))
@@ -1,11 +1,14 @@
 import datetime
 import logging
+import os
+import statistics
 import time
 import traceback
 
 from .command import Command, CommandArgumentError, CommandError, CommandKilledError
 from ..devices.device.frontend import Device
 from ..instrument.privileges import PRIV_BEAMSTOP, PRIV_MOVEMOTORS, PRIV_PINHOLE
+from ..utils.timeout import TimeOut
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
@@ -16,10 +19,10 @@ class GeneralScan(Command):
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        assert self.name in ['scan', 'scanrel']
+        assert self.name in ['scan', 'scanrel', 'flyscan']
         if self.kwargs:
             raise CommandArgumentError('Command {} does not support keyword arguments.'.format(self.name))
-        if self.name == 'scan':
+        if self.name in ['scan', 'flyscan']:
             if len(self.args) != 6:
                 raise CommandArgumentError('Command {} needs exactly six positional arguments.'.format(self.name))
         else:
@@ -38,7 +41,7 @@ class GeneralScan(Command):
         if (self.motorname in ['PH1_X', 'PH1_Y', 'PH2_X', 'PH2_Y', 'PH3_X', 'PH3_Y'] and
                 not self.services['accounting'].has_privilege(PRIV_PINHOLE)):
             raise CommandError('Insufficient privileges to move the pinholes')
-        if self.name == 'scan':
+        if self.name in ['scan', 'flyscan']:
             self.start = float(self.args[1])
             self.end = float(self.args[2])
             self.npoints = int(self.args[3])
@@ -76,7 +79,7 @@ class GeneralScan(Command):
             self.start = pos - self.halfwidth
             self.end = pos + self.halfwidth
         else:
-            assert self.name == 'scan'
+            assert self.name in ['scan', 'flyscan']
         if not motor.checklimits(self.start):
             raise CommandArgumentError(
                 'Start position is outside the software limits for motor {}'.format(self.motorname))
@@ -246,3 +249,375 @@ class ScanRel(GeneralScan):
         None
     """
     name = 'scanrel'
+
+
+class FlyScan(GeneralScan):
+    """Do a scan measurement while the motor is moving continuously
+
+    Invocation: flyscan(<motor>, <start>, <end>, <Npoints>, <exptime>, <comment>)
+
+    Arguments:
+        <motor>: name of the motor
+        <start>: starting position (inclusive)
+        <end>: end position (inclusive)
+        <Npoints>: number of points
+        <exptime>: exposure time at each point
+        <comment>: description of the scan
+
+    Remarks:
+        The motor is moved at a constant speed while the detector takes
+        <Npoints> images in one go, one in every <exptime> + 3 ms. The
+        position assigned to an image is that of the motor in the middle of
+        the exposure, calculated from the start time reported by the detector
+        and a model of the motion, which is matched to the positions read back
+        from the motor controller. The motor is started from
+        a run-up position before <start> and stops after <end>: these must
+        also be inside the soft limits. The required speed must not exceed
+        the maximum speed currently set for the motor, which is restored
+        after the scan. The reduced speed is not stored in the EEPROM of the
+        motor controller.
+    """
+    name = 'flyscan'
+
+    # the dead time between the images, the lowest allowed by the detector
+    expdelay = 0.003
+
+    # time spent at constant speed before the first exposure (seconds)
+    runup_time = 0.5
+
+    # interval of looking for new image files (seconds)
+    filecheck_interval = 0.5
+
+    # how long to wait for the image files after the detector has finished (seconds)
+    file_wait_timeout = 30
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.period = self.exptime + self.expdelay
+        self.speed = None
+        self.acceleration = None
+        self.runup_start = None
+        self.runout_end = None
+        self.imgpath = None
+        self.fsns = None
+        self.filenames = None
+        self._pending = []  # indices of the images not yet submitted to exposureanalyzer
+        self._original_maxspeed = None
+        self._motorstartpos = None
+        self._motorstarttime = None
+        self._motordelays = []  # read-back time minus the time given by the model, in the constant speed range
+        self._exposecommandtime = None
+        self._exposurestarttime = None
+        self._detector_idle_since = None
+        self._motor_stopped = False
+        self._speed_acknowledged = False  # the maxspeed of the motor has been read back after setting it
+        self._detector_ready = False  # the detector has acknowledged the multi-image settings
+        self._timer = None
+
+    def validate(self):
+        super().validate()
+        motor = self.get_motor(self.motorname)
+        if self.start == self.end:
+            raise CommandArgumentError('Start and end positions must be different.')
+        self.speed = abs(self.end - self.start) / (self.npoints - 1) / self.period
+        maxspeed = motor.get_variable('maxspeed')
+        if self.speed > maxspeed:
+            raise CommandArgumentError(
+                'The required speed ({:.4f}) is larger than the maximum speed of motor {} ({:.4f}). Increase the '
+                'exposure time or the number of points.'.format(self.speed, self.motorname, maxspeed))
+        self.acceleration = motor.get_variable('maxacceleration')
+        if self.acceleration <= 0:
+            raise CommandError('Invalid acceleration for motor {}: {}'.format(self.motorname, self.acceleration))
+        # run-up: reach the constant speed, run at it for `runup_time` and half an exposure more, thus the middle of
+        # the first exposure will be at the start position. The same on the other end, for decelerating.
+        runup = self.speed ** 2 / (2 * self.acceleration) + self.speed * (self.runup_time + 0.5 * self.exptime)
+        direction = 1 if self.end > self.start else -1
+        self.runup_start = self.start - direction * runup
+        self.runout_end = self.end + direction * runup
+        for pos in [self.runup_start, self.runout_end]:
+            if not motor.checklimits(pos):
+                raise CommandArgumentError(
+                    'Run-up/run-out position ({:.3f}) is outside the software limits for motor {}'.format(
+                        pos, self.motorname))
+        return True
+
+    def motor_delay(self) -> float:
+        """How much the motor lags behind the model started at the time of the move command, as found from the
+        read-back positions. Zero if there are none yet."""
+        if not self._motordelays:
+            return 0.0
+        return statistics.median(self._motordelays)
+
+    def position_at(self, t: float) -> float:
+        """The position of the motor at time `t` (as returned by time.monotonic()), calculated from the time when it
+        was started, corrected by `motor_delay()`."""
+        direction = 1 if self.runout_end > self._motorstartpos else -1
+        elapsed = max(0.0, t - self._motorstarttime - self.motor_delay())
+        acceltime = self.speed / self.acceleration
+        if elapsed < acceltime:
+            distance = 0.5 * self.acceleration * elapsed ** 2
+        else:
+            distance = 0.5 * self.speed * acceltime + self.speed * (elapsed - acceltime)
+        return self._motorstartpos + direction * min(distance, abs(self.runout_end - self._motorstartpos))
+
+    def execute(self):
+        self.idx = 0
+        self.killed = None
+        self._starttime = None
+        self._motor_stopped = False
+        self._speed_acknowledged = False
+        self._detector_ready = False
+        self._detector_idle_since = None
+        self._motordelays = []
+        self._exposecommandtime = None
+        self._exposurestarttime = None
+        try:
+            cmdline = self.namespace['commandline']
+        except KeyError:
+            cmdline = '{}("{}", {:f}, {:f}, {:d}, {:f}, "{}")'.format(
+                self.name, self.motorname, self.start, self.end, self.npoints, self.exptime, self.comment)
+        self.scanfsn = self.services['filesequence'].new_scan(
+            cmdline, self.comment, self.exptime, self.npoints, self.motorname)
+        self._ea_connection = self.services['exposureanalyzer'].connect('scanpoint',
+                                                                        self.on_scanpoint)
+        self.fsns = list(self.services['filesequence'].get_nextfreefsns(self.prefix, self.npoints))
+        self.filenames = [self.services['filesequence'].exposurefileformat(self.prefix, f) + '.cbf'
+                          for f in self.fsns]
+        self.imgpath = self.config['path']['directories']['images_detector'][0] + '/' + self.prefix
+        self._pending = list(range(self.npoints))
+        self._outstanding_scanpoints = 0
+        self._work_status = 'Moving to start'
+        self.emit('message', 'Scan #{:d} started. Moving motor {} to the run-up position ({:.3f})'.format(
+            self.scanfsn, self.motorname, self.runup_start))
+        self.get_motor(self.motorname).moveto(self.runup_start)
+
+    def on_variable_change(self, device: Device, variablename: str, newvalue):
+        if self.killed is not None:
+            return False
+        if (device.name == self.motorname) and (variablename == 'maxspeed') and (
+                self._work_status == 'Initializing detector'):
+            # the speed actually set, after the conversion to the units of the controller.
+            if newvalue <= 0:
+                # too slow for the controller: it was truncated to zero.
+                self._fail(CommandError(
+                    'The required speed ({:g}) is too low for motor {}: it would not move. Decrease the exposure '
+                    'time or the number of points.'.format(self.speed, self.motorname)))
+                return False
+            self.speed = newvalue
+            self._speed_acknowledged = True
+            self._start_motor()
+        elif (device.name == 'pilatus') and (variablename == 'exptime') and (
+                self._work_status == 'Initializing detector'):
+            self._detector_ready = True
+            self._start_motor()
+        elif (device.name == 'pilatus') and (variablename == 'starttime') and (newvalue is not None) and (
+                self._work_status == 'Exposing') and (self._exposurestarttime is None):
+            self._on_exposure_started(newvalue)
+        elif (device.name == 'pilatus') and (variablename == '_status') and (newvalue == 'idle') and (
+                self._work_status in ['Exposing', 'Finalizing']):
+            self._detector_idle_since = time.monotonic()
+            self._check_finished()
+        return False
+
+    def _start_motor(self):
+        """Start the motor when both the speed set in the controller and the detector are ready, and the exposure
+        when the motor has reached the constant speed. The two come from different backend processes, in any order."""
+        if not (self._speed_acknowledged and self._detector_ready):
+            return
+        motor = self.get_motor(self.motorname)
+        self._work_status = 'Accelerating'
+        self._motorstartpos = motor.where()
+        motor.moveto(self.runout_end)
+        self._motorstarttime = time.monotonic()
+        self._timer = TimeOut(1000 * (self.speed / self.acceleration + self.runup_time), self._start_exposure,
+                              singleShot=True)
+
+    def _start_exposure(self):
+        if self.killed is not None:
+            return False
+        self._work_status = 'Exposing'
+        # the exposure starts when the detector says so, see _on_exposure_started().
+        self._exposecommandtime = time.monotonic()
+        try:
+            self.get_device('pilatus').expose(self.filenames[0])
+        except Exception as exc:
+            self._fail(exc, traceback.format_exc())
+            return False
+        self.emit('message', 'Exposing {:d} images. First: {}'.format(self.npoints, self.filenames[0]))
+        self._timer = TimeOut(1000 * self.filecheck_interval, self._check_files)
+        return False
+
+    def _on_exposure_started(self, starttime: datetime.datetime):
+        now = time.monotonic()
+        # The start time reported by the detector, converted to our clock. The clocks of the two computers can differ
+        # a bit, but the exposure must have started after we sent the command and before we got the acknowledgement.
+        started = now - (datetime.datetime.now(starttime.tzinfo) - starttime).total_seconds()
+        self._exposurestarttime = self._starttime = min(max(started, self._exposecommandtime), now)
+        logger.debug('Exposure started {:.4f} s after the command, acknowledged after {:.4f} s'.format(
+            started - self._exposecommandtime, now - self._exposecommandtime))
+        self.exposure_startdate = datetime.datetime.now() - datetime.timedelta(seconds=now - self._exposurestarttime)
+
+    def _check_files(self):
+        """Submit the images which are ready to exposureanalyzer, in one batch."""
+        if self.killed is not None:
+            return False
+        now = time.monotonic()
+        ready = []
+        # nothing can be submitted until the detector has acknowledged the start of the exposure
+        for i in (self._pending if self._exposurestarttime is not None else []):
+            if ((self._exposurestarttime + i * self.period + self.exptime > now) or
+                    not self.services['filesequence'].is_cbf_ready(self.prefix + '/' + self.filenames[i])):
+                # keep the order of the images
+                break
+            ready.append(i)
+        if ready:
+            self._submit_images(ready)
+        if not self._pending:
+            self._timer = None
+            self._check_finished()
+            return False
+        if (self._detector_idle_since is not None) and (now - self._detector_idle_since > self.file_wait_timeout):
+            self._timer = None
+            self._fail(CommandError('Image file {} not found.'.format(self.filenames[self._pending[0]])))
+            return False
+        return True
+
+    def _submit_images(self, indices):
+        exposures = []
+        for i in indices:
+            midtime = self._exposurestarttime + i * self.period + 0.5 * self.exptime
+            exposures.append(
+                (self.fsns[i], os.path.join(self.imgpath, self.filenames[i]),
+                 self.exposure_startdate + datetime.timedelta(seconds=i * self.period),
+                 {'position': self.position_at(midtime), 'scanfsn': self.scanfsn,
+                  'retry_timeout': 0.1, 'n_retries': 10}))
+        self.services['filesequence'].new_exposures(self.prefix, exposures)
+        self._pending = self._pending[len(indices):]
+        self._outstanding_scanpoints += len(indices)
+        self.idx += len(indices)
+        elapsedtime = time.monotonic() - self._starttime
+        totaltime = self.npoints * self.period
+        self.emit('progress', 'Scan running: {:d}/{:d} (remaining time: {:.1f} s)'.format(
+            self.idx, self.npoints, max(0.0, totaltime - elapsedtime)), self.idx / self.npoints)
+        if not self._pending:
+            self._work_status = 'Finalizing'
+            self.emit('message', 'Finalizing scan #{:d}.'.format(self.scanfsn))
+
+    def _check_finished(self):
+        if ((not self._pending) and (self._detector_idle_since is not None) and self._motor_stopped and
+                (self._outstanding_scanpoints <= 0)):
+            self.emit('message', 'Scan #{:d} finished.'.format(self.scanfsn))
+            self.idle_return(self.scanfsn)
+
+    def on_scanpoint(self, exposureanalyzer, prefix, fsn, pos, counters):
+        try:
+            self.emit('detail', (fsn, pos, counters))
+        except Exception as exc:
+            logger.error('Error while emitting \'detail\' signal: {} {}'.format(exc, traceback.format_exc()))
+        self._outstanding_scanpoints -= 1
+        self._check_finished()
+        return False
+
+    def on_motor_position_change(self, motor, newposition):
+        if (self.killed is not None) or self._motor_stopped or (
+                self._work_status not in ['Accelerating', 'Exposing', 'Finalizing']):
+            return False
+        # when the backend got the position from the controller: the delay of the front-end does not count
+        timestamp = motor.get_timestamp('actualposition')
+        acceltime = self.speed / self.acceleration
+        rampdistance = 0.5 * self.speed * acceltime
+        distance = abs(newposition - self._motorstartpos)
+        if rampdistance < distance < abs(self.runout_end - self._motorstartpos) - rampdistance:
+            # the motor is at constant speed: see when the model says it should be here.
+            expected = self._motorstarttime + acceltime + (distance - rampdistance) / self.speed
+            self._motordelays.append(timestamp - expected)
+        return False
+
+    def _check_motor_model(self):
+        """Compare the model of the motion with the positions read back from the motor controller. A deviation larger
+        than half the step between the images makes their positions unreliable."""
+        if not self._motordelays:
+            msg = 'No read-back positions from motor {} at constant speed: the positions of the images ' \
+                  'could not be checked.'.format(self.motorname)
+        else:
+            delay = self.motor_delay()
+            deviation = max(abs(d - delay) for d in self._motordelays) * self.speed
+            logger.debug('Motor delay in flyscan: {:.4f} s, maximum deviation: {:.4f} from {:d} positions'.format(
+                delay, deviation, len(self._motordelays)))
+            if deviation <= 0.5 * self.speed * self.period:
+                return
+            msg = 'Motor {} deviated from the constant speed motion by up to {:.4f}, more than half the step ' \
+                  'between the images: their positions are inaccurate.'.format(self.motorname, deviation)
+        logger.warning(msg)
+        self.emit('message', msg)
+
+    def on_motor_stop(self, motor, targetreached):
+        logger.debug('on_motor_stop in flyscan: motor {}, targetreached: {}'.format(motor.name, targetreached))
+        if self.killed is False:
+            # we have already failed
+            return False
+        if self._work_status == 'Moving to start':
+            if self.killed:
+                self.die_on_kill()
+            elif not targetreached:
+                self._fail(CommandError('Run-up position of motor {} not reached.'.format(self.motorname)))
+            else:
+                self._original_maxspeed = motor.get_variable('maxspeed')
+                # not stored in the EEPROM of the controller: the original speed comes back after a power cycle
+                # even if we die before restoring it.
+                motor.set_maxspeed_temporarily(self.speed)
+                pilatus = self.get_device('pilatus')
+                pilatus.set_variable('nimages', self.npoints)
+                pilatus.set_variable('expperiod', self.period)
+                pilatus.set_variable('imgpath', self.imgpath)
+                pilatus.set_variable('exptime', self.exptime)
+                self._work_status = 'Initializing detector'
+        elif self._work_status in ['Accelerating', 'Exposing', 'Finalizing']:
+            self._motor_stopped = True
+            self._restore_speed()
+            if self.killed:
+                self.die_on_kill()
+            elif not targetreached:
+                self._fail(CommandError('Motor {} stopped before reaching the end of the scan.'.format(
+                    self.motorname)))
+            else:
+                self._check_motor_model()
+                self._check_finished()
+        return False
+
+    def _restore_speed(self):
+        if self._original_maxspeed is not None:
+            self.get_motor(self.motorname).set_maxspeed_temporarily(self._original_maxspeed)
+            self._original_maxspeed = None
+
+    def _stop_timer(self):
+        if self._timer is not None:
+            self._timer.stop()
+            self._timer = None
+
+    def _fail(self, exc: Exception, tb: str = 'no traceback'):
+        self.killed = False
+        self._stop_timer()
+        self.get_device('pilatus').stop()
+        if not self._motor_stopped:
+            self.get_motor(self.motorname).stop()
+        self._restore_speed()
+        self.emit('fail', exc, tb)
+        self.idle_return(None)
+
+    def kill(self):
+        self.killed = True
+        self._stop_timer()
+        self.get_device('pilatus').stop()
+        if (self._work_status in ['Moving to start', 'Accelerating', 'Exposing', 'Finalizing'] and
+                not self._motor_stopped):
+            # wait for the motor to stop: see on_motor_stop()
+            self.get_motor(self.motorname).stop()
+        else:
+            self._restore_speed()
+            self.die_on_kill()
+
+    def cleanup(self, *args, **kwargs):
+        self._stop_timer()
+        self._restore_speed()
+        super().cleanup(*args, **kwargs)
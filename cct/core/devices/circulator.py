@@ -1,9 +1,9 @@
 import datetime
 import logging
 import multiprocessing
-from typing import List, Tuple
+from typing import Tuple
 
-from .device import CommunicationError, Device, DeviceBackend_TCP, InvalidMessage, InvalidValue, ReadOnlyVariable, \
+from .device import DelimiterFramer, Device, DeviceBackend_TCP, InvalidMessage, InvalidValue, ReadOnlyVariable, \
     UnknownCommand, UnknownVariable
 
 logger = logging.getLogger(__name__)
@@ -14,6 +14,9 @@ logger.setLevel(logging.INFO)
 class HaakePhoenix_Backend(DeviceBackend_TCP):
     reply_timeout = 5
 
+    # more than 64 bytes without a line end: not connected or not turned on, receiving garbage
+    framer = DelimiterFramer(b'\r', keep_delimiter=True, maxlength=64)
+
     def execute_command(self, commandname: str, arguments: Tuple):
         if commandname == 'start':
             self.send_message(b'W TS 1\r')
@@ -30,15 +33,6 @@ class HaakePhoenix_Backend(DeviceBackend_TCP):
         else:
             raise UnknownCommand(commandname)
 
-    def get_complete_messages(self, message: bytes) -> List[bytes]:
-        if len(message) > 64:
-            raise CommunicationError(
-                'Haake Phoenix circulator not connected or not turned on, receiving garbage messages.')
-        messages = message.split(b'\r')
-        for i in range(len(messages) - 1):
-            messages[i] = messages[i] + b'\r'
-        return messages
-
     def process_incoming_message(self, message: bytes, original_sent=None):
         if message == b'F001\r':
             # unknown command
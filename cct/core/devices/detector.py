@@ -7,7 +7,7 @@ from typing import Optional
 import dateutil.parser
 
 from .device import Device, DeviceError, ReadOnlyVariable, CommunicationError, UnknownVariable, InvalidValue, \
-    UnknownCommand, DeviceBackend_TCP
+    UnknownCommand, DeviceBackend_TCP, DelimiterFramer
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
@@ -141,6 +141,25 @@ Channel {int}: Temperature = (?P<temperature2>{float})C, Rel. Humidity = (?P<hum
 class Pilatus_Backend(DeviceBackend_TCP):
     idle_wait = 1.0
 
+    framer = DelimiterFramer(b'\x18')
+
+    query_commands = dict(
+        [(vn, b'SetThreshold\n') for vn in ['gain', 'threshold', 'vcmp', 'trimfile']] +
+        [(vn, b'Telemetry\n') for vn in ['wpix', 'hpix', 'sel_bank', 'sel_module', 'sel_chip',
+                                          'telemetry_date']] +
+        [(vn, b'THread\n') for vn in ['humidity0', 'humidity1', 'humidity2',
+                                       'temperature0', 'temperature1', 'temperature2']] +
+        [(vn, b'camsetup\n') for vn in ['cameradef', 'cameraname', 'cameraSN', 'camstate', 'targetfile',
+                                         'timeleft', 'lastimage', 'masterPID', 'controllingPID',
+                                         'exptime', 'lastcompletedimage', 'shutterstate']] +
+        [(vn, b'setlimth\n') for vn in ['limtemp_lo0', 'limtemp_lo1', 'limtemp_lo2',
+                                         'limtemp_hi0', 'limtemp_hi1', 'limtemp_hi2',
+                                         'limhum_lo0', 'limhum_lo1', 'limhum_lo2',
+                                         'limhum_hi0', 'limhum_hi1', 'limhum_hi2']] +
+        [(vn, b'tau\n') for vn in ['tau', 'cutoff']] +
+        [('nimages', b'NImages\n'), ('imgpath', b'imgpath\n'), ('imgmode', b'imgmode\n'), ('pid', b'ShowPID\n'),
+         ('expperiod', b'expperiod\n'), ('diskfree', b'df\n'), ('version', b'version\n')])
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self._expected_status = 'idle'
@@ -165,56 +184,24 @@ class Pilatus_Backend(DeviceBackend_TCP):
             super().queryall()
 
     def query_variable(self, variablename: str) -> bool:
-        if variablename in ['gain', 'threshold', 'vcmp']:
-            self.send_message(b'SetThreshold\n', expected_replies=1, asynchronous=False)
-        elif variablename in ['trimfile', 'wpix', 'hpix', 'sel_bank', 'sel_module', 'sel_chip', 'telemetry_date']:
-            self.send_message(b'Telemetry\n', expected_replies=1, asynchronous=False)
-        elif variablename.startswith('humidity') or variablename.startswith('temperature'):
-            self.send_message(b'THread\n', expected_replies=1, asynchronous=False)
-        elif variablename == 'nimages':
-            self.send_message(b'NImages\n', expected_replies=1, asynchronous=False)
-        elif variablename in ['cameradef', 'cameraname', 'cameraSN', 'camstate', 'targetfile',
-                              'timeleft', 'lastimage', 'masterPID', 'controllingPID',
-                              'exptime', 'lastcompletedimage', 'shutterstate']:
-            self.send_message(b'camsetup\n', expected_replies=1, asynchronous=False)
-        elif variablename in ['limtemp_lo0', 'limtemp_lo1', 'limtemp_lo2',
-                              'limtemp_hi0', 'limtemp_hi1', 'limtemp_hi2',
-                              'limhum_lo0', 'limhum_lo1', 'limhum_lo2',
-                              'limhum_hi0', 'limhum_hi1', 'limhum_hi2']:
-            self.send_message(b'setlimth\n', expected_replies=1, asynchronous=False)
-        elif variablename == 'imgpath':
-            self.send_message(b'imgpath\n', expected_replies=1, asynchronous=False)
-        elif variablename == 'imgmode':
-            self.send_message(b'imgmode\n', expected_replies=1, asynchronous=False)
-        elif variablename == 'pid':
-            self.send_message(b'ShowPID\n', expected_replies=1, asynchronous=False)
-        elif variablename == 'expperiod':
-            self.send_message(b'expperiod\n', expected_replies=1, asynchronous=False)
-        elif variablename in ['tau', 'cutoff']:
-            self.send_message(b'tau\n', expected_replies=1, asynchronous=False)
-        elif variablename == 'diskfree':
-            self.send_message(b'df\n', expected_replies=1, asynchronous=False)
-        elif variablename == 'version':
-            self.send_message(b'version\n', expected_replies=1, asynchronous=False)
-        elif variablename == 'starttime':
+        if variablename == 'starttime':
             if not self.is_busy():
                 self.update_variable('starttime', None)
             else:
                 # starttime has already been set
                 pass
             return False
-
         elif variablename == 'filename':
             if not self.is_busy():
                 self.update_variable('filename', 'lastimage')
             return False
-        else:
+        try:
+            command = self.query_commands[variablename]
+        except KeyError:
             raise UnknownVariable(variablename)
+        self.send_message(command, expected_replies=1, asynchronous=False)
         return True
 
-    def get_complete_messages(self, message: bytes) -> list:
-        return message.split(b'\x18')
-
     def on_end_exposure(self, status: bool, message: bytes) -> None:
         self.logger.debug('Exposure ended.')
         try:
@@ -1,5 +1,6 @@
 from .device_modbustcp import DeviceBackend_ModbusTCP
 from .device_tcp import DeviceBackend_TCP
+from .framing import DelimiterFramer, FixedLengthFramer, LengthPrefixedFramer
 from .exceptions import DeviceError, CommunicationError, ReadOnlyVariable, InvalidValue, WatchdogTimeout, \
     UnknownCommand, UnknownVariable, InvalidMessage
 from .frontend import Device
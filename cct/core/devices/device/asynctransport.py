@@ -0,0 +1,241 @@
+"""Asyncio-based transport for TCP devices.
+
+Instead of running a dedicated communication process for each TCP device (see `TCPCommunicator`), all the device
+sockets of the program are served by a single asyncio event loop, running in a background thread. The device
+backends using this transport run in threads of the front-end process (see `Device.transport`), thus no message
+needs to be pickled on its way between the front-end, the backend and the socket.
+"""
+import asyncio
+import collections
+import concurrent.futures
+import logging
+import threading
+import time
+import traceback
+from typing import List
+
+from .exceptions import CommunicationError, DeviceError
+from .framing import Framer, ReceiveBuffer
+from .message import Message
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+class ReplyBookkeeping(object):
+    """Matching the replies of the device to the messages sent. Common to the communication classes.
+
+    The class using this mix-in must have the following attributes: `name`, `lastsent` (a stack of messages waiting
+    for replies), `lastsendtimes` (a list), `cleartosend` (bool), `framer` (see `framing.Framer`), `rxbuffer` (a
+    `framing.ReceiveBuffer`) and a `send_to_backend()` method.
+    """
+    keep_this_many_lastsendtimes = 10
+
+    def register_sent_message(self, msg: Message):
+        """Do the bookkeeping after `msg` has been sent to the device."""
+        if msg['expected_replies'] > 0:
+            # if we are expecting replies, save `msg` to the last sent stack.
+            msg['sendtime'] = time.monotonic()
+            msg['received_replies'] = 0
+            self.lastsent.append(msg)
+        else:
+            # we are not expecting replies
+            self.cleartosend = True
+        if msg['asynchronous']:
+            # we can send another message before we obtain reply/replies.
+            self.cleartosend = True
+        self.send_to_backend('send_complete', message=msg['message'])
+        self.lastsendtimes.append(time.monotonic())
+        while len(self.lastsendtimes) > self.keep_this_many_lastsendtimes:
+            self.lastsendtimes.pop(0)
+
+    def dispatch_messages(self):
+        """Take the complete messages from the receive buffer and notify the backend about them."""
+        self.dispatch_frames(self.rxbuffer.pop_frames(self.framer))
+
+    def dispatch_frames(self, messages: List[bytes]):
+        """Notify the backend about complete messages received from the device."""
+        for message in messages:
+            if not self.lastsent:
+                # this is an unsolicited message from the device.
+                raise CommunicationError('Unsolicited message from device {}: {}'.format(self.name, str(message)))
+            if len(self.lastsendtimes) > 1:
+                sendfreq = (len(self.lastsendtimes) - 1) / (self.lastsendtimes[-1] - self.lastsendtimes[0])
+            else:
+                sendfreq = 0
+            self.send_to_backend('incoming', message=message, sent_message=self.lastsent[-1]['message'],
+                                 referred_id=self.lastsent[-1]['id'],
+                                 reply_count=self.lastsent[-1]['received_replies'],
+                                 send_frequency=sendfreq)
+            self.lastsent[-1]['received_replies'] += 1
+            if self.lastsent[-1]['expected_replies'] <= self.lastsent[-1]['received_replies']:
+                del self.lastsent[-1]
+            if not self.lastsent:
+                # if no messages are waiting for replies:
+                self.cleartosend = True
+            elif self.lastsent[-1]['asynchronous']:
+                # if the next message we are expecting a reply for is asynchronous,
+                # we can send another message.
+                self.cleartosend = True
+            else:
+                # leave self.cleartosend as is.
+                pass
+
+
+class EventLoopThread(object):
+    """An asyncio event loop running in a daemon thread. A single instance is shared by all the devices."""
+    _instance = None
+    _instancelock = threading.Lock()
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run, name='cct_device_eventloop', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    @classmethod
+    def instance(cls) -> 'EventLoopThread':
+        with cls._instancelock:
+            if cls._instance is None:
+                cls._instance = cls()
+            return cls._instance
+
+    def run(self, coro, timeout: float = None):
+        """Run a coroutine in the event loop and wait for its result. Must not be called from the loop thread."""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result(timeout)
+
+    def call_soon(self, func, *args):
+        """Schedule a function call in the event loop thread."""
+        self.loop.call_soon_threadsafe(func, *args)
+
+
+class AsyncTCPConnection(ReplyBookkeeping, asyncio.BufferedProtocol):
+    """The counterpart of `TCPCommunicator` in the shared event loop.
+
+    Messages to be sent are given to `send()`, which can be called from any thread. The same messages are put in
+    `incomingqueue` as by `TCPCommunicator`: 'incoming', 'send_complete', 'timeout' and 'communication_error'.
+    After a communication error the connection is closed. The received bytes are written directly into the receive
+    buffer (asyncio.BufferedProtocol).
+    """
+
+    def __init__(self, name: str, framer: Framer, incomingqueue, loopthread: EventLoopThread):
+        self.name = name
+        self.framer = framer
+        self.incomingqueue = incomingqueue
+        self.msgid_counter = 0
+        self.rxbuffer = ReceiveBuffer()
+        self.lastsent = []  # a stack of recently sent messages.
+        self.lastsendtimes = []
+        self.cleartosend = True
+        self.connected = False
+        self._loopthread = loopthread
+        self._sendqueue = collections.deque()
+        self._transport = None
+        self._closing = False
+        self._closed = threading.Event()
+
+    @classmethod
+    def open(cls, name: str, host: str, port: int, framer: Framer, incomingqueue,
+             timeout: float = 5) -> 'AsyncTCPConnection':
+        """Connect to the device. Raises DeviceError on failure."""
+        loopthread = EventLoopThread.instance()
+        connection = cls(name, framer, incomingqueue, loopthread)
+        logger.debug('Connecting over TCP/IP (asyncio) to device {}: {}:{:d}'.format(name, host, port))
+        try:
+            loopthread.run(asyncio.wait_for(loopthread.loop.create_connection(lambda: connection, host, port),
+                                            timeout), timeout + 1)
+        except (OSError, asyncio.TimeoutError, concurrent.futures.TimeoutError) as exc:
+            raise DeviceError('Cannot connect to device.', exc)
+        return connection
+
+    def send_to_backend(self, msgtype, **kwargs):
+        self.msgid_counter += 1
+        self.incomingqueue.put_nowait(Message(msgtype, self.msgid_counter, self.name + '__asyncio', **kwargs))
+
+    # Thread-safe interface
+
+    def send(self, msg: Message):
+        """Queue a message for sending."""
+        self._loopthread.call_soon(self._enqueue, msg)
+
+    def qsize(self) -> int:
+        """The number of messages waiting to be sent."""
+        return len(self._sendqueue)
+
+    def close(self, timeout: float = 5):
+        """Close the connection and wait until it is closed."""
+        self._loopthread.call_soon(self._close)
+        self._closed.wait(timeout)
+
+    # The following methods run in the event loop
+
+    def connection_made(self, transport: asyncio.Transport):
+        self._transport = transport
+        self.connected = True
+
+    def get_buffer(self, sizehint: int) -> memoryview:
+        return self.rxbuffer.get_buffer(sizehint)
+
+    def buffer_updated(self, nbytes: int):
+        self.rxbuffer.buffer_updated(nbytes)
+        try:
+            self.dispatch_messages()
+        except Exception as exc:
+            self._fail(exc, traceback.format_exc())
+            return
+        self._send_pending()
+
+    def connection_lost(self, exc):
+        self.connected = False
+        if not self._closing:
+            self._fail(exc if exc is not None else CommunicationError('Socket has been closed by the remote side'))
+        self._closed.set()
+
+    def _enqueue(self, msg: Message):
+        if self._closing:
+            return
+        assert msg['type'] == 'send'
+        self._sendqueue.append(msg)
+        self._send_pending()
+
+    def _send_pending(self):
+        while self.cleartosend and self._sendqueue and self.connected and not self._closing:
+            msg = self._sendqueue.popleft()
+            self.cleartosend = False
+            self._transport.write(msg['message'])
+            self.register_sent_message(msg)
+            if msg['expected_replies'] > 0:
+                self._loopthread.loop.call_later(msg['timeout'], self._check_timeout, msg)
+
+    def _check_timeout(self, msg: Message):
+        if self._closing or not any(m is msg for m in self.lastsent):
+            # all replies have arrived
+            return
+        elapsed = time.monotonic() - msg['sendtime']
+        self.send_to_backend('timeout', message=msg['message'], received_replies=msg['received_replies'],
+                             referred_id=msg['id'])
+        self._fail(CommunicationError(
+            'Reply timeout ({} > {}). Last sent: {}'.format(elapsed, msg['timeout'], msg['message'])))
+
+    def _fail(self, exc: Exception, tb: str = ''):
+        if self._closing:
+            return
+        self.send_to_backend('communication_error', exception=exc, traceback=tb)
+        self._closing = True
+        self._sendqueue.clear()
+        if self._transport is not None:
+            self._transport.abort()
+        else:
+            self._closed.set()
+
+    def _close(self):
+        self._closing = True
+        self._sendqueue.clear()
+        if (self._transport is not None) and self.connected:
+            self._transport.close()
+        else:
+            self._closed.set()
+        logger.debug('Closing asyncio TCP connection for ' + self.name)
@@ -1,13 +1,19 @@
+import heapq
 import logging
+import math
 import multiprocessing
+import os
 import queue
+import string
 import time
 import traceback
 from logging.handlers import QueueHandler
-from typing import Dict, List, Optional, Tuple
+from typing import Dict, Hashable, List, Optional, Tuple
 
 from .exceptions import CommunicationError, DeviceError, InvalidMessage, WatchdogTimeout
 from .message import Message
+from ...utils.configtools import apply_config_patch
+from ...utils.logwriter import BinaryLogWriter, BufferedLogWriter
 from ...utils.telemetry import TelemetryInfo
 
 
@@ -100,6 +106,7 @@ class DeviceBackend(object):
     The following 'type's are known:
 
     'config': the frontend sends the updated configuration dictionary in the 'configdict' key.
+    'config_patch': the changes of the configuration dictionary are sent in the 'patch' key (see `configtools`).
     'exit': the frontend requests the backend to disconnect from the device and finish its work.
     'query': a state variable is to be re-queried from the device. 'name' is the variable name. If 'signal_needed'
         is True, the frontend expects to be notified on successful read of the variable, even if its value has not
@@ -126,12 +133,34 @@ class DeviceBackend(object):
     'ready': the device became ready by reading all the state variables at least once.
     'telemetry': 'data' carries a telemetry dictionary
     'update': a state variable has changed. 'name' is the variable name, 'value' is its value.
+    'update-batch': several state variables have changed. 'updates' is a dict, mapping the variable names to
+        (value, timestamp) tuples, in the order of the changes. Changes are collected by `update_variable()` and sent by
+        `flush_updates()`, typically once in a polling cycle.
     """
 
     # All timestamps are generated with time.monotonic()
 
     max_outqueue_size = 40
 
+    # maximum time (seconds) to hold back variable updates when the device keeps us busy.
+    max_update_delay = 0.1
+
+    # State variable name -> the command reading it from the device. Variables mapped to the same command are read
+    # together (the reply gives all of them), therefore the command is sent only once in a query-all cycle, and all
+    # its variables are marked as being queried. Variables not in this mapping are queried one by one. Subclasses
+    # with many parametrized variables can override `get_query_command()` instead.
+    query_commands = {}
+
+    # Adaptive polling. Every variable has its own query period, starting from `queryall_interval` (multiplied by
+    # `urgency_modulo` for the non-urgent ones). If the value is found unchanged, the period is multiplied by
+    # `query_backoff`, up to `max_query_backoff` times the starting period; a change resets it. While the device is
+    # busy (see `is_busy()`), the urgent variables are polled at least every `busy_query_interval` seconds. Queries
+    # due within `query_slack` seconds are sent together.
+    query_backoff = 1.5
+    max_query_backoff = 8
+    busy_query_interval = 0.1
+    query_slack = 0.05
+
     def __init__(self, name: str, configdir: str, config: Dict, deviceconnectionparameters: Tuple,
                  inqueue: multiprocessing.Queue, outqueue: multiprocessing.Queue,
                  watchdog_timeout: float, inqueue_timeout: float, query_timeout: float,
@@ -139,7 +168,8 @@ class DeviceBackend(object):
                  minimum_query_variables: List[str], constant_variables: Optional[List[str]],
                  urgent_variables: Optional[List[str]], urgency_modulo: int, startup_number: int,
                  loglevel: int, logfile: str, log_formatstr: str, max_busy_level: int,
-                 busysemaphore: multiprocessing.BoundedSemaphore):
+                 busysemaphore: multiprocessing.BoundedSemaphore, transport: str = 'process',
+                 logformat: str = 'text'):
         """Initialize the backend process
 
         :param name: the name of the device. Appears in log/error messages, therefore should be unique
@@ -154,15 +184,15 @@ class DeviceBackend(object):
         :param inqueue_timeout: Timeout for waiting on the inqueue.
         :param query_timeout: After this time a query sent to the device is considered "lost".
         :param telemetry_interval: Minimum time between two telemetry gatherings.
-        :param queryall_interval: Minimum time between automatic queries of _all_ device variables.
+        :param queryall_interval: The shortest period of the automatic queries of a variable. See `query_backoff`.
         :param all_variables: A list of all device variables
         :param minimum_query_variables: A minimum set of device variables. Querying all of these ensures reading all the
             state variables. Must include ALL variables needed for a fully defined state, including constant variables.
         :param constant_variables: A list of constant variables: these are queried only once, at the beginning.
         :param urgent_variables: Variables that need to be updated more frequently than the others. If None, all
             variables are considered urgent.
-        :param urgency_modulo: Auto-queries only query the urgent variables in `urgent_variables`. All the others are
-            queried only every `urgency_modulo`-eth "queryall". If zero, only urgent variables are queried, every time.
+        :param urgency_modulo: The non-urgent variables are queried `urgency_modulo` times less frequently than the
+            urgent ones. If zero, only urgent variables are queried.
         :param startup_number: The number of this startup
         :param loglevel: Log level, as in the logger module.
         :param logfile: Log file name. Should be able to be open(<>, 'a', encoding='utf-8')-ed.
@@ -171,8 +201,14 @@ class DeviceBackend(object):
         :param max_busy_level: How many times the busy semaphore can be acquired
         :param busysemaphore: A semaphore which is acquired (typically from the frontend process) when a special
             operation is initiated, and released (typically by the backend) when the operation finishes.
+        :param transport: 'process' if this backend runs in a separate process, 'asyncio' if it runs in a thread of
+            the front-end process and the communication is done in the shared asyncio event loop (if supported by
+            the subclass). See `Device.transport`.
+        :param logformat: the format of the log file: 'text' (tab-separated lines, formatted by `log_formatstr`) or
+            'binary' (see `cct.core.utils.logwriter.BinaryLogWriter`, the file extension is changed to '.binlog').
         """
         self.name = name  # name of the device
+        self.transport = transport
         self.startup_number = startup_number
         self.logger = logging.getLogger(
             __name__ + '::' + self.name + '__backgroundprocess')
@@ -199,10 +235,16 @@ class DeviceBackend(object):
         self.urgent_variables = urgent_variables
         self.urgency_modulo = urgency_modulo
         self.properties = {}  # dictionary holding the state variables of the instrument
+        self.pending_updates = {}  # changed state variables not yet sent to the frontend: name -> (value, timestamp)
         self.timestamps = {}  # timestamps for each state variable, holding the time of the last successful read.
         self.query_requested = {}  # the timestamps for each variable, holding the time of the last query.
         self.refresh_requested = {}  # counting the number of refresh requests for each variable.
         self.all_variables = all_variables  # list of the names of all variables.
+        self._query_command_variables = None  # command -> variables read by it. Built when first needed.
+        self.query_periods = {}  # the current query period of each scheduled variable
+        self.query_due = {}  # the time of the next query of each scheduled variable
+        self._query_heap = []  # (due time, variable name) pairs. Those not matching `query_due` are stale.
+        self._query_mode = None  # the conditions for which the schedule has been made, see `plan_queries()`
         self.watchdog = Watchdog(watchdog_timeout)
         self.ready = False  # becomes True if all the state variables have been successfully read at least once.
         self.telemetry_interval = telemetry_interval  # the interval (seconds) to generate and send telemetry data
@@ -211,6 +253,7 @@ class DeviceBackend(object):
                           'query': 0,
                           'send': 0,
                           'recv': 0,
+                          'pending_updates': 0,
                           }
         self.counters = {'queries': 0,
                          'queryalls': 0,
@@ -218,11 +261,18 @@ class DeviceBackend(object):
                          'outmessages': 0,
                          'outqueued': 0,
                          'inqueued': 0,
+                         'variable_updates': 0,
+                         'update_batches': 0,
+                         'deduplicated_queries': 0,
                          }
         self.busysemaphore = busysemaphore
         self.max_busy_level = max_busy_level
         self.logfile = logfile
         self.log_formatstr = log_formatstr
+        if logformat not in ('text', 'binary'):
+            raise ValueError('Invalid log format: {}'.format(logformat))
+        self.logformat = logformat
+        self.logwriter = None  # created on the first log()
         self.logger.debug('Initialized background thread for {} successfully.'.format(self.name))
 
     def is_busy(self) -> int:
@@ -238,7 +288,11 @@ class DeviceBackend(object):
 
         The common required fields (id, timestamp) are computed automatically.
         Give all the other required fields as keyword arguments.
+
+        Pending variable updates are sent before the message, thus the order of the messages is kept.
         """
+        if self.pending_updates and msgtype != 'update-batch':
+            self.flush_updates()
         self.counters['outqueued'] += 1
         msg = Message(msgtype, self.counters['outqueued'], self.name + '__backend', **kwargs)
         self.outqueue.put(msg)
@@ -285,12 +339,18 @@ class DeviceBackend(object):
         self.update_variable('_status', 'Initializing')
         self.update_variable('_auxstatus', None)
         exit_status = False  # abnormal termination
+        queried = True
         while True:
             try:
                 message = None
+                # sleep until the next query is due, but not longer than `inqueue_timeout`. If queryall() has been
+                # vetoed (e.g. by a subclass), do not wake up for the same queries again and again.
+                timeout = self.inqueue_timeout
+                if queried:
+                    timeout = max(0, min(timeout, self.get_next_query_time() - time.monotonic()))
                 try:
                     message = self.inqueue.get(
-                        block=True, timeout=self.inqueue_timeout)
+                        block=True, timeout=timeout)
                     self.counters['inqueued'] += 1
                     assert isinstance(message, Message)
                 except queue.Empty:
@@ -313,9 +373,10 @@ class DeviceBackend(object):
                     self.send_to_frontend('ready')
                 # 2) check the watchdog, i.e. decide if the device is responsive.
                 self.watchdog.check()
-                # 3) query all variables. The method will check if it is really needed, i.e. the last such
-                #    "queryall" happened not too recently
+                # 3) query the variables which are due.
+                lastqueryall = self.lasttimes['queryall']
                 self.queryall()
+                queried = self.lasttimes['queryall'] != lastqueryall
                 # 4) create a log line
                 self.log()
                 # 5) create and send telemetry information.
@@ -323,6 +384,12 @@ class DeviceBackend(object):
                     tm = self.get_telemetry()
                     self.send_to_frontend('telemetry', data=tm)
                     self.lasttimes['telemetry'] = time.monotonic()
+                # 6) send the changed variables to the frontend if the polling cycle is over, i.e. no more messages
+                #    are waiting, or if the changes have been accumulating for too long.
+                if self.pending_updates and (
+                        (message is None) or self.inqueue.empty() or
+                        (time.monotonic() - self.lasttimes['pending_updates'] > self.max_update_delay)):
+                    self.flush_updates()
             except CommunicationError as ce:
                 self.logger.error(
                     'Communication error for device ' + self.name + ', exiting background process.')
@@ -352,6 +419,9 @@ class DeviceBackend(object):
             self.disconnect_device(because_of_failure=not exit_status)
             self.finalize_after_disconnect()
         finally:
+            if self.logwriter is not None:
+                self.logwriter.close()
+                self.logwriter = None
             self.logger.debug('Background process ending for {}. Messages sent: {:d}. Messages received: {:d}.'.format(
                 self.name, self.counters['outmessages'], self.counters['inmessages']))
             for h in self.logger.handlers[:]:
@@ -363,6 +433,8 @@ class DeviceBackend(object):
         exit_status = False
         if message['type'] == 'config':
             self.config = message['configdict']
+        elif message['type'] == 'config_patch':
+            apply_config_patch(self.config, message['patch'])
         elif message['type'] == 'exit':
             exit_status = True  # normal termination
             raise ExitWorkerLoop(True)
@@ -398,6 +470,8 @@ class DeviceBackend(object):
                                       exception=exc,
                                       traceback=traceback.format_exc())
                 self.query_requested.clear()
+            else:
+                self.release_query_command(self.get_reply_query_command(message['sent_message']))
         elif message['type'] == 'log':
             self.send_to_frontend('log', logrecord=message['logrecord'])
         elif message['type'] == 'send_complete':
@@ -462,13 +536,16 @@ class DeviceBackend(object):
         tm.outstanding_queries = ', '.join([k for k in sorted(self.query_requested)])
         tm.status = self.properties['_status']
         tm.status_age = time.monotonic() - self.timestamps['_status']
+        tm.variable_updates = self.counters['variable_updates']
+        tm.update_batches = self.counters['update_batches']
+        tm.deduplicated_queries = self.counters['deduplicated_queries']
         return tm
 
     def update_variable(self, varname: str, value: object, force: bool = False) -> bool:
         """Check if the new value (`value`) of the variable `varname` is different
         from the previous one.
 
-        Also sends an 'update' message to the frontend in any of the following cases:
+        Also queues an update for the frontend in any of the following cases:
 
         1) If the new value is different (i.e. not ==) from the old one
         2) If force is True
@@ -477,8 +554,8 @@ class DeviceBackend(object):
         Regardless that the value changed or not, the corresponding timestamp is updated
         in `self.timestamps`
 
-        The function returns True if an 'update' message was queued, and False
-        otherwise.
+        The function returns True if an update was queued, and False
+        otherwise. The queued updates are sent by `flush_updates()`.
         """
         # first of all, pat the watchdog.
         self.watchdog.pat()
@@ -497,58 +574,209 @@ class DeviceBackend(object):
                     'Refresh_requested for variable {} was {:d}'.format(varname, self.refresh_requested[varname]))
                 self.refresh_requested[varname] -= 1
                 raise KeyError(varname)
+            self.adapt_query_period(varname, False)
             return False
         except KeyError:
             #            self._logger.debug('Setting {} for {} to {}'.format(varname, self.name, value))
             self.properties[varname] = value
-            self.send_to_frontend('update', name=varname, value=value)
+            if varname in self.pending_updates:
+                # do not lose the intermediate value: listeners may be interested in every transition.
+                self.flush_updates()
+            if not self.pending_updates:
+                self.lasttimes['pending_updates'] = time.monotonic()
+            self.pending_updates[varname] = (value, time.monotonic())
+            self.counters['variable_updates'] += 1
+            self.adapt_query_period(varname, True)
             return True
         finally:
             # set the timestamp
             self.timestamps[varname] = time.monotonic()
 
+    def flush_updates(self):
+        """Send the queued variable updates to the frontend in a single 'update-batch' message."""
+        if not self.pending_updates:
+            return
+        updates = self.pending_updates
+        self.pending_updates = {}
+        self.counters['update_batches'] += 1
+        self.send_to_frontend('update-batch', updates=updates)
+
     def log(self):
         """Write a line in the log-file, according to `self.log_formatstr`.
+
+        The file is kept open and written in the background, see `cct.core.utils.logwriter`.
         """
         if (not self.logfile) or (not self.log_formatstr):
             return
-        with open(self.logfile, 'a+', encoding='utf-8') as f:
-            try:
-                f.write('{:.3f}'.format(time.time()) + '\t' +
-                        self.log_formatstr.format(**self.properties) + '\n')
-            except KeyError as ke:
-                if self.ready:
-                    self.logger.warning('KeyError while producing log line for {}: {}'.format(
-                        self.name, ke.args[0]))
+        if self.logwriter is None:
+            if self.logformat == 'binary':
+                columns = [field for literal, field, spec, conversion in string.Formatter().parse(self.log_formatstr)
+                           if field]
+                self.logwriter = BinaryLogWriter(os.path.splitext(self.logfile)[0] + '.binlog', columns)
+            else:
+                self.logwriter = BufferedLogWriter(self.logfile)
+        try:
+            if self.logformat == 'binary':
+                self.logwriter.write(time.time(), [self.properties[c] for c in self.logwriter.columns])
+            else:
+                self.logwriter.write('{:.3f}'.format(time.time()) + '\t' +
+                                     self.log_formatstr.format(**self.properties) + '\n')
+        except KeyError as ke:
+            if self.ready:
+                self.logger.warning('KeyError while producing log line for {}: {}'.format(
+                    self.name, ke.args[0]))
 
     def queryall(self):
-        """Initiate a query on all variables"""
-        if (time.monotonic() - self.lasttimes['queryall']) < self.queryall_interval:
-            # do not query all variables too frequently
-            return
+        """Query the variables which are due, according to the adaptive polling schedule.
+
+        Subclasses can override this to veto polling (e.g. when the device cannot answer), by not calling the
+        inherited method.
+        """
         if (self.outqueue.qsize() > self.max_outqueue_size):
             # do not query all: the front-end cannot keep up with us
             return
-        self.lasttimes['queryall'] = time.monotonic()
-
-        if (self.urgency_modulo == 0) or (self.counters['queryalls'] % self.urgency_modulo):
-            # only query urgent variables
-            if self.urgent_variables is not None:
-                querylist = self.urgent_variables
-            else:
-                querylist = self.minimum_query_variables
-        else:
-            # query all variables
-            querylist = self.minimum_query_variables
-        # remove constant variables
-        querylist = [v for v in querylist if v not in self.constant_variables]
-        # add missing variables
-        querylist.extend([v for v in self.get_missing_variables() if v not in querylist])
-        assert isinstance(querylist, list)
+        now = time.monotonic()
+        self.lasttimes['queryall'] = now
+        self.counters['queryalls'] += 1
+        self.plan_queries()
+        querylist = []
+        heap = self._query_heap
+        while heap and heap[0][0] <= now + self.query_slack:
+            due, vn = heapq.heappop(heap)
+            if self.query_due.get(vn) != due:
+                # stale entry: the variable has been rescheduled or removed since.
+                continue
+            querylist.append(vn)
+            # come back to this variable even if no reply arrives.
+            self.schedule_query(vn, now + self.query_periods[vn])
+        issued = set()  # commands sent (or found still waiting for a reply) in this cycle
         for vn in querylist:
-            self.queryone(vn)
+            command = self.get_query_command(vn)
+            if command is None:
+                self.queryone(vn)
+            elif command in issued:
+                self.counters['deduplicated_queries'] += 1
+            elif self.queryone(vn):
+                issued.add(command)
+                self.mark_query_requested(command, vn)
+            elif vn in self.query_requested:
+                # the previous query of this variable is still waiting for a reply
+                issued.add(command)
         return
 
+    def get_base_query_period(self, variablename: str) -> float:
+        """The query period of a variable before backoff. Infinite if it need not be queried."""
+        if (self.urgent_variables is None) or (variablename in self.urgent_variables):
+            period = self.queryall_interval
+            if (self.urgent_variables is not None) and self.is_busy():
+                period = min(period, self.busy_query_interval)
+        elif variablename not in self.properties:
+            # missing variables are needed for becoming ready
+            period = self.queryall_interval
+        elif self.urgency_modulo == 0:
+            return math.inf
+        else:
+            period = self.queryall_interval * self.urgency_modulo
+        if self.watchdog.timeout is not None:
+            # keep the device talking to us
+            period = min(period, self.watchdog.timeout / 2)
+        return period
+
+    def plan_queries(self):
+        """(Re)build the polling schedule if the conditions have changed since the last time: the device became
+        busy or idle, the set of urgent variables has changed or new variables have been read."""
+        mode = (bool(self.is_busy()), None if self.urgent_variables is None else tuple(self.urgent_variables),
+                self.urgency_modulo, len(self.properties))
+        if mode == self._query_mode:
+            return
+        self._query_mode = mode
+        now = time.monotonic()
+        constant = set(self.constant_variables)
+        variables = [v for v in self.minimum_query_variables if v not in constant]
+        scheduled = set(variables)
+        variables.extend(v for v in self.get_missing_variables() if v not in scheduled)
+        periods = {v: self.get_base_query_period(v) for v in variables}
+        periods = {v: p for v, p in periods.items() if p < math.inf}
+        for vn in list(self.query_due):
+            if vn not in periods:
+                del self.query_due[vn]
+        for vn, period in periods.items():
+            # the backoff is reset, and the next query is not later than one (new) period from now.
+            self.query_periods[vn] = period
+            self.schedule_query(vn, min(self.query_due.get(vn, now), now + period))
+        if len(self._query_heap) > 4 * len(self.query_due) + 16:
+            # remove stale entries
+            self._query_heap = [(due, vn) for vn, due in self.query_due.items()]
+            heapq.heapify(self._query_heap)
+
+    def schedule_query(self, variablename: str, due: float):
+        """Set the time of the next query of a variable"""
+        self.query_due[variablename] = due
+        heapq.heappush(self._query_heap, (due, variablename))
+
+    def adapt_query_period(self, variablename: str, changed: bool):
+        """A new value has been read for a variable: adjust its query period (see `query_backoff`) and schedule the
+        next query."""
+        if variablename not in self.query_due:
+            return
+        base = self.get_base_query_period(variablename)
+        if base == math.inf:
+            del self.query_due[variablename]
+            return
+        if changed:
+            period = base
+        else:
+            period = min(self.query_periods[variablename] * self.query_backoff, base * self.max_query_backoff)
+            if self.watchdog.timeout is not None:
+                period = min(period, self.watchdog.timeout / 2)
+        self.query_periods[variablename] = period
+        self.schedule_query(variablename, time.monotonic() + period)
+
+    def get_next_query_time(self) -> float:
+        """The time when the next query is due (infinite if none)"""
+        heap = self._query_heap
+        while heap and self.query_due.get(heap[0][1]) != heap[0][0]:
+            heapq.heappop(heap)
+        return heap[0][0] if heap else math.inf
+
+    def get_query_command(self, variablename: str) -> Optional[Hashable]:
+        """Get the command which reads the value of `variablename` from the device, or None if the variable does not
+        share its query command with other variables. See `query_commands`."""
+        return self.query_commands.get(variablename)
+
+    def get_query_command_variables(self, command: Hashable) -> List[str]:
+        """Get the state variables read by `command`"""
+        if self._query_command_variables is None:
+            self._query_command_variables = {}
+            for vn in self.all_variables:
+                cmd = self.get_query_command(vn)
+                if cmd is not None:
+                    self._query_command_variables.setdefault(cmd, []).append(vn)
+        return self._query_command_variables.get(command, [])
+
+    def mark_query_requested(self, command: Hashable, variablename: str):
+        """`command` has been sent to query `variablename`: the other variables read by the same command are also
+        waiting for the reply."""
+        if variablename not in self.query_requested:
+            # the reply has already been processed (synchronous devices)
+            return
+        now = self.query_requested[variablename]
+        for vn in self.get_query_command_variables(command):
+            self.query_requested.setdefault(vn, now)
+
+    def get_reply_query_command(self, sent_message: bytes) -> Optional[Hashable]:
+        """Find the query command (see `query_commands`) to which `sent_message` belongs. By default the query
+        commands are the messages sent to the device."""
+        return sent_message
+
+    def release_query_command(self, command: Optional[Hashable]):
+        """The reply to `command` has been processed. The variables read by it which have not been updated (e.g. the
+        reply does not contain them in the current state of the device) are not waiting for a reply any more."""
+        if command is None:
+            return
+        for vn in self.get_query_command_variables(command):
+            self.query_requested.pop(vn, None)
+
     def queryone(self, variablename: str, force: bool = False) -> bool:
         """Queries the value of a state variable.
 
@@ -565,7 +793,7 @@ class DeviceBackend(object):
                 if variablename not in self.refresh_requested:
                     self.refresh_requested[variablename] = 0
                 self.refresh_requested[variablename] += 1
-            elif ((self.query_requested[variablename] - time.monotonic()) < self.query_timeout):
+            elif (time.monotonic() - self.query_requested[variablename]) < self.query_timeout:
                 # This mechanism avoids re-querying the variable until a value
                 # has been obtained for it, or until a very long time
                 # (self.query_timeout) has passed
@@ -8,8 +8,10 @@ import time
 import traceback
 from logging.handlers import QueueHandler
 
+from .asynctransport import AsyncTCPConnection, ReplyBookkeeping
 from .backend import DeviceBackend
 from .exceptions import DeviceError, CommunicationError
+from .framing import CallbackFramer, Framer, ReceiveBuffer
 from .message import Message
 
 logger = logging.getLogger(__name__)
@@ -21,7 +23,7 @@ class QueueLogHandler(QueueHandler):
         return Message('log', 0, 'logger', logrecord=record)
 
 
-class TCPCommunicator:
+class TCPCommunicator(ReplyBookkeeping):
     """A class to perform direct communications over TCP/IP with the hardware.
 
     This class should be instantiated in a separate, dedicated process.
@@ -80,17 +82,15 @@ class TCPCommunicator:
     in this class.
     """
 
-    keep_this_many_lastsendtimes = 10
-
     def __init__(self, instancename, host, port, poll_timeout, sendqueue, incomingqueue,
-                 killflag, exitedflag, getcompletemessages):
+                 killflag, exitedflag, framer: Framer):
         self.name = instancename
         assert isinstance(sendqueue, multiprocessing.queues.Queue)
         self.sendqueue = sendqueue
         assert isinstance(incomingqueue, multiprocessing.queues.Queue)
         self.incomingqueue = incomingqueue
         self.poll_timeout = poll_timeout
-        self.get_complete_messages = getcompletemessages
+        self.framer = framer
         self.logger = logging.getLogger(
             __name__ + '::' + instancename + '__tcpprocess')
         self.logger.propagate = False
@@ -117,7 +117,7 @@ class TCPCommunicator:
             self.send_to_backend('exited', normaltermination=False)
             raise DeviceError('Cannot connect to device.', exc)
 
-        self.message_part = b''
+        self.rxbuffer = ReceiveBuffer()
         self.lastsent = []  # a stack of recently sent messages.
         self.lastsendtimes = []
         self.cleartosend = True
@@ -155,25 +155,10 @@ class TCPCommunicator:
             chars_sent += justsent
         # print('***SENT; {}'.format(self.name))
         # the message has been sent.
-        if msg['expected_replies'] > 0:
-            # if we are expecting replies, save `msg` to the last sent stack.
-            msg['sendtime'] = time.monotonic()
-            msg['received_replies'] = 0
-            self.lastsent.append(msg)
-        else:
-            # we are not expecting replies
-            self.cleartosend = True
-        if msg['asynchronous']:
-            # we can send another message before we obtain reply/replies.
-            self.cleartosend = True
-        self.send_to_backend('send_complete', message=outmsg)
-        self.lastsendtimes.append(time.monotonic())
-        while len(self.lastsendtimes) > self.keep_this_many_lastsendtimes:
-            self.lastsendtimes.pop(0)
+        self.register_sent_message(msg)
 
     def receive_message_from_device(self, polling):
         """Try to receive a message from the device."""
-        message = b''
         while True:
             # read all parts of the message.
             try:
@@ -188,58 +173,17 @@ class TCPCommunicator:
                 raise CommunicationError(
                     'Socket is in exceptional state: {:d}'.format(event))
                 # end watching the socket.
-            # read the incoming message
-            message = message + self.tcpsocket.recv(4096)
-            if not message:
+            # read the incoming message, appending it to the previously received incomplete message, if any.
+            if not self.rxbuffer.recv_into(self.tcpsocket):
                 # remote end hung up on us
                 raise CommunicationError(
                     'Socket has been closed by the remote side')
-        # append the currently received message to the previously received,
-        # incomplete message, if any
-        self.message_part = self.message_part + message
-        if self.message_part:
-            self.message_part = self.dispatch_message(self.message_part)
-        # Otherwise, if 'message' is empty, it means that no message has been
-        # read, because no message was waiting. Note that this is not the same
-        # as receiving an empty message, which signifies the breakdown of the
-        # communication channel. This case has been handled above, in the
-        # while loop.
+        # If nothing has been read, no message was waiting. Note that this is not the same as receiving an empty
+        # message, which signifies the breakdown of the communication channel. This case has been handled above, in
+        # the while loop.
+        self.dispatch_messages()
         return
 
-    def dispatch_message(self, message: bytes) -> bytes:
-        if message:
-            # The incoming message is ready, send it to the incoming queue.
-            # First dissect the message into different parts, if needed.
-            messages = self.get_complete_messages.__call__(self.message_part)
-            for message in messages[:-1]:
-                if not self.lastsent:
-                    # this is an unsolicited message from the device.
-                    raise CommunicationError('Unsolicited message from device {}: {}'.format(self.name, str(message)))
-                if len(self.lastsendtimes) > 1:
-                    sendfreq = (len(self.lastsendtimes) - 1) / (self.lastsendtimes[-1] - self.lastsendtimes[0])
-                else:
-                    sendfreq = 0
-                self.send_to_backend('incoming', message=message, sent_message=self.lastsent[-1]['message'],
-                                     referred_id=self.lastsent[-1]['id'],
-                                     reply_count=self.lastsent[-1]['received_replies'],
-                                     send_frequency=sendfreq)
-                self.lastsent[-1]['received_replies'] += 1
-                if self.lastsent[-1]['expected_replies'] <= self.lastsent[-1]['received_replies']:
-                    del self.lastsent[-1]
-                if not self.lastsent:
-                    # if no messages are waiting for replies:
-                    self.cleartosend = True
-                elif self.lastsent[-1]['asynchronous']:
-                    # if the next message we are expecting a reply for is asynchronous,
-                    # we can send another message.
-                    self.cleartosend = True
-                else:
-                    # leave self.cleartosend as is.
-                    pass
-            return messages[-1]
-        else:
-            return b''
-
     def run(self):
         """Background process for communication."""
         self.exitedflag.clear()
@@ -281,10 +225,10 @@ class TCPCommunicator:
 
     @classmethod
     def create_and_run(cls, name, host, port, poll_timeout, sendqueue, incomingqueue, killflag, exitedflag,
-                       getcompletemessages):
+                       framer: Framer):
         """Can be used as a target function of multiprocessing.Process"""
         tcpcomm = cls(name, host, port, poll_timeout, sendqueue, incomingqueue, killflag, exitedflag,
-                      getcompletemessages)
+                      framer)
         tcpcomm.run()
 
 
@@ -302,15 +246,25 @@ class DeviceBackend_TCP(DeviceBackend):
     Interactions with the device are primarily initiated by the front-end,
     managed by the primary back-end and carried out by the communication
     back-end.
+
+    With the 'asyncio' transport (see `Device.transport`), no communication
+    process is started: the socket is handled by an `AsyncTCPConnection` in
+    the event loop shared by all devices, which notifies this back-end through
+    `inqueue` in the same way.
     """
 
     reply_timeout = 5
 
     outqueue_query_limit = 10  # skip query all if the outqueue is larger than this limit
 
+    # Splits the byte stream received from the device into messages. Set this to an instance of one of the
+    # `framing.Framer` subclasses, or override `get_complete_messages()`.
+    framer = None
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.tcp_outqueue = multiprocessing.Queue()
+        self.tcp_outqueue = multiprocessing.Queue() if self.transport == 'process' else None
+        self.asyncconnection = None
         self.poll_timeout = None
         self.killflag = multiprocessing.Event()
         self.tcpprocess_exited = multiprocessing.Event()
@@ -319,10 +273,16 @@ class DeviceBackend_TCP(DeviceBackend):
 
     def get_telemetry(self):
         tm = super().get_telemetry()
-        tm.sendqueuelen = self.tcp_outqueue.qsize()
+        tm.sendqueuelen = self.get_sendqueue_length()
         tm.sendfrequency = self.send_frequency
         return tm
 
+    def get_framer(self) -> Framer:
+        """The framer used by the communication process or the asyncio connection"""
+        if self.framer is not None:
+            return self.framer
+        return CallbackFramer(self.get_complete_messages)
+
     def get_complete_messages(self, message: bytes):
         """Check if the received message is complete. All devices signify the
         end of a message in some way: either by using fixed-length messages,
@@ -353,12 +313,27 @@ class DeviceBackend_TCP(DeviceBackend):
         Note: if subclassing this abstract method, you can only use the value
         of `message`, and should not access any other outside data, because
         this method is called from a different process (not the foreground and
-        not the background process)"""
-        raise NotImplementedError
+        not the background process)
+
+        Devices having a `framer` need not override this method."""
+        if self.framer is None:
+            raise NotImplementedError
+        messages, consumed = self.framer.frames(bytearray(message), 0, len(message))
+        return messages + [message[consumed:]]
+
+    def get_sendqueue_length(self) -> int:
+        """The number of messages waiting to be sent to the device"""
+        if self.asyncconnection is not None:
+            return self.asyncconnection.qsize()
+        elif self.tcp_outqueue is not None:
+            return self.tcp_outqueue.qsize()
+        return 0
 
     def get_connected(self) -> bool:
         """Check if the device is connected.
         """
+        if self.transport == 'asyncio':
+            return (self.asyncconnection is not None) and self.asyncconnection.connected
         if self.tcp_communicator is None:
             return False
         assert isinstance(self.tcp_communicator, multiprocessing.Process)
@@ -369,6 +344,11 @@ class DeviceBackend_TCP(DeviceBackend):
 
         Raises an exception if the connection cannot be established.
         """
+        if self.transport == 'asyncio':
+            self.asyncconnection = AsyncTCPConnection.open(
+                self.name, self.deviceconnectionparameters[0], self.deviceconnectionparameters[1],
+                self.get_framer(), self.inqueue)
+            return
         self.killflag.clear()
         self.tcp_communicator = multiprocessing.Process(name=self.name + '__tcpcommunicator',
                                                         target=TCPCommunicator.create_and_run,
@@ -379,7 +359,7 @@ class DeviceBackend_TCP(DeviceBackend):
                                                               self.tcp_outqueue,
                                                               self.inqueue,
                                                               self.killflag, self.tcpprocess_exited,
-                                                              self.get_complete_messages))
+                                                              self.get_framer()))
         self.tcp_communicator.daemon = True
         self.tcp_communicator.start()
 
@@ -393,6 +373,10 @@ class DeviceBackend_TCP(DeviceBackend):
         This method can safely assume that a connection exists to the
         device.
         """
+        if self.transport == 'asyncio':
+            self.asyncconnection.close()
+            self.asyncconnection = None
+            return
         self.killflag.set()
         self.logger.debug('Waiting for TCP communication process of {} to exit'.format(self.name))
         self.tcpprocess_exited.wait(5) # wait for clean exit
@@ -414,11 +398,14 @@ class DeviceBackend_TCP(DeviceBackend):
         self.counters['outmessages'] += 1
         msg = Message('send', self.counters['outmessages'], self.name + '__backend', message=message,
                       expected_replies=expected_replies, timeout=timeout, asynchronous=asynchronous)
-        self.tcp_outqueue.put_nowait(msg)
+        if self.asyncconnection is not None:
+            self.asyncconnection.send(msg)
+        else:
+            self.tcp_outqueue.put_nowait(msg)
         del msg
 
     def queryall(self):
-        if self.tcp_outqueue.qsize() > self.outqueue_query_limit:
+        if self.get_sendqueue_length() > self.outqueue_query_limit:
             # do not query all if there are too many messages waiting to be sent to the device.
             return
         return super().queryall()
@@ -0,0 +1,195 @@
+"""Splitting the byte stream received from a device into messages (frames).
+
+The received bytes are collected in a `ReceiveBuffer`, which is filled by `socket.recv_into()` (or by the asyncio
+buffered protocol) without intermediate copies. A framer finds the message boundaries in the buffer and returns only
+offsets: a message is copied out of the buffer exactly once, when it is handed over to the backend.
+"""
+import socket
+import struct
+from typing import Callable, List, Tuple
+
+from .exceptions import CommunicationError
+
+
+class Framer(object):
+    """Abstract base class of the framers."""
+
+    def split(self, buffer: bytearray, start: int, end: int) -> Tuple[List[Tuple[int, int]], int]:
+        """Find the complete messages in `buffer[start:end]`.
+
+        :return: the list of (start, end) offsets of the complete messages and the offset of the first byte not
+            belonging to a complete message.
+        """
+        raise NotImplementedError
+
+    def frames(self, buffer: bytearray, start: int, end: int) -> Tuple[List[bytes], int]:
+        """The same as split(), but the messages are returned as bytes."""
+        offsets, consumed = self.split(buffer, start, end)
+        with memoryview(buffer) as view:
+            return [view[s:e].tobytes() for s, e in offsets], consumed
+
+
+class FixedLengthFramer(Framer):
+    """Messages of a fixed length"""
+
+    def __init__(self, length: int):
+        self.length = length
+
+    def split(self, buffer: bytearray, start: int, end: int) -> Tuple[List[Tuple[int, int]], int]:
+        count = (end - start) // self.length
+        stop = start + count * self.length
+        return [(s, s + self.length) for s in range(start, stop, self.length)], stop
+
+    def frames(self, buffer: bytearray, start: int, end: int) -> Tuple[List[bytes], int]:
+        # copy the complete messages out of the buffer at once and cut them up there
+        stop = start + (end - start) // self.length * self.length
+        if stop == start:
+            return [], start
+        with memoryview(buffer) as view:
+            data = view[start:stop].tobytes()
+        return [data[i:i + self.length] for i in range(0, len(data), self.length)], stop
+
+
+class DelimiterFramer(Framer):
+    """Messages ending in a delimiter.
+
+    :param delimiter: the delimiter
+    :param keep_delimiter: if the delimiter is part of the message
+    :param maxlength: if more bytes than this are waiting to be split, the device is considered to be sending
+        garbage and CommunicationError is raised. None means no limit.
+    """
+
+    def __init__(self, delimiter: bytes, keep_delimiter: bool = False, maxlength: int = None):
+        self.delimiter = delimiter
+        self.keep_delimiter = keep_delimiter
+        self.maxlength = maxlength
+
+    def split(self, buffer: bytearray, start: int, end: int) -> Tuple[List[Tuple[int, int]], int]:
+        if (self.maxlength is not None) and (end - start > self.maxlength):
+            raise CommunicationError('Too long message from the device, receiving garbage?')
+        offsets = []
+        dlen = len(self.delimiter)
+        while True:
+            pos = buffer.find(self.delimiter, start, end)
+            if pos < 0:
+                return offsets, start
+            offsets.append((start, pos + dlen if self.keep_delimiter else pos))
+            start = pos + dlen
+
+    def frames(self, buffer: bytearray, start: int, end: int) -> Tuple[List[bytes], int]:
+        # Splitting in one go is much faster than finding the delimiters one by one.
+        if (self.maxlength is not None) and (end - start > self.maxlength):
+            raise CommunicationError('Too long message from the device, receiving garbage?')
+        last = buffer.rfind(self.delimiter, start, end)
+        if last < 0:
+            return [], start
+        with memoryview(buffer) as view:
+            messages = view[start:last].tobytes().split(self.delimiter)
+        if self.keep_delimiter:
+            messages = [m + self.delimiter for m in messages]
+        return messages, last + len(self.delimiter)
+
+
+class LengthPrefixedFramer(Framer):
+    """Messages with a header containing the length of the message body.
+
+    :param lengthformat: the struct format of the length field (e.g. '>H')
+    :param lengthoffset: the offset of the length field from the beginning of the message
+    :param headerlength: the length of the header, i.e. the offset of the body
+    :param trailerlength: number of bytes after the body, not included in the length (e.g. checksum)
+    """
+
+    def __init__(self, lengthformat: str, lengthoffset: int = 0, headerlength: int = None, trailerlength: int = 0):
+        self.lengthstruct = struct.Struct(lengthformat)
+        self.lengthoffset = lengthoffset
+        self.headerlength = lengthoffset + self.lengthstruct.size if headerlength is None else headerlength
+        self.trailerlength = trailerlength
+
+    def split(self, buffer: bytearray, start: int, end: int) -> Tuple[List[Tuple[int, int]], int]:
+        offsets = []
+        while end - start >= self.headerlength:
+            bodylength, = self.lengthstruct.unpack_from(buffer, start + self.lengthoffset)
+            stop = start + self.headerlength + bodylength + self.trailerlength
+            if stop > end:
+                break
+            offsets.append((start, stop))
+            start = stop
+        return offsets, start
+
+
+class CallbackFramer(Framer):
+    """Adapter for the traditional `get_complete_messages()` functions: they receive the pending bytes and return a
+    list of the complete messages, the last element being the incomplete remainder."""
+
+    def __init__(self, function: Callable[[bytes], List[bytes]]):
+        self.function = function
+
+    def frames(self, buffer: bytearray, start: int, end: int) -> Tuple[List[bytes], int]:
+        messages = self.function(bytes(buffer[start:end]))
+        return messages[:-1], end - len(messages[-1])
+
+
+class ReceiveBuffer(object):
+    """A growable receive buffer.
+
+    New data is written after the pending bytes, and complete messages are removed from the beginning. The pending
+    (incomplete) data is moved back to the beginning of the buffer only when the free space at the end runs low.
+    """
+    minfree = 4096
+
+    def __init__(self, size: int = 65536):
+        self._buffer = bytearray(size)
+        self._view = memoryview(self._buffer)
+        self._start = 0
+        self._end = 0
+
+    def __len__(self) -> int:
+        return self._end - self._start
+
+    def _reserve(self, needed: int):
+        """Make room for at least `needed` bytes at the end of the buffer"""
+        pending = self._end - self._start
+        if self._start > 0:
+            # the source and the destination can overlap: memoryview assignment copies with memmove().
+            self._view[:pending] = self._view[self._start:self._end]
+            self._start, self._end = 0, pending
+        if len(self._buffer) - self._end < needed:
+            # views returned by get_buffer() may still exist, thus the buffer cannot be resized in place.
+            buffer = bytearray(max(2 * len(self._buffer), pending + needed))
+            buffer[:pending] = self._view[:pending]
+            self._buffer = buffer
+            self._view = memoryview(buffer)
+
+    def get_buffer(self, sizehint: int = -1) -> memoryview:
+        """Get a writable view of the free space at the end of the buffer, at least `sizehint` bytes long.
+        After writing, call `buffer_updated()`."""
+        if len(self._buffer) - self._end < max(sizehint, self.minfree):
+            self._reserve(max(sizehint, self.minfree))
+        return self._view[self._end:]
+
+    def buffer_updated(self, nbytes: int):
+        """Register that `nbytes` bytes have been written in the view returned by `get_buffer()`."""
+        self._end += nbytes
+
+    def recv_into(self, sock: socket.socket) -> int:
+        """Receive from a socket. Returns the number of bytes received (zero if the remote side closed)."""
+        if len(self._buffer) - self._end < self.minfree:
+            self._reserve(self.minfree)
+        nbytes = sock.recv_into(self._view[self._end:])
+        self._end += nbytes
+        return nbytes
+
+    def feed(self, data: bytes):
+        """Append data to the buffer"""
+        self.get_buffer(len(data))[:len(data)] = data
+        self._end += len(data)
+
+    def pop_frames(self, framer: Framer) -> List[bytes]:
+        """Remove the complete messages from the beginning of the buffer and return them."""
+        start, end = self._start, self._end
+        if start == end:
+            return []
+        frames, self._start = framer.frames(self._buffer, start, end)
+        if self._start == end:
+            self._start = self._end = 0
+        return frames
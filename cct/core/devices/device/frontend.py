@@ -2,13 +2,16 @@ import logging
 import multiprocessing
 import os
 import queue
+import threading
 import time
 import traceback
+from typing import Dict, Tuple
 
 from .backend import DeviceBackend
 from .exceptions import DeviceError
 from .message import Message
 from ...utils.callback import Callbacks, SignalFlags
+from ...utils.configtools import apply_config_patch
 from ...utils.timeout import IdleFunction
 
 logger = logging.getLogger(__name__)
@@ -58,6 +61,8 @@ class Device(Callbacks):
         'telemetry': request telemetry
         'config': an update of the config dictionary is sent. Fields:
             'configdict': the updated config dictionary
+        'config_patch': the changes of the config dictionary are sent. Fields:
+            'patch': the list of changes (see `configtools`)
 
     Other supported message types to the backend, from the communication facilities:
         'incoming': an incoming message. Additional fields:
@@ -70,6 +75,8 @@ class Device(Callbacks):
         'update': a variable has been updated. Additional fields:
             'name': the name of the variable
             'value': the new value of the variable
+        'update-batch': several variables have been updated. Additional fields:
+            'updates': a dict of variable name -> (new value, timestamp)
         'telemetry': telemetry data. Additional fields:
             'data': the telemetry data
         'error': a non-critical error happened
@@ -90,10 +97,11 @@ class Device(Callbacks):
 
     Properties are refreshed periodically, automatically by the background
     process. The period is in `self.backend_interval`. If during such a refresh
-    a change in the value occurs, the back-end sends an 'update' message
-    through `_queue_to_frontend`. If no change occurred, an 'update' message
+    a change in the value occurs, the back-end sends an update
+    through `_queue_to_frontend`. If no change occurred, an update
     is only sent if the frontend requested an update with a previous 'query'
-    message.
+    message. The updates collected in a polling cycle are sent together in a
+    single 'update-batch' message.
 
     On the front-end side, an idle function is running, which takes care of
     reading `_queue_to_frontend` and emit-ing variable-change signals.
@@ -148,15 +156,17 @@ class Device(Callbacks):
     urgent_variables = None
 
     # Urgency modulus. Not urgent variables, which have already been read at
-    # least once, will only be checked at every `urgency_modulo`-eth queryall
-    # in the backend process. If zero, only urgent variables are queried every
-    # time.
+    # least once, are polled `urgency_modulo` times less frequently than the
+    # urgent ones in the backend process. If zero, only urgent variables are
+    # queried.
     urgency_modulo = 1
 
-    # How long the backend thread waits on its input queue (seconds)
+    # How long the backend thread waits on its input queue at most (seconds)
     backend_interval = 1.0
 
-    # How frequently a queryall is issued by the backend (seconds)
+    # The shortest polling period of a variable in the backend (seconds). The
+    # period is increased for variables which do not change, see
+    # `DeviceBackend.query_backoff`.
     queryall_interval = 1.0
 
     # A timeout (seconds) for communication with the devices. If no message is
@@ -184,6 +194,15 @@ class Device(Callbacks):
     # do not log these via the variable logging facility
     no_log_variables = []
 
+    # How the backend is run. 'process': in a separate process (TCP devices start a third process for the socket
+    # communication). 'asyncio': in a thread of this process; the sockets of TCP devices are handled by an asyncio
+    # event loop shared by all devices. Modbus devices do their (blocking) communication in the backend thread.
+    transport = 'process'
+    transports = ('process', 'asyncio')
+
+    # Format of the log file written by the backend: 'text' or 'binary'. See `DeviceBackend.__init__()`.
+    logformat = 'text'
+
     def __init__(self, instancename, logdir='log', configdir='config', configdict=None):
         Callbacks.__init__(self)
         self._msgidcounter = 0
@@ -242,6 +261,11 @@ class Device(Callbacks):
         self.config = configdict
         self.send_to_backend('config', configdict=configdict)
 
+    def send_config_patch(self, patch):
+        """Update the config dictionary in the main process and the backend with the changes in `patch`."""
+        apply_config_patch(self.config, patch)
+        self.send_to_backend('config_patch', patch=patch)
+
     def load_state(self, dictionary):
         """Load the state of this device to a dictionary. You probably need to
         override this method in subclasses. Do not forget to call the parent's
@@ -262,6 +286,11 @@ class Device(Callbacks):
         """
         return self._properties[name]
 
+    def get_timestamp(self, name) -> float:
+        """Get the time (from time.monotonic()) when the backend has got the last value of the variable from the
+        device. Already updated when the 'variable-change' signal is emitted."""
+        return self._timestamps[name]
+
     def get_all_variables(self):
         """Get a dictionary of the present values of all state variables."""
         return self._properties.copy()
@@ -370,11 +399,14 @@ class Device(Callbacks):
                     self.emit('error', message['variablename'],
                               message['exception'], message['traceback'])
                 elif message['type'] == 'update':
+                    # the timestamp is available to the handlers, but the old value is still there.
+                    self._timestamps[message['name']] = message['timestamp']
                     try:
                         self.emit('variable-change', message['name'], message['value'])
                     finally:
                         self._properties[message['name']] = message['value']
-                        self._timestamps[message['name']] = message['timestamp']
+                elif message['type'] == 'update-batch':
+                    self._apply_updates(message['updates'])
                 else:
                     raise ValueError(message['type'])
         except Exception as exc:
@@ -382,6 +414,21 @@ class Device(Callbacks):
                 self.name, exc, traceback.format_exc()))
         return True  # this is an idle function, we want to be called again.
 
+    def _apply_updates(self, updates: Dict[str, Tuple[object, float]]):
+        """Store the new values of several variables. 'variable-change' is emitted for each one, but only if
+        somebody is listening."""
+        if not self.has_handler_pending('variable-change'):
+            for name, (value, timestamp) in updates.items():
+                self._properties[name] = value
+                self._timestamps[name] = timestamp
+            return
+        for name, (value, timestamp) in updates.items():
+            self._timestamps[name] = timestamp
+            try:
+                self.emit('variable-change', name, value)
+            finally:
+                self._properties[name] = value
+
     def do_disconnect(self, because_of_failure: bool):
         """default handler for the 'disconnect' signal"""
         if because_of_failure:
@@ -442,7 +489,10 @@ class Device(Callbacks):
                 break
         logger.debug('queue_to_backend empty.')
         # nevertheless, create a fresh queue instance
-        self._queue_to_backend = multiprocessing.Queue()
+        if self.transport not in self.transports:
+            raise DeviceError('Invalid transport for device {}: {}'.format(self.name, self.transport))
+        queueclass = multiprocessing.Queue if self.transport == 'process' else queue.Queue
+        self._queue_to_backend = queueclass()
         while True:
             try:
                 msg = self._queue_to_frontend.get_nowait()
@@ -451,7 +501,7 @@ class Device(Callbacks):
                 break
         logger.debug('queue_to_frontend empty')
         # nevertheless, create a fresh queue instance
-        self._queue_to_frontend = multiprocessing.Queue()
+        self._queue_to_frontend = queueclass()
         self._ready = False
         # note that we do not clear the '_properties' and '_timestamps' in
         # order to ensure smooth operation of the instrument between sudden
@@ -461,7 +511,8 @@ class Device(Callbacks):
         self._busy = multiprocessing.BoundedSemaphore(self.max_busy_level)
 
         assert issubclass(self.backend_class, DeviceBackend)
-        self._background_process = multiprocessing.Process(
+        backgroundclass = multiprocessing.Process if self.transport == 'process' else threading.Thread
+        self._background_process = backgroundclass(
             target=self.backend_class.create_and_run, name=self.name + '_background',
             args=(self.name, self.configdir, self.config, self.deviceconnectionparameters, self._queue_to_backend,
                   self._queue_to_frontend, self.watchdog_timeout, self.backend_interval, self.query_timeout,
@@ -470,7 +521,8 @@ class Device(Callbacks):
                   self.loglevel, self.logfile, self.log_formatstr, self.max_busy_level, self._busy),
             kwargs=self._get_kwargs_for_backend(),
         )
-        self._background_process.daemon = False
+        # a backend thread must not keep the program alive.
+        self._background_process.daemon = self.transport != 'process'
         self.background_startup_count += 1
         self._background_process.start()
         logger.debug('Started background process for device {}'.format(self.name))
@@ -482,7 +534,7 @@ class Device(Callbacks):
         """You can supply custom keyword arguments to the __init__() method of
         the backend process by overriding this method and returning the desired
         'kwargs' dict."""
-        return dict()
+        return dict(transport=self.transport, logformat=self.logformat)
 
     def disconnect_device(self):
         """Initiate disconnection from the device: request the background
@@ -82,12 +82,18 @@ class Motor(Callbacks):
     def get_variable(self, varname):
         return self._controller.get_variable(varname + '$' + str(self._index))
 
+    def get_timestamp(self, varname):
+        return self._controller.get_timestamp(varname + '$' + str(self._index))
+
     def refresh_variable(self, varname):
         return self._controller.refresh_variable(varname + '$' + str(self._index))
 
     def set_variable(self, varname, value):
         return self._controller.set_variable(varname + '$' + str(self._index), value)
 
+    def set_maxspeed_temporarily(self, speed):
+        return self._controller.set_maxspeed_temporarily(self._index, speed)
+
     def where(self):
         return self._controller.where(self._index)
 
@@ -9,7 +9,7 @@ import time
 from typing import List
 
 from ..device import DeviceBackend_TCP, DeviceError, UnknownCommand, UnknownVariable, ReadOnlyVariable, InvalidValue, \
-    Device
+    Device, FixedLengthFramer
 from ..device.message import Message
 
 logger = logging.getLogger(__name__)
@@ -44,6 +44,13 @@ PER_MOTOR_VARIABLES_NOQUERY = ['maxcurrentraw', 'standbycurrentraw',
 
 DEVICE_VARIABLES = ['firmwareversion']
 
+# Type numbers of the axis parameters, as used in the GAP (get axis parameter) TMCL command.
+AXIS_PARAMETERS = {'targetposition': 0, 'actualposition': 1, 'targetspeed': 2, 'actualspeed': 3, 'maxspeed': 4,
+                   'maxacceleration': 5, 'maxcurrent': 6, 'standbycurrent': 7, 'targetpositionreached': 8,
+                   'rightswitchstatus': 10, 'leftswitchstatus': 11, 'rightswitchenable': 12, 'leftswitchenable': 13,
+                   'actualacceleration': 135, 'rampmode': 138, 'microstepresolution': 140, 'rampdivisor': 153,
+                   'pulsedivisor': 154, 'freewheelingdelay': 204, 'load': 206, 'drivererror': 208}
+
 TMCL_ERROR_MESSAGES = {1: 'wrong checksum',
                        2: 'invalid command',
                        3: 'wrong type',
@@ -63,6 +70,9 @@ class TMCMCard_Backend(DeviceBackend_TCP):
     """Motor controller card from Trinamic GmbH, Hamburg, Germany. Developed for TMCM351 and TMCM6110, may or may not
     work for other models."""
 
+    # messages from the TMCM cards always consist of 9 bytes.
+    framer = FixedLengthFramer(9)
+
     def __init__(self, *args, **kwargs):
         self.N_axes = kwargs.pop('N_axes')
         self.top_RMS_current = kwargs.pop('top_RMS_current')
@@ -78,6 +88,21 @@ class TMCMCard_Backend(DeviceBackend_TCP):
         self.original_urgency_modulo = self.urgency_modulo
         self.logger.debug('Initialized motor controller {}'.format(self.name))
 
+    def get_query_command(self, variablename: str):
+        """Axis parameters are read by the GAP (get axis parameter) command, one for each parameter and axis. The
+        physical and the raw value of a parameter ('<name>$<idx>' and '<name>raw$<idx>') come from the same reply."""
+        try:
+            name, motor_idx = variablename.split('$')
+            motor_idx = int(motor_idx)
+        except ValueError:
+            return None
+        if name.endswith('raw'):
+            name = name[:-3]
+        try:
+            return 'GAP', AXIS_PARAMETERS[name], motor_idx
+        except KeyError:
+            return None
+
     def query_variable(self, variablename: str):
         try:
             motor_idx = int(variablename.split('$')[1])
@@ -85,52 +110,11 @@ class TMCMCard_Backend(DeviceBackend_TCP):
                 raise UnknownVariable(variablename)
         except (IndexError, ValueError):
             motor_idx = None
-        if 'raw$' in variablename:
-            self.query_variable(variablename.replace('raw$', '$'))
+        command = self.get_query_command(variablename)
+        if command is not None:
+            self.send_tmcl_command(6, command[1], motor_idx, 0)
         elif variablename == 'firmwareversion':
             self.send_tmcl_command(136, 1, 0, 0)
-        elif variablename.startswith('targetposition$') or variablename.startswith('targetpositionraw$'):
-            self.send_tmcl_command(6, 0, motor_idx, 0)
-        elif variablename.startswith('actualposition$') or variablename.startswith('actualpositionraw$'):
-            self.send_tmcl_command(6, 1, motor_idx, 0)
-        elif variablename.startswith('targetspeed$'):
-            self.send_tmcl_command(6, 2, motor_idx, 0)
-        elif variablename.startswith('actualspeed$'):
-            self.send_tmcl_command(6, 3, motor_idx, 0)
-        elif variablename.startswith('maxspeed$'):
-            self.send_tmcl_command(6, 4, motor_idx, 0)
-        elif variablename.startswith('maxacceleration$'):
-            self.send_tmcl_command(6, 5, motor_idx, 0)
-        elif variablename.startswith('maxcurrent$'):
-            self.send_tmcl_command(6, 6, motor_idx, 0)
-        elif variablename.startswith('standbycurrent$'):
-            self.send_tmcl_command(6, 7, motor_idx, 0)
-        elif variablename.startswith('targetpositionreached$'):
-            self.send_tmcl_command(6, 8, motor_idx, 0)
-        elif variablename.startswith('rightswitchstatus$'):
-            self.send_tmcl_command(6, 10, motor_idx, 0)
-        elif variablename.startswith('leftswitchstatus$'):
-            self.send_tmcl_command(6, 11, motor_idx, 0)
-        elif variablename.startswith('rightswitchenable$'):
-            self.send_tmcl_command(6, 12, motor_idx, 0)
-        elif variablename.startswith('leftswitchenable$'):
-            self.send_tmcl_command(6, 13, motor_idx, 0)
-        elif variablename.startswith('actualacceleration$'):
-            self.send_tmcl_command(6, 135, motor_idx, 0)
-        elif variablename.startswith('rampmode$'):
-            self.send_tmcl_command(6, 138, motor_idx, 0)
-        elif variablename.startswith('microstepresolution$'):
-            self.send_tmcl_command(6, 140, motor_idx, 0)
-        elif variablename.startswith('rampdivisor$'):
-            self.send_tmcl_command(6, 153, motor_idx, 0)
-        elif variablename.startswith('pulsedivisor$'):
-            self.send_tmcl_command(6, 154, motor_idx, 0)
-        elif variablename.startswith('freewheelingdelay$'):
-            self.send_tmcl_command(6, 204, motor_idx, 0)
-        elif variablename.startswith('load$'):
-            self.send_tmcl_command(6, 206, motor_idx, 0)
-        elif variablename.startswith('drivererror$'):
-            self.send_tmcl_command(6, 208, motor_idx, 0)
         elif variablename.startswith('softleft$') or variablename.startswith('softright$'):
             # these variables are not known to the hardware, the values are
             # stored here in this class.
@@ -144,16 +128,7 @@ class TMCMCard_Backend(DeviceBackend_TCP):
             self.update_variable(variablename, self.properties[variablename])
         else:
             raise UnknownVariable(variablename)
-
-    def get_complete_messages(self, message):
-        messages = []
-        # messages from the TMCM cards always consist of 9 bytes.
-        while len(message) >= 9:
-            messages.append(message[:9])
-            message = message[9:]
-        # now add the remainder as the last item of the list
-        messages.append(message)
-        return messages
+        return True
 
     def moving_idx(self):
         """Get the index of the currently moving motor. If no motor is moving,
@@ -292,6 +267,8 @@ class TMCMCard_Backend(DeviceBackend_TCP):
                 # if we reach this, _update_variable() has not been called with
                 # the new value. We must manually remove the variable name from
                 # self._query_requested, in order to allow re-querying it.
+                for vn in self.get_query_command_variables(('GAP', typenum, motoridx)):
+                    self.query_requested.pop(vn, None)
                 if self.has_all_variables():
                     # Some TMCMConversionErrors are expected until all the
                     # variables have been obtained.
@@ -577,6 +554,10 @@ class TMCMCard_Backend(DeviceBackend_TCP):
         elif commandname == 'stop':
             motor = arguments[0]
             self.send_tmcl_command(3, 0, motor, 0)
+        elif commandname == 'set_maxspeed_temporarily':
+            # SAP without STAP: the value stored in the EEPROM is kept and restored on the next power-up.
+            motor, speed = arguments
+            self.send_tmcl_command(5, 4, motor, self._convert_speed_to_raw(speed, motor))
         elif commandname == 'load_positions':
             self.load_positions()
         elif commandname == 'save_positions':
@@ -902,6 +883,13 @@ class TMCMCard(Device):
         """Commence stopping of a motor"""
         self.execute_command('stop', motor)
 
+    def set_maxspeed_temporarily(self, motor, speed):
+        """Set the maximum speed of a motor without storing it in the EEPROM of the controller, unlike
+        `set_variable('maxspeed$<motor>', ...)`. For short-term changes: should the program die before the original
+        value is set back, a power cycle of the controller restores it."""
+        self.execute_command('set_maxspeed_temporarily', motor, speed)
+        self.refresh_variable('maxspeed$' + str(motor))
+
     def calibrate(self, motor, pos):
         """Calibrate the position of the motor. To be called from the FRONTEND"""
         if not self._busy.acquire(False):
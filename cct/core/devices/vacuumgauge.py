@@ -5,7 +5,7 @@ Created on Oct 13, 2015
 """
 import logging
 
-from .device import DeviceBackend_TCP, DeviceError, UnknownVariable, Device, UnknownCommand, ReadOnlyVariable
+from .device import DelimiterFramer, DeviceBackend_TCP, DeviceError, UnknownVariable, Device, UnknownCommand, ReadOnlyVariable
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
@@ -15,6 +15,8 @@ logger.setLevel(logging.INFO)
 class TPG201_Backend(DeviceBackend_TCP):
     invalid_characters = [b'\xc6', b'\xbe']
 
+    framer = DelimiterFramer(b'\r', keep_delimiter=True)
+
     def set_variable(self, variable: str, value: object):
         raise ReadOnlyVariable(variable)
 
@@ -29,12 +31,6 @@ class TPG201_Backend(DeviceBackend_TCP):
             raise UnknownVariable(variablename)
         return True
 
-    def get_complete_messages(self, message: bytes):
-        messages = message.split(b'\r')
-        for i in range(len(messages) - 1):
-            messages[i] = messages[i] + b'\r'
-        return messages
-
     def process_incoming_message(self, message: bytes, original_sent=None):
         for c in self.invalid_characters:
             message = message.replace(c, b'')
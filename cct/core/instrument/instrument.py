@@ -1,3 +1,4 @@
+import copy
 import logging
 import os
 import pickle
@@ -10,6 +11,8 @@ from ..devices.motor import Motor
 from ..services import Accounting, ExposureAnalyzer, FileSequence, Interpreter, SampleStore, Service, TelemetryManager, \
     WebStateFileWriter
 from ..utils.callback import Callbacks, SignalFlags
+from ..utils.configtools import apply_config_patch, check_config_schema, diff_config, read_config_file, \
+    write_config_file
 from ..utils.telemetry import TelemetryInfo
 from ..utils.timeout import TimeOut
 
@@ -71,8 +74,12 @@ class Instrument(Callbacks):
         self.pseudo_devices = {}
         self.services = {}
         self.motors = {}
-        self.configfile = os.path.join(self.configdir, 'cct.pickle')
+        self.configfile = os.path.join(self.configdir, 'cct.config')
+        # previous versions saved the config dict as a plain pickle file
+        self.legacy_configfile = os.path.join(self.configdir, 'cct.pickle')
         self._initialize_config()
+        # the configuration as last sent to the devices and services, for computing the changes.
+        self._propagated_config = None
         self._signalconnections = {}
         self._waiting_for_ready = []
         self._telemetries = {}
@@ -329,24 +336,41 @@ class Instrument(Callbacks):
             return None
 
     def save_state(self):
-        """Save the current configuration (including that of all devices) to a
-        pickle file."""
+        """Save the current configuration (including that of all devices) to
+        the config file and propagate the changes to the devices and services."""
         for devname, dev in self.devices.items():
             assert isinstance(dev, Device)
             self.config['devices'][devname] = dev.save_state()
         for servname, serv in self.services.items():
             assert isinstance(serv, Service)
             self.config['services'][servname] = serv.save_state()
-        with open(self.configfile, 'wb') as f:
-            pickle.dump(self.config, f)
+        write_config_file(self.configfile, self.config)
         logger.info('Saved state to ' + self.configfile)
+        self.propagate_config_changes()
+        self.emit_config_change_signal()
+
+    def propagate_config_changes(self):
+        """Send the changes of the config dictionary since the last call to the devices and services, as a patch
+        (see `configtools`)."""
+        if self._propagated_config is None:
+            # first time: everybody gets the whole config
+            self._propagated_config = copy.deepcopy(self.config)
+            for dev in self.devices.values():
+                dev.send_config(self.config)
+            for serv in self.services.values():
+                serv.update_config(self.config)
+            return
+        patch = diff_config(self._propagated_config, self.config)
+        if not patch:
+            return
+        logger.debug('Propagating {:d} config changes'.format(len(patch)))
+        apply_config_patch(self._propagated_config, copy.deepcopy(patch))
         for dev in self.devices.values():
             assert isinstance(dev, Device)
-            dev.send_config(self.config)
+            dev.send_config_patch(patch)
         for serv in self.services.values():
             assert isinstance(serv, Service)
-            serv.update_config(self.config)
-        self.emit_config_change_signal()
+            serv.update_config_patch(patch)
 
     def update_config(self, config_orig, config_loaded):
         """Uppdate the config dictionary in `config_orig` with the loaded
@@ -365,9 +389,10 @@ class Instrument(Callbacks):
         """Load the saved configuration file. This is only useful before
         connecting to devices, because status of the back-end process is
         not updated by Device._load_state()."""
-        with open(self.configfile, 'rb') as f:
-            config_loaded = pickle.load(f)
+        config_loaded = read_config_file(self.configfile, [self.legacy_configfile])
         config_loaded = self.fix_config(config_loaded)
+        for problem in check_config_schema(self.config, config_loaded):
+            logger.warning('Invalid config entry replaced by the default: ' + problem)
         self.update_config(self.config, config_loaded)
 
     # noinspection PyMethodMayBeStatic
@@ -475,6 +500,11 @@ class Instrument(Callbacks):
 
             dev = cls(cfg['name'])  # instantiate the class
             assert (isinstance(dev, Device))
+            dev.transport = cfg.get('transport', dev.transport)
+            dev.logformat = cfg.get('logformat', dev.logformat)
+            if self._propagated_config is not None:
+                # later changes are only sent as patches
+                dev.config = self.config
             self.devices[cfg['name']] = dev
             try:
                 # connect signal handlers
@@ -1,5 +1,7 @@
-from . import correlmatrix, loader, matrixaverager, outliers, processingjob
+from . import correlmatrix, fileindex, incrementalcorrelmatrix, loader, matrixaverager, outliers, processingjob
 from .backgroundprocedure import BackgroundProcedure, Results, ProcessingError, UserStopException, Message
+from .fileindex import FileIndex
+from .incrementalcorrelmatrix import IncrementalCorrelMatrix
 from .loader import Loader
 from .matrixaverager import MatrixAverager
 from .processingjob import ProcessingError, ProcessingJob, ProcessingJobResults
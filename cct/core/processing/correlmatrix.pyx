@@ -1,10 +1,113 @@
-#cython: boundscheck=False, cdivision=True, embedsignature=True, language_level=3, initializedcheck=False
+#cython: boundscheck=False, wraparound=False, cdivision=True, embedsignature=True, language_level=3, initializedcheck=False
 import numpy as np
 from cython.parallel import prange
-from libc.math cimport log, nan, isfinite
+from libc.math cimport nan, isfinite
 
+ctypedef fused floating:
+    float
+    double
 
-def correlmatrix_cython(double[:,:] intensities not None, double[:,:] errors not None, bint logarithmic=False):
+
+def _prepare(intensities, errors, bint logarithmic, dtype):
+    """Transform the curves once before the pairwise loops
+
+    The values (intensities or their logarithms) and the variances (squared absolute or relative errors) are
+    returned in curve-major, C-contiguous arrays, so that the points of a curve are adjacent in memory. Invalid
+    points (nonpositive error or, in logarithmic mode, nonpositive intensity) get zero value and infinite variance:
+    their terms in the pairwise sums then vanish exactly, thus no mask is needed in the inner loop.
+    """
+    intensities = np.asarray(intensities, np.double).T
+    errors = np.asarray(errors, np.double).T
+    if intensities.shape != errors.shape:
+        raise ValueError('Invalid shape of errors')
+    valid = errors > 0
+    if logarithmic:
+        valid &= intensities > 0
+    values = np.zeros(intensities.shape, np.double)
+    variances = np.full(intensities.shape, np.inf, np.double)
+    if logarithmic:
+        np.log(intensities, out=values, where=valid)
+        np.divide(errors, intensities, out=variances, where=valid)
+    else:
+        np.copyto(values, intensities, where=valid)
+        np.copyto(variances, errors, where=valid)
+    np.multiply(variances, variances, out=variances)
+    return np.ascontiguousarray(values, dtype), np.ascontiguousarray(variances, dtype)
+
+
+cdef void _pairsums(floating[:, ::1] values1, floating[:, ::1] variances1,
+                    floating[:, ::1] values2, floating[:, ::1] variances2,
+                    double[:, ::1] sums, double[:, ::1] weights,
+                    bint symmetric, bint ratio, Py_ssize_t blocksize) noexcept nogil:
+    """Calculate the pairwise sums in tiles of `blocksize` x `blocksize` curves.
+
+    If `symmetric` is True, the two sets of curves are the same and only the upper triangle is calculated, the lower
+    one is mirrored. If `ratio` is True, the sums are divided by the weights in place (NaN if there were no common
+    valid points) and `weights` is not touched.
+    """
+    cdef Py_ssize_t Ncurves1 = values1.shape[0], Ncurves2 = values2.shape[0], Npoints = values1.shape[1]
+    cdef Py_ssize_t Nblocks1 = (Ncurves1 + blocksize - 1) // blocksize
+    cdef Py_ssize_t iblock, jstart, i, j, k, iend, jend
+    cdef floating d, r
+    cdef double cmpoint, weight
+    cdef double NaN = nan('NaN')
+    for iblock in prange(Nblocks1, nogil=True, schedule='dynamic'):
+        iend = min((iblock + 1) * blocksize, Ncurves1)
+        jstart = iblock * blocksize if symmetric else 0
+        while jstart < Ncurves2:
+            jend = min(jstart + blocksize, Ncurves2)
+            for i in range(iblock * blocksize, iend):
+                for j in range(max(jstart, i + 1) if symmetric else jstart, jend):
+                    cmpoint = 0
+                    weight = 0
+                    for k in range(Npoints):
+                        d = values1[i, k] - values2[j, k]
+                        r = (<floating>1) / (variances1[i, k] + variances2[j, k])
+                        cmpoint = cmpoint + d * d * r
+                        weight = weight + r
+                    if ratio:
+                        cmpoint = cmpoint / weight if weight > 0 else NaN
+                        sums[i, j] = cmpoint
+                        if symmetric:
+                            sums[j, i] = cmpoint
+                    else:
+                        sums[i, j] = cmpoint
+                        weights[i, j] = weight
+                        if symmetric:
+                            sums[j, i] = cmpoint
+                            weights[j, i] = weight
+            jstart = jend
+
+
+def _run(intensities1, errors1, intensities2, errors2, bint logarithmic, bint single_precision,
+         Py_ssize_t blocksize, bint ratio):
+    cdef bint symmetric = intensities2 is None
+    cdef float[:, ::1] fval1, fvar1, fval2, fvar2
+    cdef double[:, ::1] dval1, dvar1, dval2, dvar2
+    cdef double[:, ::1] sums, weights
+    if blocksize < 1:
+        raise ValueError('Invalid block size')
+    dtype = np.float32 if single_precision else np.double
+    values1, variances1 = _prepare(intensities1, errors1, logarithmic, dtype)
+    if symmetric:
+        values2, variances2 = values1, variances1
+    else:
+        values2, variances2 = _prepare(intensities2, errors2, logarithmic, dtype)
+        if values2.shape[1] != values1.shape[1]:
+            raise ValueError('The number of points is different in the two sets of curves')
+    sums = np.empty((values1.shape[0], values2.shape[0]), np.double)
+    weights = sums if ratio else np.empty((values1.shape[0], values2.shape[0]), np.double)
+    if single_precision:
+        fval1, fvar1, fval2, fvar2 = values1, variances1, values2, variances2
+        _pairsums(fval1, fvar1, fval2, fvar2, sums, weights, symmetric, ratio, blocksize)
+    else:
+        dval1, dvar1, dval2, dvar2 = values1, variances1, values2, variances2
+        _pairsums(dval1, dvar1, dval2, dvar2, sums, weights, symmetric, ratio, blocksize)
+    return np.asarray(sums), np.asarray(weights)
+
+
+def correlmatrix_cython(double[:,:] intensities not None, double[:,:] errors not None, bint logarithmic=False,
+                        bint single_precision=False, Py_ssize_t blocksize=16):
     """Calculate the correlation matrix of scattering curves
 
     The c_ij element of the symmetric correlation matrix is calculated as:
@@ -25,48 +128,31 @@ def correlmatrix_cython(double[:,:] intensities not None, double[:,:] errors not
 
     In this case, nonpositive intensities are automatically skipped.
 
+    The transformed curves are precalculated once, and the pairs are visited in tiles of `blocksize` curves, so that
+    the data of a tile stay in the cache.
+
     :param intensities: an array containing the intensities of independent measurements in columns
     :type intensities: MxN np.ndarray, double dtype
     :param errors: an array containing the absolute errors of independent measurements in columns
     :type errors: MxN np.ndarray, double dtype
     :param logarithmic: if logarithmic distances are to be used
     :type logarithmic: bool
+    :param single_precision: store the transformed curves in single precision, halving their memory footprint.
+        The sums are still accumulated in double precision, the relative error of the result is ~1e-7.
+    :type single_precision: bool
+    :param blocksize: number of curves in a tile
+    :type blocksize: int
     :return: the correlation matrix
     :rtype: NxN np.ndarray, double dtype
     """
-    cdef Py_ssize_t Ncurves, Npoints, icurves, ipoints, jcurves, npoints
+    cdef Py_ssize_t Ncurves, icurves, jcurves, npoints
     cdef double[:,:] cm
-    cdef double weight
-    cdef double cmpoint, w
-    cdef unsigned char[:,:] mymask
+    cdef double cmpoint
     cdef double NaN = nan('NaN')
-    Ncurves=intensities.shape[1]
-    Npoints=intensities.shape[0]
-    if (errors.shape[1] != Ncurves) or (errors.shape[0] != Npoints):
+    if (errors.shape[1] != intensities.shape[1]) or (errors.shape[0] != intensities.shape[0]):
         raise ValueError('Invalid shape of errors')
-    mymask = np.empty((Npoints, Ncurves), np.uint8)
-    cm = np.empty((Ncurves, Ncurves), np.double)
-    for icurves in range(Ncurves):
-        for ipoints in range(Npoints):
-            mymask[ipoints, icurves] = (((intensities[ipoints, icurves])>0) or (not logarithmic)) and (errors[ipoints, icurves]>0)
-    for icurves in prange(Ncurves, nogil=True, schedule='guided'):
-        for jcurves in range(icurves+1, Ncurves):
-            cmpoint=0
-            weight = 0
-            for ipoints in range(Npoints):
-                if (not mymask[ipoints, icurves]) or (not mymask[ipoints, jcurves]):
-                    continue
-                if logarithmic:
-                    w = (errors[ipoints, icurves]/intensities[ipoints,icurves])**2+ (errors[ipoints,jcurves]/intensities[ipoints,jcurves])**2
-                    cmpoint=cmpoint+(log(intensities[ipoints, icurves])-log(intensities[ipoints,jcurves]))**2/w
-                else:
-                    w = errors[ipoints, icurves]**2+errors[ipoints,jcurves]**2
-                    cmpoint=cmpoint +(intensities[ipoints,icurves]-intensities[ipoints,jcurves])**2/w
-                weight=weight+1/w
-            if weight>0:
-                cm[icurves,jcurves]=cm[jcurves,icurves]=cmpoint/weight
-            else:
-                cm[icurves, jcurves]=cm[jcurves,icurves]=NaN
+    cm = _run(intensities, errors, None, None, logarithmic, single_precision, blocksize, True)[0]
+    Ncurves = cm.shape[0]
     for icurves in range(Ncurves):
         cmpoint = 0
         npoints = 0
@@ -78,8 +164,45 @@ def correlmatrix_cython(double[:,:] intensities not None, double[:,:] errors not
             cm[icurves,icurves] = cmpoint / npoints
         else:
             cm[icurves, icurves] = NaN
-    del mymask
-    return cm
+    return np.asarray(cm)
+
+
+def correlmatrix_sums_cython(double[:,:] intensities1 not None, double[:,:] errors1 not None,
+                             double[:,:] intensities2 not None, double[:,:] errors2 not None,
+                             bint logarithmic=False, bint single_precision=False, Py_ssize_t blocksize=16):
+    """Calculate the pairwise weighted distance sums between two sets of scattering curves
+
+    For each curve i from the first set and curve j from the second set, the two sums making up the off-diagonal
+    element of the correlation matrix (see correlmatrix_cython()) are returned separately:
+
+    S_ij = sum_k( 1/(E_i(q_k)**2 + E_j(q_k)**2) * (I_i(q_k)-I_j(q_k))**2)
+    W_ij = sum_k (1/(E_i(q_k)**2+E_j(q_k)**2))
+
+    c_ij is then S_ij / W_ij. This makes it possible to extend an already known correlation matrix with new curves
+    without recalculating the elements between the old ones.
+
+    :param intensities1: intensities of the first set of measurements, in columns
+    :type intensities1: MxN1 np.ndarray, double dtype
+    :param errors1: absolute errors of the first set of measurements, in columns
+    :type errors1: MxN1 np.ndarray, double dtype
+    :param intensities2: intensities of the second set of measurements, in columns
+    :type intensities2: MxN2 np.ndarray, double dtype
+    :param errors2: absolute errors of the second set of measurements, in columns
+    :type errors2: MxN2 np.ndarray, double dtype
+    :param logarithmic: if logarithmic distances are to be used
+    :type logarithmic: bool
+    :param single_precision: store the transformed curves in single precision
+    :type single_precision: bool
+    :param blocksize: number of curves in a tile
+    :type blocksize: int
+    :return: the weighted sums of the squared distances and the sums of the weights
+    :rtype: two N1xN2 np.ndarrays, double dtype
+    """
+    if (errors1.shape[1] != intensities1.shape[1]) or (errors1.shape[0] != intensities1.shape[0]):
+        raise ValueError('Invalid shape of errors1')
+    if (errors2.shape[1] != intensities2.shape[1]) or (errors2.shape[0] != intensities2.shape[0]):
+        raise ValueError('Invalid shape of errors2')
+    return _run(intensities1, errors1, intensities2, errors2, logarithmic, single_precision, blocksize, False)
 
 
 def correlmatrix2d_cython(double[:,:,:] intensities not None,
@@ -0,0 +1,146 @@
+"""An index of the files in a set of directories, to avoid probing many directories for each file"""
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+from typing import Dict, List, Optional, Sequence
+
+import appdirs
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+class FileIndex:
+    """Map file names to full paths in a list of directories (not recursive).
+
+    If a file name occurs in more directories, the first one in the list wins, as with probing the directories
+    one after the other. The contents of the directories are scanned once and saved in a cache file, together with
+    the modification times of the directories. Adding or removing a file changes the modification time of the
+    directory, therefore when the index is loaded again (or a file is not found in it), only those directories are
+    re-scanned which have changed since.
+    """
+    version: int = 1
+    dirs: List[str]
+    cachefile: Optional[str]
+    refreshinterval: float  # do not check the directories for changes more frequently than this (seconds)
+    _dirinfo: Dict[str, dict]  # directory -> {'mtime': mtime_ns, 'scantime': time.time(), 'files': [filenames]}
+    _index: Dict[str, str]  # file name -> full path
+    _lastrefresh: float = 0
+
+    def __init__(self, dirs: Sequence[str], cachefile: Optional[str] = '', refreshinterval: float = 1.0):
+        """Create the index.
+
+        :param dirs: the directories to index, in decreasing priority
+        :param cachefile: name of the cache file. If an empty string (the default), a file in the user cache
+            directory is used, named after the list of directories. If None, the index is not persisted.
+        :param refreshinterval: minimum time between checking the directories for changes
+        """
+        self.dirs = [os.path.normpath(d) for d in dirs]
+        if cachefile == '':
+            cachefile = self.defaultCacheFile(self.dirs)
+        self.cachefile = os.path.abspath(cachefile) if cachefile is not None else None
+        self.refreshinterval = refreshinterval
+        self._dirinfo = {}
+        self._index = {}
+        self._loadCache()
+        self.refresh(force=True)
+
+    @staticmethod
+    def defaultCacheFile(dirs: Sequence[str]) -> str:
+        digest = hashlib.sha1('\n'.join(os.path.abspath(d) for d in dirs).encode('utf-8')).hexdigest()
+        return os.path.join(appdirs.user_cache_dir('cpt', 'CREDO'), 'fileindex', digest + '.json')
+
+    def _loadCache(self):
+        if self.cachefile is None:
+            return
+        try:
+            with open(self.cachefile, 'rt', encoding='utf-8') as f:
+                cache = json.load(f)
+            if cache.get('version') != self.version:
+                return
+            self._dirinfo = {d: info for d, info in cache['dirs'].items() if d in self.dirs}
+        except (OSError, ValueError, KeyError, AttributeError) as exc:
+            logger.debug('Cannot load file index cache {}: {}'.format(self.cachefile, exc))
+            self._dirinfo = {}
+
+    def _saveCache(self):
+        if self.cachefile is None:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.cachefile), exist_ok=True)
+            # write atomically, more processes may use the same cache file.
+            fd, tmpname = tempfile.mkstemp(dir=os.path.dirname(self.cachefile), suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wt', encoding='utf-8') as f:
+                    json.dump({'version': self.version, 'dirs': self._dirinfo}, f)
+                os.replace(tmpname, self.cachefile)
+            except BaseException:
+                os.unlink(tmpname)
+                raise
+        except OSError as exc:
+            logger.debug('Cannot save file index cache {}: {}'.format(self.cachefile, exc))
+
+    def refresh(self, force: bool = False) -> bool:
+        """Re-scan the directories which have changed since the last scan.
+
+        :param force: check the directories even if the last check was less than `refreshinterval` ago.
+        :return: True if any of the directories has been re-scanned.
+        """
+        if (not force) and (time.monotonic() - self._lastrefresh < self.refreshinterval):
+            return False
+        self._lastrefresh = time.monotonic()
+        changed = False
+        for d in self.dirs:
+            try:
+                mtime = os.stat(d).st_mtime_ns
+            except OSError:
+                # the directory does not exist (anymore)
+                changed |= self._dirinfo.pop(d, None) is not None
+                continue
+            info = self._dirinfo.get(d)
+            # Some file systems have a coarse timestamp resolution: a file added in the same tick as the last
+            # scan does not change the modification time. Such directories are not trusted.
+            if (info is not None) and (info['mtime'] == mtime) and (info['scantime'] - mtime / 1e9 > 2):
+                continue
+            scantime = time.time()
+            try:
+                files = [entry.name for entry in os.scandir(d) if not entry.is_dir()]
+            except OSError:
+                continue
+            self._dirinfo[d] = {'mtime': mtime, 'scantime': scantime, 'files': files}
+            changed = True
+        if changed or not self._index:
+            self._index = {}
+            for d in reversed(self.dirs):
+                if d in self._dirinfo:
+                    self._index.update({f: os.path.join(d, f) for f in self._dirinfo[d]['files']})
+        if changed:
+            self._saveCache()
+        return changed
+
+    def find(self, filename: str) -> Optional[str]:
+        """Get the full path of a file, or None if it is not in any of the directories."""
+        try:
+            return self._index[filename]
+        except KeyError:
+            if self.refresh():
+                return self._index.get(filename)
+            return None
+
+    def findFirst(self, filenames: Sequence[str]) -> Optional[str]:
+        """Get the full path of the first file found from a list of alternatives, e.g. different extensions.
+
+        The directories are searched one after the other and in each of them the names are tried in the given
+        order, as with probing: a file in a directory of higher priority wins, even if its name comes later.
+        """
+        found = [path for path in (self.find(f) for f in filenames) if path is not None]
+        if not found:
+            return None
+        # min() returns the first of equal keys, thus the order of the names is kept within a directory.
+        return min(found, key=lambda path: self.dirs.index(os.path.dirname(path)))
+
+    def __contains__(self, filename: str) -> bool:
+        return self.find(filename) is not None
@@ -0,0 +1,121 @@
+"""Incrementally updatable correlation matrix of scattering curves"""
+import hashlib
+from typing import List, Optional
+
+import h5py
+import numpy as np
+
+from .correlmatrix import correlmatrix_sums_cython
+
+
+class IncrementalCorrelMatrix:
+    """Correlation matrix which can be extended by new curves without recalculating the already known elements.
+
+    The off-diagonal elements of the correlation matrix (see `correlmatrix_cython()`) are ratios of two pairwise
+    sums: the weighted squared distances and the weights. These are kept (and persisted in the HDF5 file) for each
+    pair of curves, together with the FSNs and a checksum of the curves. When the matrix is updated, only the rows
+    and columns of the curves which are new (or have changed since) are calculated. The diagonal is always
+    recalculated from the off-diagonal elements, which is cheap.
+    """
+    fsns: List[int] = None
+    checksums: List[str] = None
+    sums: np.ndarray = None
+    weights: np.ndarray = None
+    logarithmic: bool = False
+    reused: int = 0  # number of curves taken over from the previous state in the last update()
+
+    def __init__(self, logarithmic: bool):
+        self.logarithmic = logarithmic
+        self.fsns = []
+        self.checksums = []
+        self.sums = np.zeros((0, 0), np.double)
+        self.weights = np.zeros((0, 0), np.double)
+
+    @staticmethod
+    def checksum(q: np.ndarray, intensity: np.ndarray, error: np.ndarray) -> str:
+        """Fingerprint of a curve: if it changes, the cached pairwise sums of the curve are invalid."""
+        digest = hashlib.sha1()
+        for array in (q, intensity, error):
+            digest.update(np.ascontiguousarray(array, np.double).tobytes())
+        return digest.hexdigest()
+
+    def update(self, fsns: List[int], q: np.ndarray, intensities: np.ndarray, errors: np.ndarray) -> np.ndarray:
+        """Update the correlation matrix with a new set of curves.
+
+        :param fsns: file sequence numbers of the curves
+        :param q: the common scattering variable of the curves
+        :param intensities: intensities of the curves, in columns
+        :param errors: absolute errors of the intensities, in columns
+        :return: the correlation matrix, rows and columns ordered as in `fsns`.
+        """
+        intensities = np.asarray(intensities, np.double)
+        errors = np.asarray(errors, np.double)
+        checksums = [self.checksum(q, intensities[:, i], errors[:, i]) for i in range(len(fsns))]
+        cached = {key: idx for idx, key in enumerate(zip(self.fsns, self.checksums))}
+        oldindex = np.array([cached.get(key, -1) for key in zip(fsns, checksums)], np.intp)
+        known = np.flatnonzero(oldindex >= 0)
+        new = np.flatnonzero(oldindex < 0)
+        sums = np.empty((len(fsns), len(fsns)), np.double)
+        weights = np.empty((len(fsns), len(fsns)), np.double)
+        sums[np.ix_(known, known)] = self.sums[np.ix_(oldindex[known], oldindex[known])]
+        weights[np.ix_(known, known)] = self.weights[np.ix_(oldindex[known], oldindex[known])]
+        if len(new):
+            newsums, newweights = correlmatrix_sums_cython(
+                intensities[:, new], errors[:, new], intensities, errors, self.logarithmic)
+            sums[new, :] = newsums
+            sums[:, new] = newsums.T
+            weights[new, :] = newweights
+            weights[:, new] = newweights.T
+        self.fsns = list(fsns)
+        self.checksums = checksums
+        self.sums = sums
+        self.weights = weights
+        self.reused = len(known)
+        return self.matrix()
+
+    def matrix(self) -> np.ndarray:
+        """Calculate the correlation matrix from the pairwise sums.
+
+        The diagonal elements are the averages of the finite off-diagonal elements in the same row.
+        """
+        cmat = np.full(self.sums.shape, np.nan, np.double)
+        valid = self.weights > 0
+        cmat[valid] = self.sums[valid] / self.weights[valid]
+        np.fill_diagonal(cmat, np.nan)
+        finite = np.isfinite(cmat)
+        count = finite.sum(axis=1)
+        total = np.where(finite, cmat, 0).sum(axis=1)
+        diagonal = np.full(len(count), np.nan, np.double)
+        diagonal[count > 0] = total[count > 0] / count[count > 0]
+        np.fill_diagonal(cmat, diagonal)
+        return cmat
+
+    @classmethod
+    def load(cls, group: Optional[h5py.Group], logarithmic: bool) -> "IncrementalCorrelMatrix":
+        """Restore the state saved by `save()`. If the saved state is missing or was made with different settings,
+        an empty instance is returned."""
+        self = cls(logarithmic)
+        if (group is None) or (bool(group.attrs.get('logarithmic', not logarithmic)) != bool(logarithmic)):
+            return self
+        try:
+            fsns = [int(f) for f in group['fsns']]
+            checksums = [c.decode('ascii') if isinstance(c, bytes) else str(c) for c in group['checksums']]
+            sums = np.array(group['sums'], np.double)
+            weights = np.array(group['weights'], np.double)
+        except KeyError:
+            return self
+        if not (len(fsns) == len(checksums) == sums.shape[0] == weights.shape[0]):
+            return self
+        self.fsns = fsns
+        self.checksums = checksums
+        self.sums = sums
+        self.weights = weights
+        return self
+
+    def save(self, group: h5py.Group, compression: Optional[str] = None):
+        """Save the state into an HDF5 group"""
+        group.attrs['logarithmic'] = int(self.logarithmic)
+        group.create_dataset('fsns', data=np.array(self.fsns, np.int64))
+        group.create_dataset('checksums', data=np.array(self.checksums, dtype='S40'))
+        group.create_dataset('sums', data=self.sums, compression=compression)
+        group.create_dataset('weights', data=self.weights, compression=compression)
@@ -6,6 +6,8 @@ import numpy as np
 from sastool.io.credo_cct import Header, Exposure
 from scipy.io import loadmat
 
+from .fileindex import FileIndex
+
 logger=logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
@@ -19,6 +21,7 @@ class Loader:
     filenameformat: str # file name format string: constructed from the prefix and the number of FSN digits
     subsubdircount: int # number of sub-subdirectories to search for
     subsubdirs: Dict[str, List[str]] # existing 2nd level subdirectories in dataroot for each subdir
+    eval2dindex: FileIndex # file name -> path index of the eval2d subdirectory tree
 
     def __init__(self, rootdir: str, prefix: str='crd', fsndigits:int=5, subsubdircount:int=30):
         self.rootdir = rootdir
@@ -38,6 +41,7 @@ class Loader:
                        [self.prefix+str(i) for i in range(self.subsubdircount)]
             self.subsubdirs[subdir] = [d for d in subsubdirs if os.path.isdir(os.path.join(self.rootdir, subdir, d))]
             logger.debug('SubSubdirs for subdir {}: {}'.format(subdir, ', '.join(['"{}"'.format(x) for x in self.subsubdirs[subdir]])))
+        self.eval2dindex = FileIndex([os.path.join(self.rootdir, 'eval2d', sd) for sd in self.subsubdirs['eval2d']])
 
     def loadMask(self, maskname: str, forceReload: bool = False) -> np.ndarray:
         """Load a mask from a file"""
@@ -68,13 +72,10 @@ class Loader:
     def loadHeader(self, fsn:int) -> Header:
         logger.debug('Loading header {}'.format(fsn))
         for extn in ['.pickle', '.pickle.gz']:
-            filename = self.filenameformat.format(fsn)+extn
-            for sd in self.subsubdirs['eval2d']:
-                logger.debug('  - Trying subdir "{}"\n'.format(os.path.join(self.rootdir, 'eval2d', sd)))
-                try:
-                    return Header.new_from_file(os.path.join(self.rootdir, 'eval2d', sd, filename))
-                except FileNotFoundError:
-                    continue
+            path = self.eval2dindex.find(self.filenameformat.format(fsn)+extn)
+            if path is not None:
+                logger.debug('  - Found in "{}"'.format(path))
+                return Header.new_from_file(path)
         raise FileNotFoundError(self.filenameformat.format(fsn)+'.pickle')
 
     def loadExposure(self, fsn:int) -> Exposure:
@@ -83,10 +84,7 @@ class Loader:
         header = self.loadHeader(fsn)
         mask = self.loadMask(header.maskname)
         logger.debug('Starting the actual loading of the exposure')
-        for sd in self.subsubdirs['eval2d']:
-            logger.debug('  - Trying subdir "{}"\n'.format(os.path.join(self.rootdir, 'eval2d', sd)))
-            try:
-                return Exposure.new_from_file(os.path.join(self.rootdir, 'eval2d', sd, filename), header, mask)
-            except FileNotFoundError:
-                continue
-        raise FileNotFoundError(filename)
+        path = self.eval2dindex.find(filename)
+        if path is None:
+            raise FileNotFoundError(filename)
+        return Exposure.new_from_file(path, header, mask)
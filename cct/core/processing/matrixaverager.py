@@ -1,4 +1,5 @@
-from typing import Tuple
+import itertools
+from typing import Iterable, Optional, Sequence, Tuple, Union
 
 import numpy as np
 
@@ -9,6 +10,7 @@ class MatrixAverager:
     error: np.ndarray = None
     count: int = 0
     method: str
+    methods: Tuple[str, ...]
 
     # Error propagation types: if y_i are the measured data and e_i are their uncertainties:
     #
@@ -24,57 +26,154 @@ class MatrixAverager:
     #  4) Conservative:
     #       y = mean(y_i)
     #       e: either the Gaussian, or that from the standard deviation, take the larger one.
+    #
+    # The sums needed by each method. More methods can be calculated at once: the common sums are only accumulated
+    # once. Names: 'value': sum(y_i), 'value2': sum(y_i^2), 'error': sum(e_i), 'error2': sum(e_i^2),
+    # 'weightedvalue': sum(y_i/e_i^2), 'weight': sum(1/e_i^2)
+    _sumsneeded = {'Weighted': ('weightedvalue', 'weight'),
+                   'Average': ('value', 'error'),
+                   'Squared (Gaussian)': ('value', 'error2'),
+                   'Conservative': ('value', 'error2', 'value2'),
+                   }
+
+    def __init__(self, errorpropagationmethod: Union[str, Sequence[str]]):
+        methods = (errorpropagationmethod,) if isinstance(errorpropagationmethod, str) else tuple(
+            errorpropagationmethod)
+        for method in methods:
+            if method not in self._sumsneeded:
+                raise ValueError('Invalid error propagation method: {}'.format(method))
+        if not methods:
+            raise ValueError('At least one error propagation method must be given')
+        self.methods = methods
+        self.method = methods[0]
+        self._sums = {}  # the sums needed by the error propagation methods, keyed by their names (see above)
+        self._fixederror = None  # work buffer: the error matrix with bad values replaced
+        self._work = None  # work buffer for the derived quantities
+        self._good = None  # work buffer: the good points of the error matrix
+        self._finite = None  # work buffer
+        self._nonfinite = None  # the number of non-finite values added in each point, allocated when first needed
 
-    def __init__(self, errorpropagationmethod:str):
-        if errorpropagationmethod in ['Weighted', 'Average', 'Squared (Gaussian)', 'Conservative']:
-            self.method = errorpropagationmethod
+    def _allocate(self, shape: Tuple[int, ...]):
+        for method in self.methods:
+            for name in self._sumsneeded[method]:
+                self._sums[name] = np.zeros(shape, np.double)
+        self._fixederror = np.empty(shape, np.double)
+        self._work = np.empty(shape, np.double)
+        self._good = np.empty(shape, np.bool_)
+        self._finite = np.empty(shape, np.bool_)
+
+    def _accumulate(self, value: np.ndarray, error: np.ndarray, sign: int):
+        if not self._sums:
+            self._allocate(value.shape)
+        elif value.shape != self._work.shape:
+            raise ValueError('Shape mismatch: expected {}, got {}'.format(self._work.shape, value.shape))
+        accumulate = np.add if sign > 0 else np.subtract
+        np.isfinite(value, out=self._finite)
+        if not self._finite.all():
+            # NaNs and infinities would stay in the sums even after subtract(): they are counted separately and left
+            # out of the sums. The average is NaN in the points where the count is nonzero.
+            if self._nonfinite is None:
+                self._nonfinite = np.zeros(value.shape, np.int32)
+            np.logical_not(self._finite, out=self._finite)
+            accumulate(self._nonfinite, self._finite, out=self._nonfinite)
+            value = np.where(self._finite, 0, value)
+        error = self._fixBadValuesInPlace(error)
+        sums = self._sums
+        if 'value' in sums:
+            accumulate(sums['value'], value, out=sums['value'])
+        if 'error' in sums:
+            accumulate(sums['error'], error, out=sums['error'])
+        if 'value2' in sums:
+            np.multiply(value, value, out=self._work)
+            accumulate(sums['value2'], self._work, out=sums['value2'])
+        if ('error2' in sums) or ('weight' in sums):
+            np.multiply(error, error, out=error)
+            if 'error2' in sums:
+                accumulate(sums['error2'], error, out=sums['error2'])
+            if 'weight' in sums:
+                np.reciprocal(error, out=error)
+                accumulate(sums['weight'], error, out=sums['weight'])
+                np.multiply(value, error, out=self._work)
+                accumulate(sums['weightedvalue'], self._work, out=sums['weightedvalue'])
+        self.count += sign
+        # keep the traditional attributes up to date
+        if self.method == 'Weighted':
+            self.value, self.error = sums['weightedvalue'], sums['weight']
         else:
-            raise ValueError('Invalid error propagation method: {}'.format(errorpropagationmethod))
-
-    def add(self, value:np.ndarray, error:np.ndarray):
-        error = self.fixBadValues(error)
-        if self.value is None:
-            if self.method == 'Weighted':
-                self.value = value/error**2
-                self.error = 1/error**2
-            elif self.method == 'Average':
-                self.error = error*1  # Multiplication by 1: make a copy
-                self.value = value*1  # Multiplication by 1: make a copy
-            elif self.method == 'Squared (Gaussian)':
-                self.error = error**2
-                self.value = value*1  # Multiplication by 1: make a copy
-            elif self.method == 'Conservative':
-                self.error = error**2
-                self.value = value *1  # Multiplication by 1: make a copy
-                self.value2 = value**2
+            self.value = sums['value']
+            self.error = sums['error'] if self.method == 'Average' else sums['error2']
+            self.value2 = sums.get('value2')
+
+    def add(self, value: np.ndarray, error: np.ndarray):
+        self._accumulate(value, error, +1)
+
+    def add_batch(self, values: Iterable[np.ndarray], errors: Iterable[np.ndarray]):
+        """Add several matrices at once.
+
+        `values` and `errors` are either 3D arrays, the first index running over the matrices, or iterables (e.g.
+        generators) yielding 2D arrays. Only one matrix is accessed at a time, the accumulation is done in place.
+
+        Raises ValueError if `values` and `errors` have different lengths. The matrices before the missing one are
+        already added then.
+        """
+        missing = object()
+        for value, error in itertools.zip_longest(values, errors, fillvalue=missing):
+            if (value is missing) or (error is missing):
+                raise ValueError('The number of value and error matrices differ')
+            self._accumulate(value, error, +1)
+
+    def subtract(self, value: np.ndarray, error: np.ndarray):
+        """Remove a matrix previously given to add() from the average.
+
+        Non-finite values of `value` are also removed: the average is finite again in the points where no other
+        matrix has a non-finite value."""
+        if self.count < 1:
+            raise ValueError('Cannot subtract from an empty average')
+        self._accumulate(value, error, -1)
+
+    def get(self, method: Optional[str] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Get the average and its uncertainty.
+
+        :param method: the error propagation method. Must be one of those given to the constructor. If None, the
+            first one is used.
+        """
+        if method is None:
+            method = self.method
+        elif method not in self.methods:
+            raise ValueError('Error propagation method {} was not requested at construction'.format(method))
+        sums = self._sums
+        if method == 'Weighted':
+            value, error = sums['weightedvalue'] / sums['weight'], 1 / sums['weight'] ** 0.5
+        elif method == 'Average':
+            value, error = sums['value'] / self.count, sums['error'] / self.count ** 2
+        elif method == 'Squared (Gaussian)':
+            value, error = sums['value'] / self.count, sums['error2'] ** 0.5 / self.count
         else:
-            if self.method == 'Weighted':
-                self.value += value/error**2
-                self.error += 1/error**2
-            elif self.method == 'Average':
-                self.error += error
-                self.value += value
-            elif self.method == 'Squared (Gaussian)':
-                self.error += error**2
-                self.value += value
-            elif self.method == 'Conservative':
-                self.value += value
-                self.error += error**2
-                self.value2 += value**2
-        self.count +=1
-
-    def get(self) -> Tuple[np.ndarray, np.ndarray]:
-        if self.method == 'Weighted':
-            return self.value / self.error, 1/self.error**0.5
-        elif self.method == 'Average':
-            return self.value / self.count, self.error/self.count**2
-        elif self.method == 'Squared (Gaussian)':
-            return self.value / self.count, self.error**0.5/self.count
-        elif self.method == 'Conservative':
-            error_std = (self.value2 - self.value ** 2 / self.count) / (
-                    self.count - 1) / self.count ** 0.5 if self.count > 1 else np.zeros_like(self.value)
-            error_propagated = self.error ** 0.5 / self.count
-            return self.value / self.count, np.stack((error_std, error_propagated)).max(axis=0)
+            assert method == 'Conservative'
+            error_std = (sums['value2'] - sums['value'] ** 2 / self.count) / (
+                    self.count - 1) / self.count ** 0.5 if self.count > 1 else np.zeros_like(sums['value'])
+            error_propagated = sums['error2'] ** 0.5 / self.count
+            value, error = sums['value'] / self.count, np.stack((error_std, error_propagated)).max(axis=0)
+        if (self._nonfinite is not None) and self._nonfinite.any():
+            nonfinite = self._nonfinite > 0
+            value[nonfinite] = np.nan
+            error[nonfinite] = np.nan
+        return value, error
+
+    def _fixBadValuesInPlace(self, matrix: np.ndarray) -> np.ndarray:
+        """Same as fixBadValues(), but the result is written in a preallocated work buffer"""
+        good = self._good
+        np.greater(matrix, 0, out=good)
+        np.isfinite(matrix, out=self._finite)
+        np.logical_and(good, self._finite, out=good)
+        out = self._fixederror
+        if not good.any():
+            out.fill(1)
+            return out
+        np.copyto(out, matrix)
+        np.logical_not(good, out=self._finite)
+        np.copyto(out, np.min(matrix, where=good, initial=np.inf), where=self._finite)
+        return out
 
     @staticmethod
     def fixBadValues(matrix: np.ndarray) -> np.ndarray:
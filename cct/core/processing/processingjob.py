@@ -14,7 +14,7 @@ from sastool.io.credo_cct import Header, Exposure
 
 from . import outliers
 from .backgroundprocedure import BackgroundProcedure, Results, ProcessingError, UserStopException
-from .correlmatrix import correlmatrix_cython
+from .incrementalcorrelmatrix import IncrementalCorrelMatrix
 from .loader import Loader
 from .matrixaverager import MatrixAverager
 
@@ -23,6 +23,7 @@ class ProcessingJobResults(Results):
     time_loadheaders: float = 0
     time_loadexposures: float = 0
     time_outlierdetection: float = 0
+    correlmatrix_reused: int = 0
     time_averaging: float = 0
     time_averaging_header: float = 0
     time_averaging_exposures: float = 0
@@ -45,14 +46,19 @@ class ProcessingJob(BackgroundProcedure):
     exposures: List[Exposure] = None
     _loader: Loader = None
     bigmemorymode: bool = False
+    singlepassmode: bool = False
     badfsns: List[int] = None
     initialBadfsns: List[int] = None
+    correlmatrixsums: IncrementalCorrelMatrix = None
+    _average2d: MatrixAverager = None  # running average of the exposures in single-pass mode
+    _maskcount: np.ndarray = None  # number of exposures in which the pixel is not masked, in single-pass mode
+    _averagedfsns: List[int] = None  # FSNs of the exposures in `_average2d`
 
     def __init__(self, jobid: Any, h5writerLock: Lock, killswitch: Event,
                  resultsqueue: Queue, h5file:str, rootdir: str,
                  fsnlist: List[int], badfsns: List[int],
                  ierrorprop: str, qerrorprop: str, outliermethod: str, outliermultiplier: float, logcmat: bool,
-                 qrange: Optional[np.ndarray], bigmemorymode: bool = False):
+                 qrange: Optional[np.ndarray], bigmemorymode: bool = False, singlepassmode: bool = False):
         super().__init__(jobid, h5writerLock, killswitch, resultsqueue, h5file)
         self.fsnlist = fsnlist
         self._loader = Loader(rootdir)
@@ -74,6 +80,7 @@ class ProcessingJob(BackgroundProcedure):
         self.logcmat = logcmat
         self.qrange = qrange
         self.bigmemorymode = bigmemorymode
+        self.singlepassmode = singlepassmode
         self.result = ProcessingJobResults()
 
     def _loadheaders(self):
@@ -98,7 +105,10 @@ class ProcessingJob(BackgroundProcedure):
         self.result.time_loadheaders = time.monotonic() - t0
 
     def _loadexposures(self):
-        """Load all exposures, i.e. 2D images. Do radial averaging as well."""
+        """Load all exposures, i.e. 2D images. Do radial averaging as well.
+
+        In single-pass mode the exposures are also added to the 2D average here, so they need not be kept in memory
+        or loaded again in _summarize()."""
         if not self.headers:
             return
         t0 = time.monotonic()
@@ -107,6 +117,9 @@ class ProcessingJob(BackgroundProcedure):
         self.curvesforcmap = []
         self.fsnsforcmap = []
         self.curves = []
+        self._average2d = MatrixAverager(self.ierrorprop)
+        self._maskcount = None
+        self._averagedfsns = []
         self.sendProgress('Loading exposures {}/{}'.format(0, len(self.headers)),
                           total=len(self.headers), current=0)
         qrange = self.qrange
@@ -126,7 +139,13 @@ class ProcessingJob(BackgroundProcedure):
                     self.fsnsforcmap.append(h.fsn)
 
                 self.curves.append(radavg)
-                if self.bigmemorymode:
+                if self.singlepassmode:
+                    if self._maskcount is None:
+                        # allocated even if every exposure is bad, the shape of the mask is needed in _summarize()
+                        self._maskcount = np.zeros(ex.mask.shape, np.int32)
+                    if h.fsn not in self.badfsns:
+                        self._addexposuretoaverage(ex)
+                elif self.bigmemorymode:
                     self.exposures.append(ex)
                 self.sendProgress('Loading exposures {}/{}'.format(i, len(self.headers)),
                                   total=len(self.headers), current=i)
@@ -134,12 +153,26 @@ class ProcessingJob(BackgroundProcedure):
                 raise ProcessingError('Cannot find file: {}'.format(fnfe.args[0]))
         self.result.time_loadexposures = time.monotonic() - t0
 
+    def _addexposuretoaverage(self, ex: Exposure):
+        self._average2d.add(ex.intensity, ex.error)
+        self._maskcount += ex.mask != 0
+        self._averagedfsns.append(ex.header.fsn)
+
+    def _removeexposurefromaverage(self, ex: Exposure):
+        self._average2d.subtract(ex.intensity, ex.error)
+        self._maskcount -= ex.mask != 0
+        self._averagedfsns.remove(ex.header.fsn)
+
     def _checkforoutliers(self):
         t0 = time.monotonic()
         self.sendProgress('Testing for outliers...', total=0, current=0)
         intensities = np.vstack([c.Intensity for c in self.curvesforcmap]).T
         errors = np.vstack([c.Error for c in self.curvesforcmap]).T
-        cmat = correlmatrix_cython(intensities, errors, self.logcmat)
+        # pairwise sums of the previous run: only the rows and columns of the new (or changed) curves need to be
+        # calculated.
+        self.correlmatrixsums = self._loadcorrelmatrixsums()
+        cmat = self.correlmatrixsums.update(self.fsnsforcmap, self.curvesforcmap[0].q, intensities, errors)
+        self.result.correlmatrix_reused = self.correlmatrixsums.reused
         discrp = np.diagonal(cmat)
         # find outliers
         if self.outliermethod in ['Interquartile Range', 'Tukey_IQR', 'Tukey', 'IQR']:
@@ -154,6 +187,20 @@ class ProcessingJob(BackgroundProcedure):
         self.correlmatrix = cmat
         self.result.time_outlierdetection = time.monotonic() - t0
 
+    def _distgroupname(self) -> str:
+        return 'Samples/{}/{:.2f}'.format(self.headers[0].title, float(self.headers[0].distance))
+
+    def _loadcorrelmatrixsums(self) -> IncrementalCorrelMatrix:
+        """Load the pairwise correlation matrix sums saved by the previous processing of this sample and distance"""
+        with self.h5WriterLock:
+            try:
+                with h5py.File(self.h5file, mode='r') as h5:
+                    return IncrementalCorrelMatrix.load(
+                        h5.get(self._distgroupname() + '/correlmatrix_sums'), self.logcmat)
+            except OSError:
+                # the file does not exist or is not a valid HDF5 file.
+                return IncrementalCorrelMatrix(self.logcmat)
+
     def _summarize(self):
         """Calculate average scattering pattern and curve"""
 
@@ -219,23 +266,43 @@ class ProcessingJob(BackgroundProcedure):
         # summarize 2D and 1D datasets
         t1 = time.monotonic()
         self.sendProgress('Averaging exposures...', current=0, total=0)
-        maskavg = None
-        avg = MatrixAverager(self.ierrorprop)
-        for i, header in enumerate(self.headers):
-            self.sendProgress('Averaging exposures {}/{}...'.format(i, len(self.headers)),
-                              current=i, total=len(self.headers))
-            if header.fsn in self.badfsns:
-                continue
-            if self.exposures:
-                ex = self.exposures[i]
-            else:
-                ex = self._loader.loadExposure(header.fsn)
-            if maskavg is None:
-                maskavg = ex.mask.copy()
+        if self.singlepassmode:
+            # the good exposures have already been summed in _loadexposures(): only the outliers found since then need
+            # to be taken out.
+            avg = self._average2d
+            outlierfsns = [fsn for fsn in self._averagedfsns if fsn in self.badfsns]
+            for i, fsn in enumerate(outlierfsns):
+                self.sendProgress('Removing outlier exposures {}/{}...'.format(i, len(outlierfsns)),
+                                  current=i, total=len(outlierfsns))
+                self._removeexposurefromaverage(self._loader.loadExposure(fsn))
+            if avg.count > 0:
+                maskavg = self._maskcount == avg.count
             else:
-                maskavg = np.logical_and(ex.mask != 0, maskavg != 0)
-            avg.add(ex.intensity, ex.error)
-        avgintensity, avgerr = avg.get()
+                # no exposure left in the average: every pixel is masked
+                maskavg = np.zeros(self._maskcount.shape, np.bool_)
+        else:
+            maskavg = None
+            avg = MatrixAverager(self.ierrorprop)
+            for i, header in enumerate(self.headers):
+                self.sendProgress('Averaging exposures {}/{}...'.format(i, len(self.headers)),
+                                  current=i, total=len(self.headers))
+                if header.fsn in self.badfsns:
+                    continue
+                if self.exposures:
+                    ex = self.exposures[i]
+                else:
+                    ex = self._loader.loadExposure(header.fsn)
+                if maskavg is None:
+                    maskavg = ex.mask.copy()
+                else:
+                    maskavg = np.logical_and(ex.mask != 0, maskavg != 0)
+                avg.add(ex.intensity, ex.error)
+        if avg.count > 0:
+            avgintensity, avgerr = avg.get()
+        elif maskavg is not None:
+            avgintensity, avgerr = np.full(maskavg.shape, np.nan), np.full(maskavg.shape, np.nan)
+        else:
+            raise ProcessingError('No exposures to average: all of them are bad.')
         self.averaged2D = Exposure(avgintensity, avgerr, avgheader, maskavg)
         self.result.time_averaging_exposures = time.monotonic() - t1
 
@@ -243,13 +310,9 @@ class ProcessingJob(BackgroundProcedure):
         self.sendProgress('Averaging curves...', total=0, current=0)
         avgq = MatrixAverager(self.qerrorprop)
         avgi = MatrixAverager(self.ierrorprop)
-        for h, c, i in zip(self.headers, self.curves, range(len(self.headers))):
-            self.sendProgress('Averaging curves {}/{}...'.format(i, len(self.headers)), total=len(self.headers),
-                              current=i)
-            if h.fsn in self.badfsns:
-                continue
-            avgq.add(c.q, c.qError)
-            avgi.add(c.Intensity, c.Error)
+        goodcurves = [c for h, c in zip(self.headers, self.curves) if h.fsn not in self.badfsns]
+        avgq.add_batch((c.q for c in goodcurves), (c.qError for c in goodcurves))
+        avgi.add_batch((c.Intensity for c in goodcurves), (c.Error for c in goodcurves))
         qavg, qErravg = avgq.get()
         Iavg, Erravg = avgi.get()
         self.averaged1D = Curve(qavg, Iavg, Erravg, qErravg)
@@ -296,6 +359,7 @@ class ProcessingJob(BackgroundProcedure):
                 distgroup.create_dataset('image_uncertainty', data=self.averaged2D.error,
                                          compression=self.h5compression)
                 distgroup.create_dataset('correlmatrix', data=self.correlmatrix, compression=self.h5compression)
+                self.correlmatrixsums.save(distgroup.create_group('correlmatrix_sums'), self.h5compression)
                 distgroup.create_dataset('mask', data=self.averaged2D.mask, compression=self.h5compression)
                 distgroup['badfsns'] = np.array(self.badfsns)
                 distgroup.create_dataset('curve_averaged', data=np.vstack(
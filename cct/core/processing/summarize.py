@@ -11,6 +11,7 @@ from sastool.misc.errorvalue import ErrorValue
 from scipy.io import loadmat
 
 from .correlmatrix import correlmatrix_cython
+from .fileindex import FileIndex
 
 
 def zscore(data:np.ndarray) -> np.ndarray:
@@ -121,28 +122,30 @@ class Summarizer(object):
         self.corrmatoutliermethod=corrmatoutliermethod
         self._headers = []
         self._masks = {}
+        self._paramindex = None
+        self._expindex = None
+
+    def _filename(self, fsn: int, extn: str) -> str:
+        return '{{}}_{{:0{:d}d}}{}'.format(self.ndigits, extn).format(self.prefix, fsn)
 
     def load_headers(self, yield_messages=False, logger=None):
         self._headers = []
+        # a single scan of the directories instead of trying to open each file in each directory
+        self._paramindex = FileIndex(self.parampath)
+        headerclasses = [('.pickle', credo_cct.Header),
+                         ('.pickle.gz',credo_cct.Header),
+                         ('.param',credo_saxsctrl.Header),
+                         ('.param.gz',credo_saxsctrl.Header)]
         for f in self.fsns:
-            for p in self.parampath:
-                for extn, cls in [('.pickle', credo_cct.Header),
-                                  ('.pickle.gz',credo_cct.Header),
-                                  ('.param',credo_saxsctrl.Header),
-                                  ('.param.gz',credo_saxsctrl.Header)]:
-                    try:
-                        self._headers.append(cls.new_from_file(
-                            os.path.join(
-                                p,
-                                '{{}}_{{:0{:d}d}}{}'.format(self.ndigits, extn).format(self.prefix, f))
-                        ))
-                        if yield_messages:
-                            if logger is not None:
-                                logger.debug('Header loaded for prefix {}, fsn {}'.format(self.prefix, f))
-                            yield '__header_loaded__', f
-                        break
-                    except FileNotFoundError:
-                        pass
+            candidates = {self._filename(f, extn): cls for extn, cls in headerclasses}
+            # the first directory in parampath wins, then the first extension in it
+            path = self._paramindex.findFirst(list(candidates))
+            if path is not None:
+                self._headers.append(candidates[os.path.basename(path)].new_from_file(path))
+                if yield_messages:
+                    if logger is not None:
+                        logger.debug('Header loaded for prefix {}, fsn {}'.format(self.prefix, f))
+                    yield '__header_loaded__', f
             else:
                 if logger is not None:
                     logger.error('No header found for prefix {}, fsn {}.'.format(self.prefix, f))
@@ -173,18 +176,12 @@ class Summarizer(object):
     def load_exposure(self, fsn: int, logger=None) -> Exposure:
         header = [h for h in self._headers if h.fsn == fsn][0]
         mask = self.get_mask(header.maskname, logger=logger)
-        for p in self.exppath:
-            try:
-                ex = credo_cct.Exposure.new_from_file(
-                    os.path.join(
-                        p,
-                        '{{}}_{{:0{:d}d}}.npz'.format(self.ndigits).format(self.prefix, fsn)),
-                    header, mask
-                )
-                return ex
-            except FileNotFoundError:
-                continue
-        raise FileNotFoundError(fsn)
+        if self._expindex is None:
+            self._expindex = FileIndex(self.exppath)
+        path = self._expindex.find(self._filename(fsn, '.npz'))
+        if path is None:
+            raise FileNotFoundError(fsn)
+        return credo_cct.Exposure.new_from_file(path, header, mask)
 
     def allsamplenames(self) -> List[str]:
         if self.samplenamelist is None:
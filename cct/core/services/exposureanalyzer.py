@@ -1,3 +1,4 @@
+import collections
 import logging
 import multiprocessing
 import multiprocessing.queues
@@ -7,7 +8,7 @@ import queue
 import time
 import traceback
 from logging.handlers import QueueHandler
-from typing import Union, Dict, Optional
+from typing import Union, Dict, Optional, Sequence, Tuple
 
 import numpy as np
 from sastool.io.credo_cct import Exposure, Header
@@ -19,9 +20,11 @@ from scipy.io import loadmat
 from .service import Service, ServiceError
 from ..devices.device.message import Message
 from ..utils.callback import SignalFlags
-from ..utils.geometrycorrections import solidangle, angledependentabsorption, angledependentairtransmission
+from ..utils.configtools import apply_config_patch
+from ..utils.geometrycorrections import GeometryCache
 from ..utils.io import write_legacy_paramfile
 from ..utils.pathutils import find_in_subfolders
+from ..utils.sharedarrays import SharedArrayRing, SharedArrayReader, SharedArrayDescriptor
 from ..utils.telemetry import TelemetryInfo
 from ..utils.timeout import IdleFunction
 
@@ -69,6 +72,22 @@ def get_statistics(matrix: np.ndarray, masktotal: Union[np.ndarray, int, None],
     return result
 
 
+def updates_context(param: Optional[Dict], config: Dict) -> bool:
+    """Check if the data reduction of an exposure updates the data reduction
+    context (dark background level, empty beam or absolute intensity
+    reference), i.e. the subsequent exposures depend on it.
+
+    If the sample title cannot be determined, True is returned to be on the
+    safe side."""
+    try:
+        title = Header(param).title
+    except (KeyError, TypeError, AttributeError):
+        return True
+    return title in [config['datareduction']['darkbackgroundname'],
+                     config['datareduction']['backgroundname'],
+                     config['datareduction']['absintrefname']]
+
+
 # noinspection PyPep8Naming
 class ExposureAnalyzer_Backend(object):
     """Background worker process of exposureanalyzer.
@@ -83,14 +102,35 @@ class ExposureAnalyzer_Backend(object):
         'filename': the filename
         'fsn': the file sequence number
         'param': the parameter dictionary
+        'jobid': the job identifier, which is sent back with each message
+            concerning this exposure
     'exit': finish working and exit.
     'config': a config dictionary is sent in the 'configdict' field.
+    'config_patch': the changes of the config dictionary are sent in the
+        'patch' field (see `configtools`).
+    'release_sharedmemory': the frontend does not need the shared memory
+        slots listed in the 'slots' field anymore.
+    'context': replace the data reduction context named in the 'context'
+        field with the dictionary in the 'contextdict' field.
+
+    Several instances of this class can work in parallel. After processing
+    an exposure which updates the data reduction context (see
+    `updates_context()`), the new context is sent to the frontend in a
+    'context' message, to be distributed to the other workers.
+
+    If shared memory slots are enabled (`nslots` > 0), large arrays are not
+    pickled through the queue, but written into a ring of shared memory
+    segments and only a `SharedArrayDescriptor` is sent in the 'shared' field
+    of the message. If all slots are in use, the arrays are sent in the
+    message as usual.
     """
     name = 'exposureanalyzer_backend'
 
     telemetry_interval = 1
 
-    def __init__(self, loglevel, config, inqueue, outqueue):
+    def __init__(self, loglevel, config, inqueue, outqueue, nslots: int = 0, workerid: int = 0):
+        self.name = '{}_{:d}'.format(self.__class__.name, workerid)
+        self.workerid = workerid
         self._logger = logging.getLogger(__name__ + '::' + self.name + '__backgroundprocess')
         self._logger.propagate = False
         self.inqueue = inqueue
@@ -104,7 +144,10 @@ class ExposureAnalyzer_Backend(object):
             self._logger.setLevel(loglevel)
         self.masks = {}
         self._context = {}
+        self._geometrycache = GeometryCache()
         self._lasttelemetry = 0
+        self._jobid = None
+        self._sharedarrays = SharedArrayRing(nslots) if nslots > 0 else None
 
     def new_context(self, context:Optional[str] = None):
         self._context[context]={'lastdarkbackground':None,
@@ -122,12 +165,25 @@ class ExposureAnalyzer_Backend(object):
 
     def send_to_frontend(self, type_: str, **kwargs):
         self._msgid += 1
-        self.outqueue.put_nowait(Message(type_, self._msgid, self.name, **kwargs))
+        kwargs.setdefault('jobid', self._jobid)
+        self.outqueue.put_nowait(Message(type_, self._msgid, self.name, worker=self.workerid, **kwargs))
+
+    def share_arrays(self, **arrays) -> Optional[SharedArrayDescriptor]:
+        """Write arrays into a free shared memory slot. Returns None if the
+        arrays must be sent through the queue."""
+        if self._sharedarrays is None:
+            return None
+        try:
+            return self._sharedarrays.store(arrays)
+        except OSError as exc:
+            self._logger.warning('Cannot write to shared memory: {}'.format(exc))
+            return None
 
     def worker(self):
         try:
             while True:
                 assert isinstance(self.inqueue, multiprocessing.queues.Queue)
+                self._jobid = None
                 if (time.monotonic() - self._lasttelemetry) > self.telemetry_interval:
                     # forge a telemetry request message.
                     message = Message('telemetry', 0, self.name)
@@ -141,11 +197,19 @@ class ExposureAnalyzer_Backend(object):
                     break  # the while True loop
                 elif message['type'] == 'invalidate_mask_cache':
                     self.masks={}
+                elif message['type'] == 'release_sharedmemory':
+                    for slot in message['slots']:
+                        self._sharedarrays.release(slot)
                 elif message['type'] == 'config':
                     self.config = message['configdict']
+                elif message['type'] == 'config_patch':
+                    apply_config_patch(self.config, message['patch'])
+                elif message['type'] == 'context':
+                    self._context[message['context']] = message['contextdict']
                 elif message['type'] == 'telemetry':
                     self.send_to_frontend('telemetry', telemetry=self.get_telemetry())
                 elif message['type'] == 'analyze':
+                    self._jobid = message['jobid'] if 'jobid' in message else None
                     self._logger.debug(
                         'Got work: prefix = {}, fsn = {}, filename = {}'.format(message['prefix'], message['fsn'],
                                                                                 message['filename']))
@@ -221,15 +285,29 @@ class ExposureAnalyzer_Backend(object):
                             assert isinstance(mask, np.ndarray)
                             im = self.datareduction(cbfdata, mask, message['param'], context)
                             self.savecorrected(message['prefix'], message['fsn'], im)
-                            self.send_to_frontend('datareduction-done', prefix=message['prefix'], fsn=message['fsn'],
-                                                  image=im)
-                            self.send_to_frontend('image', prefix=message['prefix'], fsn=message['fsn'],
-                                                  data=cbfdata, mask=mask, param=message['param'])
+                            shared = self.share_arrays(intensity=im.intensity, error=im.error,
+                                                       exposuremask=im.mask, data=cbfdata, mask=mask)
+                            if shared is None:
+                                self.send_to_frontend('datareduction-done', prefix=message['prefix'],
+                                                      fsn=message['fsn'], image=im)
+                                self.send_to_frontend('image', prefix=message['prefix'], fsn=message['fsn'],
+                                                      data=cbfdata, mask=mask, param=message['param'])
+                            else:
+                                # the image data is in shared memory, only send the header.
+                                self.send_to_frontend('datareduction-done', prefix=message['prefix'],
+                                                      fsn=message['fsn'], image=None, header=im.header,
+                                                      shared=shared)
+                                self.send_to_frontend('image', prefix=message['prefix'], fsn=message['fsn'],
+                                                      data=None, mask=None, param=message['param'], shared=shared)
                         except Exception as exc:
                             self.send_to_frontend('error', prefix=message['prefix'], fsn=message['fsn'],
                                                   exception=exc, traceback=traceback.format_exc())
                             self._logger.error(
                                 'Error in data reduction: {}, {}'.format(str(exc), traceback.format_exc()))
+                        if updates_context(message['param'], self.config) and (context in self._context):
+                            # this must precede the 'done' message: the frontend holds back the subsequent
+                            # exposures until it has forwarded the new context to the other workers.
+                            self.send_to_frontend('context', context=context, contextdict=self._context[context])
                         self.send_to_frontend('done', prefix=message['prefix'], fsn=message['fsn'])
                     elif message['prefix'] == self.config['path']['prefixes']['tra']:  # transmission measurement
                         self._logger.debug('This is a transmission measurement.')
@@ -267,8 +345,8 @@ class ExposureAnalyzer_Backend(object):
                         resultlist = tuple([message['position']] + [stat[k]
                                                                     for k in self.config['scan']['columns']])
                         self._logger.debug('Sending the image')
-                        self.send_to_frontend('image', prefix=message['prefix'], fsn=message['fsn'],
-                                              param=message['param'], mask=scanmasktotal, data=cbfdata)
+                        self.send_image_to_frontend(message['prefix'], message['fsn'], message['param'],
+                                                    cbfdata, scanmasktotal)
                         self._logger.debug('Sending the scanpoint')
                         self.send_to_frontend('scanpoint', prefix=message['prefix'], fsn=message['fsn'],
                                               counters=resultlist, position=message['position'])
@@ -287,13 +365,23 @@ class ExposureAnalyzer_Backend(object):
                             self.send_to_frontend('error', prefix=message['prefix'], fsn=message['fsn'], exception=exc,
                                                   traceback=traceback.format_exc())
                         else:
-                            self.send_to_frontend('image', prefix=message['prefix'], fsn=message['fsn'], data=cbfdata,
-                                                  mask=mask, param=message['param'])
+                            self.send_image_to_frontend(message['prefix'], message['fsn'], message['param'],
+                                                        cbfdata, mask)
                         self.send_to_frontend('done', prefix=message['prefix'], fsn=message['fsn'])
         except Exception as exc:
             self.send_to_frontend('error', prefix='', fsn=0, exception=exc, traceback=traceback.format_exc())
+        finally:
+            if self._sharedarrays is not None:
+                self._sharedarrays.close()
         self.send_to_frontend('exited', prefix=None, fsn=None)
 
+    def send_image_to_frontend(self, prefix: str, fsn: int, param: Dict, data: np.ndarray, mask: np.ndarray):
+        shared = self.share_arrays(data=data, mask=mask)
+        if shared is None:
+            self.send_to_frontend('image', prefix=prefix, fsn=fsn, data=data, mask=mask, param=param)
+        else:
+            self.send_to_frontend('image', prefix=prefix, fsn=fsn, data=None, mask=None, param=param, shared=shared)
+
     def get_mask(self, maskname: str) -> np.ndarray:
         self._logger.debug('Getting mask: {}'.format(maskname))
         try:
@@ -369,36 +457,40 @@ class ExposureAnalyzer_Backend(object):
         return im, datared
 
     def correctgeometry(self, im: Exposure, datared: Dict, context:Optional[str]=None):
-        tth = im.twotheta
-        assert isinstance(tth, ErrorValue)
-        datared['tthval_statistics'] = self.get_matrix_statistics(tth.val)
-        datared['ttherr_statistics'] = self.get_matrix_statistics(tth.err)
         assert im.header.pixelsizex == im.header.pixelsizey
-        corr_sa = solidangle(tth.val, tth.err, im.header.distance.val,
-                             im.header.distance.err, im.header.pixelsizex)
-        im *= corr_sa
+        # the two-theta matrix and the solid angle correction only depend on the geometry, which seldom changes.
+        geometry = self._geometrycache.get(im)
+        assert isinstance(geometry.twotheta, ErrorValue)
+        if not geometry.statistics:
+            geometry.statistics.update({
+                'tthval_statistics': self.get_matrix_statistics(geometry.twotheta.val),
+                'ttherr_statistics': self.get_matrix_statistics(geometry.twotheta.err),
+                'solidangle_matrixval_statistics': self.get_matrix_statistics(geometry.solidangle.val),
+                'solidangle_matrixerr_statistics': self.get_matrix_statistics(geometry.solidangle.err),
+            })
+        for key in ['tthval_statistics', 'ttherr_statistics']:
+            datared[key] = geometry.statistics[key].copy()
+        im *= geometry.solidangle
         datared['history'].append('Corrected for solid angle')
-        datared['solidangle_matrixval_statistics'] = self.get_matrix_statistics(corr_sa.val)
-        datared['solidangle_matrixerr_statistics'] = self.get_matrix_statistics(corr_sa.err)
-        corr_ada = angledependentabsorption(tth.val, tth.err, im.header.transmission.val,
-                                            im.header.transmission.err)
+        for key in ['solidangle_matrixval_statistics', 'solidangle_matrixerr_statistics']:
+            datared[key] = geometry.statistics[key].copy()
+        try:
+            vacuum = im.header.vacuum
+        except KeyError:
+            vacuum = None
+        corr_ada, corr_adat = geometry.corrections(im.header.transmission, vacuum,
+                                                   self.config['datareduction']['mu_air'],
+                                                   self.config['datareduction']['mu_air.err'])
         im *= corr_ada
         datared['angledependentabsorption_matrixval_statistics'] = self.get_matrix_statistics(
             corr_ada.val)
         datared['angledependentabsorption_matrixerr_statistics'] = self.get_matrix_statistics(
             corr_ada.err)
         datared['history'].append('Corrected for angle-dependent absorption')
-        try:
-            vacuum = im.header.vacuum
-        except KeyError:
+        if corr_adat is None:
             datared['history'].append(
                 'Skipped angle-dependent air absorption correction: no pressure value.')
         else:
-            corr_adat = angledependentairtransmission(tth.val, tth.err, vacuum,
-                                                      im.header.distance.val,
-                                                      im.header.distance.err,
-                                                      self.config['datareduction']['mu_air'],
-                                                      self.config['datareduction']['mu_air.err'])
             im *= corr_adat
             datared[
                 'angledependentairtransmission_matrixval_statistics'] = self.get_matrix_statistics(corr_adat.val)
@@ -544,6 +636,28 @@ class ExposureAnalyzer(Service):
     crd: carry out the on-line data reduction on the image
     scn: calculate various statistics on the image and return a tuple of them,
         to be added to the scan dataset
+
+    The work is distributed among a pool of background processes, the size of
+    which is set by the 'reduction_workers' state variable. The data reduction
+    context (dark background, empty beam and absolute intensity reference) is
+    kept consistent with the order of submission: an exposure updating the
+    context is only started when all previously submitted exposures in the
+    same context are done, and the subsequent ones wait for it. The messages
+    from the workers are re-sequenced, therefore the signals are emitted in
+    the order of submission.
+
+    If a worker process dies unexpectedly (e.g. it is killed or crashes in
+    an extension module), the exposure it was working on is reported with
+    an 'error' signal and skipped, so that the later ones are not held back.
+    A new worker is started in its place, which gets the data reduction
+    contexts and the exposures waiting in the queue of the dead one.
+
+    Images are received from the backend through shared memory (see
+    `ExposureAnalyzer_Backend`): the arrays given to the 'image' and
+    'datareduction-done' signal handlers are views of a shared memory slot,
+    which is reused once the handlers have dropped all references to them.
+    The number of slots per worker is set by the 'sharedmemory_slots' state
+    variable (0 disables shared memory transport).
     """
     __signals__ = {
         # emitted on a failure. Arguments: prefix, fsn, exception, formatted
@@ -568,11 +682,15 @@ class ExposureAnalyzer(Service):
 
     name = 'exposureanalyzer'
 
+    state = {'sharedmemory_slots': 4, 'reduction_workers': 2}
+
     def __init__(self, *args, **kwargs):
         Service.__init__(self, *args, **kwargs)
-        self._queue_to_backend = multiprocessing.Queue()
+        nworkers = max(1, self.state['reduction_workers'])
+        self._queues_to_backend = [multiprocessing.Queue() for i in range(nworkers)]
         self._queue_to_frontend = multiprocessing.Queue()
-        self._backendprocess = None
+        # worker index -> process. The indices of dead workers are not reused.
+        self._backendprocesses = {}
         self._handler = None
         self._msgid = 0
         # A copy of the config hierarchy will be inherited by the back-end
@@ -580,88 +698,259 @@ class ExposureAnalyzer(Service):
         # since we are running in a different process
         self.config = self.instrument.config
         self._working = {}
+        self._sharedarrays = [SharedArrayReader() for i in range(nworkers)]
+        # submitted jobs, in the order of submission. Keys are the job IDs, values are dicts.
+        self._jobs = collections.OrderedDict()
+        self._nextjobid = 0
+        # number of dispatched but not yet finished jobs for each worker
+        self._workerload = [0] * nworkers
+        self._exitedworkers = set()
+        self._deadworkers = set()
+        self._stopping = False
+        # the latest data reduction contexts received from the workers, for the replacements of dead workers
+        self._contexts = {}
 
     def start(self):
         super().start()
         self._handler = IdleFunction(self._idle_function)
-        self._backendprocess = multiprocessing.Process(
+        self._exitedworkers = set()
+        self._stopping = False
+        for worker in self._live_workers():
+            self._start_worker(worker)
+
+    def _start_worker(self, worker: int):
+        process = multiprocessing.Process(
             target=ExposureAnalyzer_Backend.create_and_run,
-            args=(logger.level, self.config, self._queue_to_backend,
-                  self._queue_to_frontend))
-        self._backendprocess.daemon = False
-        self._backendprocess.start()
+            args=(logger.level, self.config, self._queues_to_backend[worker],
+                  self._queue_to_frontend, self.state['sharedmemory_slots'], worker))
+        process.daemon = False
+        process.start()
+        self._backendprocesses[worker] = process
+
+    def _live_workers(self):
+        return [w for w in range(len(self._queues_to_backend)) if w not in self._deadworkers]
+
+    def _check_workers(self):
+        """Look for worker processes which died without being asked to."""
+        for worker, process in list(self._backendprocesses.items()):
+            if process.is_alive():
+                continue
+            if self._stopping:
+                # do not wait for its 'exited' message forever
+                self._handle_message(Message('exited', 0, 'exposureanalyzer_frontend', worker=worker, prefix=None,
+                                             fsn=None))
+            elif worker not in self._deadworkers:
+                self._replace_worker(worker, process.exitcode)
+
+    def _replace_worker(self, worker: int, exitcode: Optional[int]):
+        """Report the unfinished jobs of a dead worker as failed and start a new worker."""
+        logger.error('Exposure analyzer worker #{:d} died unexpectedly (exit code {}), starting a new one.'.format(
+            worker, exitcode))
+        del self._backendprocesses[worker]
+        self._deadworkers.add(worker)
+        self._workerload[worker] = 0
+        # The messages already received from the dead worker refer to its own shared memory reader, thus the new
+        # worker gets a new index.
+        newworker = len(self._queues_to_backend)
+        self._queues_to_backend.append(multiprocessing.Queue())
+        self._sharedarrays.append(SharedArrayReader())
+        self._workerload.append(0)
+        self._start_worker(newworker)
+        for context, contextdict in self._contexts.items():
+            self.send_to_backend('context', newworker, context=context, contextdict=contextdict)
+        culprit = True
+        for jobid, job in self._jobs.items():
+            if (job['worker'] != worker) or job['done']:
+                continue
+            if not culprit:
+                # The worker takes the jobs in the order of submission, thus the later ones have not been started yet.
+                job['worker'] = None
+                continue
+            # Not re-submitted: the exposure may well be the reason of the crash.
+            culprit = False
+            exc = ServiceError('Exposure analyzer worker #{:d} died while processing this exposure '
+                               '(exit code {}).'.format(worker, exitcode))
+            for msgtype, kwargs in [('error', {'exception': exc, 'traceback': ''}), ('done', {})]:
+                self._msgid += 1
+                job['messages'].append(Message(msgtype, self._msgid, 'exposureanalyzer_frontend', worker=worker,
+                                               jobid=jobid, prefix=job['kwargs']['prefix'],
+                                               fsn=job['kwargs']['fsn'], **kwargs))
+            job['done'] = True
+        self._dispatch()
+        self._emit_finished_jobs()
+
+    def _emit_finished_jobs(self):
+        """Handle the held back messages of the finished jobs at the head of the submission order."""
+        while self._jobs:
+            jobid, job = next(iter(self._jobs.items()))
+            if not job['done']:
+                break
+            del self._jobs[jobid]
+            for msg in job['messages']:
+                self._handle_message(msg)
 
     def is_busy(self):
         return sum(self._working.values()) > 0
 
     def _idle_function(self):
         try:
+            for worker, reader in enumerate(self._sharedarrays):
+                released = reader.collect()
+                if released and (worker in self._backendprocesses):
+                    self.send_to_backend('release_sharedmemory', worker, slots=released)
             try:
-                njobs_before = sum(self._working.values())
                 message = self._queue_to_frontend.get_nowait()
-                assert isinstance(message, Message)
-                if message['type'] in ['done']:
-                    assert message['prefix'] in self._working
-                    self._working[message['prefix']] -= 1
-                    if self._working[message['prefix']] < 0:
-                        raise ServiceError(
-                            'Working[{}]=={:d} less than zero!'.format(
-                                message['prefix'], self._working[message['prefix']]))
-                njobs = sum(self._working.values())
-                if njobs:
-                    logger.debug('Exposureanalyzer working on {:d} jobs'.format(njobs))
-                elif njobs_before:
-                    self.emit('idle-changed', True)
             except queue.Empty:
+                # all the messages of a dead worker have been received by now.
+                self._check_workers()
                 return True
-            if message['type'] == 'error':
-                logger.error('Error in exposureanalyzer while treating exposure (prefix {}, fsn {:d}): {} {}'.format(
-                    message['prefix'], message['fsn'], message['exception'], message['traceback']))
-                self.emit(
-                    'error', message['prefix'], message['fsn'], message['exception'], message['traceback'])
-            elif message['type'] == 'scanpoint':
-                logger.debug('New scan point at motor position {:f}'.format(message['position']))
-                self.emit('scanpoint', message['prefix'], message['fsn'], message['position'], message['counters'])
-            elif message['type'] == 'datareduction-done':
-                logger.debug('Emitting datareduction-done message')
-                self.emit('datareduction-done', message['prefix'], message['fsn'], message['image'])
-            elif message['type'] == 'transmdata':
-                logger.debug(
-                    'transmission data for sample {} ({}): {}'.format(message['sample'], message['what'],
-                                                                      message['data']))
-                self.emit('transmdata', message['prefix'], message['fsn'], message['sample'], message['what'],
-                          message['data'])
-            elif message['type'] == 'image':
-                logger.debug(
-                    'New image received from exposureanalyzer backend: fsn: {}, prefix: {}'.format(message['fsn'],
-                                                                                                   message[
-                                                                                                       'prefix']))
-                self.emit('image', message['prefix'], message['fsn'], message['data'], message['param'],
-                          message['mask'])
-            elif message['type'] == 'telemetry':
-                self.emit('telemetry', message['telemetry'])
-            elif message['type'] == 'log':
-                logger.handle(message['logrecord'])
-            elif message['type'] == 'exited':
-                self.emit('shutdown')
+            assert isinstance(message, Message)
+            if message['type'] == 'context':
+                # distribute the updated data reduction context to the other workers. This happens before the
+                # subsequent jobs are dispatched, since the 'done' message of this job comes after this one.
+                self._contexts[message['context']] = message['contextdict']
+                for worker in self._live_workers():
+                    if worker != message['worker']:
+                        self.send_to_backend('context', worker, context=message['context'],
+                                             contextdict=message['contextdict'])
+            elif (message['type'] in ['telemetry', 'log', 'exited']) or (message['jobid'] not in self._jobs):
+                self._handle_message(message)
+            else:
+                # hold back the message until all the previously submitted jobs are done.
+                job = self._jobs[message['jobid']]
+                job['messages'].append(message)
+                if message['type'] == 'done':
+                    job['done'] = True
+                    self._workerload[job['worker']] -= 1
+                    self._dispatch()
+                    self._emit_finished_jobs()
         except Exception as exc:
             logger.error('Error in the idle function for exposureanalyzer: {} {}'.format(
                 exc, traceback.format_exc()))
         return True
 
-    def submit(self, fsn, filename, prefix, **kwargs):
+    def _handle_message(self, message: Message):
+        if message['type'] == 'done':
+            njobs_before = sum(self._working.values())
+            self._sharedarrays[message['worker']].finish((message['prefix'], message['fsn']))
+            assert message['prefix'] in self._working
+            self._working[message['prefix']] -= 1
+            if self._working[message['prefix']] < 0:
+                raise ServiceError(
+                    'Working[{}]=={:d} less than zero!'.format(
+                        message['prefix'], self._working[message['prefix']]))
+            njobs = sum(self._working.values())
+            if njobs:
+                logger.debug('Exposureanalyzer working on {:d} jobs'.format(njobs))
+            elif njobs_before:
+                self.emit('idle-changed', True)
+        elif message['type'] == 'error':
+            logger.error('Error in exposureanalyzer while treating exposure (prefix {}, fsn {:d}): {} {}'.format(
+                message['prefix'], message['fsn'], message['exception'], message['traceback']))
+            self.emit(
+                'error', message['prefix'], message['fsn'], message['exception'], message['traceback'])
+        elif message['type'] == 'scanpoint':
+            logger.debug('New scan point at motor position {:f}'.format(message['position']))
+            self.emit('scanpoint', message['prefix'], message['fsn'], message['position'], message['counters'])
+        elif message['type'] == 'datareduction-done':
+            logger.debug('Emitting datareduction-done message')
+            if 'shared' in message:
+                arrays = self._sharedarrays[message['worker']].arrays(
+                    message['shared'], (message['prefix'], message['fsn']))
+                image = Exposure(arrays['intensity'], arrays['error'], message['header'], arrays['exposuremask'])
+                del arrays
+            else:
+                image = message['image']
+            self.emit('datareduction-done', message['prefix'], message['fsn'], image)
+        elif message['type'] == 'transmdata':
+            logger.debug(
+                'transmission data for sample {} ({}): {}'.format(message['sample'], message['what'],
+                                                                  message['data']))
+            self.emit('transmdata', message['prefix'], message['fsn'], message['sample'], message['what'],
+                      message['data'])
+        elif message['type'] == 'image':
+            logger.debug(
+                'New image received from exposureanalyzer backend: fsn: {}, prefix: {}'.format(message['fsn'],
+                                                                                               message[
+                                                                                                   'prefix']))
+            if 'shared' in message:
+                arrays = self._sharedarrays[message['worker']].arrays(
+                    message['shared'], (message['prefix'], message['fsn']))
+                data, mask = arrays['data'], arrays['mask']
+                del arrays
+            else:
+                data, mask = message['data'], message['mask']
+            self.emit('image', message['prefix'], message['fsn'], data, message['param'], mask)
+        elif message['type'] == 'telemetry':
+            self.emit('telemetry', message['telemetry'])
+        elif message['type'] == 'log':
+            logger.handle(message['logrecord'])
+        elif message['type'] == 'exited':
+            if message['worker'] in self._exitedworkers:
+                return
+            self._exitedworkers.add(message['worker'])
+            if self._stopping and self._exitedworkers.issuperset(self._live_workers()):
+                self.emit('shutdown')
+
+    def _dispatch(self):
+        """Send the submitted jobs to the workers, as far as the data reduction
+        context allows it."""
+        unfinished = []  # (context, updates context) for unfinished crd jobs submitted before the current one
+        for jobid, job in self._jobs.items():
+            if job['worker'] is None:
+                if job['crd'] and any(ctx == job['context'] and (job['updatescontext'] or updating)
+                                      for ctx, updating in unfinished):
+                    # An exposure updating the context must wait for every previously submitted exposure in the
+                    # same context, the others only for the previous exposures updating the context.
+                    pass
+                else:
+                    worker = min(self._live_workers(), key=lambda w: self._workerload[w])
+                    job['worker'] = worker
+                    self._workerload[worker] += 1
+                    self.send_to_backend('analyze', worker, jobid=jobid, **job['kwargs'])
+            if job['crd'] and not job['done']:
+                unfinished.append((job['context'], job['updatescontext']))
+
+    def _add_job(self, fsn, filename, prefix, kwargs):
         logger.debug(
             'Submitting work to exposureanalyzer. Prefix: {}, fsn: {:d}. Filename: {}'.format(prefix, fsn, filename))
+        crd = (prefix == self.config['path']['prefixes']['crd'])
+        self._jobs[self._nextjobid] = {
+            'kwargs': dict(prefix=prefix, fsn=fsn, filename=filename, **kwargs),
+            'crd': crd,
+            'context': kwargs.get('context', None),
+            'updatescontext': crd and updates_context(kwargs.get('param', None), self.config),
+            'worker': None,
+            'done': False,
+            'messages': []}
+        self._nextjobid += 1
+        if prefix not in self._working:
+            self._working[prefix] = 0
+        self._working[prefix] += 1
 
-        self.send_to_backend('analyze', prefix=prefix, fsn=fsn, filename=filename, **kwargs)
+    def submit(self, fsn, filename, prefix, **kwargs):
+        was_idle = not self.is_busy()
+        self._add_job(fsn, filename, prefix, kwargs)
+        self._dispatch()
         try:
             logger.debug('Mask of the last exposure sent to the backend: {}'.format(kwargs['param']['geometry']['mask']))
         except KeyError:
             logger.debug('Last exposure did not have a param.')
+        logger.debug('Exposureanalyzer currently working on {:d} jobs.'.format(sum(self._working.values())))
+        if was_idle:
+            self.emit('idle-changed', False)
+
+    def submit_many(self, jobs: Sequence[Tuple[int, str, str, Dict]]):
+        """Submit several exposures at once, e.g. the frames of a fly scan.
+
+        :param jobs: (fsn, filename, prefix, kwargs) tuples, `kwargs` being the keyword arguments of `submit()`.
+        """
+        if not jobs:
+            return
         was_idle = not self.is_busy()
-        if prefix not in self._working:
-            self._working[prefix] = 0
-        self._working[prefix] += 1
+        for fsn, filename, prefix, kwargs in jobs:
+            self._add_job(fsn, filename, prefix, kwargs)
+        self._dispatch()
         logger.debug('Exposureanalyzer currently working on {:d} jobs.'.format(sum(self._working.values())))
         if was_idle:
             self.emit('idle-changed', False)
@@ -669,15 +958,26 @@ class ExposureAnalyzer(Service):
     def update_config(self, dictionary):
         self.send_to_backend('config', configdict=dictionary)
 
+    def update_config_patch(self, patch):
+        self.send_to_backend('config_patch', patch=patch)
+
     def stop(self):
-        if self._backendprocess.is_alive():
+        self._stopping = True
+        if any(p.is_alive() for p in self._backendprocesses.values()):
             self.send_to_backend('exit')
         else:
             self.emit('shutdown')
 
-    def send_to_backend(self, msgtype, **kwargs):
-        self._msgid += 1
-        self._queue_to_backend.put_nowait(Message(msgtype, self._msgid, 'exposureanalyzer_frontend', **kwargs))
+    def send_to_backend(self, msgtype, worker: Optional[int] = None, **kwargs):
+        """Send a message to a worker process, or to all of the live ones if
+        `worker` is None."""
+        if worker is None:
+            queues = [self._queues_to_backend[w] for w in self._live_workers()]
+        else:
+            queues = [self._queues_to_backend[worker]]
+        for q in queues:
+            self._msgid += 1
+            q.put_nowait(Message(msgtype, self._msgid, 'exposureanalyzer_frontend', **kwargs))
 
     def do_scanpoint(self, prefix, fsn, position, counters):
         self.instrument.services['filesequence'].write_scandataline(position, counters)
@@ -687,8 +987,11 @@ class ExposureAnalyzer(Service):
         if self._handler is not None:
             self._handler.stop()
             self._handler = None
-        self._backendprocess.join()
-        self._backendprocess = None
+        for process in self._backendprocesses.values():
+            process.join()
+        self._backendprocesses = {}
+        for reader in self._sharedarrays:
+            reader.close()
         self.starttime = None
 
     def invalidate_mask_cache(self):
@@ -7,7 +7,7 @@ import os
 import pickle
 import re
 import time
-from typing import Optional, Dict, Sequence
+from typing import Optional, Dict, Sequence, Tuple
 
 import dateutil.parser
 import numpy as np
@@ -355,6 +355,30 @@ class FileSequence(Service):
         Keyword arguments can be given: they will be passed on to the submit()
         method of the exposureanalyzer service.
         """
+        filename = self._prepare_exposure(fsn, filename, prefix, startdate, kwargs)
+        self.instrument.services['exposureanalyzer'].submit(
+            fsn, filename, prefix, **kwargs)
+
+    def new_exposures(self, prefix: str, exposures: Sequence[Tuple[int, str, datetime.datetime, Dict]]):
+        """The same as new_exposure(), for several exposure files at once.
+
+        `exposures` is a sequence of (fsn, filename, startdate, kwargs)
+        tuples. They are submitted to the exposureanalyzer service in one
+        batch.
+        """
+        jobs = []
+        for fsn, filename, startdate, kwargs in exposures:
+            kwargs = dict(kwargs)
+            filename = self._prepare_exposure(fsn, filename, prefix, startdate, kwargs)
+            jobs.append((fsn, filename, prefix, kwargs))
+        self.instrument.services['exposureanalyzer'].submit_many(jobs)
+
+    def _prepare_exposure(self, fsn: int, filename: str, prefix: str, startdate: datetime.datetime,
+                          kwargs: Dict) -> str:
+        """Update the last FSN and write the header file of a new exposure.
+
+        The header is added to `kwargs` as 'param'. Returns the file name
+        relative to the images directory."""
         if (prefix not in self._lastfsn) or (fsn > self._lastfsn[prefix]):
             self._lastfsn[prefix] = fsn
             self.emit('lastfsn-changed', prefix, self._lastfsn[prefix])
@@ -380,8 +404,7 @@ class FileSequence(Service):
             logger.debug('Dumping pickle file ' + picklefilename)
             pickle.dump(params, f)
         kwargs['param'] = params
-        self.instrument.services['exposureanalyzer'].submit(
-            fsn, filename, prefix, **kwargs)
+        return filename
 
     def construct_params(self, prefix, fsn, startdate, simple=False):
         # construct the params dictionary
@@ -57,6 +57,10 @@ class Service(Callbacks):
     def update_config(self, dictionary):
         pass
 
+    def update_config_patch(self, patch):
+        """Called with the changes of the config dictionary (see `configtools`), which is already up to date."""
+        self.update_config(self.instrument.config)
+
     def is_busy(self) -> bool:
         """Return if the service is busy."""
         return False
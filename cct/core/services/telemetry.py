@@ -1,26 +1,49 @@
 import datetime
 import logging
+import math
 import os
 import time
+from typing import Dict, Optional, Sequence, Tuple
+
+import numpy as np
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
 from .service import Service, ServiceError
 from ..utils.callback import SignalFlags
+from ..utils.logwriter import BufferedLogWriter
 from ..utils.telemetry import TelemetryInfo
 from ..utils.timeout import TimeOut
+from ..utils.timeseries import TimeSeriesStore
 
 
 class TelemetryManager(Service):
     """A class for storing and saving telemetry information and
-    occasionally logging memory usage."""
+    occasionally logging memory usage.
+
+    The numeric fields of the incoming telemetry are also recorded in a time
+    series store (see `get_history()`), which is appended to binary files in
+    the 'telemetry' subdirectory of the log directory."""
 
     name = 'telemetrymanager'
 
     state = {'memlog_file_basename': 'memoryusage',
              'memlog_interval': 30.0,
-             'overall_telemetry_interval': 1.0}
+             'overall_telemetry_interval': 1.0,
+             'history_directory': 'telemetry',
+             'history_length': 3600,  # the number of the most recent records of each unit kept in full resolution
+             'history_flush_interval': 60.0,
+             'history_default_window': 86400.0,  # the time range returned by get_history() if no start is given
+             'history_max_file_size': 16 * 1024 * 1024,
+             'history_retention': 30 * 86400.0}  # history files older than this are deleted. None keeps them.
+
+    # (averaging interval in seconds, number of records) for the downsampled history
+    history_levels = ((10, 2160), (120, 2160))
+
+    # properties of TelemetryInfo recorded in the history besides the numeric attributes
+    history_properties = ('memusage', 'usertime', 'systemtime', 'pagefaultswithoutio', 'pagefaultswithio',
+                          'fsinput', 'fsoutput', 'voluntarycontextswitches', 'involuntarycontextswitches')
 
     __signals__ = {
         # emitted when telemetry information arrives from a unit. ARguments are
@@ -33,18 +56,28 @@ class TelemetryManager(Service):
         self.timestamps = {}
         self._memlog_timeout_handle = None
         self.memlog_file = None
+        self._memlog_writer = None
         self._last_overall_telemetry_emit = 0
+        self.history = None
         super().__init__(*args, **kwargs)
 
     def start(self):
         super().start()
         self.init_memlog_file()
+        self.history = TimeSeriesStore(
+            os.path.join(self.instrument.config['path']['directories']['log'], self.state['history_directory']),
+            capacity=self.state['history_length'], levels=self.history_levels,
+            flush_interval=self.state['history_flush_interval'],
+            default_window=self.state['history_default_window'],
+            max_file_size=self.state['history_max_file_size'], retention=self.state['history_retention'])
         self._memlog_timeout_handle = TimeOut(self.state['memlog_interval'] * 1000,
                                               self.write_memlog_line)
 
     def incoming_telemetry(self, label, telemetry: TelemetryInfo):
         self.telemetries[label] = telemetry
         self.timestamps[label] = time.monotonic()
+        if self.history is not None:
+            self.record_history(label, telemetry)
         self.emit('telemetry', label, telemetry)
         if (time.monotonic() - self._last_overall_telemetry_emit) > self.state['overall_telemetry_interval']:
             self.emit('telemetry', None, self.get_telemetry(None))
@@ -60,6 +93,41 @@ class TelemetryManager(Service):
         else:
             return self.telemetries[label]
 
+    def record_history(self, label: str, telemetry: TelemetryInfo):
+        values = {a: getattr(telemetry, a) for a in telemetry.attributes((int, float)) if a != 'timestamp'}
+        for p in self.history_properties:
+            try:
+                values[p] = getattr(telemetry, p)
+            except (AttributeError, AssertionError):
+                pass
+        self.history.record(label, time.time(), values)
+
+    def get_history(self, label: str, start: Optional[float] = None, end: float = math.inf,
+                    fields: Optional[Sequence[str]] = None,
+                    maxpoints: Optional[int] = 2000) -> Tuple[np.ndarray, Dict[str, np.ndarray]]:
+        """Get the history of the telemetry of a unit.
+
+        :param label: the name of the unit (device, service or 'main')
+        :param start: the first time stamp (seconds since the epoch). None means the 'history_default_window'
+            seconds before `end` (or before now). Use -math.inf to read all the history, also from the files.
+        :param end: the last time stamp (seconds since the epoch)
+        :param fields: the telemetry fields needed (e.g. ['memusage', 'sendqueuelen']). None means all.
+        :param maxpoints: average consecutive records if more are found. None means no limit.
+        :return: the time stamps and a dictionary of the fields. Missing values are NaNs.
+        """
+        if self.history is None:
+            raise ServiceError('Telemetry history is not recorded.')
+        try:
+            return self.history.get(label, start, end, fields, maxpoints)
+        except KeyError:
+            raise ServiceError('No telemetry history for unit {}.'.format(label))
+
+    def history_labels(self):
+        """The units having telemetry history in this session"""
+        if self.history is None:
+            return []
+        return self.history.labels()
+
     def init_memlog_file(self):
         memlogfiles = [f for f in os.listdir(self.instrument.config['path']['directories']['log']) if
                        f.rsplit('.', 1)[0] == self.state['memlog_file_basename']]
@@ -77,30 +145,30 @@ class TelemetryManager(Service):
             for s in sorted(self.instrument.services):
                 f.write('\t {} (MB)'.format(s))
             f.write('\n')
+        self._memlog_writer = BufferedLogWriter(self.memlog_file, flush_interval=self.state['memlog_interval'] * 10)
 
     def write_memlog_line(self):
-        with open(self.memlog_file, 'at', encoding='utf-8') as f:
+        try:
+            tm = self.telemetries['main']
+        except KeyError:
+            return True
+        memsizes = []
+        for d in sorted(self.instrument.devices):
             try:
-                tm = self.telemetries['main']
+                tm = self.telemetries[d]
+                assert isinstance(tm, TelemetryInfo)
+                memsizes.append(tm.memusage)
             except KeyError:
-                return True
-            memsizes = []
-            for d in sorted(self.instrument.devices):
-                try:
-                    tm = self.telemetries[d]
-                    assert isinstance(tm, TelemetryInfo)
-                    memsizes.append(tm.memusage)
-                except KeyError:
-                    memsizes.append(0)
-            for d in sorted(self.instrument.services):
-                try:
-                    tm = self.telemetries[d]
-                    assert isinstance(tm, TelemetryInfo)
-                    memsizes.append(tm.memusage)
-                except KeyError:
-                    memsizes.append(0)
-            data = [time.time(), time.monotonic() - self.starttime, sum(memsizes)] + memsizes
-            f.write('\t'.join(['{:.3f}'.format(d) for d in data]) + '\n')
+                memsizes.append(0)
+        for d in sorted(self.instrument.services):
+            try:
+                tm = self.telemetries[d]
+                assert isinstance(tm, TelemetryInfo)
+                memsizes.append(tm.memusage)
+            except KeyError:
+                memsizes.append(0)
+        data = [time.time(), time.monotonic() - self.starttime, sum(memsizes)] + memsizes
+        self._memlog_writer.write('\t'.join(['{:.3f}'.format(d) for d in data]) + '\n')
         return True
 
     def stop(self):
@@ -109,6 +177,11 @@ class TelemetryManager(Service):
             logger.debug('Stopping memlog timeout handle')
             self._memlog_timeout_handle.stop()
             self._memlog_timeout_handle = None
+        if self._memlog_writer is not None:
+            self._memlog_writer.close()
+            self._memlog_writer = None
+        if self.history is not None:
+            self.history.close()
         super().stop()
 
     def __getitem__(self, item):
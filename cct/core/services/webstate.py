@@ -1,9 +1,11 @@
 """Periodically create and update a state file viewable over a HTTP server"""
 import datetime
+import io
 import os
-import shutil
 import string
+import tempfile
 import time
+from typing import List, Set
 from xml.dom.minidom import parse
 
 import numpy as np
@@ -26,17 +28,50 @@ def get_svg_object_by_id(dom, idname):
 
 
 class WebStateFileWriter(Service):
+    """Write the status page.
+
+    The parts of the page (fragments) are cached and only those are regenerated whose inputs have changed since the
+    last time: the service listens to the signals of the devices and the services involved. The template, the
+    stylesheet and the SVG scheme are read once, and a file is only written (atomically) if its contents change.
+    """
     name = 'webstate'
 
     state = {'interval': 30}
 
+    # fragments regenerated every time: their contents change continuously
+    volatile_fragments = ('timestamp', 'uptime', 'devicehealth_tablecontents')
+
     def __init__(self, *args, **kwargs):
         self._timeouthandler = None
         self._statusfile_template = None
+        self._stylesheet = None
+        self._svg_dom = None
+        self._svg_objects = {}  # id -> list of SVG elements
+        self._fragments = {}  # name -> text
+        self._dirty = set()  # fragments to be regenerated. 'svg' stands for the SVG scheme.
+        self._device_connections = {}  # device name -> (device, list of connection IDs)
+        self._service_connections = []  # (service, connection ID) tuples
+        self._written = {}  # file name -> the contents last written
         super().__init__(*args, **kwargs)
 
     def start(self):
         super().start()
+        self._dirty = set(self.fragment_builders()) | {'svg'}
+        for servicename, signal, fragment in [('filesequence', 'nextfsn-changed', 'filesequence_data'),
+                                              ('filesequence', 'nextscan-changed', 'filesequence_data'),
+                                              ('filesequence', 'lastfsn-changed', 'filesequence_data'),
+                                              ('filesequence', 'lastscan-changed', 'filesequence_data'),
+                                              ('accounting', 'privlevel-changed', 'accounting_data'),
+                                              ('accounting', 'project-changed', 'accounting_data'),
+                                              ('accounting', 'user-changed', 'accounting_data'),
+                                              ('samplestore', 'active-changed', 'svg'),
+                                              ('samplestore', 'list-changed', 'svg')]:
+            try:
+                service = self.instrument.services[servicename]
+            except KeyError:
+                continue
+            self._service_connections.append(
+                (service, service.connect(signal, self.on_input_changed, {fragment})))
         if self.instrument.online:
             self._timeouthandler = TimeOut(self.state['interval'] * 1000, self.write_statusfile)
 
@@ -44,15 +79,99 @@ class WebStateFileWriter(Service):
         if self._timeouthandler is not None:
             self._timeouthandler.stop()
             self._timeouthandler = None
+        for service, connection in self._service_connections:
+            service.disconnect(connection)
+        self._service_connections = []
+        for devicename in list(self._device_connections):
+            self._unsubscribe_device(devicename)
         super().stop()
 
+    def fragment_builders(self):
+        """The fragments of the HTML template and the methods creating them"""
+        return {'devicehealth_tablecontents': self.create_devicehealth_data,
+                'motorpositions_tablecontents': self.create_motorstatus_data,
+                'xraysource_status': self.create_xraysource_status,
+                'detector_status': self.create_detector_status,
+                'filesequence_data': self.create_fsnlist_data,
+                'accounting_data': self.create_accountingdata,
+                }
+
+    def on_input_changed(self, sender, *args):
+        # the last argument is always the set of fragments affected, the preceding ones come from the signal.
+        self._dirty.update(args[-1])
+
+    def get_fragments_of_device(self, devicename: str) -> Set[str]:
+        """The fragments depending on the variables of a device"""
+        fragments = {'devicehealth_tablecontents'}
+        roles = {}
+        for role in ['xray_source', 'detector', 'vacuum', 'temperature']:
+            try:
+                roles[role] = self.instrument.get_device(role).name
+            except (KeyError, AttributeError):
+                pass
+        if devicename == roles.get('xray_source'):
+            fragments.update({'xraysource_status', 'svg'})
+        if devicename == roles.get('detector'):
+            fragments.update({'detector_status', 'svg'})
+        if devicename in {roles.get('vacuum'), roles.get('temperature'), 'tpg201', 'haakephoenix'}:
+            fragments.add('svg')
+        if any(mot.controller.name == devicename for mot in self.instrument.motors.values()):
+            fragments.update({'motorpositions_tablecontents', 'svg'})
+        return fragments
+
+    def _unsubscribe_device(self, devicename: str):
+        device, connections = self._device_connections.pop(devicename)
+        for c in connections:
+            try:
+                device.disconnect(c)
+            except ValueError:
+                pass
+
+    def update_device_subscriptions(self):
+        """Follow the variables of the devices. Devices may be added or replaced while running."""
+        for devicename in list(self._device_connections):
+            if self.instrument.devices.get(devicename) is not self._device_connections[devicename][0]:
+                self._unsubscribe_device(devicename)
+                self._dirty.update(self.get_fragments_of_device(devicename))
+        for devicename, device in self.instrument.devices.items():
+            if devicename in self._device_connections:
+                continue
+            fragments = self.get_fragments_of_device(devicename)
+            self._device_connections[devicename] = (
+                device, [device.connect(signal, self.on_input_changed, fragments)
+                         for signal in ['variable-change', 'disconnect', 'ready']])
+            self._dirty.update(fragments)
+
     def reload_statusfile_template(self):
-        # if not hasattr(self,'_statusfile_template'):
-        if True:
-            with open(pkg_resources.resource_filename(
-                    'cct', 'resource/cct_status/credo_status.html'),
-                    'rt', encoding='utf-8') as f:
-                self._statusfile_template = string.Template(f.read())
+        with open(pkg_resources.resource_filename(
+                'cct', 'resource/cct_status/credo_status.html'),
+                'rt', encoding='utf-8') as f:
+            self._statusfile_template = string.Template(f.read())
+        with open(pkg_resources.resource_filename('cct', 'resource/cct_status/credo_status.css'),
+                  'rt', encoding='utf-8') as f:
+            self._stylesheet = f.read()
+        self._svg_dom = parse(pkg_resources.resource_filename('cct', 'resource/cct_status/scheme_interactive.svg'))
+        self._svg_objects = {}
+        self._dirty.update(set(self.fragment_builders()) | {'svg'})
+
+    def write_file_if_changed(self, filename: str, contents: str) -> bool:
+        """Write a file in the status directory atomically, if its contents differ from those last written.
+
+        Returns True if the file has been written."""
+        filename = os.path.join(self.instrument.config['path']['directories']['status'], filename)
+        if (self._written.get(filename) == contents) and os.path.exists(filename):
+            return False
+        fd, tmpname = tempfile.mkstemp(dir=os.path.dirname(filename), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wt', encoding='utf-8') as f:
+                f.write(contents)
+            os.chmod(tmpname, 0o644)
+            os.replace(tmpname, filename)
+        except BaseException:
+            os.unlink(tmpname)
+            raise
+        self._written[filename] = contents
+        return True
 
     def create_devicehealth_data(self):
         # create contents of devicehealth table.
@@ -307,52 +426,65 @@ class WebStateFileWriter(Service):
         """This method writes a status file: a HTML file and other auxiliary
         files (e.g. images to include), which can be published over the net.
         """
-        self.reload_statusfile_template()
+        if self._statusfile_template is None:
+            self.reload_statusfile_template()
+        self.update_device_subscriptions()
         uptime = time.monotonic() - self.instrument.starttime
         uptime_hour = uptime // 3600
         uptime -= uptime_hour * 3600
         uptime_min = uptime // 60
         uptime_sec = uptime - uptime_min * 60
-        subs = {'timestamp': str(datetime.datetime.now()),
-                'uptime': '{:02.0f}:{:02.0f}:{:05.2f}'.format(uptime_hour, uptime_min, uptime_sec),
-                'devicehealth_tablecontents': self.create_devicehealth_data(),
-                'motorpositions_tablecontents': self.create_motorstatus_data(),
-                'xraysource_status': self.create_xraysource_status(),
-                'detector_status': self.create_detector_status(),
-                'filesequence_data': self.create_fsnlist_data(),
-                'accounting_data': self.create_accountingdata(),
-                }
-        shutil.copy2(pkg_resources.resource_filename('cct', 'resource/cct_status/credo_status.css'),
-                     os.path.join(self.instrument.config['path']['directories']['status'], 'credo_status.css'))
-        self.adjust_svg()
-        with open(os.path.join(self.instrument.config['path']['directories']['status'], 'index.html'), 'wt',
-                  encoding='utf-8') as f:
-            f.write(self._statusfile_template.safe_substitute(**subs))
+        self._fragments['timestamp'] = str(datetime.datetime.now())
+        self._fragments['uptime'] = '{:02.0f}:{:02.0f}:{:05.2f}'.format(uptime_hour, uptime_min, uptime_sec)
+        dirty = self._dirty.union(self.volatile_fragments)
+        self._dirty = set()
+        try:
+            for name, builder in self.fragment_builders().items():
+                if (name in dirty) or (name not in self._fragments):
+                    self._fragments[name] = builder()
+                    dirty.discard(name)
+            if 'svg' in dirty:
+                self.adjust_svg()
+                dirty.discard('svg')
+        finally:
+            # retry the failed ones next time
+            self._dirty.update(dirty.difference(self.volatile_fragments))
+        self.write_file_if_changed('credo_status.css', self._stylesheet)
+        self.write_file_if_changed('index.html', self._statusfile_template.safe_substitute(**self._fragments))
         return True
 
+    def get_svg_objects(self, idname: str) -> List:
+        try:
+            return self._svg_objects[idname]
+        except KeyError:
+            self._svg_objects[idname] = get_svg_object_by_id(self._svg_dom, idname)
+            return self._svg_objects[idname]
+
     def adjust_svg(self):
-        dom = parse(pkg_resources.resource_filename('cct', 'resource/cct_status/scheme_interactive.svg'))
+        if self._svg_dom is None:
+            self.reload_statusfile_template()
+        dom = self._svg_dom
         try:
             shutter = self.instrument.get_device('xray_source').get_variable('shutter')
         except KeyError:
             shutter = False
         beamstop = self.instrument.get_beamstop_state()
-        for x in get_svg_object_by_id(dom, 'xray'):
+        for x in self.get_svg_objects('xray'):
             if shutter:
                 x.setAttribute('visibility', 'visible')
             else:
                 x.setAttribute('visibility', 'hidden')
-        for x in get_svg_object_by_id(dom, 'hitting_xray'):
+        for x in self.get_svg_objects('hitting_xray'):
             if shutter and (beamstop != 'in'):
                 x.setAttribute('visibility', 'visible')
             else:
                 x.setAttribute('visibility', 'hidden')
-        for x in get_svg_object_by_id(dom, 'beamstop_in'):
+        for x in self.get_svg_objects('beamstop_in'):
             if beamstop == 'out':
                 x.setAttribute('visibility', 'hidden')
             else:
                 x.setAttribute('visibility', 'visible')
-        for x in get_svg_object_by_id(dom, 'beamstop_out'):
+        for x in self.get_svg_objects('beamstop_out'):
             if beamstop == 'in':
                 x.setAttribute('visibility', 'hidden')
             else:
@@ -361,28 +493,28 @@ class WebStateFileWriter(Service):
             ht = '{:.2f} kV'.format(self.instrument.get_device('xray_source').get_variable('ht'))
         except KeyError:
             ht = '??? kV'
-        for x in get_svg_object_by_id(dom, 'hv'):
+        for x in self.get_svg_objects('hv'):
             x.firstChild.firstChild.data = ht
         try:
             current = '{:.2f} mA'.format(self.instrument.get_device('xray_source').get_variable('current'))
         except KeyError:
             current = '??? mA'
-        for x in get_svg_object_by_id(dom, 'current'):
+        for x in self.get_svg_objects('current'):
             x.firstChild.firstChild.data = current
-        for x in get_svg_object_by_id(dom, 'detector_state'):
+        for x in self.get_svg_objects('detector_state'):
             try:
                 x.firstChild.firstChild.data = self.instrument.get_device('detector').get_variable('_status')
             except KeyError:
                 x.firstChild.firstChild.data = 'Disconnected'
-        for x in get_svg_object_by_id(dom, 'vacuum'):
+        for x in self.get_svg_objects('vacuum'):
             try:
                 x.firstChild.firstChild.data = '{:.3f} mbar'.format(
                     self.instrument.devices['tpg201'].get_variable('pressure'))
             except KeyError:
                 x.firstChild.firstChild.data = 'Vacuum gauge disconnected'
-        for x in get_svg_object_by_id(dom, 'samplename'):
+        for x in self.get_svg_objects('samplename'):
             x.firstChild.firstChild.data = str(self.instrument.services['samplestore'].get_active_name())
-        for x in get_svg_object_by_id(dom, 'temperature'):
+        for x in self.get_svg_objects('temperature'):
             try:
                 temperature = self.instrument.devices['haakephoenix'].get_variable('temperature_internal')
                 temperature = '{:.2f} °C'.format(temperature)
@@ -392,8 +524,8 @@ class WebStateFileWriter(Service):
                 temperature = 'Uncontrolled'
             x.firstChild.firstChild.data = temperature
         for m in self.instrument.motors:
-            for x in get_svg_object_by_id(dom, m):
+            for x in self.get_svg_objects(m):
                 x.firstChild.firstChild.data = '{:.3f}'.format(self.instrument.motors[m].where())
-        with open(os.path.join(self.instrument.config['path']['directories']['status'], 'scheme.svg'), 'wt',
-                  encoding='utf-8') as f:
-            dom.writexml(f)
+        svg = io.StringIO()
+        dom.writexml(svg)
+        self.write_file_if_changed('scheme.svg', svg.getvalue())
@@ -1,12 +1,14 @@
 import gc
-import itertools
 import logging
 import traceback
-from typing import Callable, Optional
+from typing import Callable, Dict, Optional, Tuple
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
+# signals emitted so frequently that they are not logged, not even on the debug level
+_frequent_signals = frozenset(['telemetry', 'variable-change'])
+
 
 class SignalFlags(object):
     RUN_FIRST = 1
@@ -50,20 +52,31 @@ class Callbacks(object):
     __signals__ = {}
     _nextsignalconnectionid = 0
 
+    # Check the types of the signal arguments on each emission. This is a help during development, and can be
+    # switched off (Callbacks.check_signal_arguments = False) to make frequent signals cheaper.
+    check_signal_arguments = True
+
     def __init__(self):
-        self.__signalhandles = []
+        self.__signalhandles = {}  # signal name -> list of connections. The lists are replaced, never modified.
+        self.__connections = {}  # connection ID -> connection
+
+    @classmethod
+    def _get_signal_table(cls) -> Dict[str, Tuple]:
+        """The signals of this class, including the inherited ones. Computed once for each class."""
+        try:
+            return cls.__dict__['_signaltable']
+        except KeyError:
+            table = {}
+            for bcls in reversed(cls.__mro__):
+                table.update(bcls.__dict__.get('__signals__', {}))
+            cls._signaltable = table
+            return table
 
     @classmethod
     def _get_signal_description(cls, name):
-        if name in cls.__signals__:
-            return cls.__signals__[name]
-        else:
-            for bcls in cls.__bases__:
-                try:
-                    # noinspection PyProtectedMember
-                    return bcls._get_signal_description(name)
-                except AttributeError:
-                    pass
+        try:
+            return cls._get_signal_table()[name]
+        except KeyError:
             raise ValueError(name)
 
     def connect(self, signal: str, callback: Callable, *args, **kwargs) -> int:
@@ -82,51 +95,64 @@ class Callbacks(object):
         self._get_signal_description(signal)
         conn = {'signal': signal, 'callback': callback, 'args': args, 'kwargs': kwargs,
                 'id': self.__class__._nextsignalconnectionid, 'blocked': 0}
-        self.__signalhandles.append(conn)
+        # replace the list, a signal may be being emitted just now.
+        self.__signalhandles[signal] = self.__signalhandles.get(signal, []) + [conn]
+        self.__connections[conn['id']] = conn
         self.__class__._nextsignalconnectionid += 1
         logger.debug('Connected signal handler {:d} for signal {}, callback {}'.format(conn['id'], signal, callback))
         return conn['id']
 
+    def _get_connection(self, connectionid: int) -> Dict:
+        try:
+            return self.__connections[connectionid]
+        except KeyError:
+            raise ValueError('No signal hander with ID {:d} has been registered with this object!'.format(connectionid))
+
     def disconnect(self, connectionid: Optional[int] = None):
         """Disconnect a callback signal."""
         # if connectionid is None:
         #    return
         assert isinstance(connectionid, int)
-        conn = [s for s in self.__signalhandles if s['id'] == connectionid]
-        if not conn:
-            raise ValueError('No signal hander with ID {:d} has been registered with this object!'.format(connectionid))
-        assert len(conn) == 1
-        lenbefore = len(self.__signalhandles)
-        self.__signalhandles.remove(conn[0])
+        conn = self._get_connection(connectionid)
+        lenbefore = len(self.__connections)
+        del self.__connections[connectionid]
+        handles = [s for s in self.__signalhandles[conn['signal']] if s is not conn]
+        if handles:
+            self.__signalhandles[conn['signal']] = handles
+        else:
+            del self.__signalhandles[conn['signal']]
         logger.debug('Deregistered signal handler {:d}. Registered connections: {:d} -> {:d}'.format(
-            connectionid, lenbefore, len(self.__signalhandles)))
+            connectionid, lenbefore, len(self.__connections)))
 
     def handler_block(self, connectionid: int):
-        for s_ in self.__signalhandles:
-            assert isinstance(s_, dict)
-        [s_ for s_ in self.__signalhandles if s_['id'] == connectionid][0]['blocked'] += 1
+        self._get_connection(connectionid)['blocked'] += 1
 
     def handler_unblock(self, connectionid: int):
-        for s_ in self.__signalhandles:
-            assert isinstance(s_, dict)
-        sc = [s_ for s_ in self.__signalhandles if s_['id'] == connectionid][0]
-        assert isinstance(sc, dict)
+        sc = self._get_connection(connectionid)
         if sc['blocked'] <= 0:
             sc['blocked'] = 0
             raise ValueError('Cannot unblock signal handler #{:d}: not blocked.'.format(connectionid))
         sc['blocked'] -= 1
 
+    def has_handler_pending(self, signal: str) -> bool:
+        """Check if emitting `signal` would call anything: an unblocked handler or a default callback."""
+        if callable(getattr(self, 'do_' + signal.replace('-', '_'), None)):
+            return True
+        return any(s['blocked'] <= 0 for s in self.__signalhandles.get(signal, ()))
+
     def emit(self, signal: str, *args):
-        if signal not in ['telemetry', 'variable-change']:
+        verbose = signal not in _frequent_signals
+        if verbose:
             logger.debug('Emitting signal: {}'.format(signal))
         sigdesc = self._get_signal_description(signal)
         if len(args) != len(sigdesc[2]):
             raise ValueError('Incorrect number of arguments supplied to signal {}.'.format(signal))
-        # test the types of the supplied arguments
-        for a, t, i in zip(args, sigdesc[2], itertools.count(0)):
-            if not isinstance(a, (t, type(None))):
-                raise TypeError('Argument #{:d} of signal {} is of incorrect type {}. Expected: {} or None.'.format(
-                    i, signal, type(a), t))
+        if self.check_signal_arguments:
+            # test the types of the supplied arguments
+            for i, (a, t) in enumerate(zip(args, sigdesc[2])):
+                if (a is not None) and not isinstance(a, t):
+                    raise TypeError('Argument #{:d} of signal {} is of incorrect type {}. Expected: {} or None.'.format(
+                        i, signal, type(a), t))
         if sigdesc[0] & SignalFlags.RUN_FIRST:
             # run the default callback before the connected handlers
             retval = self._call_default_callback(signal, *args)
@@ -138,16 +164,13 @@ class Callbacks(object):
                 ret = None
             if done:
                 assert isinstance(ret, sigdesc[1])
-                if signal not in ['telemetry', 'variable-change']:
+                if verbose:
                     logger.debug('Done emitting signal {} after the default callback (RUN_FIRST).'.format(signal))
                 return ret
-        for s_ in self.__signalhandles:
-            assert isinstance(s_, dict)
-        for s in self.__signalhandles:
-            assert isinstance(s, dict)
-            if (s['signal'] != signal) or (s['blocked'] > 0):
+        for s in self.__signalhandles.get(signal, ()):
+            if s['blocked'] > 0:
                 continue
-            if signal not in ['telemetry', 'variable-change']:
+            if verbose:
                 logger.debug('Calling signal hander {:d} for signal {}: {}'.format(s['id'], signal, str(s['callback'])))
             try:
                 retval = s['callback'](self, *(args + s['args']), **s['kwargs'])
@@ -164,7 +187,7 @@ class Callbacks(object):
             if done:
                 if sigdesc[1] is not None:
                     assert isinstance(ret, sigdesc[1])
-                if signal not in ['telemetry', 'variable-change']:
+                if verbose:
                     logger.debug('Done emitting signal {} after registered callback {:d}.'.format(signal, s['id']))
                 return ret
         if sigdesc[0] & SignalFlags.RUN_LAST:
@@ -178,10 +201,10 @@ class Callbacks(object):
             if done:
                 if sigdesc[1] is not None:
                     assert isinstance(ret, sigdesc[1])
-                    if signal not in ['telemetry', 'variable-change']:
+                    if verbose:
                         logger.debug('Done emitting signal {} after the default callback (RUN_LAST).'.format(signal))
                     return ret
-        if signal not in ['telemetry', 'variable-change']:
+        if verbose:
             logger.debug('Done emitting signal {}: no callbacks left'.format(signal))
         return None
 
@@ -198,5 +221,6 @@ class Callbacks(object):
         return None
 
     def cleanup_callback_handlers(self):
-        self.__signalhandles = []
+        self.__signalhandles = {}
+        self.__connections = {}
         gc.collect()
@@ -0,0 +1,159 @@
+"""Tools for the configuration dictionary: computing and applying differences (patches), checking it against the
+defaults and saving it in a versioned file.
+
+A patch is a list of (operation, path, value) tuples, where the path is a tuple of keys (or list indices) leading from
+the root of the configuration dictionary to the changed item. The operations are 'set' (create or replace the item
+with the value) and 'del' (remove the item from a dictionary; the value is None).
+
+The configuration file starts with `CONFIG_FILE_MAGIC` and a little-endian uint16 format version, followed by the
+pickled dictionary.
+"""
+import logging
+import os
+import pickle
+import struct
+import tempfile
+from typing import Any, Dict, List, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+CONFIG_FILE_MAGIC = b'CCTCONF\n'
+CONFIG_FILE_VERSION = 1
+
+ConfigPatch = List[Tuple[str, Tuple[str, ...], Any]]
+
+
+def _equal(a, b) -> bool:
+    if type(a) is not type(b):
+        return False
+    try:
+        result = (a == b)
+    except Exception:
+        return False
+    # e.g. numpy arrays compare elementwise: consider them different.
+    return result if isinstance(result, bool) else False
+
+
+def _diff_value(old, new, path: Tuple, patch: ConfigPatch):
+    if isinstance(new, dict) and isinstance(old, dict):
+        patch.extend(diff_config(old, new, path))
+    elif isinstance(new, list) and isinstance(old, list) and (len(new) == len(old)):
+        # e.g. the list of samples: changing one sample should not send all of them
+        for i, (o, n) in enumerate(zip(old, new)):
+            _diff_value(o, n, path + (i,), patch)
+    elif not _equal(old, new):
+        patch.append(('set', path, new))
+
+
+def diff_config(old: Dict, new: Dict, path: Tuple = ()) -> ConfigPatch:
+    """Compute the patch transforming `old` to `new`. Dictionaries and lists of the same length are compared
+    recursively, other values as a whole."""
+    patch = []
+    for key, value in new.items():
+        if key not in old:
+            patch.append(('set', path + (key,), value))
+        else:
+            _diff_value(old[key], value, path + (key,), patch)
+    for key in old:
+        if key not in new:
+            patch.append(('del', path + (key,), None))
+    return patch
+
+
+def apply_config_patch(config: Dict, patch: ConfigPatch) -> Dict:
+    """Apply a patch on a configuration dictionary in place. Missing intermediate dictionaries are created.
+
+    Returns `config` for convenience."""
+    for operation, path, value in patch:
+        parent = config
+        for key in path[:-1]:
+            parent = parent[key] if isinstance(parent, list) else parent.setdefault(key, {})
+        if operation == 'set':
+            parent[path[-1]] = value
+        elif operation == 'del':
+            parent.pop(path[-1], None)
+        else:
+            raise ValueError('Unknown config patch operation: {}'.format(operation))
+    return config
+
+
+def check_config_schema(defaults: Dict, config: Dict, path: Tuple[str, ...] = ()) -> List[str]:
+    """Check the structure of `config` against `defaults`, in place.
+
+    Items present in `defaults` must be of a compatible type (dictionaries must remain dictionaries, numbers must
+    remain numbers, strings must remain strings, None is always accepted). Offending items are replaced by the default
+    value. Items not present in the defaults are not checked.
+
+    :return: the list of the problems found, for logging.
+    """
+    problems = []
+    for key, default in defaults.items():
+        if key not in config:
+            continue
+        value = config[key]
+        if value is None:
+            continue
+        if isinstance(default, dict):
+            if isinstance(value, dict):
+                problems.extend(check_config_schema(default, value, path + (key,)))
+                continue
+        elif isinstance(default, bool) or not isinstance(default, (int, float, str)):
+            continue
+        elif isinstance(default, str) and isinstance(value, str):
+            continue
+        elif isinstance(default, (int, float)) and isinstance(value, (int, float)) and not isinstance(value, bool):
+            continue
+        problems.append('{}: expected {}, got {}'.format(
+            '/'.join(str(k) for k in path + (key,)), type(default).__name__, type(value).__name__))
+        config[key] = default
+    return problems
+
+
+def write_config_file(filename: str, config: Dict):
+    """Save the configuration atomically: a temporary file is written and renamed.
+
+    The file keeps the permissions of the previous version, or gets the default ones (0666 minus the umask) if it is
+    new: `tempfile.mkstemp()` would make it readable only by the owner.
+    """
+    data = CONFIG_FILE_MAGIC + struct.pack('<H', CONFIG_FILE_VERSION) + pickle.dumps(
+        config, protocol=pickle.HIGHEST_PROTOCOL)
+    try:
+        mode = os.stat(filename).st_mode & 0o7777
+    except FileNotFoundError:
+        umask = os.umask(0)
+        os.umask(umask)
+        mode = 0o666 & ~umask
+    fd, tmpname = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(filename)), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.chmod(tmpname, mode)
+        os.replace(tmpname, filename)
+    except BaseException:
+        os.unlink(tmpname)
+        raise
+
+
+def read_config_file(filename: str, legacy_filenames: Sequence[str] = ()) -> Dict:
+    """Load a configuration file written by `write_config_file()`.
+
+    If it does not exist, the first existing one of `legacy_filenames` is loaded instead: these are plain pickle
+    files, as saved by previous versions.
+    """
+    for fn in [filename] + list(legacy_filenames):
+        if not os.path.exists(fn):
+            continue
+        with open(fn, 'rb') as f:
+            data = f.read()
+        if fn != filename:
+            logger.info('Loading legacy config file ' + fn)
+            return pickle.loads(data)
+        if not data.startswith(CONFIG_FILE_MAGIC):
+            raise ValueError('Not a CCT configuration file: {}'.format(filename))
+        version, = struct.unpack_from('<H', data, len(CONFIG_FILE_MAGIC))
+        if version > CONFIG_FILE_VERSION:
+            raise ValueError('Configuration file {} has a newer format version ({:d}) than supported ({:d})'.format(
+                filename, version, CONFIG_FILE_VERSION))
+        return pickle.loads(data[len(CONFIG_FILE_MAGIC) + 2:])
+    raise FileNotFoundError(filename)
@@ -0,0 +1,99 @@
+#cython: boundscheck=False, wraparound=False, cdivision=True, embedsignature=True, language_level=3, initializedcheck=False
+import numpy as np
+from cython.parallel import prange
+from libc.math cimport exp, expm1, log, sqrt, hypot, fabs
+
+
+def correctionmatrices_cython(const double[:,:] sin2theta not None, const double[:,:] invcos2theta not None,
+                              const double[:,:] dtwotheta not None,
+                              double distance, double ddistance, double transmission, double dtransmission,
+                              double pressure=0, double mu0_air=1/883.49, double dmu0_air=0,
+                              bint solidangle=True, bint airtransmission=True):
+    """Calculate the geometric correction matrices with error propagation in a single pass
+
+    The same formulae are used as in cct.core.utils.geometrycorrections:
+
+    - solid angle: distance**2 / cos(2*theta)**3 (the division by the squared pixel size is left to the caller)
+    - angle-dependent absorption of the sample: y / (exp(y)-1), where y = log(T) * (1/cos(2*theta) - 1)
+    - angle-dependent absorption of air: exp(mu_air * distance / cos(2*theta)), mu_air = mu0_air / 1000 * pressure
+
+    :param sin2theta: sine of the scattering angles
+    :type sin2theta: MxN np.ndarray, double dtype
+    :param invcos2theta: reciprocal of the cosine of the scattering angles
+    :type invcos2theta: MxN np.ndarray, double dtype
+    :param dtwotheta: absolute error of the scattering angles
+    :type dtwotheta: MxN np.ndarray, double dtype
+    :param distance: sample-to-detector distance
+    :param ddistance: absolute error of the sample-to-detector distance
+    :param transmission: transmission of the sample
+    :param dtransmission: absolute error of the transmission
+    :param pressure: air pressure in mbar
+    :param mu0_air: linear absorption coefficient of air at 1000 mbar, in 1/distance units
+    :param dmu0_air: absolute error of mu0_air
+    :param solidangle: if the solid angle correction is to be calculated
+    :type solidangle: bool
+    :param airtransmission: if the air absorption correction is to be calculated
+    :type airtransmission: bool
+    :return: the value and the error matrices of the solid angle, the sample absorption and the air absorption
+        corrections. The matrices of the corrections not requested are None.
+    :rtype: tuple of six MxN np.ndarrays
+    """
+    cdef Py_ssize_t Nrows, Ncolumns, irow, icolumn
+    cdef double[:,:] saval, saerr, adaval, adaerr, adatval, adaterr
+    cdef double c, s, u, dt, y, em1, ratio, v
+    cdef double logt = log(transmission)
+    cdef double mu_air = mu0_air / 1000 * pressure
+    cdef double dmu_air = dmu0_air / 1000 * pressure
+    cdef double airconst = dmu_air ** 2 * distance ** 2 + ddistance ** 2 * mu_air ** 2
+    Nrows = sin2theta.shape[0]
+    Ncolumns = sin2theta.shape[1]
+    if (invcos2theta.shape[0] != Nrows) or (invcos2theta.shape[1] != Ncolumns):
+        raise ValueError('Invalid shape of invcos2theta')
+    if (dtwotheta.shape[0] != Nrows) or (dtwotheta.shape[1] != Ncolumns):
+        raise ValueError('Invalid shape of dtwotheta')
+    adaval = np.empty((Nrows, Ncolumns), np.double)
+    adaerr = np.empty((Nrows, Ncolumns), np.double)
+    # the output matrices of the corrections not requested are left empty.
+    if solidangle:
+        saval = np.empty((Nrows, Ncolumns), np.double)
+        saerr = np.empty((Nrows, Ncolumns), np.double)
+    else:
+        saval = saerr = np.empty((0, Ncolumns), np.double)
+    if airtransmission:
+        adatval = np.empty((Nrows, Ncolumns), np.double)
+        adaterr = np.empty((Nrows, Ncolumns), np.double)
+    else:
+        adatval = adaterr = np.empty((0, Ncolumns), np.double)
+    for irow in prange(Nrows, nogil=True, schedule='static'):
+        for icolumn in range(Ncolumns):
+            s = sin2theta[irow, icolumn]
+            u = invcos2theta[irow, icolumn]
+            c = 1 / u
+            dt = dtwotheta[irow, icolumn]
+            if solidangle:
+                saval[irow, icolumn] = distance ** 2 * u ** 3
+                saerr[irow, icolumn] = distance * sqrt(4 * ddistance ** 2 * c ** 2 +
+                                                       9 * dt ** 2 * distance ** 2 * s ** 2) * u ** 4
+            # sample absorption: see _angledependentabsorption_trig() in geometrycorrections.py
+            y = logt * (u - 1)
+            em1 = expm1(y)
+            if y != 0:
+                adaval[irow, icolumn] = y / em1
+            else:
+                adaval[irow, icolumn] = 1
+            if fabs(y) < 1e-5:
+                ratio = y / 6 - 0.5
+            else:
+                ratio = (em1 - y * (em1 + 1)) / em1 ** 2
+            adaerr[irow, icolumn] = fabs(ratio) / transmission * hypot(
+                (u - 1) * dtransmission, transmission * logt * s * u ** 2 * dt)
+            if airtransmission:
+                v = exp(mu_air * distance * u)
+                adatval[irow, icolumn] = v
+                adaterr[irow, icolumn] = v * u * sqrt(airconst + dt ** 2 * mu_air ** 2 * distance ** 2 * s ** 2 * u ** 2)
+    return (np.asarray(saval) if solidangle else None,
+            np.asarray(saerr) if solidangle else None,
+            np.asarray(adaval),
+            np.asarray(adaerr),
+            np.asarray(adatval) if airtransmission else None,
+            np.asarray(adaterr) if airtransmission else None)
@@ -1,7 +1,16 @@
+import collections
+from typing import Optional, Tuple, Union
+
 import numpy as np
 
 from sastool.misc.errorvalue import ErrorValue
 
+try:
+    from .correctionmatrices import correctionmatrices_cython
+except ImportError:
+    # the extension module is not built: CachedGeometry.corrections() uses NumPy
+    correctionmatrices_cython = None
+
 
 def solidangle(twotheta, dtwotheta, sampletodetectordistance, dsampletodetectordistance, pixelsize):
     """Solid-angle correction for two-dimensional SAS images with error propagation
@@ -16,66 +25,73 @@ def solidangle(twotheta, dtwotheta, sampletodetectordistance, dsampletodetectord
         matrix should be multiplied by the first one. The second one is the propagated
         error of the first one.
     """
-    return ErrorValue(sampletodetectordistance ** 2 / np.cos(twotheta) ** 3,
-                      (sampletodetectordistance * (4 * dsampletodetectordistance ** 2 * np.cos(twotheta) ** 2 +
-                                                   9 * dtwotheta ** 2 * sampletodetectordistance ** 2 * np.sin(
-                                                       twotheta) ** 2) ** 0.5
-                       / np.cos(twotheta) ** 4)) / pixelsize ** 2
-
-
-def _angledependentabsorption_value(twotheta, transmission):
-    """Correction for angle-dependent absorption of the sample
-
-    Inputs:
-        twotheta: matrix of two-theta values
-        transmission: the transmission of the sample (I_after/I_before, or
-            exp(-mu*d))
-
-    The output matrix is of the same shape as twotheta. The scattering intensity
-        matrix should be multiplied by it. Note, that this does not corrects for
-        sample transmission by itself, as the 2*theta -> 0 limit of this matrix
-        is unity. Twotheta==0 and transmission==1 cases are handled correctly
-        (the limit is 1 in both cases).
-    """
-    cor = np.ones(twotheta.shape)
-    if transmission == 1:
-        return cor
-    mud = -np.log(transmission)
-
-    cor[twotheta > 0] = transmission * mud * (1 - 1 / np.cos(twotheta[twotheta > 0])) / (
-        np.exp(-mud / np.cos(twotheta[twotheta > 0])) - np.exp(-mud))
-    return cor
+    return ErrorValue(*_solidangle_trig(np.cos(twotheta), np.sin(twotheta), dtwotheta, sampletodetectordistance,
+                                        dsampletodetectordistance)) / pixelsize ** 2
 
 
-def _angledependentabsorption_error_ugly(twotheta, dtwotheta, transmission, dtransmission):
-    # calculated using sympy
-    return ((transmission * np.cos(twotheta) - np.exp(np.log(transmission) / np.cos(twotheta)) *
-             np.log(transmission) * np.cos(twotheta) + np.exp(np.log(transmission) / np.cos(twotheta))
-             * np.log(transmission) - np.exp(np.log(transmission) / np.cos(twotheta)) * np.cos(twotheta)) ** 2
-            * (transmission ** 2 * dtwotheta ** 2 * np.log(transmission) ** 2 * np.sin(twotheta) ** 2
-               + dtransmission ** 2 * np.sin(twotheta) ** 4 - 3 * dtransmission ** 2 * np.sin(twotheta) ** 2
-               - 2 * dtransmission ** 2 * np.cos(twotheta) ** 3 + 2 * dtransmission ** 2) /
-            (transmission - np.exp(np.log(transmission) / np.cos(twotheta))) ** 4) ** 0.5 * \
-           np.abs(np.cos(twotheta)) ** (-3.0)
+def _solidangle_trig(cos2theta, sin2theta, dtwotheta, sampletodetectordistance,
+                     dsampletodetectordistance) -> Tuple[np.ndarray, np.ndarray]:
+    """Same as solidangle() without the division by the squared pixel size,
+    but from precomputed cos(2*theta) and sin(2*theta) matrices, keeping the
+    number of temporary arrays low."""
+    value = cos2theta ** 3
+    np.divide(sampletodetectordistance ** 2, value, out=value)
+    error = np.multiply(sin2theta, dtwotheta)
+    np.square(error, out=error)
+    error *= 9 * sampletodetectordistance ** 2
+    error += 4 * dsampletodetectordistance ** 2 * cos2theta ** 2
+    np.sqrt(error, out=error)
+    error /= cos2theta ** 4
+    error *= sampletodetectordistance
+    return value, error
 
 
-def __create_adaerror_function():
-    try:
-        # noinspection PyUnresolvedReferences,PyPackageRequirements
-        import sympy
+def _angledependentabsorption_trig(sin2theta, invcos2theta, dtwotheta, transmission,
+                                   dtransmission) -> Tuple[np.ndarray, np.ndarray]:
+    """Correction for angle-dependent absorption of the sample with error
+    propagation, from precomputed sin(2*theta) and 1/cos(2*theta) matrices.
 
-        tth, dtth, T, dT = sympy.symbols('tth dtth T dT')
-        mud = -sympy.log(T)
-        corr = sympy.exp(-mud) * mud * (1 - 1 / sympy.cos(tth)) / (sympy.exp(-mud / sympy.cos(tth)) - sympy.exp(-mud))
-        dcorr = (sympy.diff(corr, T) ** 2 * dT ** 2 + sympy.diff(corr, tth) ** 2 * dtth ** 2) ** 0.5
-        func = sympy.lambdify((tth, dtth, T, dT), dcorr, "numpy")
-        del sympy, tth, dtth, T, dT, mud, corr, dcorr
-    except ImportError:
-        func = _angledependentabsorption_error_ugly
-    return func
+    The correction is T * mu*d * (1 - 1/cos(2*theta)) / (exp(-mu*d/cos(2*theta))
+    - exp(-mu*d)), where T = exp(-mu*d) is the transmission. With
+    y = log(T) * (1/cos(2*theta) - 1), this simplifies to y / (exp(y)-1),
+    which is evaluated using expm1() to avoid the loss of precision near the
+    beam and for transmissions close to unity.
 
+    The partial derivatives of the correction by T and by 1/cos(2*theta) are
+    (1/cos(2*theta) - 1) * R and T * log(T) * R, respectively, where
+    R = (expm1(y) - y * exp(y)) / (T * expm1(y) ** 2). R -> -1/(2*T) as y -> 0.
 
-_angledependentabsorption_error = __create_adaerror_function()
+    Returns the correction matrix and its absolute error.
+    """
+    logt = np.log(transmission)
+    y = invcos2theta - 1
+    y *= logt
+    em1 = np.expm1(y)
+    nonzero = y != 0
+    value = np.ones_like(y)
+    np.divide(y, em1, out=value, where=nonzero)
+    # R * T, using its series expansion where y is small
+    small = np.abs(y) < 1e-5
+    ratio = np.multiply(y, 1 / 6)
+    ratio -= 0.5
+    large = ~small
+    yl = y[large]
+    em1l = em1[large]
+    ratio[large] = (em1l - yl * (em1l + 1)) / em1l ** 2
+    del yl, em1l, large, small, em1, y, nonzero
+    np.abs(ratio, out=ratio)
+    ratio /= transmission
+    # error propagation
+    dt_term = invcos2theta - 1
+    dt_term *= dtransmission
+    dtth_term = np.square(invcos2theta)
+    dtth_term *= sin2theta
+    dtth_term *= dtwotheta
+    dtth_term *= transmission * logt
+    np.hypot(dt_term, dtth_term, out=dt_term)
+    del dtth_term
+    dt_term *= ratio
+    return value, dt_term
 
 
 def angledependentabsorption(twotheta, dtwotheta, transmission, dtransmission):
@@ -89,11 +105,14 @@ def angledependentabsorption(twotheta, dtwotheta, transmission, dtransmission):
         dtransmission: the absolute error of the transmission of the sample
 
     Two matrices are returned: the first one is the correction (intensity matrix
-        should be multiplied by it), the second is its absolute error.
+        should be multiplied by it), the second is its absolute error. Note, that
+        this does not corrects for sample transmission by itself, as the
+        2*theta -> 0 limit of the correction is unity. Twotheta==0 and
+        transmission==1 cases are handled correctly (the limit is 1 in both
+        cases).
     """
-    # error propagation formula calculated using sympy
-    return ErrorValue(_angledependentabsorption_value(twotheta, transmission),
-                      _angledependentabsorption_error(twotheta, dtwotheta, transmission, dtransmission))
+    return ErrorValue(*_angledependentabsorption_trig(np.sin(twotheta), 1 / np.cos(twotheta), dtwotheta,
+                                                      transmission, dtransmission))
 
 
 def angledependentairtransmission(twotheta, dtwotheta,
@@ -116,16 +135,131 @@ def angledependentairtransmission(twotheta, dtwotheta,
 
     The scattering intensity matrix should be multiplied by the resulting
     correction matrix."""
+    return ErrorValue(*_angledependentairtransmission_trig(
+        np.sin(twotheta), 1 / np.cos(twotheta), dtwotheta, pressure, sampletodetectordistance,
+        dsampletodetectordistance, mu0_air, dmu0_air))
+
+
+def _angledependentairtransmission_trig(sin2theta, invcos2theta, dtwotheta, pressure, sampletodetectordistance,
+                                        dsampletodetectordistance, mu0_air=1 / 883.49,
+                                        dmu0_air=0) -> Tuple[np.ndarray, np.ndarray]:
+    """Same as angledependentairtransmission(), but using precomputed
+    sin(2*theta) and 1/cos(2*theta) matrices."""
     mu_air = mu0_air / 1000 * pressure
     dmu_air = dmu0_air / 1000 * pressure
-    return ErrorValue(np.exp(mu_air * sampletodetectordistance / np.cos(twotheta)),
-                      np.sqrt(dmu_air ** 2 * sampletodetectordistance ** 2 *
-                              np.exp(2 * mu_air * sampletodetectordistance / np.cos(twotheta))
-                              / np.cos(twotheta) ** 2 + dsampletodetectordistance ** 2 *
-                              mu_air ** 2 * np.exp(2 * mu_air * sampletodetectordistance /
-                                                   np.cos(twotheta)) /
-                              np.cos(twotheta) ** 2 + dtwotheta ** 2 * mu_air ** 2 *
-                              sampletodetectordistance ** 2 *
-                              np.exp(2 * mu_air * sampletodetectordistance / np.cos(twotheta))
-                              * np.sin(twotheta) ** 2 / np.cos(twotheta) ** 4)
-                      )
+    value = np.multiply(invcos2theta, mu_air * sampletodetectordistance)
+    np.exp(value, out=value)
+    # sqrt(dmu^2 * L^2 + dL^2 * mu^2 + dtth^2 * mu^2 * L^2 * sin^2 / cos^2) * exp(mu * L / cos) / cos
+    error = np.multiply(sin2theta, invcos2theta)
+    error *= dtwotheta
+    np.square(error, out=error)
+    error *= mu_air ** 2 * sampletodetectordistance ** 2
+    error += dmu_air ** 2 * sampletodetectordistance ** 2 + dsampletodetectordistance ** 2 * mu_air ** 2
+    np.sqrt(error, out=error)
+    error *= value
+    error *= invcos2theta
+    return value, error
+
+
+class CachedGeometry(object):
+    """The two-theta matrix and the geometry-only correction matrices of a
+    detector geometry, with the trigonometric matrices needed for evaluating
+    the transmission- and pressure-dependent corrections.
+
+    The matrices are made read-only, since they are shared between
+    exposures.
+
+    The `statistics` dictionary can be used by the caller to store derived
+    quantities, which are only to be calculated once per geometry.
+
+    The exposure-dependent corrections are best obtained by `corrections()`,
+    which evaluates them in a single pass over the matrices. The methods
+    `angledependentabsorption()` and `angledependentairtransmission()` give
+    the same results using NumPy. These are also used by `corrections()` if
+    the `correctionmatrices` extension module is not built.
+    """
+
+    def __init__(self, twotheta: ErrorValue, sampletodetectordistance: ErrorValue,
+                 pixelsize: Union[ErrorValue, float]):
+        self.twotheta = twotheta
+        self.distance = sampletodetectordistance
+        self.cos = np.cos(twotheta.val)
+        self.sin = np.sin(twotheta.val)
+        self.invcos = 1 / self.cos
+        self.solidangle = ErrorValue(*_solidangle_trig(
+            self.cos, self.sin, twotheta.err, sampletodetectordistance.val,
+            sampletodetectordistance.err)) / pixelsize ** 2
+        for matrix in [twotheta.val, twotheta.err, self.cos, self.sin, self.invcos,
+                       self.solidangle.val, self.solidangle.err]:
+            matrix.setflags(write=False)
+        self.statistics = {}
+
+    def corrections(self, transmission: ErrorValue, pressure: Optional[float] = None, mu0_air=1 / 883.49,
+                    dmu0_air=0) -> Tuple[ErrorValue, Optional[ErrorValue]]:
+        """Calculate the angle-dependent absorption correction of the sample
+        and the angle-dependent air absorption correction (if the pressure is
+        not None) in a single pass."""
+        if correctionmatrices_cython is None:
+            return (self.angledependentabsorption(transmission.val, transmission.err),
+                    None if pressure is None else self.angledependentairtransmission(pressure, mu0_air, dmu0_air))
+        saval, saerr, adaval, adaerr, adatval, adaterr = correctionmatrices_cython(
+            self.sin, self.invcos, self.twotheta.err, self.distance.val, self.distance.err,
+            transmission.val, transmission.err, 0 if pressure is None else pressure, mu0_air, dmu0_air,
+            solidangle=False, airtransmission=pressure is not None)
+        return ErrorValue(adaval, adaerr), (None if pressure is None else ErrorValue(adatval, adaterr))
+
+    def angledependentabsorption(self, transmission, dtransmission) -> ErrorValue:
+        """See angledependentabsorption()"""
+        return ErrorValue(*_angledependentabsorption_trig(
+            self.sin, self.invcos, self.twotheta.err, transmission, dtransmission))
+
+    def angledependentairtransmission(self, pressure, mu0_air=1 / 883.49, dmu0_air=0) -> ErrorValue:
+        """See angledependentairtransmission()"""
+        return ErrorValue(*_angledependentairtransmission_trig(
+            self.sin, self.invcos, self.twotheta.err, pressure, self.distance.val, self.distance.err,
+            mu0_air, dmu0_air))
+
+
+class GeometryCache(object):
+    """A least-recently-used cache of CachedGeometry instances, keyed by the
+    detector geometry of exposures."""
+
+    def __init__(self, maxsize: int = 4):
+        self.maxsize = maxsize
+        self._cache = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key_of(value: Union[ErrorValue, float]):
+        if isinstance(value, ErrorValue):
+            return float(value.val), float(value.err)
+        return float(value)
+
+    def key(self, exposure) -> Tuple:
+        """The cache key of an exposure: shape, beam center, distance, pixel
+        size and wavelength"""
+        header = exposure.header
+        return (tuple(exposure.shape),) + tuple(
+            self._key_of(x) for x in [header.beamcenterx, header.beamcentery, header.distance,
+                                      header.pixelsizex, header.pixelsizey, header.wavelength])
+
+    def get(self, exposure) -> CachedGeometry:
+        """Get the cached geometry for an exposure (an instance of
+        sastool.io.credo_cct.Exposure), calculating it if needed."""
+        key = self.key(exposure)
+        try:
+            geometry = self._cache[key]
+        except KeyError:
+            self.misses += 1
+            geometry = CachedGeometry(exposure.twotheta, exposure.header.distance, exposure.header.pixelsizex)
+            self._cache[key] = geometry
+            while len(self._cache) > self.maxsize:
+                self._cache.popitem(last=False)
+        else:
+            self.hits += 1
+            self._cache.move_to_end(key)
+        return geometry
+
+    def clear(self):
+        self._cache.clear()
@@ -0,0 +1,329 @@
+"""Buffered log file writers, which keep the file open and write it from a background thread.
+
+Two formats are supported:
+
+- text: the lines are written as given (see `BufferedLogWriter`)
+- binary: records of a timestamp and a fixed set of values (see `BinaryLogWriter`), which can be read back by
+  `read_binary_log()` much faster than parsing the same data from text.
+
+The binary file starts with the magic bytes `BINARY_LOG_MAGIC`, followed by a header: a little-endian uint32 length
+and a JSON object of that length, with the key 'columns' (list of the column names, excluding the timestamp). Then
+chunks follow, one for each flush. A chunk consists of:
+
+- three little-endian uint32 numbers: the number of rows, the number of columns (including the timestamp) and the
+  length of the chunk descriptor
+- the chunk descriptor, a JSON object: 'kinds' is a string of one character for each column: 'f' for numbers or
+  'c' for codes of strings. 'strings' is the list of strings first occurring in this chunk. The string table of the
+  file is built by concatenating these lists.
+- the columns one after the other, each as an array of little-endian float64 numbers. Missing values are NaNs.
+
+If the program dies while writing a chunk, the incomplete chunk at the end of the file is ignored by the reader and
+cut off by the writer before appending to the file.
+"""
+import json
+import logging
+import math
+import numbers
+import os
+import queue
+import struct
+import threading
+import time
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+BINARY_LOG_MAGIC = b'CCTBLOG1'
+
+
+class BufferedLogWriter(object):
+    """Append lines to a text file.
+
+    The lines given to `write()` are collected by a background thread, which keeps the file open and writes them
+    when `flush_interval` seconds have passed since the first line waiting, or when more than `flush_size` bytes
+    (approximately) have been collected. Nothing is lost on `close()`.
+    """
+    filemode = 'at'
+
+    def __init__(self, filename: str, flush_interval: float = 5.0, flush_size: int = 65536):
+        self.filename = filename
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self._queue = queue.Queue()
+        self._file = None
+        self._thread = threading.Thread(target=self._worker, name='logwriter_' + os.path.basename(filename),
+                                        daemon=True)
+        self._thread.start()
+
+    def write(self, line: str):
+        """Queue a line (including the line terminator) for writing"""
+        self._queue.put(('data', line))
+
+    def flush(self, wait: bool = True):
+        """Write the collected data to the file.
+
+        :param wait: wait until the data has been written.
+        """
+        done = threading.Event()
+        self._queue.put(('flush', done))
+        if wait:
+            done.wait()
+
+    def close(self):
+        """Write the pending data, close the file and stop the background thread."""
+        if not self._thread.is_alive():
+            return
+        self._queue.put(('close', None))
+        self._thread.join()
+
+    def _open(self):
+        self._file = open(self.filename, self.filemode, **({} if 'b' in self.filemode else {'encoding': 'utf-8'}))
+
+    def _size(self, item) -> int:
+        return len(item)
+
+    def _encode(self, items: List):
+        return ''.join(items)
+
+    def _write(self, items: List) -> bool:
+        """Write the items to the file. Returns True if successful."""
+        if not items:
+            return True
+        try:
+            if self._file is None:
+                self._open()
+            self._file.write(self._encode(items))
+            self._file.flush()
+            return True
+        except Exception as exc:
+            logger.error('Cannot write log file {}: {}'.format(self.filename, exc))
+            # the file may end in a partially written record: reopen it next time.
+            if self._file is not None:
+                try:
+                    self._file.close()
+                except Exception:
+                    pass
+                self._file = None
+            return False
+
+    def _worker(self):
+        items = []
+        size = 0
+        firsttime = None  # the time when the oldest item in `items` was received
+        while True:
+            timeout = None if firsttime is None else max(0, firsttime + self.flush_interval - time.monotonic())
+            try:
+                kind, payload = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                kind, payload = 'flush', None
+            if kind == 'data':
+                items.append(payload)
+                size += self._size(payload)
+                if firsttime is None:
+                    firsttime = time.monotonic()
+                if size < self.flush_size:
+                    continue
+            self._write(items)
+            items = []
+            size = 0
+            firsttime = None
+            if kind == 'flush' and payload is not None:
+                payload.set()
+            elif kind == 'close':
+                if self._file is not None:
+                    self._file.close()
+                    self._file = None
+                return
+
+
+class BinaryLogWriter(BufferedLogWriter):
+    """Append records of a timestamp and the values of a fixed set of columns to a binary log file. See the module
+    docstring for the format.
+
+    Values can be numbers (including booleans), strings or None. Strings (and other objects, converted to strings)
+    are stored as codes in a string table.
+    """
+    filemode = 'ab'
+
+    def __init__(self, filename: str, columns: Sequence[str], flush_interval: float = 5.0, flush_size: int = 65536):
+        self.columns = list(columns)
+        self._strings = {}  # string -> code, for the strings already in the file
+        self._newstrings = {}  # string -> code, for the strings in the chunk being written
+        super().__init__(filename, flush_interval, flush_size)
+
+    def write(self, timestamp: float, values: Sequence):
+        """Queue a record for writing"""
+        if len(values) != len(self.columns):
+            raise ValueError('Expected {} values, got {}'.format(len(self.columns), len(values)))
+        self._queue.put(('data', (timestamp, tuple(values))))
+
+    def _open(self):
+        end = 0
+        if os.path.exists(self.filename) and os.path.getsize(self.filename) > 0:
+            try:
+                columns, self._strings, end = _read_binary_log_layout(self.filename)
+            except EOFError:
+                logger.warning('Incomplete header in binary log file {}, rewriting it.'.format(self.filename))
+                end = 0
+            else:
+                if columns != self.columns:
+                    raise ValueError('Binary log file {} has different columns'.format(self.filename))
+            if os.path.getsize(self.filename) > end:
+                logger.warning('Cutting off incomplete data from the end of binary log file {}'.format(
+                    self.filename))
+                os.truncate(self.filename, end)
+        super()._open()
+        if end == 0:
+            self._strings = {}
+            header = json.dumps({'columns': self.columns}).encode('utf-8')
+            self._file.write(BINARY_LOG_MAGIC + struct.pack('<I', len(header)) + header)
+
+    def _write(self, items: List) -> bool:
+        # the new strings get their codes only if the chunk introducing them is in the file.
+        self._newstrings = {}
+        if not super()._write(items):
+            return False
+        self._strings.update(self._newstrings)
+        self._newstrings = {}
+        return True
+
+    def _size(self, item) -> int:
+        return 8 * (len(self.columns) + 1)
+
+    def _encode(self, items: List) -> bytes:
+        data = np.empty((len(self.columns) + 1, len(items)), np.float64)
+        data[0, :] = [timestamp for timestamp, values in items]
+        kinds = ['f']
+        newstrings = []
+        for icol in range(len(self.columns)):
+            column = [values[icol] for timestamp, values in items]
+            if any((v is not None) and not isinstance(v, numbers.Real) for v in column):
+                kinds.append('c')
+                codes = []
+                for v in column:
+                    if v is None:
+                        codes.append(math.nan)
+                        continue
+                    v = str(v)
+                    if v in self._strings:
+                        codes.append(self._strings[v])
+                        continue
+                    if v not in self._newstrings:
+                        self._newstrings[v] = len(self._strings) + len(self._newstrings)
+                        newstrings.append(v)
+                    codes.append(self._newstrings[v])
+                data[icol + 1, :] = codes
+            else:
+                kinds.append('f')
+                data[icol + 1, :] = [math.nan if v is None else float(v) for v in column]
+        descriptor = json.dumps({'kinds': ''.join(kinds), 'strings': newstrings}).encode('utf-8')
+        return (struct.pack('<III', len(items), len(self.columns) + 1, len(descriptor)) + descriptor +
+                data.astype('<f8').tobytes())
+
+
+def _read_header(f) -> List[str]:
+    """Read the header. Raises EOFError if it is incomplete."""
+    magic = f.read(len(BINARY_LOG_MAGIC))
+    if not BINARY_LOG_MAGIC.startswith(magic):
+        raise ValueError('Not a binary log file: {}'.format(f.name))
+    lengthfield = f.read(4)
+    if (magic != BINARY_LOG_MAGIC) or (len(lengthfield) < 4):
+        raise EOFError('Incomplete header in binary log file {}'.format(f.name))
+    headerlength, = struct.unpack('<I', lengthfield)
+    header = f.read(headerlength)
+    if len(header) < headerlength:
+        raise EOFError('Incomplete header in binary log file {}'.format(f.name))
+    return json.loads(header.decode('utf-8'))['columns']
+
+
+def _read_chunks(f):
+    """Iterate over the complete chunks: yield (number of rows, number of columns, descriptor dict, offset of the
+    data). An incomplete chunk at the end of the file (the program died while writing it) is skipped."""
+    filesize = os.fstat(f.fileno()).st_size
+    while True:
+        start = f.tell()
+        chunkheader = f.read(12)
+        if not chunkheader:
+            return
+        if len(chunkheader) == 12:
+            nrows, ncols, descriptorlength = struct.unpack('<III', chunkheader)
+            offset = start + 12 + descriptorlength
+            if offset + 8 * nrows * ncols <= filesize:
+                descriptor = json.loads(f.read(descriptorlength).decode('utf-8'))
+                f.seek(8 * nrows * ncols, os.SEEK_CUR)
+                yield nrows, ncols, descriptor, offset
+                continue
+        logger.warning('Incomplete chunk at offset {} of binary log file {}, ignoring it.'.format(start, f.name))
+        f.seek(start)
+        return
+
+
+def _read_binary_log_layout(filename: str) -> Tuple[List[str], Dict[str, int], int]:
+    """Get the columns, the string table and the end of the last complete chunk of a binary log file, for
+    appending to it"""
+    strings = {}
+    with open(filename, 'rb') as f:
+        columns = _read_header(f)
+        for nrows, ncols, descriptor, offset in _read_chunks(f):
+            for s in descriptor['strings']:
+                strings[s] = len(strings)
+        end = f.tell()
+    return columns, strings, end
+
+
+def read_binary_log(filename: str) -> Tuple[np.ndarray, Dict[str, np.ndarray]]:
+    """Load a binary log file written by `BinaryLogWriter`.
+
+    :param filename: the name of the file
+    :return: the timestamps and a dictionary of the columns. Columns containing strings are object arrays (None for
+        missing values), the others are float arrays (NaN for missing values).
+    """
+    with open(filename, 'rb') as f:
+        columns = _read_header(f)
+        chunks = list(_read_chunks(f))
+        strings = [s for nrows, ncols, descriptor, offset in chunks for s in descriptor['strings']]
+        f.seek(0)
+        raw = f.read()
+    blocks = [np.frombuffer(raw, '<f8', nrows * ncols, offset).reshape(ncols, nrows)
+              for nrows, ncols, descriptor, offset in chunks]
+    if not blocks:
+        return np.zeros(0), {c: np.zeros(0) for c in columns}
+    data = np.concatenate(blocks, axis=1)
+    result = {}
+    stringtable = np.array(strings + [None], dtype=object)
+    for icol, column in enumerate(columns):
+        values = data[icol + 1]
+        if not any(descriptor['kinds'][icol + 1] == 'c' for nrows, ncols, descriptor, offset in chunks):
+            result[column] = values.copy()
+            continue
+        # at least a part of this column consists of strings
+        parts = []
+        start = 0
+        for nrows, ncols, descriptor, offset in chunks:
+            part = values[start:start + nrows]
+            if descriptor['kinds'][icol + 1] == 'c':
+                codes = np.where(np.isfinite(part), part, len(strings)).astype(np.intp)
+                parts.append(stringtable[codes])
+            else:
+                parts.append(np.array([None if not np.isfinite(v) else str(v) for v in part], dtype=object))
+            start += nrows
+        result[column] = np.concatenate(parts)
+    return data[0].copy(), result
+
+
+def read_binary_log_times(filename: str) -> np.ndarray:
+    """Load only the timestamps of a binary log file written by `BinaryLogWriter`. Only the first column of each
+    chunk is read, which is much faster than `read_binary_log()`."""
+    with open(filename, 'rb') as f:
+        _read_header(f)
+        chunks = list(_read_chunks(f))
+        parts = []
+        for nrows, ncols, descriptor, offset in chunks:
+            f.seek(offset)
+            parts.append(np.frombuffer(f.read(8 * nrows), '<f8'))
+    if not parts:
+        return np.zeros(0)
+    return np.concatenate(parts)
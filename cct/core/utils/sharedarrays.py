@@ -0,0 +1,176 @@
+"""Transport of large NumPy arrays between processes through shared memory.
+
+The producer side (`SharedArrayRing`) owns a small ring of shared memory
+segments ("slots"). Arrays are copied into a free slot once, and only a small,
+picklable `SharedArrayDescriptor` needs to be passed through a queue. The
+consumer side (`SharedArrayReader`) attaches to the slots and hands out
+zero-copy NumPy views. A slot is given back to the producer only when the
+consumer has finished with the job and no views on the slot are alive.
+"""
+import logging
+import weakref
+from multiprocessing import shared_memory
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# data blocks inside a slot are aligned to this many bytes
+_ALIGNMENT = 64
+
+
+def _align(nbytes: int) -> int:
+    return (nbytes + _ALIGNMENT - 1) // _ALIGNMENT * _ALIGNMENT
+
+
+class SharedArrayDescriptor(object):
+    """Picklable description of a set of arrays stored in a shared memory slot.
+
+    `arrays` is a dictionary of name -> (dtype string, shape, offset).
+    """
+
+    def __init__(self, slot: int, shmname: str, arrays: Dict[str, Tuple[str, Tuple[int, ...], int]]):
+        self.slot = slot
+        self.shmname = shmname
+        self.arrays = arrays
+
+
+class SharedArrayRing(object):
+    """Producer side: a ring of shared memory segments.
+
+    Segments are created lazily and grown on demand. If every slot is in use
+    (i.e. not yet released by the consumer), `store()` returns None and the
+    caller is expected to fall back to sending the arrays in the usual way.
+    """
+
+    def __init__(self, nslots: int):
+        self._segments = [None] * nslots  # type: List[Optional[shared_memory.SharedMemory]]
+        self._free = list(range(nslots))
+
+    def store(self, arrays: Dict[str, np.ndarray]) -> Optional[SharedArrayDescriptor]:
+        """Copy the arrays into a free slot and return the descriptor, or None
+        if no slot is available."""
+        if not self._free:
+            return None
+        layout = {}
+        nbytes = 0
+        for name, array in arrays.items():
+            layout[name] = (array.dtype.str, array.shape, nbytes)
+            nbytes += _align(array.nbytes)
+        slot = self._free.pop(0)
+        segment = self._segments[slot]
+        if (segment is None) or (segment.size < nbytes):
+            if segment is not None:
+                # the consumer has already released this slot, so nobody uses the old segment.
+                segment.close()
+                segment.unlink()
+            segment = self._segments[slot] = shared_memory.SharedMemory(create=True, size=max(nbytes, 1))
+            logger.debug('Allocated shared memory slot #{:d}: {} ({:d} bytes)'.format(slot, segment.name, nbytes))
+        for name, array in arrays.items():
+            dtype, shape, offset = layout[name]
+            np.copyto(np.ndarray(shape, dtype, buffer=segment.buf, offset=offset), array, casting='no')
+        return SharedArrayDescriptor(slot, segment.name, layout)
+
+    def release(self, slot: int):
+        """Mark a slot free again."""
+        if slot not in self._free:
+            self._free.append(slot)
+
+    def close(self):
+        """Destroy all the shared memory segments"""
+        for segment in self._segments:
+            if segment is not None:
+                segment.close()
+                segment.unlink()
+        self._segments = [None] * len(self._segments)
+        self._free = list(range(len(self._segments)))
+
+
+class SharedArrayReader(object):
+    """Consumer side: attach to the slots of a `SharedArrayRing` and give
+    zero-copy views on them.
+
+    The workflow is:
+        1) `arrays()` for each descriptor received
+        2) `finish()` when the job the descriptors belong to is done
+        3) `collect()` periodically: returns the slot indices which can be
+            released to the producer.
+    """
+
+    def __init__(self):
+        self._segments = {}  # slot index -> attached SharedMemory instance
+        self._pending = {}  # slot index -> (job, weak reference to the array owning the views)
+        self._finishedjobs = set()
+
+    def _attach(self, descriptor: SharedArrayDescriptor) -> shared_memory.SharedMemory:
+        try:
+            segment = self._segments[descriptor.slot]
+        except KeyError:
+            segment = None
+        if (segment is not None) and (segment.name.lstrip('/') == descriptor.shmname.lstrip('/')):
+            return segment
+        if segment is not None:
+            # the producer re-allocated the slot with a larger size.
+            segment.close()
+        segment = shared_memory.SharedMemory(name=descriptor.shmname)
+        try:
+            # The segment is owned by the producer, which is responsible for unlinking. Do not let the resource
+            # tracker of this process destroy it on exit.
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(segment._name, 'shared_memory')
+        except (ImportError, AttributeError, KeyError):
+            pass
+        self._segments[descriptor.slot] = segment
+        return segment
+
+    def arrays(self, descriptor: SharedArrayDescriptor, job=None) -> Dict[str, np.ndarray]:
+        """Get zero-copy views of the arrays in a slot.
+
+        `job` is an arbitrary hashable key, which identifies the unit of
+        work this slot belongs to (see `finish()`).
+        """
+        segment = self._attach(descriptor)
+        # All the views share a common base array, which is alive as long as any of the views (or views of the views)
+        # are referenced from anywhere. If the same slot is unpacked more than once, reuse the previous base array.
+        owner = None
+        if descriptor.slot in self._pending:
+            owner = self._pending[descriptor.slot][1]()
+        if owner is None:
+            owner = np.ndarray((segment.size,), np.uint8, buffer=segment.buf)
+        result = {}
+        for name, (dtype, shape, offset) in descriptor.arrays.items():
+            dtype = np.dtype(dtype)
+            count = int(np.prod(shape, dtype=np.int64))
+            result[name] = owner[offset:offset + count * dtype.itemsize].view(dtype).reshape(shape)
+        self._pending[descriptor.slot] = (job, weakref.ref(owner))
+        return result
+
+    def finish(self, job):
+        """Signify that no more descriptors are expected for `job`."""
+        self._finishedjobs.add(job)
+
+    def collect(self) -> List[int]:
+        """Return the indices of the slots which can be given back to the
+        producer: their job is finished and no views are referenced anymore."""
+        released = []
+        for slot, (job, ownerref) in list(self._pending.items()):
+            if (job in self._finishedjobs) and (ownerref() is None):
+                del self._pending[slot]
+                released.append(slot)
+        stillused = {job for job, ownerref in self._pending.values()}
+        self._finishedjobs.intersection_update(stillused)
+        return released
+
+    def close(self):
+        """Detach from all the shared memory segments."""
+        for segment in self._segments.values():
+            try:
+                segment.close()
+            except BufferError:
+                # views are still alive, the memory will be unmapped when they are garbage collected.
+                pass
+        self._segments = {}
+        self._pending = {}
+        self._finishedjobs = set()
@@ -0,0 +1,388 @@
+"""Time series of numeric records (e.g. telemetry), kept in ring buffers at several resolutions and optionally
+appended to binary log files (see `logwriter.BinaryLogWriter`).
+
+Each series has a fixed list of columns. The most recent records are kept as they are, older ones are available
+as averages over longer and longer intervals: a query for a long time range is served from a coarse level, thus
+plotting hours of history needs only a few thousand points.
+"""
+import glob
+import logging
+import math
+import os
+import re
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .logwriter import BinaryLogWriter, read_binary_log, read_binary_log_times
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+class RingLevel(object):
+    """A ring buffer of records at a given resolution.
+
+    :param interval: records are averaged over time bins of this length (seconds). Zero means no averaging.
+    :param capacity: the maximum number of records kept
+    :param ncolumns: the number of columns
+    """
+
+    def __init__(self, interval: float, capacity: int, ncolumns: int):
+        self.interval = interval
+        self.capacity = capacity
+        self.times = np.empty(capacity, np.float64)
+        self.data = np.empty((capacity, ncolumns), np.float64)
+        self.count = 0  # the number of records written so far, including the already overwritten ones
+        self.complete_until = -math.inf  # all the records before this time stamp have been included
+        # the bin being averaged: index, sum of the time stamps, sum of the values and number of the values
+        self._bin = None
+        self._bintimesum = 0.0
+        self._binsum = np.zeros(ncolumns, np.float64)
+        self._binvalues = np.zeros(ncolumns, np.int64)
+        self._binrecords = 0
+
+    def add_columns(self, n: int):
+        self.data = np.hstack((self.data, np.full((self.capacity, n), np.nan)))
+        self._binsum = np.concatenate((self._binsum, np.zeros(n)))
+        self._binvalues = np.concatenate((self._binvalues, np.zeros(n, np.int64)))
+
+    def _push(self, timestamp: float, values: np.ndarray):
+        self.times[self.count % self.capacity] = timestamp
+        self.data[self.count % self.capacity] = values
+        self.count += 1
+
+    def append(self, timestamp: float, values: np.ndarray):
+        if self.interval <= 0:
+            self._push(timestamp, values)
+            self.complete_until = timestamp
+            return
+        binindex = math.floor(timestamp / self.interval)
+        if (self._bin is not None) and (binindex != self._bin):
+            self.close_bin()
+        self._bin = binindex
+        valid = np.isfinite(values)
+        self._bintimesum += timestamp
+        self._binrecords += 1
+        self._binsum += np.where(valid, values, 0)
+        self._binvalues += valid
+
+    def close_bin(self):
+        """Store the average of the current bin"""
+        if not self._binrecords:
+            return
+        with np.errstate(invalid='ignore', divide='ignore'):
+            self._push(self._bintimesum / self._binrecords,
+                       np.where(self._binvalues > 0, self._binsum / self._binvalues, np.nan))
+        self.complete_until = (self._bin + 1) * self.interval
+        self._bin = None
+        self._bintimesum = 0.0
+        self._binsum[:] = 0
+        self._binvalues[:] = 0
+        self._binrecords = 0
+
+    def __len__(self) -> int:
+        return min(self.count, self.capacity)
+
+    def first_time(self) -> float:
+        """The time stamp of the oldest record kept, or +inf if empty"""
+        if not self.count:
+            return math.inf
+        return float(self.times[self.count % self.capacity if self.count > self.capacity else 0])
+
+    def get(self, start: float, end: float) -> Tuple[np.ndarray, np.ndarray]:
+        """The records with `start` <= time stamp <= `end`, in chronological order."""
+        if self.count > self.capacity:
+            head = self.count % self.capacity
+            times = np.concatenate((self.times[head:], self.times[:head]))
+            data = np.concatenate((self.data[head:], self.data[:head]))
+        else:
+            times = self.times[:self.count]
+            data = self.data[:self.count]
+        i1 = np.searchsorted(times, start, side='left')
+        i2 = np.searchsorted(times, end, side='right')
+        return times[i1:i2].copy(), data[i1:i2].copy()
+
+
+def downsample(times: np.ndarray, data: np.ndarray, maxpoints: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Average consecutive records so that at most `maxpoints` remain."""
+    if (maxpoints is None) or (len(times) <= maxpoints):
+        return times, data
+    step = int(math.ceil(len(times) / maxpoints))
+    n = len(times) // step * step
+    # the records not filling a whole group at the end are averaged separately
+    groups_t = [times[:n].reshape(-1, step).mean(axis=1)]
+    with np.errstate(invalid='ignore'):
+        valid = np.isfinite(data[:n]).reshape(-1, step, data.shape[1])
+        sums = np.where(valid, data[:n].reshape(-1, step, data.shape[1]), 0).sum(axis=1)
+        groups_d = [np.where(valid.any(axis=1), sums / valid.sum(axis=1), np.nan)]
+        if n < len(times):
+            groups_t.append(times[n:].mean(keepdims=True))
+            groups_d.append(np.nanmean(data[n:], axis=0, keepdims=True)
+                            if np.isfinite(data[n:]).any() else np.full((1, data.shape[1]), np.nan))
+    return np.concatenate(groups_t), np.concatenate(groups_d)
+
+
+class TimeSeries(object):
+    """A series of records: a time stamp and the values of some columns. Missing values are NaNs.
+
+    :param columns: the names of the columns. More can be added later by `add_columns()`.
+    :param capacity: the number of the most recent records kept without averaging
+    :param levels: (interval, capacity) tuples for the averaged levels, from the finest to the coarsest.
+    """
+
+    def __init__(self, columns: Sequence[str], capacity: int, levels: Sequence[Tuple[float, int]] = ()):
+        self.columns = list(columns)
+        self._columnindex = {c: i for i, c in enumerate(self.columns)}
+        self.levels = [RingLevel(0, capacity, len(self.columns))] + [
+            RingLevel(interval, cap, len(self.columns)) for interval, cap in levels]
+
+    def has_column(self, column: str) -> bool:
+        return column in self._columnindex
+
+    def add_columns(self, columns: Sequence[str]):
+        columns = [c for c in columns if c not in self._columnindex]
+        if not columns:
+            return
+        for c in columns:
+            self._columnindex[c] = len(self.columns)
+            self.columns.append(c)
+        for level in self.levels:
+            level.add_columns(len(columns))
+
+    def append(self, timestamp: float, values: Sequence[float]):
+        values = np.asarray(values, np.float64)
+        for level in self.levels:
+            level.append(timestamp, values)
+
+    def get(self, start: float = -math.inf, end: float = math.inf, columns: Optional[Sequence[str]] = None,
+            maxpoints: Optional[int] = None) -> Tuple[np.ndarray, Dict[str, np.ndarray]]:
+        """Get the records between `start` and `end`.
+
+        The finest level reaching back to `start` is used. If none of them does, the one reaching back the
+        farthest. The most recent records, not yet averaged in that level, are taken from the finer levels.
+
+        :param start: the first time stamp
+        :param end: the last time stamp
+        :param columns: the columns to return. None means all.
+        :param maxpoints: if more records are found, consecutive ones are averaged.
+        :return: the time stamps and a dictionary of the columns
+        """
+        level = min((lev for lev in self.levels if len(lev)), key=lambda lev: lev.first_time(), default=None)
+        for lev in self.levels:
+            if len(lev) and lev.first_time() <= start:
+                level = lev
+                break
+        if columns is None:
+            columns = self.columns
+        if level is None:
+            return np.zeros(0), {c: np.zeros(0) for c in columns}
+        times, data = level.get(start, end)
+        complete_until = level.complete_until
+        for finer in reversed(self.levels[:self.levels.index(level)]):
+            t, d = finer.get(max(start, complete_until), end)
+            t, d = t[t >= complete_until], d[t >= complete_until]
+            times, data = np.concatenate((times, t)), np.concatenate((data, d))
+            complete_until = max(complete_until, finer.complete_until)
+        times, data = downsample(times, data, maxpoints)
+        return times, {c: data[:, self._columnindex[c]] for c in columns}
+
+
+class TimeSeriesStore(object):
+    """A collection of time series, named by labels. Columns are added to a series as they appear.
+
+    If `directory` is given, the records are also appended to binary log files there (one file for each series at a
+    time; a new one is started whenever the columns of a series change or the file grows larger than
+    `max_file_size`). `get()` reads these files if the requested time range reaches back before the oldest record in
+    memory, e.g. in a previous session. The time range of each file is kept in an index, thus only the files
+    overlapping the requested range are read. Files older than `retention` are deleted.
+
+    :param directory: the directory for the log files, or None to keep the data in memory only.
+    :param capacity: see `TimeSeries`
+    :param levels: see `TimeSeries`
+    :param flush_interval: see `logwriter.BufferedLogWriter`
+    :param default_window: the length of the time range (seconds) returned by `get()` if `start` is not given.
+    :param max_file_size: the approximate maximum size of a log file (bytes)
+    :param retention: log files with all their records older than this (seconds) are deleted when the store is
+        created and whenever a new file is started. None means keeping them forever.
+    """
+
+    def __init__(self, directory: Optional[str] = None, capacity: int = 3600,
+                 levels: Sequence[Tuple[float, int]] = ((10, 2160), (120, 2160)), flush_interval: float = 60,
+                 default_window: float = 86400, max_file_size: int = 16 * 1024 * 1024,
+                 retention: Optional[float] = None):
+        self.directory = directory
+        self.capacity = capacity
+        self.levels = levels
+        self.flush_interval = flush_interval
+        self.default_window = default_window
+        self.max_file_size = max_file_size
+        self.retention = retention
+        self.series = {}  # type: Dict[str, TimeSeries]
+        self._writers = {}  # type: Dict[str, BinaryLogWriter]
+        self._written = {}  # type: Dict[str, int]  # approximate size of the file being written, for each label
+        # file name -> (size, first time stamp, last time stamp). Files are only appended, a change in the size
+        # means new records.
+        self._fileindex = {}  # type: Dict[str, Tuple[int, float, float]]
+        if self.directory is not None:
+            os.makedirs(self.directory, exist_ok=True)
+            self.remove_old_files()
+
+    @staticmethod
+    def _filename_label(label: str) -> str:
+        return re.sub(r'[^\w.+-]', '_', label)
+
+    def _logfiles(self, label: str) -> Dict[int, str]:
+        """The log files of a series, by their serial numbers. The file names of other series can begin with the
+        same characters (e.g. 'a.b.0.binlog' for 'a.b' and 'a.0.binlog' for 'a'), thus only '<label>.<serial>.binlog'
+        is accepted."""
+        regex = re.compile(re.escape(self._filename_label(label)) + r'\.(\d+)\.binlog$')
+        files = {}
+        for f in os.listdir(self.directory):
+            m = regex.match(f)
+            if m is not None:
+                files[int(m.group(1))] = os.path.join(self.directory, f)
+        return files
+
+    def _open_writer(self, label: str):
+        if label in self._writers:
+            self._writers[label].close()
+        filename = os.path.join(self.directory, '{}.{:d}.binlog'.format(
+            self._filename_label(label), max(self._logfiles(label), default=-1) + 1))
+        self._writers[label] = BinaryLogWriter(filename, self.series[label].columns,
+                                               flush_interval=self.flush_interval)
+        self._written[label] = 0
+        self.remove_old_files()
+
+    def record(self, label: str, timestamp: float, values: Dict[str, float]):
+        """Append a record to a series (created if needed)"""
+        try:
+            series = self.series[label]
+        except KeyError:
+            series = self.series[label] = TimeSeries(sorted(values), self.capacity, self.levels)
+            if self.directory is not None:
+                self._open_writer(label)
+        newcolumns = [c for c in values if not series.has_column(c)]
+        if newcolumns:
+            series.add_columns(sorted(newcolumns))
+            if self.directory is not None:
+                self._open_writer(label)
+        row = [values.get(c, math.nan) for c in series.columns]
+        series.append(timestamp, row)
+        if label in self._writers:
+            self._writers[label].write(timestamp, row)
+            self._written[label] += 8 * (len(row) + 1)
+            if self._written[label] >= self.max_file_size:
+                self._open_writer(label)
+
+    def labels(self) -> List[str]:
+        return sorted(self.series)
+
+    def get(self, label: str, start: Optional[float] = None, end: float = math.inf,
+            columns: Optional[Sequence[str]] = None,
+            maxpoints: Optional[int] = None) -> Tuple[np.ndarray, Dict[str, np.ndarray]]:
+        """Get the records of a series. See `TimeSeries.get()` for the arguments. If `start` is None, the records
+        of the last `default_window` seconds before `end` (or before now, if `end` is infinite) are returned. Use
+        -math.inf explicitly to get all the records."""
+        if start is None:
+            start = (time.time() if math.isinf(end) else end) - self.default_window
+        series = self.series.get(label)
+        if series is not None:
+            oldest = min((lev.first_time() for lev in series.levels), default=math.inf)
+        else:
+            oldest = math.inf
+        if (self.directory is None) or (start >= oldest):
+            if series is None:
+                raise KeyError(label)
+            return series.get(start, end, columns, maxpoints)
+        # read the older data from the files. `end` is inclusive here, but exclusive in read_files().
+        times, data = self.read_files(label, start, min(np.nextafter(end, math.inf), oldest))
+        if columns is None:
+            columns = sorted(set(data).union(series.columns if series is not None else []))
+        if series is not None and end >= oldest:
+            t2, d2 = series.get(oldest, end, [c for c in columns if c in series.columns])
+            times = np.concatenate((times, t2))
+            data = {c: np.concatenate((data.get(c, np.full(len(times) - len(t2), np.nan)),
+                                       d2.get(c, np.full(len(t2), np.nan)))) for c in columns}
+        matrix = np.stack([np.asarray(data.get(c, np.full(len(times), np.nan)), np.float64) for c in columns],
+                          axis=1) if columns else np.zeros((len(times), 0))
+        times, matrix = downsample(times, matrix, maxpoints)
+        return times, {c: matrix[:, i] for i, c in enumerate(columns)}
+
+    def read_files(self, label: str, start: float = -math.inf,
+                   end: float = math.inf) -> Tuple[np.ndarray, Dict[str, np.ndarray]]:
+        """Read the records of a series from the log files. Records with `start` <= time stamp < `end` are
+        returned, in chronological order."""
+        for writer in self._writers.values():
+            writer.flush()
+        parts = []
+        for filename in self._logfiles(label).values():
+            first, last = self.file_timerange(filename)
+            if (last < start) or (first >= end):
+                continue
+            try:
+                times, columns = read_binary_log(filename)
+            except (OSError, ValueError, EOFError) as exc:
+                logger.warning('Cannot read time series file {}: {}'.format(filename, exc))
+                continue
+            selected = (times >= start) & (times < end)
+            if selected.any():
+                parts.append((times[selected], {c: np.asarray(v[selected], np.float64)
+                                                for c, v in columns.items() if v.dtype.kind == 'f'}))
+        if not parts:
+            return np.zeros(0), {}
+        allcolumns = sorted(set().union(*[d for t, d in parts]))
+        times = np.concatenate([t for t, d in parts])
+        order = np.argsort(times, kind='stable')
+        data = {c: np.concatenate([d.get(c, np.full(len(t), np.nan)) for t, d in parts])[order]
+                for c in allcolumns}
+        return times[order], data
+
+    def file_timerange(self, filename: str) -> Tuple[float, float]:
+        """The first and the last time stamp in a log file, from the index if the file has not changed since it
+        was indexed. (+inf, -inf) for empty files, (-inf, +inf) for unreadable ones, so that the latter are not
+        skipped by `read_files()`, which reports the error."""
+        try:
+            size = os.path.getsize(filename)
+        except OSError:
+            return -math.inf, math.inf
+        try:
+            indexedsize, first, last = self._fileindex[filename]
+            if indexedsize == size:
+                return first, last
+        except KeyError:
+            pass
+        try:
+            times = read_binary_log_times(filename)
+        except (OSError, ValueError, EOFError):
+            return -math.inf, math.inf
+        first, last = (float(times.min()), float(times.max())) if len(times) else (math.inf, -math.inf)
+        self._fileindex[filename] = (size, first, last)
+        return first, last
+
+    def remove_old_files(self):
+        """Delete the log files, which only contain records older than `retention` seconds. The files being
+        written are kept."""
+        if (self.directory is None) or (self.retention is None):
+            return
+        limit = time.time() - self.retention
+        writing = {writer.filename for writer in self._writers.values()}
+        for filename in glob.glob(os.path.join(glob.escape(self.directory), '*.binlog')):
+            if filename in writing:
+                continue
+            first, last = self.file_timerange(filename)
+            if first <= last < limit:
+                try:
+                    os.remove(filename)
+                except OSError as exc:
+                    logger.warning('Cannot remove old time series file {}: {}'.format(filename, exc))
+                    continue
+                logger.info('Removed old time series file {}'.format(filename))
+                del self._fileindex[filename]
+
+    def close(self):
+        """Close the log files"""
+        for writer in self._writers.values():
+            writer.close()
+        self._writers = {}
@@ -4,12 +4,12 @@ from sastool.io import credo_cct, credo_saxsctrl
 from sastool.classes2 import Header
 import os
 import sqlite3
-import pickle
 import datetime
 import argparse
 import pkg_resources
 import numpy as np
 from .sequences import findsequences
+from ..core.utils.configtools import read_config_file
 
 try:
     import pymysql.cursors
@@ -79,8 +79,7 @@ def run():
 
 
     try:
-        with open('config/cct.pickle', 'rb') as f:
-            config = pickle.load(f)
+        config = read_config_file('config/cct.config', ['config/cct.pickle'])
     except FileNotFoundError:
         config={
             'path':{'directories':{'eval2d':'eval2d',
@@ -10,6 +10,7 @@ from PyQt5 import QtWidgets, QtCore
 from .fsnrangemodel import FSNRangeModel
 from .iotool_ui import Ui_Form
 from ..toolbase import ToolBase, HeaderModel
+from ....core.utils.configtools import read_config_file
 
 
 class IoTool(ToolBase, Ui_Form):
@@ -112,17 +113,17 @@ class IoTool(ToolBase, Ui_Form):
 
     def setRootDir(self, rootdir: str):
         self.rootdir = rootdir
-        configfile = os.path.join(self.rootdir, 'config', 'cct.pickle')
+        configfile = os.path.join(self.rootdir, 'config', 'cct.config')
         try:
-            with open(configfile, 'rb') as f:
-                self.cctConfigChanged.emit(pickle.load(f))
+            self.cctConfigChanged.emit(
+                read_config_file(configfile, [os.path.join(self.rootdir, 'config', 'cct.pickle')]))
         except FileNotFoundError:
             QtWidgets.QMessageBox.warning(self, 'Error while loading config file',
                                           'Error while loading config file: {} not found. Using a default config.'.format(
                                               configfile))
             self.cctConfigChanged.emit(self._default_config)
             return False
-        except pickle.PickleError:
+        except (pickle.PickleError, ValueError):
             QtWidgets.QMessageBox.critical(self, 'Error while loading config file',
                                            'Error while loading config file: {} is malformed'.format(configfile))
             return False
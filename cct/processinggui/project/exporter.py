@@ -0,0 +1,283 @@
+"""A mechanism to export the results (curves, patterns, correlation matrices) to files using the `multiprocessing`
+module.
+
+The data are read from the HDF5 file in the main thread, in as few locked sessions as possible, and the files are
+formatted and written by a pool of worker processes.
+"""
+import gzip
+import logging
+import os
+from multiprocessing import Pool, cpu_count
+from multiprocessing.pool import AsyncResult
+from typing import Sequence, List, Optional, Tuple, Dict, Any, Callable
+
+import numpy as np
+import openpyxl
+import openpyxl.utils
+from PyQt5 import QtCore
+from scipy.io import savemat
+
+from .h5reader import H5Reader
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+def _savetxt(f, array: np.ndarray, fmt: Optional[str] = None):
+    """The same as `np.savetxt()`, but formats all the rows with a single % operation instead of one by one."""
+    if fmt is None:
+        fmt = ' '.join(['%.18e'] * array.shape[1])
+    f.write(((fmt + '\n') * len(array)) % tuple(array.ravel().tolist()))
+
+
+def _writeHeader(f, header: Dict[str, Any]):
+    f.write(''.join('# {} : {}\n'.format(key, header[key]) for key in sorted(header)))
+
+
+def writeCurveASCII(filename: str, curve: np.ndarray, header: Dict[str, Any], title: str):
+    """Four columns: q, intensity, error, q error"""
+    with open(filename, 'wt') as f:
+        _writeHeader(f, header)
+        f.write('# Columns:\n')
+        f.write('#  q [1/nm],  Intensity [1/cm * 1/sr], '
+                'Propagated uncertainty of the intensity [1/cm * 1/sr], Propagated uncertainty of q [1/nm]\n')
+        _savetxt(f, curve[:, :4])
+
+
+def writeCurveDAT(filename: str, curve: np.ndarray, header: Dict[str, Any], title: str):
+    """Three columns: q, intensity, error"""
+    with open(filename, 'wt') as f:
+        _writeHeader(f, header)
+        f.write('# Columns:\n')
+        f.write('#  q [1/nm],  Intensity [1/cm * 1/sr], Propagated uncertainty of the intensity [1/cm * 1/sr]\n')
+        _savetxt(f, curve[:, :3])
+
+
+def writeCurveATSAS(filename: str, curve: np.ndarray, header: Dict[str, Any], title: str):
+    """Three columns: q (in 1/A), intensity, error"""
+    with open(filename, 'wt') as f:
+        _writeHeader(f, header)
+        f.write('# Columns:\n')
+        f.write('#  q [1/A],  Intensity [1/cm * 1/sr], Propagated uncertainty of the intensity [1/cm * 1/sr]\n')
+        _savetxt(f, np.column_stack((curve[:, 0] / 10, curve[:, 1], curve[:, 2])))
+
+
+def writeCurveRSR(filename: str, curve: np.ndarray, header: Dict[str, Any], title: str):
+    with open(filename, 'wt') as f:
+        f.write(' TIME\n')
+        f.write(' 1.0\n')
+        f.write(' {}\n'.format(len(curve)))
+        _savetxt(f, np.column_stack((curve[:, 0] / 10., curve[:, 1], curve[:, 2], np.ones(len(curve)))),
+                 ' %.9f %.9f %.9f %d')
+
+
+def writeCurvePDH(filename: str, curve: np.ndarray, header: Dict[str, Any], title: str):
+    with open(filename, 'wt') as f:
+        f.write('{}\n'.format(title))
+        f.write('SAXS\n')
+        f.write('{:>9d} {:>9d} {:>9d} {:>9d} {:>9d} {:>9d} {:>9d} {:>9d}\n'.format(len(curve), 0, 0, 0, 0, 0, 0, 0))
+        f.write('{:>14.6E} {:>14.6E} {:>14.6E} {:>14.6E} {:>14.6E}\n'.format(0, 0, 0, 1, 0))
+        f.write('{:>14.6E} {:>14.6E} {:>14.6E} {:>14.6E} {:>14.6E}\n'.format(0, 0, 0, 0, 0))
+        _savetxt(f, np.column_stack((curve[:, 0] / 10, curve[:, 1], curve[:, 2])), '%14.6E %14.6E %14.6E')
+
+
+curvewriters = {
+    'ASCII (*.txt)': (writeCurveASCII, '.txt'),
+    'ASCII (*.dat)': (writeCurveDAT, '.dat'),
+    'ATSAS (*.dat)': (writeCurveATSAS, '.dat'),
+    'RSR (*.rsr)': (writeCurveRSR, '.rsr'),
+    'PDH (*.pdh)': (writeCurvePDH, '.pdh'),
+}
+
+
+def writeCurvesXLSX(filename: str, curves: Sequence[Tuple[str, np.ndarray]]):
+    """Write the curves to separate sheets of a workbook. The first sheet ('Summary') refers to all of them, side by
+    side."""
+    wb = openpyxl.Workbook()
+    ws_main = wb.active
+    ws_main.title = 'Summary'
+    summaryrows = []
+    for sheetindex, (sheetname, curve) in enumerate(curves):
+        ws = wb.create_sheet(sheetname)
+        ws_main.cell(row=1, column=4 * sheetindex + 1, value=sheetname)
+        ws_main.merge_cells(start_row=1, start_column=4 * sheetindex + 1, end_row=1, end_column=4 * sheetindex + 4)
+        ws.append(['q', 'Intensity', 'dIntensity', 'dq'])
+        ws.append(['1/nm', '1/cm * 1/sr', '1/cm * 1/sr', '1/nm'])
+        for row in curve[:, :4].tolist():
+            ws.append(row)
+        quotedname = openpyxl.utils.quote_sheetname(sheetname)
+        for row in range(1, 3 + len(curve) + 1):
+            if len(summaryrows) < row:
+                summaryrows.append([None] * (4 * sheetindex))
+            summaryrows[row - 1].extend(
+                ['={}!{}{}'.format(quotedname, openpyxl.utils.get_column_letter(column), row)
+                 for column in range(1, 5)])
+        for summaryrow in summaryrows[3 + len(curve):]:
+            # pad the rows below the end of this curve
+            summaryrow.extend([None] * 4)
+    for summaryrow in summaryrows:
+        ws_main.append(summaryrow)
+    wb.save(filename)
+
+
+def writeArrays(basename: str, fileformat: str, arrays: Dict[str, np.ndarray]):
+    """Save 2D arrays in one of the pattern file formats.
+
+    Numpy and Matlab(TM) files contain all the arrays under their names. ASCII formats need a separate file for each
+    array: the name of the array is appended to `basename`, unless there is only one array.
+    """
+    if fileformat == 'Numpy (*.npz)':
+        np.savez_compressed(basename + '.npz', **arrays)
+    elif fileformat == 'Matlab(TM) (*.mat)':
+        savemat(basename + '.mat', arrays, do_compression=True)
+    elif fileformat in ['Gzip-ped ASCII (*.txt.gz)', 'ASCII (*.txt)']:
+        gzipped = fileformat.lower().startswith('gzip')
+        for name, array in arrays.items():
+            filename = (basename if len(arrays) == 1 else basename + '_' + name) + ('.txt.gz' if gzipped else '.txt')
+            with (gzip.open(filename, 'wt') if gzipped else open(filename, 'wt')) as f:
+                _savetxt(f, array)
+    else:
+        raise ValueError('Unknown file format: {}'.format(fileformat))
+
+
+class Exporter(QtCore.QObject):
+    TIMERINTERVAL: int = 100  # milliseconds
+    IMAGEBATCHSIZE: int = 8  # averaged images are read in batches of this size, to limit the memory usage
+    pool: Optional[Pool]
+    outstanding: List[Tuple[AsyncResult, int, str]]  # async result, number of results written, file name
+    errors: List[str]
+    finished = QtCore.pyqtSignal()  # exporting finished.
+    progress = QtCore.pyqtSignal(int, int)  # total count, ready count
+    timerid: int = 0
+
+    def __init__(self, nprocesses: Optional[int] = None):
+        super().__init__()
+        self.pool = None  # do not create a pool yet
+        self.nprocesses = nprocesses if nprocesses is not None else cpu_count()
+        self.outstanding = []
+        self.errors = []
+        self.total = 0
+        self.done = 0
+        self._batches = []
+        self._submitBatch = None
+
+    @property
+    def idle(self) -> bool:
+        return (not self.outstanding) and (not self._batches)
+
+    def exportCurves(self, h5reader: H5Reader, results: Sequence[Tuple[str, float]], folder: str, fileformat: str):
+        if (fileformat not in curvewriters) and (fileformat != 'Excel 2007- (*.xlsx)'):
+            raise ValueError('Unknown 1D file format: {}'.format(fileformat))
+
+        def submit(batch: List[Tuple[str, float]]):
+            data = h5reader.averagedCurvesAndHeaders(batch)
+            self._skipMissing(batch, data)
+            if fileformat == 'Excel 2007- (*.xlsx)':
+                filename = os.path.join(folder, 'SAXS_curves.xlsx')
+                self._submit(len(data), filename, writeCurvesXLSX, filename,
+                             [('{}_{:.2f}'.format(sample, float(distance)), data[(sample, distance)][0])
+                              for sample, distance in batch if (sample, distance) in data])
+                return
+            writer, extn = curvewriters[fileformat]
+            for sample, distance in batch:
+                if (sample, distance) not in data:
+                    continue
+                curve, header = data[(sample, distance)]
+                filename = os.path.join(folder, '{}_{:.2f}{}'.format(sample, float(distance), extn))
+                self._submit(1, filename, writer, filename, curve, header,
+                             '{} @ {:.2f}'.format(sample, float(distance)))
+
+        self._start(results, len(results), submit)
+
+    def exportPatterns(self, h5reader: H5Reader, results: Sequence[Tuple[str, float]], folder: str,
+                       fileformat: str):
+        def submit(batch: List[Tuple[str, float]]):
+            exposures = h5reader.averagedImages(batch)
+            self._skipMissing(batch, exposures)
+            for (sample, distance), exposure in exposures.items():
+                basename = os.path.join(folder, '{}_{:.2f}'.format(sample, float(distance)))
+                self._submit(1, basename, writeArrays, basename, fileformat,
+                             {'intensity': exposure.intensity, 'error': exposure.error, 'mask': exposure.mask})
+
+        self._start(results, self.IMAGEBATCHSIZE, submit)
+
+    def exportCorrelMatrices(self, h5reader: H5Reader, results: Sequence[Tuple[str, float]], folder: str,
+                             fileformat: str):
+        def submit(batch: List[Tuple[str, float]]):
+            cmats = h5reader.getCorrMats(batch)
+            self._skipMissing(batch, cmats)
+            for (sample, distance), cmat in cmats.items():
+                basename = os.path.join(folder, 'correlmatrix_{}_{:.2f}'.format(sample, float(distance)))
+                self._submit(1, basename, writeArrays, basename, fileformat, {'correlmatrix': cmat})
+
+        self._start(results, len(results), submit)
+
+    def _start(self, results: Sequence[Tuple[str, float]], batchsize: int,
+               submitbatch: Callable[[List[Tuple[str, float]]], None]):
+        if not self.idle:
+            raise RuntimeError('Export is already running')
+        results = list(results)
+        logger.debug('Exporting {} results.'.format(len(results)))
+        self.total = len(results)
+        self.done = 0
+        self.errors = []
+        self._batches = [results[i:i + batchsize] for i in range(0, len(results), max(batchsize, 1))]
+        self._submitBatch = submitbatch
+        self.pool = Pool(self.nprocesses)
+        self.timerid = self.startTimer(self.TIMERINTERVAL)
+        self._feed()
+        self.progress.emit(self.total, self.done)
+
+    def _feed(self):
+        # keep the workers busy, but do not read more data than they can write in the meantime
+        while self._batches and (len(self.outstanding) < 2 * self.nprocesses):
+            batch = self._batches.pop(0)
+            try:
+                self._submitBatch(batch)
+            except OSError as exc:
+                logger.error('Cannot read results for exporting: {}'.format(exc))
+                self.errors.append('Cannot read {}: {}'.format(', '.join(s for s, d in batch), exc))
+                self.done += len(batch)
+
+    def _submit(self, count: int, filename: str, function: Callable, *args):
+        self.outstanding.append((self.pool.apply_async(function, args), count, filename))
+
+    def _skipMissing(self, batch: Sequence[Tuple[str, float]], data: Dict):
+        for sample, distance in batch:
+            if (sample, distance) not in data:
+                logger.warning('No results to export for sample {} at {:.2f}'.format(sample, float(distance)))
+                self.done += 1
+
+    def timerEvent(self, event: QtCore.QTimerEvent) -> None:
+        ready = [o for o in self.outstanding if o[0].ready()]  # select those which are ready
+        if (not ready) and self.outstanding:
+            # do not block the event loop
+            event.accept()
+            return
+        for asyncresult, count, filename in ready:
+            try:
+                asyncresult.get()
+            except Exception as exc:
+                logger.error('Error while exporting {}: {}'.format(filename, exc))
+                self.errors.append('{}: {}'.format(filename, exc))
+            self.done += count
+        self.outstanding = [o for o in self.outstanding if o not in ready]
+        self._feed()
+        self.progress.emit(self.total, self.done)
+        if self.idle:
+            # we have finished
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+            self.killTimer(self.timerid)
+            self.finished.emit()
+        event.accept()
+
+    def stop(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+            self.killTimer(self.timerid)
+        self.outstanding = []
+        self._batches = []
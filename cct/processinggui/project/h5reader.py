@@ -1,7 +1,7 @@
 import logging
 import time
 from multiprocessing.synchronize import Lock
-from typing import List, Union, Dict, Any, Optional
+from typing import List, Union, Dict, Any, Optional, Sequence, Tuple
 
 import h5py
 import numpy as np
@@ -121,3 +121,45 @@ class H5Reader:
                          np.array(group[fsn][:, 1]),
                          np.array(group[fsn][:, 2]),
                          np.array(group[fsn][:, 3]))
+
+    def averagedCurvesAndHeaders(self, results: Sequence[Tuple[str, Union[float, str]]]) -> Dict[
+            Tuple[str, Union[float, str]], Tuple[np.ndarray, Dict[str, Any]]]:
+        """Read the averaged curves (as (q, intensity, error, qerror) columns) and the header dictionaries of several
+        samples in a single session. Missing (sample, distance) pairs are left out of the result."""
+        dic = {}
+        with LockedHDF5File(self.h5lock, self.h5filename, 'r') as f:
+            for sample, distance in results:
+                try:
+                    group = f['Samples'][sample]['{:.2f}'.format(distance) if isinstance(distance, float) else distance]
+                    dic[(sample, distance)] = (np.array(group['curve'][:, :4]), dict(**group.attrs))
+                except KeyError:
+                    continue
+        return dic
+
+    def averagedImages(self, results: Sequence[Tuple[str, Union[float, str]]]) -> Dict[
+            Tuple[str, Union[float, str]], Exposure]:
+        """Read the averaged images of several samples in a single session. Missing (sample, distance) pairs are left
+        out of the result."""
+        dic = {}
+        with LockedHDF5File(self.h5lock, self.h5filename, 'r') as f:
+            for sample, distance in results:
+                try:
+                    dic[(sample, distance)] = Exposure.new_from_group(
+                        f['Samples'][sample]['{:.2f}'.format(distance) if isinstance(distance, float) else distance])
+                except KeyError:
+                    continue
+        return dic
+
+    def getCorrMats(self, results: Sequence[Tuple[str, Union[float, str]]]) -> Dict[
+            Tuple[str, Union[float, str]], np.ndarray]:
+        """Read the correlation matrices of several samples in a single session. Missing (sample, distance) pairs are
+        left out of the result."""
+        dic = {}
+        with LockedHDF5File(self.h5lock, self.h5filename, 'r') as f:
+            for sample, distance in results:
+                try:
+                    group = f['Samples'][sample]['{:.2f}'.format(distance) if isinstance(distance, float) else distance]
+                    dic[(sample, distance)] = np.array(group['correlmatrix'])
+                except KeyError:
+                    continue
+        return dic
@@ -8,6 +8,8 @@ from typing import Sequence, List, Optional, Tuple
 from PyQt5 import QtCore
 from sastool.io.credo_cct import Header
 
+from ...core.processing.fileindex import FileIndex
+
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
@@ -51,9 +53,19 @@ class HeaderLoader(QtCore.QObject):
         logger.debug('Submitting header loading jobs for {} fsns.'.format(len(self.fsns)))
         self.pool = Pool()
         self.results = []
-        self.outstanding = [self.pool.apply_async(loadHeader, [f, self.dirs, self.headerfileformat]) for f in self.fsns]
+        self.outstanding = []
+        # Resolve the file names here, from a single scan of the directories: the workers only need to open the
+        # files which really exist.
+        index = FileIndex(self.dirs)
+        for f in self.fsns:
+            path = index.find(self.headerfileformat.format(f))
+            if path is None:
+                self.results.append((f, None))
+            else:
+                self.outstanding.append(
+                    self.pool.apply_async(loadHeader, [f, [os.path.dirname(path)], self.headerfileformat]))
         self.timerid = self.startTimer(self.TIMERINTERVAL)
-        self.progress.emit(len(self.fsns), 0)
+        self.progress.emit(len(self.fsns), len(self.results))
 
     def timerEvent(self, event: QtCore.QTimerEvent) -> None:
         ready = [o for o in self.outstanding if o.ready()]  # select those which are ready
@@ -56,6 +56,7 @@ class ProcessingJobRecord(JobRecord):
                   'logcmat': project.config.logcorrelmatrix,
                   'qrange': qrange,
                   'bigmemorymode': False,
+                  'singlepassmode': True,
                   })
 
     def reap(self, project:"Project"):
@@ -128,6 +128,8 @@ class Project(QtWidgets.QWidget, Ui_projectWindow):
         self._processor.finalize()
         logger.debug('Finalizing _subtractor')
         self._subtractor.finalize()
+        logger.debug('Finalizing _resultsdispatcher')
+        self._resultsdispatcher.finalize()
         logger.debug('Finalized project.')
 
     def confirmSave(self):
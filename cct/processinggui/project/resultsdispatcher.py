@@ -4,12 +4,9 @@ import re
 from time import monotonic
 from typing import Sequence, Tuple, Optional
 
-import numpy as np
-import openpyxl
-import openpyxl.utils
 from PyQt5 import QtCore, QtWidgets, QtGui
-from scipy.io import savemat
 
+from .exporter import Exporter
 from .resultsdispatcher_ui import Ui_Form
 from ..config import Config
 from ..graphing import ImageView, CurveView, CorrMatView, VacuumFluxViewer, OutlierViewer, ExposureTimeReport, \
@@ -93,10 +90,20 @@ class ResultsDispatcher(QtWidgets.QWidget, Ui_Form):
         self.exportCurvesGraphPushButton.clicked.connect(self.exportCurvesGraph)
         self.exportPatternsGraphPushButton.clicked.connect(self.exportPatternsGraph)
         self.exportProgressBar.setVisible(False)
+        self.exporter = Exporter()
+        self.exporter.progress.connect(self.onExportProgress)
+        self.exporter.finished.connect(self.onExportFinished)
         self.treeView.selectionModel().selectionChanged.connect(self.updateCommandWidgetsSensitivity)
         self.updateCommandWidgetsSensitivity()
         self.resizeTreeViewColumns()
 
+    def finalize(self):
+        """Stop the export in progress, if any: the worker processes must not write into the export folder after
+        the project has been closed."""
+        if not self.exporter.idle:
+            self.exporter.stop()
+            self._finishExport()
+
     def onRegexInvalid(self):
         self.selectRegexToolButton.setEnabled(self.sampleNameRegexLineEdit.hasAcceptableInput())
         self.deselectRegexToolButton.setEnabled(self.sampleNameRegexLineEdit.hasAcceptableInput())
@@ -285,192 +292,28 @@ class ResultsDispatcher(QtWidgets.QWidget, Ui_Form):
 
     def exportCurves(self):
         self._startExport('Exporting curves...')
-        if self.curveFileFormatComboBox.currentText() == 'ASCII (*.txt)':
-            for i, (samplename, distance) in enumerate(self.selectedResults()):
-                self.exportProgress(i)
-                try:
-                    curve = self.project.h5reader.averagedCurve(samplename, distance)
-                except KeyError:
-                    continue  # ToDo: present an error message
-                with open(os.path.join(self.exportDirLineEdit.text(),
-                                       '{}_{:.2f}.txt'.format(samplename, float(distance))), 'wt') as f:
-                    dic = self.project.h5reader.averagedHeaderDict(samplename, distance)
-                    for key in sorted(dic):
-                        f.write('# {} : {}\n'.format(key, dic[key]))
-                    f.write('# Columns:\n')
-                    f.write(
-                        '#  q [1/nm],  Intensity [1/cm * 1/sr], '
-                        'Propagated uncertainty of the intensity [1/cm * 1/sr], Propagated uncertainty of q [1/nm]\n')
-                    np.savetxt(f, np.vstack((curve.q, curve.Intensity, curve.Error, curve.qError)).T)
-        elif self.curveFileFormatComboBox.currentText() == 'ASCII (*.dat)':
-            for i, (samplename, distance) in enumerate(self.selectedResults()):
-                self.exportProgress(i)
-                try:
-                    curve = self.project.h5reader.averagedCurve(samplename, distance)
-                except KeyError:
-                    continue  # ToDo: present an error message
-                with open(os.path.join(self.exportDirLineEdit.text(),
-                                       '{}_{:.2f}.dat'.format(samplename, float(distance))), 'wt') as f:
-                    dic = self.project.h5reader.averagedHeaderDict(samplename, distance)
-                    for key in sorted(dic):
-                        f.write('# {} : {}\n'.format(key, dic[key]))
-                    f.write('# Columns:\n')
-                    f.write(
-                        '#  q [1/nm],  Intensity [1/cm * 1/sr], '
-                        'Propagated uncertainty of the intensity [1/cm * 1/sr]\n')
-                    np.savetxt(f, np.vstack((curve.q, curve.Intensity, curve.Error)).T)
-        elif self.curveFileFormatComboBox.currentText() == 'ATSAS (*.dat)':
-            for i, (samplename, distance) in enumerate(self.selectedResults()):
-                self.exportProgress(i)
-                try:
-                    curve = self.project.h5reader.averagedCurve(samplename, distance)
-                except KeyError:
-                    continue  # ToDo: present an error message
-                with open(os.path.join(self.exportDirLineEdit.text(),
-                                       '{}_{:.2f}.dat'.format(samplename, float(distance))), 'wt') as f:
-                    dic = self.project.h5reader.averagedHeaderDict(samplename, distance)
-                    for key in sorted(dic):
-                        f.write('# {} : {}\n'.format(key, dic[key]))
-                    f.write('# Columns:\n')
-                    f.write(
-                        '#  q [1/A],  Intensity [1/cm * 1/sr], Propagated uncertainty of the intensity [1/cm * 1/sr]\n')
-                    np.savetxt(f, np.vstack((curve.q / 10, curve.Intensity, curve.Error)).T)
-        elif self.curveFileFormatComboBox.currentText() == 'RSR (*.rsr)':
-            for i, (samplename, distance) in enumerate(self.selectedResults()):
-                self.exportProgress(i)
-                try:
-                    curve = self.project.h5reader.averagedCurve(samplename, distance)
-                except KeyError:
-                    continue  # ToDo: present an error message
-                with open(os.path.join(self.exportDirLineEdit.text(),
-                                       '{}_{:.2f}.rsr'.format(samplename, float(distance))), 'wt') as f:
-                    f.write(' TIME\n')
-                    f.write(' 1.0\n')
-                    f.write(' {}\n'.format(len(curve)))
-                    for j in range(len(curve)):
-                        f.write(
-                            ' {:.9f} {:.9f} {:.9f} 1\n'.format(curve.q[j] / 10., curve.Intensity[j], curve.Error[j]))
-        elif self.curveFileFormatComboBox.currentText() == 'PDH (*.pdh)':
-            for i, (samplename, distance) in enumerate(self.selectedResults()):
-                self.exportProgress(i)
-                try:
-                    curve = self.project.h5reader.averagedCurve(samplename, distance)
-                except KeyError:
-                    continue  # ToDo: present an error message
-                with open(os.path.join(self.exportDirLineEdit.text(),
-                                       '{}_{:.2f}.pdh'.format(samplename, float(distance))), 'wt') as f:
-                    f.write('{} @ {:.2f}\n'.format(samplename, float(distance)))
-                    f.write('SAXS\n')
-                    f.write(
-                        '{:>9d} {:>9d} {:>9d} {:>9d} {:>9d} {:>9d} {:>9d} {:>9d}\n'.format(len(curve), 0, 0, 0, 0, 0, 0,
-                                                                                           0))
-                    f.write('{:>14.6E} {:>14.6E} {:>14.6E} {:>14.6E} {:>14.6E}\n'.format(0, 0, 0, 1, 0))
-                    f.write('{:>14.6E} {:>14.6E} {:>14.6E} {:>14.6E} {:>14.6E}\n'.format(0, 0, 0, 0, 0))
-                    for j in range(len(curve)):
-                        f.write('{:>14.6E} {:>14.6E} {:>14.6E}\n'.format(curve.q[j] / 10, curve.Intensity[j],
-                                                                         curve.Error[j]))
-        elif self.curveFileFormatComboBox.currentText() == 'Excel 2007- (*.xlsx)':
-            wb = openpyxl.Workbook()
-            ws_main = wb.active
-            ws_main.title = 'Summary'
-            sheetindex = 0
-            for i, (samplename, distance) in enumerate(self.selectedResults()):
-                self.exportProgress(i)
-                try:
-                    curve = self.project.h5reader.averagedCurve(samplename, distance)
-                except KeyError:
-                    continue  # ToDo: present an error message
-                sheetname = '{}_{:.2f}'.format(samplename, float(distance))
-                ws = wb.create_sheet(sheetname)
-                ws_main.cell(row=1, column=4 * sheetindex + 1, value=sheetname)
-                ws_main.merge_cells(start_row=1, start_column=4 * sheetindex + 1, end_row=1,
-                                    end_column=4 * sheetindex + 4)
-                ws.cell(row=1, column=1, value='q')
-                ws.cell(row=1, column=2, value='Intensity')
-                ws.cell(row=1, column=3, value='dIntensity')
-                ws.cell(row=1, column=4, value='dq')
-                ws.cell(row=2, column=1, value='1/nm')
-                ws.cell(row=2, column=2, value='1/cm * 1/sr')
-                ws.cell(row=2, column=3, value='1/cm * 1/sr')
-                ws.cell(row=2, column=4, value='1/nm')
-                for j in range(len(curve)):
-                    ws.cell(row=3 + j, column=1, value=curve.q[j])
-                    ws.cell(row=3 + j, column=2, value=curve.Intensity[j])
-                    ws.cell(row=3 + j, column=3, value=curve.Error[j])
-                    ws.cell(row=3 + j, column=4, value=curve.qError[j])
-                for row in range(1, 3 + len(curve) + 1):
-                    for column in range(1, 5):
-                        ws_main.cell(row=row + 1, column=4 * sheetindex + column, value='={}!{}{}'.format(
-                            openpyxl.utils.quote_sheetname(sheetname), openpyxl.utils.get_column_letter(column),
-                            row
-                        ))
-                sheetindex += 1
-            wb.save(os.path.join(self.exportDirLineEdit.text(), 'SAXS_curves.xlsx'))
-        else:
-            raise ValueError('Unknown 1D file format: {}'.format(self.curveFileFormatComboBox.currentText()))
-        self._finishExport()
+        self.exporter.exportCurves(self.project.h5reader, list(self.selectedResults()), self.exportDirLineEdit.text(),
+                                   self.curveFileFormatComboBox.currentText())
 
     def exportPatterns(self):
         self._startExport('Exporting patterns...')
-        for i, (samplename, distance) in enumerate(self.selectedResults()):
-            self.exportProgress(i)
-            try:
-                exposure = self.project.h5reader.averagedImage(samplename, distance)
-            except KeyError:
-                continue  # ToDo: warn the user.
-            if self.patternFileFormatComboBox.currentText() == 'Numpy (*.npz)':
-                np.savez_compressed(
-                    os.path.join(self.exportDirLineEdit.text(), '{}_{:.2f}.npz'.format(samplename, float(distance))),
-                    intensity=exposure.intensity,
-                    error=exposure.error,
-                    mask=exposure.mask
-                )
-            elif self.patternFileFormatComboBox.currentText() == 'Matlab(TM) (*.mat)':
-                savemat(
-                    os.path.join(self.exportDirLineEdit.text(), '{}_{:.2f}.mat'.format(samplename, float(distance))),
-                    {'intensity': exposure.intensity,
-                     'error': exposure.error,
-                     'mask': exposure.mask},
-                    do_compression=True
-                )
-            elif self.patternFileFormatComboBox.currentText() in ['Gzip-ped ASCII (*.txt.gz)', 'ASCII (*.txt)']:
-                extn = '.txt.gz' if self.patternFileFormatComboBox.currentText().lower().startswith('gzip') else '.txt'
-                basename = os.path.join(self.exportDirLineEdit.text(), '{}_{:.2f}'.format(samplename, float(distance)))
-                np.savetxt(basename + '_intensity' + extn, exposure.intensity)
-                np.savetxt(basename + '_error' + extn, exposure.error)
-                np.savetxt(basename + '_mask' + extn, exposure.mask)
-            else:
-                raise ValueError('Unknown file format: {}'.format(self.patternFileFormatComboBox.currentText()))
-        self._finishExport()
+        self.exporter.exportPatterns(self.project.h5reader, list(self.selectedResults()),
+                                     self.exportDirLineEdit.text(), self.patternFileFormatComboBox.currentText())
 
     def exportCorrelMatrices(self):
         self._startExport('Exporting correlation matrices...')
-        for i, (samplename, distance) in enumerate(self.selectedResults()):
-            self.exportProgress(i)
-            try:
-                cmat = self.project.h5reader.getCorrMat(samplename, distance)
-            except KeyError:
-                continue  # ToDo: warn the user.
-            if self.patternFileFormatComboBox.currentText() == 'Numpy (*.npz)':
-                np.savez_compressed(
-                    os.path.join(self.exportDirLineEdit.text(),
-                                 'correlmatrix_{}_{:.2f}.npz'.format(samplename, float(distance))),
-                    correlmatrix=cmat)
-            elif self.patternFileFormatComboBox.currentText() == 'Matlab(TM) (*.mat)':
-                savemat(
-                    os.path.join(self.exportDirLineEdit.text(),
-                                 'correlmatrix_{}_{:.2f}.mat'.format(samplename, float(distance))),
-                    {'correlmatrix': cmat},
-                    do_compression=True
-                )
-            elif self.patternFileFormatComboBox.currentText() in ['Gzip-ped ASCII (*.txt.gz)', 'ASCII (*.txt)']:
-                extn = '.txt.gz' if self.patternFileFormatComboBox.currentText().lower().startswith('gzip') else '.txt'
-                basename = os.path.join(self.exportDirLineEdit.text(),
-                                        'correlmatrix_{}_{:.2f}'.format(samplename, float(distance)))
-                np.savetxt(basename + extn, cmat)
-            else:
-                raise ValueError('Unknown file format: {}'.format(self.patternFileFormatComboBox.currentText()))
+        self.exporter.exportCorrelMatrices(self.project.h5reader, list(self.selectedResults()),
+                                           self.exportDirLineEdit.text(), self.cmatFileFormatComboBox.currentText())
+
+    def onExportProgress(self, total: int, done: int):
+        self.exportProgressBar.setMaximum(total)
+        self.exportProgressBar.setValue(done)
+
+    def onExportFinished(self):
         self._finishExport()
+        if self.exporter.errors:
+            QtWidgets.QMessageBox.critical(self, 'Export error', 'Could not export all results:\n' +
+                                           '\n'.join(self.exporter.errors))
 
     def browseExportFolder(self):
         folder = QtWidgets.QFileDialog.getExistingDirectory(self, 'Export files to...', '')
@@ -1,5 +1,4 @@
 import datetime
-import gc
 
 import matplotlib.cm
 import matplotlib.colors
@@ -21,15 +20,54 @@ def get_colormaps():
         key=lambda x: x.lower())
 
 
+def downsample(matrix: np.ndarray, factor: int, ufunc: np.ufunc, fill) -> np.ndarray:
+    """Reduce a matrix by `factor` in both directions, combining the elements of each block with `ufunc` (e.g.
+    np.fmax). The matrix is padded with `fill` to a multiple of `factor`."""
+    if factor <= 1:
+        return matrix
+    rows, columns = -(-matrix.shape[0] // factor), -(-matrix.shape[1] // factor)
+    padded = np.full((rows * factor, columns * factor), fill, dtype=matrix.dtype)
+    padded[:matrix.shape[0], :matrix.shape[1]] = matrix
+    return ufunc.reduce(ufunc.reduce(padded.reshape(rows, factor, columns, factor), axis=3), axis=1)
+
+
+def downsampled_extent(extent, shape, factor: int):
+    """The extent of a matrix of `shape`, shown with `extent`, after `downsample()`. The padding makes the reduced
+    matrix cover a few more original pixels at the right and at the bottom: the extent is extended accordingly,
+    so that the pixels stay where they were. `extent` is (left, right, bottom, top), for origin='upper'."""
+    if factor <= 1:
+        return extent
+    left, right, bottom, top = extent
+    rows, columns = -(-shape[0] // factor) * factor, -(-shape[1] // factor) * factor
+    return (left, left + (right - left) * columns / shape[1], top + (bottom - top) * rows / shape[0], top)
+
+
 class PlotImage(QtWidgets.QWidget, Ui_Form):
+    """Plot a two-dimensional scattering pattern.
+
+    The image, the mask, the beam crosshair and the title are animated
+    artists: they are not drawn by `canvas.draw()` but in the 'draw_event'
+    handler, where the rest of the figure is saved for blitting. A new
+    exposure with the same settings and axes only updates the data of these
+    artists and blits them over the saved background. Images much larger
+    than the visible area of the canvas are downsampled for display.
+    """
     lastinstances = []
     _exposure: Exposure=None
 
+    # colour of the masked pixels (RGBA)
+    maskcolour = (255, 255, 255, 178)
+
     def __init__(self, parent=None, register_instance=True):
         QtWidgets.QWidget.__init__(self, parent)
         self._exposure = None
         self.previous_extent = None
         self.previous_axestype = None
+        self._background = None
+        self._imagesettings = None
+        self._downsampling = 1
+        self._maskcache = None  # (validity matrix, downsampling factor, RGBA overlay)
+        self._maskoverlay = None  # the overlay currently shown
         self.setupUi(self)
         if register_instance:
             type(self).lastinstances.append(self)
@@ -162,11 +200,98 @@ class PlotImage(QtWidgets.QWidget, Ui_Form):
         self.figtoolbar.setSizePolicy(QtWidgets.QSizePolicy.Expanding, QtWidgets.QSizePolicy.Maximum)
         self.canvas.setSizePolicy(QtWidgets.QSizePolicy.Expanding, QtWidgets.QSizePolicy.Expanding)
         self.canvas.mpl_connect('resize_event', self.onCanvasResize)
+        self.canvas.mpl_connect('draw_event', self.onCanvasDraw)
 
     def onCanvasResize(self, event):
         self.figure.tight_layout()
+        self.onAxesLimitsChanged(self.axes)
         self.canvas.draw()
 
+    def onCanvasDraw(self, event):
+        if (event.canvas is not self.canvas) or self.canvas.is_saving():
+            # saving to a file: the animated artists are drawn by the axes.
+            return
+        self._background = self.canvas.copy_from_bbox(self.figure.bbox)
+        self._draw_animated()
+
+    def onAxesLimitsChanged(self, axes):
+        # zooming in may need finer resolution, zooming out coarser.
+        if not hasattr(self, '_image'):
+            return
+        factor = self._get_downsampling()
+        if factor != self._downsampling:
+            self._downsampling = factor
+            self._image.set_data(self._display_matrix())
+            self._image.set_extent(self._display_extent())
+            if hasattr(self, '_mask'):
+                self._maskoverlay = self._mask_overlay()
+                self._mask.set_data(self._maskoverlay)
+                self._mask.set_extent(self._image.get_extent())
+
+    def _animated_artists(self):
+        # the crosshair and the mask have the same zorder: the mask is drawn over the crosshair.
+        artists = [self._image] if hasattr(self, '_image') else []
+        artists.extend(getattr(self, '_crosshair', []))
+        if hasattr(self, '_mask'):
+            artists.append(self._mask)
+        artists.append(self.axes.title)
+        return sorted([a for a in artists if a.get_animated()], key=lambda a: a.get_zorder())
+
+    def _draw_animated(self):
+        for artist in self._animated_artists():
+            self.figure.draw_artist(artist)
+        # the frame of the axes must remain on top of the image and the crosshair
+        for spine in self.axes.spines.values():
+            self.figure.draw_artist(spine)
+
+    def _redraw(self, full: bool = False):
+        """Update the canvas: blit the animated artists if possible."""
+        if full or (self._background is None) or hasattr(self, '_colorbar'):
+            # the colour bar follows the scaling of the image: it must be drawn again
+            self.canvas.draw()
+        else:
+            self.canvas.restore_region(self._background)
+            self._draw_animated()
+            self.canvas.blit(self.figure.bbox)
+
+    def _get_downsampling(self) -> int:
+        """The downsampling factor for displaying the image at the current size of the axes."""
+        shape = self.exposure().shape
+        extent = self.previous_extent
+        bbox = self.axes.get_window_extent()
+        fractions = [1.0, 1.0]
+        if hasattr(self, '_image'):
+            for i, limits in enumerate([self.axes.get_xlim(), self.axes.get_ylim()]):
+                width = abs(extent[2 * i + 1] - extent[2 * i])
+                if width > 0:
+                    fractions[i] = min(1.0, abs(limits[1] - limits[0]) / width)
+        factor = min(shape[1] * fractions[0] / max(bbox.width, 1), shape[0] * fractions[1] / max(bbox.height, 1))
+        return max(1, int(factor))
+
+    def _display_matrix(self) -> np.ndarray:
+        matrix = self.exposure().intensity
+        if self.colourScaleComboBox.currentText() in ['logarithmic', 'square', 'square root']:
+            # do not touch the intensity matrix of the exposure
+            matrix = np.where(matrix > 0, matrix, np.nan)
+        return downsample(matrix, self._downsampling, np.fmax, np.nan)
+
+    def _display_extent(self, extent=None):
+        """The extent of the downsampled image"""
+        return downsampled_extent(self.previous_extent if extent is None else extent, self.exposure().shape,
+                                  self._downsampling)
+
+    def _mask_overlay(self) -> np.ndarray:
+        """The RGBA image of the masked pixels. It is only recalculated if the mask or the downsampling changes."""
+        valid = self.exposure().mask != 0
+        if ((self._maskcache is None) or (self._maskcache[1] != self._downsampling) or
+                not np.array_equal(self._maskcache[0], valid)):
+            # a downsampled pixel is masked if any of its pixels is masked.
+            shown = downsample(valid, self._downsampling, np.logical_and, True)
+            overlay = np.zeros(shown.shape + (4,), np.uint8)
+            overlay[~shown] = self.maskcolour
+            self._maskcache = (valid, self._downsampling, overlay)
+        return self._maskcache[2]
+
     def toolbarVisibility(self, state):
         self.toolbar.setVisible(state)
 
@@ -176,11 +301,11 @@ class PlotImage(QtWidgets.QWidget, Ui_Form):
 
     def showMaskChanged(self, checked):
         self.replot_mask()
-        self.canvas.draw()
+        self._redraw()
 
     def showBeamChanged(self, checked):
         self.replot_crosshair()
-        self.canvas.draw()
+        self._redraw()
 
     def colourScaleChanged(self):
         self.replot()
@@ -202,15 +327,22 @@ class PlotImage(QtWidgets.QWidget, Ui_Form):
         if hasattr(self, '_mask'):
             self._mask.remove()
             del self._mask
+            self._maskoverlay = None
         if self.showMaskToolButton.isChecked():
-            ex = self.exposure()
-            assert isinstance(ex, Exposure)
-            mf = np.ones(ex.shape, np.float)
-            mf[ex.mask != 0] = np.nan
             aspect = ['auto','equal'][self.equalAspectToolButton.isChecked()]
-            self._mask = self.axes.imshow(mf, cmap='gray_r', interpolation='nearest', aspect=aspect, alpha=0.7,
-                                          origin='upper', extent=self._image.get_extent(), zorder=2)
-        gc.collect()
+            self._maskoverlay = self._mask_overlay()
+            self._mask = self.axes.imshow(self._maskoverlay, interpolation='nearest', aspect=aspect,
+                                          origin='upper', extent=self._image.get_extent(), zorder=2, animated=True)
+
+    def update_mask(self):
+        """Show the mask of the current exposure, reusing the mask artist."""
+        if not hasattr(self, '_mask'):
+            return self.replot_mask()
+        self._mask.set_extent(self._image.get_extent())
+        overlay = self._mask_overlay()
+        if overlay is not self._maskoverlay:
+            self._maskoverlay = overlay
+            self._mask.set_data(overlay)
 
     def replot_crosshair(self):
         if hasattr(self, '_crosshair'):
@@ -227,12 +359,12 @@ class PlotImage(QtWidgets.QWidget, Ui_Form):
                 assert isinstance(self.axes, Axes)
                 self._crosshair = self.axes.plot([0, matrix.shape[1]], [beampos[1], beampos[1]], 'w-',
                                                  [beampos[0], beampos[0]], [0, matrix.shape[0]], 'w-',
-                                                 scalex=False, scaley=False)
+                                                 scalex=False, scaley=False, animated=True)
             else:
-                extent = self._image.get_extent()
+                extent = self.previous_extent
                 self._crosshair = self.axes.plot(extent[0:2], [0, 0], 'w-',
-                                                 [0, 0], extent[2:4], 'w-', scalex=False, scaley=False)
-        gc.collect()
+                                                 [0, 0], extent[2:4], 'w-', scalex=False, scaley=False,
+                                                 animated=True)
 
     def replot(self):
         ex = self.exposure()
@@ -249,8 +381,6 @@ class PlotImage(QtWidgets.QWidget, Ui_Form):
         else:
             assert False
         matrix = ex.intensity
-        if self.colourScaleComboBox.currentText() in ['logarithmic', 'square', 'square root']:
-            matrix[matrix <= 0] = np.nan
 
         beampos = (ex.header.beamcenterx.val, ex.header.beamcentery.val)
         distance = ex.header.distance.val
@@ -298,34 +428,60 @@ class PlotImage(QtWidgets.QWidget, Ui_Form):
             self.previous_extent = extent
             self.clear()
             return self.replot()
+        aspect = ['auto','equal'][self.equalAspectToolButton.isChecked()]
+        imagesettings = (self.colourScaleComboBox.currentText(), self.paletteComboBox.currentText(), aspect)
+        try:
+            title = ex.header.title
+        except KeyError:
+            title = 'Untitled'
+        if hasattr(self, '_image') and (imagesettings == self._imagesettings):
+            # Only the data changed: update the existing artists and blit them.
+            self._downsampling = self._get_downsampling()
+            self._image.set_data(self._display_matrix())
+            self._image.set_extent(self._display_extent(extent))
+            self._image.norm.vmin = None
+            self._image.norm.vmax = None
+            self._image.autoscale_None()
+            self.replot_crosshair()
+            self.update_mask()
+            self._title = self.axes.set_title('#{:d}: {} ({:.2f} mm)'.format(ex.header.fsn,
+                                                                             title,
+                                                                             ex.header.distance))
+            self._redraw()
+            return
         if hasattr(self, '_image'):
             if hasattr(self, '_colorbar'):
                 self._colorbar.remove()
                 del self._colorbar
-            if self._image.get_extent() != extent:
+            if self._image.get_extent() != self._display_extent(extent):
                 self.axes.axis( extent)
             self._image.remove()
             del self._image
             firstplot = False
         else:
             firstplot = True
-        aspect = ['auto','equal'][self.equalAspectToolButton.isChecked()]
-        self._image = self.axes.imshow(matrix,
+        self._imagesettings = imagesettings
+        self._downsampling = self._get_downsampling()
+        displaymatrix = self._display_matrix()
+        self._image = self.axes.imshow(displaymatrix,
                                        cmap=self.paletteComboBox.currentText(), norm=norm,
-                                       aspect=aspect, interpolation='nearest', origin='upper', zorder=1, extent=extent)
+                                       aspect=aspect, interpolation='nearest', origin='upper', zorder=1,
+                                       extent=self._display_extent(extent), animated=True)
         if firstplot:
+            # the extent of a downsampled image is a bit larger: show the area of the detector only.
+            self.axes.axis(extent)
             self.figtoolbar.update()
-        if np.isfinite(matrix).sum() > 0:
+            # axes.clear() drops the callbacks
+            self.axes.callbacks.connect('xlim_changed', self.onAxesLimitsChanged)
+            self.axes.callbacks.connect('ylim_changed', self.onAxesLimitsChanged)
+        if np.isfinite(displaymatrix).sum() > 0:
             self.replot_colourbar()
         self.replot_crosshair()
         self.replot_mask()
-        try:
-            title = ex.header.title
-        except KeyError:
-            title = 'Untitled'
         self._title = self.axes.set_title('#{:d}: {} ({:.2f} mm)'.format(ex.header.fsn,
                                                                          title,
                                                                          ex.header.distance))
+        self._title.set_animated(True)
 
         if axesscale == 'abs. pixel':
             self.axes.xaxis.set_label_text('Absolute column coordinate (pixel)')
@@ -345,7 +501,6 @@ class PlotImage(QtWidgets.QWidget, Ui_Form):
         else:
             assert False
         self.canvas.draw()
-        gc.collect()
 
     def setExposure(self, exposure: Exposure):
         self._exposure = exposure
@@ -365,8 +520,8 @@ class PlotImage(QtWidgets.QWidget, Ui_Form):
     def setMaskMatrix(self, mask:np.ndarray):
         if self._exposure.mask.shape==mask.shape:
             self._exposure.mask = mask
-            self.replot_mask()
-            self.canvas.draw()
+            self.update_mask()
+            self._redraw()
         else:
             raise ValueError('Mismatched mask shape ({0[0]:d}, {0[1]:d}) for image of shape ({1[0]:d}, {1[1]:d})'.format(mask.shape, self._exposure.shape))
 
@@ -383,5 +538,8 @@ class PlotImage(QtWidgets.QWidget, Ui_Form):
                 delattr(self, attr)
             except AttributeError:
                 pass
+        self._imagesettings = None
+        self._maskoverlay = None
+        self._background = None
         self.axes.clear()
         self.canvas.draw()
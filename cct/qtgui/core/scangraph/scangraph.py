@@ -23,12 +23,32 @@ logger.setLevel(logging.INFO)
 
 
 class ScanGraph(QtWidgets.QMainWindow, Ui_MainWindow, ToolWindow):
+    """Plot the signals of a scan measurement, finished or in progress.
+
+    While the scan is running, the new points are collected and shown at
+    most `max_redraw_rate` times per second. The data limits of the axes are
+    extended by the new points only. The view limits are extended with some
+    headroom (`autoscale_headroom` times the data range) when the new points
+    do not fit: the abscissa, which grows with each point, changes them only
+    a few times during the scan. If the view limits do not change, only the
+    new line segments are drawn on the saved background and blitted,
+    otherwise the figure is redrawn. The cursor of a finished scan is an
+    animated artist, blitted over the background.
+    """
+    # frames per second while the scan is running
+    max_redraw_rate = 10
+    # the headroom of the view limits while the scan is running, relative to the data range
+    autoscale_headroom = 0.5
+
     def __init__(self, *args, **kwargs):
         credo = kwargs.pop('credo')
         QtWidgets.QMainWindow.__init__(self, *args, **kwargs)
         self.setupToolWindow(credo)
         self._data = None
         self._lastpeakposition = None
+        self._drawnlength = 0  # the number of points already given to the lines
+        self._background = None
+        self._redrawpending = False
         self.setupUi(self)
 
     def setupUi(self, MainWindow):
@@ -76,6 +96,11 @@ class ScanGraph(QtWidgets.QMainWindow, Ui_MainWindow, ToolWindow):
         self.setCursorRange()
         self.canvas.setFocus(QtCore.Qt.OtherFocusReason)
         self.canvas.mpl_connect('resize_event', self.onCanvasResize)
+        self.canvas.mpl_connect('draw_event', self.onCanvasDraw)
+        self._updatetimer = QtCore.QTimer(self)
+        self._updatetimer.setSingleShot(True)
+        self._updatetimer.setInterval(int(1000 / self.max_redraw_rate))
+        self._updatetimer.timeout.connect(self.updateCurves)
 
         self.signalsTreeView
 
@@ -83,6 +108,34 @@ class ScanGraph(QtWidgets.QMainWindow, Ui_MainWindow, ToolWindow):
         self.figure.tight_layout()
         self.canvas.draw()
 
+    def onCanvasDraw(self, event):
+        if (event.canvas is not self.canvas) or self.canvas.is_saving():
+            return
+        self._redrawpending = False
+        self._background = self.canvas.copy_from_bbox(self.figure.bbox)
+        self._drawAnimated()
+
+    def _drawAnimated(self):
+        if hasattr(self, '_cursorhandle'):
+            self.axes.draw_artist(self._cursorhandle)
+
+    def blitAnimated(self):
+        """Draw the animated artists (the cursor) over the saved background."""
+        if (self._background is None) or self._redrawpending:
+            return self.requestRedraw()
+        self.canvas.restore_region(self._background)
+        self._drawAnimated()
+        self.canvas.blit(self.axes.bbox)
+
+    def _blitSegments(self, segments: List[Line2D]):
+        """Draw new line segments on the background and blit it."""
+        self.canvas.restore_region(self._background)
+        for segment in segments:
+            self.axes.draw_artist(segment)
+        self._background = self.canvas.copy_from_bbox(self.figure.bbox)
+        self._drawAnimated()
+        self.canvas.blit(self.axes.bbox)
+
     def onCanvasKeyPress(self, event:KeyEvent):
         logger.debug('Key pressed on canvas: {}'.format(event.key))
         if event.key == 'left':
@@ -134,7 +187,7 @@ class ScanGraph(QtWidgets.QMainWindow, Ui_MainWindow, ToolWindow):
         self._peaktexthandle = self.axes.text(float(pos), float(baseline) + float(amplitude), pos.tostring(), ha='center', va=va)
         self._lastpeakposition = pos
         self.actionMotor_to_peak.setEnabled(True)
-        self.canvas.draw_idle()
+        self.requestRedraw()
 
     def drawLegend(self):
         if self.actionShowLegend.isChecked():
@@ -143,7 +196,7 @@ class ScanGraph(QtWidgets.QMainWindow, Ui_MainWindow, ToolWindow):
             self.axes.legend(handles, labels, loc='best')
         else:
             self.axes.legend().remove()
-        self.canvas.draw_idle()
+        self.requestRedraw()
 
     def autoscale(self):
         self.axes.autoscale(self.actionAutoScale.isChecked(), tight=True)
@@ -151,7 +204,7 @@ class ScanGraph(QtWidgets.QMainWindow, Ui_MainWindow, ToolWindow):
             self.axes.relim(True)
             self.axes.autoscale_view(True, True, True)
             self.figuretoolbar.update()
-            self.canvas.draw_idle()
+            self.requestRedraw()
 
     def cursorToMaximum(self):
         self.cursorSlider.setValue(np.argmax(self._data[self.selectedSignal()]))
@@ -168,7 +221,7 @@ class ScanGraph(QtWidgets.QMainWindow, Ui_MainWindow, ToolWindow):
             h.set_lw(1)
         self._curvehandles[current.row()].set_lw(3)
         self.drawLegend()
-        self.canvas.draw_idle()
+        self.requestRedraw()
 
     def cursorMoved(self, position):
         self.cursorLeftButton.setEnabled(position > 0)
@@ -187,13 +240,13 @@ class ScanGraph(QtWidgets.QMainWindow, Ui_MainWindow, ToolWindow):
             return False
         assert isinstance(self.axes, Axes)
         cursorposition = self.cursorSlider.value()
+        x = self._data[self.abscissaName()][cursorposition]
         if hasattr(self, '_cursorhandle'):
-            self._cursorhandle.remove()
-            del self._cursorhandle
-        self._cursorhandle = self.axes.axvline(self._data[self.abscissaName()][cursorposition], color='black',
-                                               alpha=0.8, lw=3)
-        self.cursorPositionLabel.setText('{:.4f}'.format(self._data[self.abscissaName()][cursorposition]))
-        self.requestRedraw()
+            self._cursorhandle.set_xdata([x, x])
+        else:
+            self._cursorhandle = self.axes.axvline(x, color='black', alpha=0.8, lw=3, animated=True)
+        self.cursorPositionLabel.setText('{:.4f}'.format(x))
+        self.blitAnimated()
 
     def replot(self):
         t0 = time.monotonic()
@@ -221,6 +274,7 @@ class ScanGraph(QtWidgets.QMainWindow, Ui_MainWindow, ToolWindow):
                 handle.set_xdata(abscissa)
                 handle.set_ydata(self._data[signal][:self._datalength] * self.model.factor(signal))
                 handle.set_lw(1)
+        self._drawnlength = self._datalength
         try:
             self._curvehandles[self.signalsTreeView.selectedIndexes()[0].row()].set_lw(3)
         except IndexError:
@@ -319,8 +373,66 @@ class ScanGraph(QtWidgets.QMainWindow, Ui_MainWindow, ToolWindow):
         self._data[self._datalength] = scanpoint
         self._datalength += 1
         if not self.isScanRunning():
+            self._updatetimer.stop()
             self.truncateScan()
-        self.replot()
+            self.replot()
+        elif not self._updatetimer.isActive():
+            # collect the points arriving in the next 1/max_redraw_rate seconds, see updateCurves()
+            self._updatetimer.start()
+
+    def updateCurves(self):
+        """Show the points appended since the last update."""
+        if (self._data is None) or (not self._curvehandles) or (self._drawnlength >= self._datalength):
+            return
+        start, end = self._drawnlength, self._datalength
+        first = max(start - 1, 0)  # the new segments start from the last point already drawn
+        abscissa = self._data[self.abscissaName()][:end]
+        segments = []
+        for signal, handle in zip(self._data.dtype.names[1:], self._curvehandles):
+            ordinate = self._data[signal][:end] * self.model.factor(signal)
+            handle.set_data(abscissa, ordinate)
+            if handle.get_visible():
+                segment = Line2D(abscissa[first:], ordinate[first:])
+                segment.update_from(handle)
+                segment.set_figure(self.figure)
+                segments.append(segment)
+        self._drawnlength = end
+        limitschanged = False
+        if self.actionAutoScale.isChecked() and segments:
+            self.axes.update_datalim(np.vstack([s.get_xydata()[start - first:] for s in segments]))
+            limitschanged = self._extendViewLimits(start == 0)
+        self.draw2D()
+        if limitschanged or (self._background is None) or self._redrawpending:
+            self.requestRedraw()
+        else:
+            self._blitSegments(segments)
+
+    def _extendViewLimits(self, fresh: bool) -> bool:
+        """Extend the view limits of the axes to the data limits, with headroom
+        on the side where the data do not fit. If `fresh` is True, the view
+        limits are set from the data limits only.
+
+        Returns True if the view limits have changed.
+        """
+        changed = False
+        for limits, (datalow, datahigh), inverted, setlimits in [
+            (self.axes.get_xlim(), self.axes.dataLim.intervalx, self.axes.xaxis_inverted(), self.axes.set_xlim),
+            (self.axes.get_ylim(), self.axes.dataLim.intervaly, self.axes.yaxis_inverted(), self.axes.set_ylim)]:
+            if not (np.isfinite(datalow) and np.isfinite(datahigh)):
+                continue
+            low, high = sorted(limits)
+            headroom = (datahigh - datalow) * self.autoscale_headroom
+            if headroom <= 0:
+                headroom = max(abs(datalow), 1) * self.autoscale_headroom
+            if fresh or (datalow < low) or (datahigh > high):
+                if fresh or (datalow < low):
+                    low = datalow - headroom
+                if fresh or (datahigh > high):
+                    high = datahigh + headroom
+                # auto=None keeps autoscaling on: the replot at the end of the scan scales tightly.
+                setlimits(*((high, low) if inverted else (low, high)), auto=None)
+                changed = True
+        return changed
 
     def truncateScan(self):
         """Remove unused space from the data array, thus considering this scan
@@ -363,6 +475,7 @@ class ScanGraph(QtWidgets.QMainWindow, Ui_MainWindow, ToolWindow):
         return self._datalength
 
     def requestRedraw(self):
+        self._redrawpending = True
         self.canvas.draw_idle()
 
     def onMotorToPeak(self):
@@ -1,23 +1,37 @@
+from collections import Counter
+
+
 def pickfromlist(sequence):
     yield []
     for i in range(len(sequence)):
         for l in pickfromlist(sequence[i+1:]):
             yield [sequence[i]]+l
 
-def estimate_worksize_C(spacers, pinholes, float sealringwidth):
-    l_seen = []
-    count = 0
-    lastpulse = 0
+def enumerate_lengths(spacers, double sealringwidth):
+    """Find the distinct (l1, l2) length pairs which can be built from the spacers.
 
-    for l1_parts in pickfromlist(spacers):
-        l1 = len(l1_parts) * sealringwidth + sum(l1_parts)
-        spacers_remaining = list(spacers[:])
-        for s in l1_parts:
-            spacers_remaining.remove(s)
-        for l2_parts in pickfromlist(spacers_remaining):
-            l2 =len(l2_parts) * sealringwidth + sum(l2_parts)
-            if (l1, l2) in l_seen:
-                continue
-            l_seen.append((l1, l2))
-            count += 1
-    return count * len(pinholes) ** 2
+    Each spacer can be put in L1, in L2 or left out, and adds its length plus `sealringwidth` to the length of the
+    section. Spacers of the same length are interchangeable: instead of trying every subset, the number of spacers
+    of each length in L1 and in L2 is chosen (a subset-sum over a multiset), keeping only the first way of building
+    each length pair.
+
+    Returns a dict mapping (l1, l2) to (l1_parts, l2_parts), the tuples of the spacers used.
+    """
+    cdef double step
+    cdef int a, b, count
+    states = {(0.0, 0.0): ((), ())}
+    for value, count in sorted(Counter(spacers).items()):
+        step = value + sealringwidth
+        newstates = {}
+        for (l1, l2), (l1_parts, l2_parts) in states.items():
+            for a in range(count + 1):
+                for b in range(count - a + 1):
+                    # rounding: the same length must give the same key, whatever the order of the additions
+                    key = (round(l1 + a * step, 6), round(l2 + b * step, 6))
+                    if key not in newstates:
+                        newstates[key] = (l1_parts + (value,) * a, l2_parts + (value,) * b)
+        states = newstates
+    return states
+
+def estimate_worksize_C(spacers, pinholes, float sealringwidth):
+    return len(enumerate_lengths(spacers, sealringwidth)) * len(pinholes) ** 2
@@ -1,5 +1,5 @@
 import logging
-from typing import List
+from typing import List, Dict, Tuple
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
@@ -9,42 +9,69 @@ from .resultsstore import PinholeConfigurationStore
 from ...core.mixins import ToolWindow
 from .simpleeditablelist import SimpleEditableList
 from .pinholeconfiguration import PinholeConfiguration
-from multiprocessing import Queue, Process
-from queue import Empty
+from .estimateworksize import enumerate_lengths
+from multiprocessing import Pool
 
 
 def suggestPinholeSize(pc: PinholeConfiguration, pinholes:List[float]) -> float:
     """Suggest a pinhole size for the third pinhole."""
-    return sorted([p for p in pinholes if pc.D3 < p], key=lambda x: x - pc.D3)[0]
+    d3 = pc.D3
+    return sorted([p for p in pinholes if d3 < p], key=lambda x: x - d3)[0]
 
 
-def worker(queue: Queue, spacers, pinholes, ls, lbs, sd, mindist_l1, mindist_l2, sealringwidth, wavelength,
-           crit_sample, crit_beamstop, crit_l1, crit_l2, keep_best_n=200):
-    try:
-        results = []
-        for phc in PinholeConfiguration.enumerate(spacers, pinholes, ls, lbs, sd, mindist_l1, mindist_l2, sealringwidth,
-                                                  wavelength):
-            assert isinstance(phc, PinholeConfiguration)
-            try:
-                ph3_suggestion=suggestPinholeSize(phc, pinholes)
-            except IndexError:
+# (l1, [(l2, l1_parts, l2_parts), ...]) in increasing order of l1 and l2, set in the worker processes by initWorker()
+_lengths = []
+
+
+def groupLengths(lengths: Dict[Tuple[float, float], Tuple[Tuple[float, ...], Tuple[float, ...]]]) -> List[
+        Tuple[float, List[Tuple[float, Tuple[float, ...], Tuple[float, ...]]]]]:
+    """Group the output of `enumerate_lengths()` by l1 and sort it by l1 and l2."""
+    grouped = {}
+    for (l1, l2), (l1_parts, l2_parts) in lengths.items():
+        grouped.setdefault(l1, []).append((l2, l1_parts, l2_parts))
+    return [(l1, sorted(grouped[l1], key=lambda x: x[0])) for l1 in sorted(grouped)]
+
+
+def initWorker(lengths):
+    global _lengths
+    _lengths = lengths
+
+
+def worker(d1, d2, pinholes, ls, lbs, sd, mindist_l1, mindist_l2, sealringwidth, wavelength,
+           crit_sample, crit_beamstop, crit_l1, crit_l2, keep_best_n=200) -> List[PinholeConfiguration]:
+    """Find the best configurations with the given first and second apertures.
+
+    The intensity decreases with l1, thus l1 is scanned upwards and the search stops when `keep_best_n`
+    configurations have been found. The sample size increases with l2, thus the l2 loop is stopped when the sample
+    becomes too large.
+
+    :return: the list of acceptable configurations, in decreasing order of intensity
+    """
+    results = []
+    for l1, configurations in _lengths:
+        if len(results) >= keep_best_n:
+            # all the remaining configurations have longer L1, i.e. lower intensity
+            break
+        if mindist_l1 + sealringwidth + l1 < crit_l1:
+            continue
+        for l2, l1_parts, l2_parts in configurations:
+            if mindist_l2 + sealringwidth + l2 < crit_l2:
                 continue
-            dbs=phc.rbs_parasitic1(ph3_suggestion*0.5e-3)*2
-            if phc.l1 < crit_l1:
-                #                print('L1 not OK: {} < {}'.format(phc.l1, crit_l1))
+            phc = PinholeConfiguration(list(l1_parts), list(l2_parts), d1, d2, ls, lbs, sd, mindist_l1, mindist_l2,
+                                       sealringwidth, wavelength)
+            if phc.Dsample > crit_sample[1]:
+                break
+            if phc.Dsample < crit_sample[0]:
                 continue
-            if phc.l2 < crit_l2:
-                #                print('L2 not OK: {} < {}'.format(phc.l2, crit_l2))
+            try:
+                ph3_suggestion = suggestPinholeSize(phc, pinholes)
+            except IndexError:
                 continue
+            dbs = phc.rbs_parasitic1(ph3_suggestion * 0.5e-3) * 2
             if dbs < crit_beamstop[0] or dbs > crit_beamstop[1]:
-                #                print('BS not OK: {} not between {} and {}'.format(phc.Dbs, crit_beamstop[0], crit_beamstop[1]))
-                continue
-            if phc.Dsample < crit_sample[0] or phc.Dsample > crit_sample[1]:
-                #                print('Sample not OK: {} not between {} and {}'.format(phc.Dsample, crit_sample[0], crit_sample[1]))
                 continue
             results.append(phc)
-    finally:
-        queue.put_nowait(sorted(results, key=lambda phc: -phc.intensity)[:keep_best_n])
+    return results
 
 
 class OptimizeGeometry(QtWidgets.QWidget, Ui_Form, ToolWindow):
@@ -125,7 +152,7 @@ class OptimizeGeometry(QtWidgets.QWidget, Ui_Form, ToolWindow):
         self.progressBar.hide()
 
     def calculate(self):
-        if hasattr(self, 'process'):
+        if hasattr(self, 'pool'):
             return
         self.resultsStore.clear()
         self.resultsStore.setPinholeSizes([float(x) for x in self.pinholeList.items()])
@@ -142,35 +169,48 @@ class OptimizeGeometry(QtWidgets.QWidget, Ui_Form, ToolWindow):
         crit_beamstop = self.minBeamStopSizeDoubleSpinBox.value(), self.maxBeamStopSizeDoubleSpinBox.value()
         crit_l1 = self.minPh1Ph2DistanceDoubleSpinBox.value()
         crit_l2 = self.minPh2Ph3DistanceDoubleSpinBox.value()
-        n_max_results = self.nResultsSpinBox.value()
-        self.resultsQueue = Queue()
-        self.process = Process(target=worker,
-                               args=(self.resultsQueue, spacers, pinholes, ls, lbs, sd, mindist_l1, mindist_l2,
-                                     sealringwidth, wavelength, crit_sample, crit_beamstop, crit_l1, crit_l2,
-                                     n_max_results))
+        self.n_max_results = self.nResultsSpinBox.value()
+        # the length pairs are computed only once and given to the worker processes at their start.
+        self.pool = Pool(initializer=initWorker,
+                         initargs=(groupLengths(enumerate_lengths(spacers, sealringwidth)),))
+        self.asyncResults = [
+            self.pool.apply_async(worker, (d1, d2, pinholes, ls, lbs, sd, mindist_l1, mindist_l2, sealringwidth,
+                                           wavelength, crit_sample, crit_beamstop, crit_l1, crit_l2,
+                                           self.n_max_results))
+            for d1 in pinholes for d2 in pinholes]
+        self.progressBar.setMaximum(len(self.asyncResults))
+        self.progressBar.setValue(0)
         self.timer = QtCore.QTimer()
         self.timer.setInterval(100)
         self.timer.setSingleShot(False)
         self.timer.timeout.connect(self.checkWorkerResults)
-        self.process.start()
         self.timer.start()
         self.setBusy()
 
     def checkWorkerResults(self):
-        try:
-            result = self.resultsQueue.get_nowait()
+        ready = [r for r in self.asyncResults if r.ready()]
+        if (not ready) and self.asyncResults:
+            # no aperture pairs means no tasks: finish at once instead of waiting forever
+            return
+        for r in ready:
+            try:
+                self.resultsStore.mergeConfigurations(r.get(), self.n_max_results)
+            except Exception as exc:
+                logger.error('Error in the geometry optimization worker: {}'.format(exc))
+        self.asyncResults = [r for r in self.asyncResults if r not in ready]
+        self.progressBar.setValue(self.progressBar.maximum() - len(self.asyncResults))
+        for i in range(self.resultsStore.columnCount()):
+            self.treeView.resizeColumnToContents(i)
+        if not self.asyncResults:
             # logger.debug('Finished processing.')
-            self.process.join()
+            self.pool.close()
+            self.pool.join()
             self.timer.stop()
-            del self.resultsQueue
-            del self.process
+            del self.asyncResults
+            del self.pool
             del self.timer
-            self.resultsStore.addConfigurations(result)
-            for i in range(self.resultsStore.columnCount()):
-                self.treeView.resizeColumnToContents(i)
+            self.progressBar.setMaximum(0)
             self.setIdle()
-        except Empty:
-            return
 
     def copyToHTML(self):
         html = """<table>\n"""
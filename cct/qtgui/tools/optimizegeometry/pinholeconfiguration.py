@@ -1,8 +1,8 @@
-import collections
+import collections.abc
 import math
 from typing import Sequence, Union, SupportsFloat, Optional
 
-from .estimateworksize import pickfromlist
+from .estimateworksize import enumerate_lengths
 
 
 class PinholeConfiguration(object):
@@ -11,10 +11,10 @@ class PinholeConfiguration(object):
     def __init__(self, L1: Union[Sequence, SupportsFloat], L2: Union[Sequence, SupportsFloat], D1: float, D2: float,
                  ls: float, lbs: float, sd: float, mindist_l1: float = 0.0, mindist_l2: float = 0.0,
                  sealringwidth: float = 0.0, wavelength: float = 0.15418):
-        if not isinstance(L1, collections.Iterable):
+        if not isinstance(L1, collections.abc.Iterable):
             L1 = [L1]
         self.l1_elements = L1
-        if not isinstance(L2, collections.Iterable):
+        if not isinstance(L2, collections.abc.Iterable):
             L2 = [L2]
         self.l2_elements = L2
         self.mindist_l1 = mindist_l1
@@ -37,7 +37,7 @@ class PinholeConfiguration(object):
 
     @property
     def l1(self) -> float:
-        if isinstance(self.l1_elements, collections.Sequence):
+        if isinstance(self.l1_elements, collections.abc.Sequence):
             return float(sum(self.l1_elements) +
                          self.sealringwidth * (1 + len(self.l1_elements)) +
                          self.mindist_l1)
@@ -50,7 +50,7 @@ class PinholeConfiguration(object):
 
     @property
     def l2(self) -> float:
-        if isinstance(self.l2_elements, collections.Sequence):
+        if isinstance(self.l2_elements, collections.abc.Sequence):
             return float(sum(self.l2_elements) +
                          self.sealringwidth * (1 + len(self.l2_elements)) +
                          self.mindist_l2)
@@ -230,18 +230,8 @@ D3: %.0f um; I: %.2f; qmin: %.5f 1/nm' % (self.l1, self.l2, self.D1, self.D2,
     @classmethod
     def enumerate(cls, spacers: Sequence[float], pinholes: Sequence[float],
                   ls, lbs, sd, mindist_l1, mindist_l2, sealringwidth, wavelength):
-        l_seen = []
-        for l1_parts in pickfromlist(spacers):
-            l1 = mindist_l1 + len(l1_parts) * sealringwidth + sum(l1_parts)
-            spacers_remaining = list(spacers[:])
-            for s in l1_parts:
-                spacers_remaining.remove(s)
-            for l2_parts in pickfromlist(spacers_remaining):
-                l2 = mindist_l2 + len(l2_parts) * sealringwidth + sum(l2_parts)
-                if (l1, l2) in l_seen:
-                    continue
-                l_seen.append((l1, l2))
-                for d1 in pinholes:
-                    for d2 in pinholes:
-                        yield PinholeConfiguration(l1_parts, l2_parts, d1, d2, ls, lbs, sd, mindist_l1, mindist_l2,
-                                                   sealringwidth, wavelength)
+        for l1_parts, l2_parts in enumerate_lengths(spacers, sealringwidth).values():
+            for d1 in pinholes:
+                for d2 in pinholes:
+                    yield PinholeConfiguration(list(l1_parts), list(l2_parts), d1, d2, ls, lbs, sd, mindist_l1,
+                                               mindist_l2, sealringwidth, wavelength)
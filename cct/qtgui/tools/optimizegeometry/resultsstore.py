@@ -84,6 +84,12 @@ class PinholeConfigurationStore(QtCore.QAbstractItemModel):
         self._list.extend(phcs)
         self.endInsertRows()
 
+    def mergeConfigurations(self, phcs: List[PinholeConfiguration], maxcount: int):
+        """Add configurations, keeping only the `maxcount` ones with the highest intensity."""
+        self.beginResetModel()
+        self._list = sorted(self._list + list(phcs), key=lambda phc: -phc.intensity)[:maxcount]
+        self.endResetModel()
+
     def getConfiguration(self, index: int) -> PinholeConfiguration:
         return self._list[index]
 
@@ -58,6 +58,9 @@ extensions = [Extension("cct.qtgui.tools.optimizegeometry.estimateworksize",
               Extension("cct.core.processing.correlmatrix",
                         [os.path.join("cct", "core", "processing", "correlmatrix.pyx")],
                         include_dirs=[get_include()]),
+              Extension("cct.core.utils.correctionmatrices",
+                        [os.path.join("cct", "core", "utils", "correctionmatrices.pyx")],
+                        include_dirs=[get_include()]),
               ]
 
 print(get_include())
@@ -0,0 +1,170 @@
+"""Compare the single-pass Cython correction matrices with the NumPy implementation in geometrycorrections, and both
+with reference values.
+
+The extension module must be built in place: python setup.py build_ext --inplace. The tests fail if it is not.
+"""
+import numpy as np
+import pytest
+
+try:
+    from cct.core.utils import correctionmatrices
+except ImportError as exc:
+    raise ImportError('The correctionmatrices extension module is not built. Build it in place with '
+                      '"python setup.py build_ext --inplace".') from exc
+from cct.core.utils.geometrycorrections import (_angledependentabsorption_trig,
+                                                _angledependentairtransmission_trig, _solidangle_trig)
+
+RTOL = 1e-10
+
+
+def make_geometry(maxtwotheta_deg: float, shape=(61, 47)):
+    """sin(2theta), 1/cos(2theta), dtwotheta and cos(2theta) matrices, spanning 0 to `maxtwotheta_deg`."""
+    twotheta = np.linspace(0, np.deg2rad(maxtwotheta_deg), shape[0] * shape[1]).reshape(shape)
+    dtwotheta = np.full(shape, 1e-4) + twotheta * 1e-3
+    return np.sin(twotheta), 1 / np.cos(twotheta), dtwotheta, np.cos(twotheta)
+
+
+def cython_corrections(sin2theta, invcos2theta, dtwotheta, distance, ddistance, transmission, dtransmission,
+                       pressure, **kwargs):
+    return correctionmatrices.correctionmatrices_cython(
+        sin2theta, invcos2theta, dtwotheta, distance, ddistance, transmission, dtransmission, pressure, **kwargs)
+
+
+@pytest.mark.parametrize('maxtwotheta', [1.0, 10.0, 45.0, 80.0, 89.0])
+@pytest.mark.parametrize('transmission, dtransmission', [
+    (0.5, 0.01), (0.01, 0.001), (0.9, 0.02), (1 - 1e-4, 1e-3), (1 - 1e-9, 1e-6), (1.0, 0.0), (1.0, 0.01)])
+def test_against_numpy(maxtwotheta, transmission, dtransmission):
+    sin2theta, invcos2theta, dtwotheta, cos2theta = make_geometry(maxtwotheta)
+    distance, ddistance, pressure = 1300.0, 0.5, 0.2
+    saval, saerr, adaval, adaerr, adatval, adaterr = cython_corrections(
+        sin2theta, invcos2theta, dtwotheta, distance, ddistance, transmission, dtransmission, pressure,
+        mu0_air=1 / 883.49, dmu0_air=1e-5)
+    for (val, err), (refval, referr) in [
+        ((saval, saerr), _solidangle_trig(cos2theta, sin2theta, dtwotheta, distance, ddistance)),
+        ((adaval, adaerr), _angledependentabsorption_trig(
+            sin2theta, invcos2theta, dtwotheta, transmission, dtransmission)),
+        ((adatval, adaterr), _angledependentairtransmission_trig(
+            sin2theta, invcos2theta, dtwotheta, pressure, distance, ddistance, 1 / 883.49, 1e-5)),
+    ]:
+        assert np.all(np.isfinite(val)) and np.all(np.isfinite(err))
+        np.testing.assert_allclose(val, refval, rtol=RTOL, atol=0)
+        np.testing.assert_allclose(err, referr, rtol=RTOL, atol=0)
+
+
+def test_limits():
+    """The absorption correction is 1 in the direct beam and for unit transmission."""
+    sin2theta, invcos2theta, dtwotheta, cos2theta = make_geometry(60.0)
+    adaval = cython_corrections(sin2theta, invcos2theta, dtwotheta, 1300.0, 0.5, 1.0, 0.0, 0)[2]
+    np.testing.assert_array_equal(adaval, 1)
+    adaval = cython_corrections(sin2theta, invcos2theta, dtwotheta, 1300.0, 0.5, 0.3, 0.01, 0)[2]
+    assert adaval[0, 0] == 1
+    # with the transmission going to 1, the correction goes to 1 smoothly
+    adaval = cython_corrections(sin2theta, invcos2theta, dtwotheta, 1300.0, 0.5, 1 - 1e-12, 0.0, 0)[2]
+    np.testing.assert_allclose(adaval, 1, rtol=1e-11)
+
+
+def test_skipped_corrections():
+    sin2theta, invcos2theta, dtwotheta, cos2theta = make_geometry(30.0)
+    saval, saerr, adaval, adaerr, adatval, adaterr = cython_corrections(
+        sin2theta, invcos2theta, dtwotheta, 1300.0, 0.5, 0.5, 0.01, 0, solidangle=False, airtransmission=False)
+    assert saval is None and saerr is None and adatval is None and adaterr is None
+    refval, referr = _angledependentabsorption_trig(sin2theta, invcos2theta, dtwotheta, 0.5, 0.01)
+    np.testing.assert_allclose(adaval, refval, rtol=RTOL, atol=0)
+    np.testing.assert_allclose(adaerr, referr, rtol=RTOL, atol=0)
+
+
+def test_shape_mismatch():
+    sin2theta, invcos2theta, dtwotheta, cos2theta = make_geometry(30.0)
+    with pytest.raises(ValueError):
+        cython_corrections(sin2theta, invcos2theta[:-1], dtwotheta, 1300.0, 0.5, 0.5, 0.01, 0)
+    with pytest.raises(ValueError):
+        cython_corrections(sin2theta, invcos2theta, dtwotheta[:, :-1], 1300.0, 0.5, 0.5, 0.01, 0)
+
+
+# Reference values of the angle-dependent absorption correction, for dtransmission=0.01 and dtwotheta=1e-4 rad:
+# 2theta (degrees), transmission, value and error from the original formulas of geometrycorrections (the sympy-derived
+# error), value and error evaluated with mpmath at 50 digits.
+ABSORPTION = [
+    (0.01, 0.01, 1.000000041429331, 2.791934919424978e-08, 1.0000000350703773, 4.090287938347933e-08),
+    (0.01, 0.5, 1.0000000135437466, 3.422420031253282e-09, 1.0000000052786178, 6.050767671634097e-09),
+    (0.01, 0.9, 1.0000000314428485, 3.425763103303049e-08, 1.0000000008023662, 9.233293453753024e-10),
+    (0.01, 0.999, 0.9999990911396593, 9.134026296691918e-06, 1.0000000000076192, 7.672895738376989e-11),
+    (0.1, 0.01, 1.0000035069646855, 8.610786745476968e-07, 1.0000035070462003, 8.610803616464217e-07),
+    (0.1, 0.5, 1.00000052788923, 6.237348439563507e-08, 1.000000527862527, 6.237676065699885e-08),
+    (0.1, 0.9, 1.0000000801883526, 1.2497529288557181e-08, 1.000000080236725, 1.2495476589491195e-08),
+    (0.1, 0.999, 0.9999999798130187, 2.1756958999601842e-07, 1.0000000007619256, 7.623568218055942e-09),
+    (1.0, 0.01, 1.0003507892921917, 7.628786082137913e-05, 1.0003507892912658, 7.628786092106524e-05),
+    (1.0, 0.5, 1.0000527938076031, 1.639098554666198e-06, 1.0000527938061068, 1.6390985664976105e-06),
+    (1.0, 0.9, 1.0000080247004568, 8.512544154594317e-07, 1.0000080247020928, 8.512540761943618e-07),
+    (1.0, 0.999, 1.000000076019987, 7.642289949918075e-07, 1.0000000762021313, 7.62403161081876e-07),
+    (5.0, 0.01, 1.0088212877978515, 0.0019212254628230853, 1.0088212877978373, 0.0019212254628321686),
+    (5.0, 0.5, 1.0013244390088245, 3.835326693677759e-05, 1.0013244390088034, 3.835326693803996e-05),
+    (5.0, 0.9, 1.0002012435245877, 2.1229209890899975e-05, 1.0002012435244894, 2.1229209900723446e-05),
+    (5.0, 0.999, 1.000001910871987, 1.9118366856240317e-05, 1.0000019108755853, 1.911833088267033e-05),
+    (20.0, 0.01, 1.155043335804789, 0.03524113187082615, 1.1550433358047911, 0.03524113187082648),
+    (20.0, 0.5, 1.022407222532711, 0.0006514359706171864, 1.0224072225327097, 0.0006514359706172214),
+    (20.0, 0.9, 1.003384711763221, 0.0003573526559166543, 1.0033847117632246, 0.0003573526559163376),
+    (20.0, 0.999, 1.0000321052853103, 0.00032121694449308605, 1.0000321052849612, 0.0003212169479901303),
+    (45.0, 0.01, 2.240054416224972, 0.3246720230209518, 2.2400544162249734, 0.3246720230209516),
+    (45.0, 0.5, 1.1504154543151113, 0.0045377847225685775, 1.1504154543151115, 0.004537784722568574),
+    (45.0, 0.9, 1.021979589118894, 0.0023346725059627265, 1.0219795891188936, 0.0023346725059628076),
+    (45.0, 0.999, 1.0002072247156224, 0.0020734273391985075, 1.000207224715715, 0.002073427338273052),
+    (80.0, 0.01, 21.91494795758897, 4.758794220635657, 21.914947957588982, 4.758794220635657),
+    (80.0, 0.5, 3.4250407401812306, 0.08634751390836112, 3.4250407401812306, 0.08634751390836114),
+    (80.0, 0.9, 1.2715550418540669, 0.030820058506147635, 1.2715550418540666, 0.030820058506147663),
+    (80.0, 0.999, 1.0023824647741355, 0.02385546995822781, 1.0023824647741348, 0.02385546995823451),
+]
+
+# The original value formula loses precision near the beam for transmissions close to 1.
+BASELINE_VALUE_RTOL = 1e-6
+# The original error formula suffers from cancellation near the beam: at 2theta=1 degree and T=0.999 it is off by
+# 2.4e-3. Below 1 degree it has no correct digits (up to 1e5 times the exact value) and it is not compared.
+BASELINE_ERROR_RTOL = 3e-3
+BASELINE_ERROR_MIN_TWOTHETA = 1.0
+EXACT_RTOL = 1e-8
+
+# Reference values of the solid angle (distance 1300+-0.5, unit pixel size) and the air transmission (0.2 mbar,
+# mu0_air = 1/883.49+-1e-5 1/mm) corrections, for dtwotheta=1e-4 rad, from the original formulas: 2theta (degrees),
+# solid angle value and error, air transmission value and error.
+GEOMETRY = [
+    (0.0, 1690000.0, 1300.0, 1.0002943307350607, 2.6032285500434193e-06),
+    (0.01, 1690000.077220518, 1300.0000624119987, 1.0002943307395444, 2.603228589709596e-06),
+    (1.0, 1690772.4208320184, 1300.62430540725, 1.0002943755764844, 2.6036252621906293e-06),
+    (20.0, 2036710.2792816062, 1582.4054888404369, 1.000313223184022, 2.7703737463204034e-06),
+    (45.0, 4780041.84082106, 3946.693806212992, 1.000416271889398, 3.682205320619137e-06),
+    (80.0, 322757256.0221169, 602651.4417528528, 1.0016961706283087, 1.5043244871250138e-05),
+]
+
+
+def absorption_corrections(implementation, twotheta_deg, transmission):
+    twotheta = np.array([[np.deg2rad(twotheta_deg)]])
+    dtwotheta = np.full(twotheta.shape, 1e-4)
+    if implementation == 'numpy':
+        value, error = _angledependentabsorption_trig(np.sin(twotheta), 1 / np.cos(twotheta), dtwotheta,
+                                                      transmission, 0.01)
+    else:
+        value, error = cython_corrections(np.sin(twotheta), 1 / np.cos(twotheta), dtwotheta, 1300.0, 0.5,
+                                          transmission, 0.01, 0, solidangle=False, airtransmission=False)[2:4]
+    return value[0, 0], error[0, 0]
+
+
+@pytest.mark.parametrize('implementation', ['numpy', 'cython'])
+@pytest.mark.parametrize('twotheta, transmission, baseval, baseerr, exactval, exacterr', ABSORPTION)
+def test_absorption_reference(implementation, twotheta, transmission, baseval, baseerr, exactval, exacterr):
+    value, error = absorption_corrections(implementation, twotheta, transmission)
+    assert value == pytest.approx(baseval, rel=BASELINE_VALUE_RTOL, abs=0)
+    if twotheta >= BASELINE_ERROR_MIN_TWOTHETA:
+        assert error == pytest.approx(baseerr, rel=BASELINE_ERROR_RTOL, abs=0)
+    assert value == pytest.approx(exactval, rel=EXACT_RTOL, abs=0)
+    assert error == pytest.approx(exacterr, rel=EXACT_RTOL, abs=0)
+
+
+@pytest.mark.parametrize('twotheta, saval, saerr, adatval, adaterr', GEOMETRY)
+def test_geometry_reference(twotheta, saval, saerr, adatval, adaterr):
+    sin2theta = np.array([[np.sin(np.deg2rad(twotheta))]])
+    invcos2theta = np.array([[1 / np.cos(np.deg2rad(twotheta))]])
+    dtwotheta = np.full((1, 1), 1e-4)
+    results = cython_corrections(sin2theta, invcos2theta, dtwotheta, 1300.0, 0.5, 0.5, 0.01, 0.2,
+                                 mu0_air=1 / 883.49, dmu0_air=1e-5)
+    for computed, reference in zip(results[:2] + results[4:], [saval, saerr, adatval, adaterr]):
+        assert computed[0, 0] == pytest.approx(reference, rel=1e-12, abs=0)
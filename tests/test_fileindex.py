@@ -0,0 +1,56 @@
+"""Tests for the directory index used to find header and exposure files"""
+import os
+
+import pytest
+
+from cct.core.processing.fileindex import FileIndex
+
+
+@pytest.fixture
+def dirs(tmp_path):
+    """Two directories: the first has the .param file, the second both the .pickle and the .param files"""
+    first, second = str(tmp_path / 'first'), str(tmp_path / 'second')
+    for d, names in [(first, ['crd_00001.param', 'crd_00002.pickle']),
+                     (second, ['crd_00001.pickle', 'crd_00001.param', 'crd_00003.pickle.gz', 'crd_00003.pickle'])]:
+        os.mkdir(d)
+        for name in names:
+            with open(os.path.join(d, name), 'wt') as f:
+                f.write(name)
+    return first, second
+
+
+def test_find_first_directory_wins(dirs):
+    first, second = dirs
+    index = FileIndex([first, second], cachefile=None)
+    assert index.find('crd_00001.param') == os.path.join(first, 'crd_00001.param')
+    assert index.find('crd_00001.pickle') == os.path.join(second, 'crd_00001.pickle')
+    assert index.find('crd_00004.pickle') is None
+    assert 'crd_00002.pickle' in index
+    index = FileIndex([second, first], cachefile=None)
+    assert index.find('crd_00001.param') == os.path.join(second, 'crd_00001.param')
+
+
+def test_find_first_is_path_major(dirs):
+    first, second = dirs
+    index = FileIndex([first, second], cachefile=None)
+    extensions = ['.pickle', '.pickle.gz', '.param', '.param.gz']
+    # the .param file in the first directory wins over the .pickle file in the second one
+    assert index.findFirst(['crd_00001' + e for e in extensions]) == os.path.join(first, 'crd_00001.param')
+    assert index.findFirst(['crd_00002' + e for e in extensions]) == os.path.join(first, 'crd_00002.pickle')
+    # within the same directory, the order of the names decides
+    assert index.findFirst(['crd_00003' + e for e in extensions]) == os.path.join(second, 'crd_00003.pickle')
+    assert index.findFirst(['crd_00003.pickle.gz', 'crd_00003.pickle']) == os.path.join(second,
+                                                                                        'crd_00003.pickle.gz')
+    assert index.findFirst(['crd_00004' + e for e in extensions]) is None
+    assert index.findFirst([]) is None
+    index = FileIndex([second, first], cachefile=None)
+    assert index.findFirst(['crd_00001' + e for e in extensions]) == os.path.join(second, 'crd_00001.pickle')
+
+
+def test_new_files_found(dirs):
+    first, second = dirs
+    index = FileIndex([first, second], cachefile=None, refreshinterval=0)
+    assert index.find('crd_00005.param') is None
+    with open(os.path.join(second, 'crd_00005.param'), 'wt') as f:
+        f.write('crd_00005.param')
+    assert index.find('crd_00005.param') == os.path.join(second, 'crd_00005.param')
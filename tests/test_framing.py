@@ -0,0 +1,30 @@
+"""Tests for the receive buffer of the TCP devices: moving the pending data back to the beginning of the buffer."""
+from cct.core.devices.device.framing import DelimiterFramer, ReceiveBuffer
+
+
+def test_reserve_overlapping():
+    buffer = ReceiveBuffer(size=64)
+    buffer.minfree = 8
+    data = bytes(range(40, 90))
+    buffer.feed(b'0123456789\n' + data)
+    assert buffer.pop_frames(DelimiterFramer(b'\n')) == [b'0123456789']
+    # the 50 pending bytes start at 11: moving them to 0 overlaps the source and the destination
+    assert len(buffer) == len(data)
+    view = buffer.get_buffer(4)
+    assert len(view) >= 4
+    assert buffer._start == 0
+    assert len(buffer._buffer) == 64  # compacted, not grown
+    assert bytes(buffer._buffer[:len(data)]) == data
+    view[:2] = b'!\n'
+    buffer.buffer_updated(2)
+    assert buffer.pop_frames(DelimiterFramer(b'\n')) == [data + b'!']
+    assert len(buffer) == 0
+
+
+def test_reserve_grow():
+    buffer = ReceiveBuffer(size=16)
+    buffer.minfree = 8
+    buffer.feed(b'abc\ndefghij')
+    assert buffer.pop_frames(DelimiterFramer(b'\n')) == [b'abc']
+    buffer.feed(b'klmnopqrstuvwxyz\n')
+    assert buffer.pop_frames(DelimiterFramer(b'\n')) == [b'defghijklmnopqrstuvwxyz']
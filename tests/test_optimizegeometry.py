@@ -0,0 +1,91 @@
+"""Compare the length pair enumeration and the pruned search of the pinhole geometry optimizer with the exhaustive
+search over spacer subsets.
+
+The extension module must be built in place: python setup.py build_ext --inplace. The tests fail if it is not.
+"""
+import pytest
+
+try:
+    from cct.qtgui.tools.optimizegeometry.estimateworksize import enumerate_lengths, pickfromlist
+except ImportError as exc:
+    raise ImportError('The estimateworksize extension module is not built. Build it in place with '
+                      '"python setup.py build_ext --inplace".') from exc
+from cct.qtgui.tools.optimizegeometry.pinholeconfiguration import PinholeConfiguration
+
+SPACERS = [65, 65, 100, 100, 100, 200, 200, 500, 800]
+PINHOLES = [150, 200, 300, 400, 500, 600, 750, 1000, 1250]
+SEALRINGWIDTH = 4
+# ls, lbs, sd, mindist_l1, mindist_l2, sealringwidth, wavelength
+SETUP = (130, 100, 1300, 104, 104, SEALRINGWIDTH, 0.15418)
+# crit_sample, crit_beamstop, crit_l1, crit_l2
+CRITERIA = ((0.5, 2.0), (1.5, 4.0), 0, 0)
+
+
+def pickfromlist_lengths(spacers, sealringwidth):
+    """The (l1, l2) pairs as they were found before enumerate_lengths(): by trying every pair of disjoint subsets."""
+    seen = set()
+    for l1_parts in pickfromlist(spacers):
+        remaining = list(spacers)
+        for s in l1_parts:
+            remaining.remove(s)
+        for l2_parts in pickfromlist(remaining):
+            seen.add((round(len(l1_parts) * sealringwidth + sum(l1_parts), 6),
+                      round(len(l2_parts) * sealringwidth + sum(l2_parts), 6)))
+    return seen
+
+
+@pytest.mark.parametrize('spacers', [[], [100], [100, 100], [65, 100, 100.5], SPACERS])
+@pytest.mark.parametrize('sealringwidth', [0, 4, 4.5])
+def test_enumerate_lengths(spacers, sealringwidth):
+    lengths = enumerate_lengths(spacers, sealringwidth)
+    assert set(lengths) == pickfromlist_lengths(spacers, sealringwidth)
+    for (l1, l2), (l1_parts, l2_parts) in lengths.items():
+        assert l1 == pytest.approx(sum(l1_parts) + len(l1_parts) * sealringwidth)
+        assert l2 == pytest.approx(sum(l2_parts) + len(l2_parts) * sealringwidth)
+        remaining = list(spacers)
+        for s in l1_parts + l2_parts:
+            remaining.remove(s)  # each spacer is used at most once
+
+
+def exhaustive_search(d1, d2, pinholes, ls, lbs, sd, mindist_l1, mindist_l2, sealringwidth, wavelength,
+                      crit_sample, crit_beamstop, crit_l1, crit_l2):
+    """All the acceptable configurations with the given apertures, checked as the optimizer did before pruning."""
+    from cct.qtgui.tools.optimizegeometry.optimizegeometry import suggestPinholeSize
+    results = []
+    for l1_parts, l2_parts in enumerate_lengths(SPACERS, sealringwidth).values():
+        phc = PinholeConfiguration(list(l1_parts), list(l2_parts), d1, d2, ls, lbs, sd, mindist_l1, mindist_l2,
+                                   sealringwidth, wavelength)
+        try:
+            ph3_suggestion = suggestPinholeSize(phc, pinholes)
+        except IndexError:
+            continue
+        dbs = phc.rbs_parasitic1(ph3_suggestion * 0.5e-3) * 2
+        if phc.l1 < crit_l1 or phc.l2 < crit_l2:
+            continue
+        if dbs < crit_beamstop[0] or dbs > crit_beamstop[1]:
+            continue
+        if phc.Dsample < crit_sample[0] or phc.Dsample > crit_sample[1]:
+            continue
+        results.append(phc)
+    return results
+
+
+@pytest.mark.parametrize('keep_best_n', [5, 200])
+def test_worker(keep_best_n):
+    optimizegeometry = pytest.importorskip('cct.qtgui.tools.optimizegeometry.optimizegeometry')
+    optimizegeometry.initWorker(optimizegeometry.groupLengths(enumerate_lengths(SPACERS, SEALRINGWIDTH)))
+    l1s = [l1 for l1, configurations in optimizegeometry._lengths]
+    assert l1s == sorted(l1s)
+    for l1, configurations in optimizegeometry._lengths:
+        l2s = [c[0] for c in configurations]
+        assert l2s == sorted(l2s)
+    found_any = False
+    for d1 in PINHOLES:
+        for d2 in PINHOLES:
+            expected = sorted(phc.intensity for phc in exhaustive_search(d1, d2, PINHOLES, *SETUP, *CRITERIA))
+            found = optimizegeometry.worker(d1, d2, PINHOLES, *SETUP, *CRITERIA, keep_best_n=keep_best_n)
+            found_any = found_any or bool(found)
+            # the pruned search finds at least the best `keep_best_n` configurations
+            best = sorted((phc.intensity for phc in found), reverse=True)[:keep_best_n]
+            assert best == pytest.approx(expected[::-1][:keep_best_n])
+    assert found_any
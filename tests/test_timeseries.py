@@ -0,0 +1,155 @@
+"""Tests for the time series store: writing the log files, reading them back within one file and across several
+files, and selecting the time range."""
+import math
+import os
+import time
+
+import numpy as np
+import pytest
+
+from cct.core.utils import timeseries
+from cct.core.utils.logwriter import read_binary_log_times
+from cct.core.utils.timeseries import TimeSeriesStore
+
+
+def fill(store: TimeSeriesStore, label: str, times, **columns):
+    for i, t in enumerate(times):
+        store.record(label, t, {c: v[i] for c, v in columns.items()})
+
+
+def binlogs(directory) -> list:
+    return sorted(f for f in os.listdir(str(directory)) if f.endswith('.binlog'))
+
+
+def test_write_and_read_one_file(tmp_path):
+    store = TimeSeriesStore(str(tmp_path), capacity=10, levels=())
+    times = 1000.0 + np.arange(50)
+    fill(store, 'main', times, memusage=times * 2, sendqueuelen=times * 3)
+    store.close()
+    assert binlogs(tmp_path) == ['main.0.binlog']
+    np.testing.assert_array_equal(read_binary_log_times(os.path.join(str(tmp_path), 'main.0.binlog')), times)
+    # a new session: nothing in memory, everything comes from the file
+    store = TimeSeriesStore(str(tmp_path))
+    t, data = store.read_files('main')
+    np.testing.assert_array_equal(t, times)
+    np.testing.assert_array_equal(data['memusage'], times * 2)
+    np.testing.assert_array_equal(data['sendqueuelen'], times * 3)
+    store.close()
+
+
+def test_read_memory_and_file(tmp_path):
+    store = TimeSeriesStore(str(tmp_path), capacity=10, levels=())
+    times = 1000.0 + np.arange(50)
+    fill(store, 'main', times, memusage=times * 2)
+    # the 10 most recent records are in memory, the rest is read from the file
+    t, data = store.get('main', -math.inf)
+    np.testing.assert_array_equal(t, times)
+    np.testing.assert_array_equal(data['memusage'], times * 2)
+    store.close()
+
+
+def test_read_across_files(tmp_path):
+    # a new file is started when a column appears and when the file gets too large
+    store = TimeSeriesStore(str(tmp_path), capacity=5, levels=(), max_file_size=8 * 3 * 20)
+    fill(store, 'main', 1000.0 + np.arange(10), memusage=np.arange(10.))
+    fill(store, 'main', 1010.0 + np.arange(50), memusage=np.arange(10., 60.), sendqueuelen=np.arange(50.))
+    store.close()
+    assert len(binlogs(tmp_path)) == 4
+    store = TimeSeriesStore(str(tmp_path))
+    t, data = store.get('main', -math.inf)
+    np.testing.assert_array_equal(t, 1000.0 + np.arange(60))
+    np.testing.assert_array_equal(data['memusage'], np.arange(60.))
+    assert np.isnan(data['sendqueuelen'][:10]).all()
+    np.testing.assert_array_equal(data['sendqueuelen'][10:], np.arange(50.))
+    store.close()
+
+
+def test_labels_with_dots(tmp_path):
+    # the files of 'main.sub' must not be taken for those of 'main'
+    store = TimeSeriesStore(str(tmp_path), capacity=5, levels=(), max_file_size=8 * 2 * 20)
+    fill(store, 'main.sub', 1000.0 + np.arange(50), memusage=np.arange(50.))
+    fill(store, 'main', 2000.0 + np.arange(10), memusage=-np.arange(10.))
+    store.close()
+    assert 'main.0.binlog' in binlogs(tmp_path)
+    assert 'main.1.binlog' not in binlogs(tmp_path)
+    store = TimeSeriesStore(str(tmp_path))
+    t, data = store.read_files('main')
+    np.testing.assert_array_equal(t, 2000.0 + np.arange(10))
+    np.testing.assert_array_equal(data['memusage'], -np.arange(10.))
+    t, data = store.read_files('main.sub')
+    np.testing.assert_array_equal(t, 1000.0 + np.arange(50))
+    store.close()
+
+
+def test_time_window(tmp_path):
+    store = TimeSeriesStore(str(tmp_path), capacity=5, levels=(), max_file_size=8 * 2 * 10)
+    times = 1000.0 + np.arange(100)
+    fill(store, 'main', times, memusage=times)
+    # both start and end are inclusive, in memory and in the files
+    for start, end in [(1020, 1030), (1005, 1097), (1096, 1098), (1095, 1095), (1020, math.inf), (-math.inf, 1010)]:
+        t, data = store.get('main', start, end)
+        expected = times[(times >= start) & (times <= end)]
+        np.testing.assert_array_equal(t, expected)
+        np.testing.assert_array_equal(data['memusage'], expected)
+    t, data = store.get('main', 2000, 3000)
+    assert len(t) == 0
+    store.close()
+
+
+def test_default_window(tmp_path):
+    now = time.time()
+    store = TimeSeriesStore(str(tmp_path), capacity=5, levels=(), default_window=3600)
+    times = now - np.array([7200, 5000, 3000, 1000, 10, 9, 8, 7, 6, 5])
+    fill(store, 'main', times, memusage=np.arange(10.))
+    t, data = store.get('main')
+    np.testing.assert_array_equal(t, times[2:])
+    t, data = store.get('main', end=now - 4000)
+    np.testing.assert_array_equal(t, times[:2])
+    store.close()
+
+
+def test_index_skips_files(tmp_path, monkeypatch):
+    store = TimeSeriesStore(str(tmp_path), capacity=5, levels=(), max_file_size=8 * 2 * 10)
+    times = 1000.0 + np.arange(100)
+    fill(store, 'main', times, memusage=times)
+    store.close()
+    assert len(binlogs(tmp_path)) == 10
+    store = TimeSeriesStore(str(tmp_path))
+    store.read_files('main')  # index the files
+    read = []
+
+    def read_binary_log(filename):
+        read.append(os.path.basename(filename))
+        return original(filename)
+
+    original = timeseries.read_binary_log
+    monkeypatch.setattr(timeseries, 'read_binary_log', read_binary_log)
+    t, data = store.get('main', 1025, 1034.5)
+    np.testing.assert_array_equal(t, times[25:35])
+    assert sorted(read) == ['main.2.binlog', 'main.3.binlog']
+    store.close()
+
+
+def test_retention(tmp_path):
+    now = time.time()
+    store = TimeSeriesStore(str(tmp_path), capacity=5, levels=(), max_file_size=8 * 2 * 10)
+    times = now - 86400 * np.linspace(10, 0, 40)
+    fill(store, 'main', times, memusage=times)
+    store.close()
+    assert len(binlogs(tmp_path)) == 4
+    store = TimeSeriesStore(str(tmp_path), retention=5 * 86400)
+    assert binlogs(tmp_path) == ['main.2.binlog', 'main.3.binlog']
+    t, data = store.get('main', -math.inf)
+    np.testing.assert_array_equal(t, times[20:])
+    store.close()
+
+
+@pytest.mark.parametrize('retention', [None, 86400])
+def test_no_directory(retention):
+    store = TimeSeriesStore(None, capacity=10, levels=(), retention=retention)
+    fill(store, 'main', [1000.0, 1001.0], memusage=[1., 2.])
+    t, data = store.get('main', -math.inf)
+    np.testing.assert_array_equal(t, [1000., 1001.])
+    with pytest.raises(KeyError):
+        store.get('other')
+    store.close()